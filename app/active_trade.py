@@ -0,0 +1,252 @@
+# ============================================================
+# ACTIVE TRADE – Trading X Hyper Pro
+# Modelo tipado del trade activo (memoria + persistencia)
+#
+# - dataclass con __slots__: campos tipados, sin dict por instancia.
+# - None = campo ausente. to_dict() omite los None para que el resto
+#   del engine vea exactamente el dict de siempre (mismas claves).
+# - Claves desconocidas viajan en `extra` (compatibilidad hacia atrás).
+# - La forma persistida lleva schema_version. from_doc() valida al
+#   cargar (tipos + campos mínimos) y lanza ActiveTradeSchemaError: un
+#   estado roto se detecta al leerlo, no a mitad del trade.
+# ============================================================
+
+from __future__ import annotations
+
+import copy
+import json
+from dataclasses import dataclass, field, fields
+from typing import Any, Callable, Dict, Iterable, List, Optional, get_type_hints
+
+ACTIVE_TRADE_SCHEMA_VERSION = 1
+
+
+class ActiveTradeSchemaError(ValueError):
+    pass
+
+
+def _as_str(v: Any) -> str:
+    if isinstance(v, str):
+        return v
+    if isinstance(v, (int, float, bool)):
+        return str(v)
+    raise TypeError(f"str esperado, llegó {type(v).__name__}")
+
+
+def _as_float(v: Any) -> float:
+    if isinstance(v, float):
+        return v
+    if isinstance(v, (int, str)):
+        return float(v)
+    raise TypeError(f"float esperado, llegó {type(v).__name__}")
+
+
+def _as_int(v: Any) -> int:
+    if isinstance(v, int) and not isinstance(v, bool):
+        return v
+    if isinstance(v, (float, str)):
+        return int(float(v))
+    raise TypeError(f"int esperado, llegó {type(v).__name__}")
+
+
+def _as_bool(v: Any) -> bool:
+    if isinstance(v, bool):
+        return v
+    if isinstance(v, (int, float)):
+        return bool(v)
+    if isinstance(v, str) and v.strip().lower() in ("true", "false", "1", "0"):
+        return v.strip().lower() in ("true", "1")
+    raise TypeError(f"bool esperado, llegó {type(v).__name__}")
+
+
+def _jsonable(v: Any) -> Any:
+    try:
+        json.dumps(v, ensure_ascii=False)
+        return v
+    except Exception:
+        try:
+            return json.loads(json.dumps(v, ensure_ascii=False, default=str))
+        except Exception:
+            return str(v)
+
+
+# ============================================================
+# MODELO
+# ============================================================
+
+@dataclass(slots=True)
+class ActiveTrade:
+    # Identidad de la posición
+    symbol: Optional[str] = None
+    symbol_for_exec: Optional[str] = None
+    direction: Optional[str] = None
+    side: Optional[str] = None
+    opposite: Optional[str] = None
+    mode: Optional[str] = None
+    entry_price: Optional[float] = None
+    qty_coin_for_log: Optional[float] = None
+    qty_usdc_for_profit: Optional[float] = None
+    best_score: Optional[float] = None
+    entry_strength: Optional[float] = None
+    sl_price_pct: Optional[float] = None
+    started_at: Optional[str] = None
+    opened_at_ms: Optional[int] = None
+
+    # Plan de gestión congelado al abrir
+    bucket: Optional[str] = None
+    tp_activation_price: Optional[float] = None
+    trail_retrace_price: Optional[float] = None
+    force_min_profit_price: Optional[float] = None
+    force_min_strength: Optional[float] = None
+    partial_tp_activation_price: Optional[float] = None
+    partial_tp_close_fraction: Optional[float] = None
+    break_even_activation_price: Optional[float] = None
+    break_even_offset_price: Optional[float] = None
+
+    # Runtime del manager
+    partial_tp_taken: Optional[bool] = None
+    break_even_armed: Optional[bool] = None
+    trailing_active: Optional[bool] = None
+    best_pnl_pct: Optional[float] = None
+    trailing_stop_pnl: Optional[float] = None
+    peak_price: Optional[float] = None
+    last_price: Optional[float] = None
+    last_pnl_pct: Optional[float] = None
+    strength_check_ts: Optional[float] = None
+    manager_heartbeat_ts: Optional[float] = None
+    sl_in_exchange: Optional[bool] = None
+    exchange_stop_price: Optional[float] = None
+
+    # ADOPT
+    adopt_last_seen_ts: Optional[float] = None
+    adopt_plan_logged_at: Optional[float] = None
+    adopt_sl_checked_at: Optional[float] = None
+
+    # Cierre
+    close_in_progress: Optional[bool] = None
+    close_finalized: Optional[bool] = None
+    close_started_at: Optional[float] = None
+    close_finished_at: Optional[float] = None
+    close_source: Optional[str] = None
+    close_reason: Optional[str] = None
+    close_profit: Optional[float] = None
+
+    # Metadatos de persistencia
+    user_id: Optional[int] = None
+    persisted_at: Optional[str] = None
+
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+    # --------------------------------------------------------
+    # Construcción
+    # --------------------------------------------------------
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> "ActiveTrade":
+        """Desde un dict del engine (coerce de tipos, sin exigir campos mínimos)."""
+        trade = cls()
+        trade.update(data or {})
+        return trade
+
+    @classmethod
+    def from_doc(cls, doc: Optional[Dict[str, Any]]) -> "ActiveTrade":
+        """Desde la forma persistida (Mongo / journal). Valida versión y campos mínimos."""
+        if not isinstance(doc, dict):
+            raise ActiveTradeSchemaError("documento no es dict")
+        data = dict(doc)
+        data.pop("_id", None)
+        try:
+            version = int(data.pop("schema_version", 0) or 0)
+        except Exception:
+            raise ActiveTradeSchemaError("schema_version inválido")
+        if version > ACTIVE_TRADE_SCHEMA_VERSION:
+            raise ActiveTradeSchemaError(f"schema_version={version} > soportado={ACTIVE_TRADE_SCHEMA_VERSION}")
+        if version < 1 and "tp_activation_price" not in data and "tp_activate_price" in data:
+            # v0: algunos snapshots viejos guardaban el nombre del mgmt.
+            data["tp_activation_price"] = data.pop("tp_activate_price")
+
+        trade = cls.from_dict(data)
+        if not trade.symbol:
+            raise ActiveTradeSchemaError("symbol vacío")
+        if str(trade.direction or "").lower() not in ("long", "short"):
+            raise ActiveTradeSchemaError(f"direction inválida: {trade.direction!r}")
+        if not trade.entry_price or trade.entry_price <= 0:
+            raise ActiveTradeSchemaError(f"entry_price inválido: {trade.entry_price!r}")
+        return trade
+
+    # --------------------------------------------------------
+    # Mutación
+    # --------------------------------------------------------
+
+    def update(self, data: Dict[str, Any]) -> List[str]:
+        """Aplica campos (con coerce). Retorna los nombres que cambiaron de valor."""
+        changed: List[str] = []
+        for k, v in data.items():
+            coerce = _COERCE.get(k)
+            if coerce is None:
+                if k not in self.extra or self.extra[k] != v:
+                    self.extra[k] = v
+                    changed.append(k)
+                continue
+            if v is not None:
+                try:
+                    v = coerce(v)
+                except (TypeError, ValueError) as e:
+                    raise ActiveTradeSchemaError(f"{k}: {e}")
+            if getattr(self, k) != v:
+                setattr(self, k, v)
+                changed.append(k)
+        return changed
+
+    def copy(self) -> "ActiveTrade":
+        out = copy.copy(self)
+        out.extra = dict(self.extra)
+        return out
+
+    # --------------------------------------------------------
+    # Serialización
+    # --------------------------------------------------------
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Vista dict para el engine (sin los campos ausentes)."""
+        out: Dict[str, Any] = {}
+        for name in _FIELD_NAMES:
+            v = getattr(self, name)
+            if v is not None:
+                out[name] = v
+        out.update(self.extra)
+        return out
+
+    def to_doc(self) -> Dict[str, Any]:
+        """Forma persistida: primitivos JSON/BSON + schema_version."""
+        out: Dict[str, Any] = {}
+        for name in _FIELD_NAMES:
+            v = getattr(self, name)
+            if v is not None:
+                out[name] = v
+        for k, v in self.extra.items():
+            out[k] = _jsonable(v)
+        out["schema_version"] = ACTIVE_TRADE_SCHEMA_VERSION
+        return out
+
+    def doc_fields(self, names: Iterable[str]) -> Dict[str, Any]:
+        """Diff persistible de los campos indicados (None incluido: limpia el valor)."""
+        out: Dict[str, Any] = {}
+        for name in names:
+            if name in _COERCE:
+                out[name] = getattr(self, name)
+            elif name in self.extra:
+                out[name] = _jsonable(self.extra[name])
+        out["schema_version"] = ACTIVE_TRADE_SCHEMA_VERSION
+        return out
+
+
+_FIELD_NAMES = tuple(f.name for f in fields(ActiveTrade) if f.name != "extra")
+_COERCE_BY_TYPE: Dict[Any, Callable[[Any], Any]] = {
+    Optional[str]: _as_str,
+    Optional[float]: _as_float,
+    Optional[int]: _as_int,
+    Optional[bool]: _as_bool,
+}
+_HINTS = get_type_hints(ActiveTrade)
+_COERCE: Dict[str, Callable[[Any], Any]] = {name: _COERCE_BY_TYPE[_HINTS[name]] for name in _FIELD_NAMES}
@@ -0,0 +1,94 @@
+# ============================================================
+# ADAPTIVE CADENCE – Trading X Hyper Pro
+# Cadencia de chequeo según distancia al trigger más cercano
+#
+# - VolatilityTracker: varianza por segundo de cada coin (EWMA de
+#   retornos log² / dt) a partir de las lecturas del tablero.
+# - interval_for_distance: tiempo para que el precio recorra la
+#   distancia al nivel con z desvíos (difusión: t = (d / (z·σ))²),
+#   acotado a [min_s, max_s]. Cerca del nivel -> min_s (misma reacción
+#   que antes); lejos y con mercado quieto -> max_s.
+# - Puro: sin I/O ni threads. Lo usa PositionSupervisor.
+# ============================================================
+
+from __future__ import annotations
+
+import math
+import os
+from typing import Dict, Optional
+
+# ============================================================
+# CONFIG
+# ============================================================
+
+CADENCE_Z = float(os.getenv("CADENCE_Z", "4.0"))
+CADENCE_VOL_HALFLIFE_SECONDS = float(os.getenv("CADENCE_VOL_HALFLIFE_SECONDS", "120"))
+CADENCE_MIN_SAMPLES = int(os.getenv("CADENCE_MIN_SAMPLES", "5"))
+# Piso de σ por √s (0.005%): evita intervalos enormes con un tablero que no se movió.
+CADENCE_SIGMA_FLOOR = float(os.getenv("CADENCE_SIGMA_FLOOR", "0.00005"))
+# Una lectura sin cambio de precio solo cuenta como muestra pasado este tiempo
+# (el tablero cachea allMids: repetir el mismo mid no es "volatilidad cero").
+CADENCE_FLAT_SAMPLE_SECONDS = float(os.getenv("CADENCE_FLAT_SAMPLE_SECONDS", "5"))
+
+
+class _CoinVol:
+    __slots__ = ("px", "ts", "var_rate", "samples")
+
+    def __init__(self, px: float, ts: float):
+        self.px = px
+        self.ts = ts
+        self.var_rate = CADENCE_SIGMA_FLOOR ** 2
+        self.samples = 0
+
+
+class VolatilityTracker:
+    def __init__(self, halflife_seconds: float = CADENCE_VOL_HALFLIFE_SECONDS):
+        self._halflife = max(1.0, float(halflife_seconds))
+        self._coins: Dict[str, _CoinVol] = {}
+
+    def observe(self, coin: str, price: float, now_ts: float) -> None:
+        if not price or price <= 0:
+            return
+        cv = self._coins.get(coin)
+        if cv is None:
+            self._coins[coin] = _CoinVol(float(price), float(now_ts))
+            return
+        dt = float(now_ts) - cv.ts
+        if dt <= 0:
+            return
+        if float(price) == cv.px and dt < CADENCE_FLAT_SAMPLE_SECONDS:
+            return
+        r = math.log(float(price) / cv.px)
+        decay = 0.5 ** (dt / self._halflife)
+        cv.var_rate = decay * cv.var_rate + (1.0 - decay) * (r * r / dt)
+        cv.px = float(price)
+        cv.ts = float(now_ts)
+        cv.samples += 1
+
+    def sigma(self, coin: str) -> Optional[float]:
+        """σ por √segundo (fracción), o None si aún no hay muestras suficientes."""
+        cv = self._coins.get(coin)
+        if cv is None or cv.samples < CADENCE_MIN_SAMPLES:
+            return None
+        return max(CADENCE_SIGMA_FLOOR, math.sqrt(cv.var_rate))
+
+    def forget(self, coin: str) -> None:
+        self._coins.pop(coin, None)
+
+    def coins(self):
+        return list(self._coins.keys())
+
+
+def interval_for_distance(
+    dist_pct: Optional[float],
+    sigma: Optional[float],
+    *,
+    min_s: float,
+    max_s: float,
+    z: float = CADENCE_Z,
+) -> float:
+    """Segundos hasta el próximo chequeo. Sin distancia o sin σ conocida -> min_s (conservador)."""
+    if dist_pct is None or sigma is None or dist_pct <= 0:
+        return float(min_s)
+    t = (float(dist_pct) / (max(1e-9, float(z)) * float(sigma))) ** 2
+    return float(min(max_s, max(min_s, t)))
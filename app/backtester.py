@@ -0,0 +1,784 @@
+# ============================================================
+# BACKTESTER – Trading X Hyper Pro
+# breakout_retest_5m sobre histórico de velas 5m (multi-coin)
+#
+# - Indicadores vectorizados sobre toda la historia (numpy/pandas),
+#   no se recalculan barra a barra.
+# - Misma lógica de señal que strategy.get_entry_signal: las constantes
+#   se leen de app.strategy (o de `params` para barridos).
+#   Las EMAs del live se siembran al inicio de la ventana de LOOKBACK_5M
+#   velas; aquí se corrige la EMA de historia completa con la fórmula
+#   cerrada para reproducir exactamente ese valor.
+# - Simula la entrada con slippage configurable y la gestión del engine:
+#   SL en exchange, partial TP, break-even, trailing por retroceso y
+#   force-exit por pérdida de fuerza (app.exit_manager, compartido con el live).
+# - Escala por coin con un pool de procesos.
+#
+# Supuestos:
+#   * Velas cerradas y contiguas de 5m (el live evalúa la vela en formación).
+#   * Dentro de cada vela el precio recorre O->L->H->C si cierra al alza
+#     y O->H->L->C si cierra a la baja.
+#   * Una posición a la vez por coin (el live es una por usuario).
+# ============================================================
+
+from __future__ import annotations
+
+import argparse
+import math
+import os
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+import app.exit_manager as exit_manager
+import app.strategy as strategy
+
+# ============================================================
+# CONFIG
+# ============================================================
+
+BAR_MS = 300_000
+
+DEFAULT_BACKTEST_CONFIG: Dict[str, Any] = {
+    "slippage_pct": 0.0005,        # fills a mercado (entrada, partial, trailing, force)
+    "stop_slippage_pct": 0.0005,   # fills del stop del exchange (trigger market)
+    "taker_fee_pct": 0.00045,      # fee por fill sobre notional
+    "entry_fill": "close",         # "close" (cierre de la vela señal) | "next_open"
+    "cooldown_bars": 2,            # USER_TRADE_COOLDOWN_SECONDS (600s) en velas de 5m
+    "force_exit": True,            # re-evaluación de fuerza en cada cierre de vela
+    "apply_symbol_policy": True,   # allowlist / memecoins como en el live
+}
+
+# Constantes de strategy.py que usa la señal. `params` puede sobreescribir cualquiera.
+STRATEGY_PARAM_NAMES = (
+    "LOOKBACK_5M", "EMA_FAST", "EMA_MID", "EMA_SLOW", "ADX_PERIOD", "ATR_PERIOD", "EMA_SLOPE_LOOKBACK",
+    "MIN_CANDLES_REQUIRED", "MIN_NONZERO_VOLUME_RATIO",
+    "ADX_MIN", "ATR_PCT_MIN", "ATR_PCT_MAX",
+    "BREAKOUT_LOOKBACK", "BREAKOUT_MIN_ATR_FRAC", "BREAKOUT_CONFIRM_CLOSE_ATR", "BREAKOUT_MAX_AGE_BARS",
+    "RETEST_TOL_ATR", "RETEST_HARD_FAIL_ATR", "MAX_CHASE_ATR", "MIN_BODY_RATIO", "BREAKOUT_MIN_BODY_RATIO",
+    "BREAKOUT_MIN_RVOL", "TRIGGER_MIN_RVOL", "TRIGGER_CLOSE_POS_LONG_MIN", "TRIGGER_CLOSE_POS_SHORT_MAX",
+    "TREND_STACK_MIN_PCT",
+    "ATR_SL_MULT", "ATR_SL_MIN_PCT", "ATR_SL_MAX_PCT", "SWING_BUFFER_ATR",
+    "MAX_SCORE", "MIN_SCORE_TO_SIGNAL", "STRENGTH_MIN", "STRENGTH_MAX",
+)
+
+# Subconjunto que cambia los arrays de compute_indicators (clave de reutilización).
+INDICATOR_PARAM_NAMES = ("EMA_FAST", "EMA_MID", "EMA_SLOW", "ATR_PERIOD", "ADX_PERIOD", "BREAKOUT_LOOKBACK")
+
+RVOL_LOOKBACK = 20
+SWING_BARS = 10
+
+
+def log(msg: str, level: str = "INFO"):
+    print(f"[BACKTEST {time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())}] {level} {msg}")
+
+
+def resolve_params(params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    out = {name: getattr(strategy, name) for name in STRATEGY_PARAM_NAMES}
+    for k, v in (params or {}).items():
+        if k not in out:
+            raise KeyError(f"parámetro de estrategia desconocido: {k}")
+        out[k] = v
+    return out
+
+
+def indicator_key(params: Optional[Dict[str, Any]] = None) -> Tuple[Any, ...]:
+    p = resolve_params(params)
+    return tuple(p[name] for name in INDICATOR_PARAM_NAMES)
+
+
+def resolve_config(config: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    out = dict(DEFAULT_BACKTEST_CONFIG)
+    out.update(config or {})
+    return out
+
+
+# ============================================================
+# CARGA DE VELAS
+# ============================================================
+
+_COLUMN_ALIASES = {
+    "time": "t", "timestamp": "t", "open": "o", "high": "h", "low": "l", "close": "c", "volume": "v",
+}
+
+
+def candles_from_frame(df: pd.DataFrame) -> Dict[str, np.ndarray]:
+    df = df.rename(columns={k: v for k, v in _COLUMN_ALIASES.items() if k in df.columns})
+    missing = [c for c in ("t", "o", "h", "l", "c", "v") if c not in df.columns]
+    if missing:
+        raise ValueError(f"faltan columnas de vela: {missing}")
+    df = df[["t", "o", "h", "l", "c", "v"]].dropna()
+    df = df[(df["c"] > 0) & (df["h"] >= df["l"])]
+    df = df.drop_duplicates(subset="t", keep="last").sort_values("t")
+    return {
+        "t": df["t"].to_numpy(dtype=np.int64),
+        "o": df["o"].to_numpy(dtype=np.float64),
+        "h": df["h"].to_numpy(dtype=np.float64),
+        "l": df["l"].to_numpy(dtype=np.float64),
+        "c": df["c"].to_numpy(dtype=np.float64),
+        "v": df["v"].to_numpy(dtype=np.float64),
+    }
+
+
+def candles_from_rows(rows: Iterable[dict]) -> Dict[str, np.ndarray]:
+    """Convierte velas en formato candleSnapshot/strategy (dicts t,o,h,l,c,v)."""
+    return candles_from_frame(pd.DataFrame(list(rows)))
+
+
+def load_candles_csv(path: str) -> Dict[str, np.ndarray]:
+    return candles_from_frame(pd.read_csv(path))
+
+
+def load_candles_dir(directory: str, coins: Optional[Iterable[str]] = None) -> Dict[str, Dict[str, np.ndarray]]:
+    """Lee `<COIN>.csv` / `<COIN>.csv.gz` de un directorio."""
+    wanted = {strategy.norm_coin(c) for c in coins} if coins else None
+    out: Dict[str, Dict[str, np.ndarray]] = {}
+    for name in sorted(os.listdir(directory)):
+        if not (name.endswith(".csv") or name.endswith(".csv.gz")):
+            continue
+        coin = strategy.norm_coin(name.split(".", 1)[0])
+        if wanted is not None and coin not in wanted:
+            continue
+        try:
+            out[coin] = load_candles_csv(os.path.join(directory, name))
+        except Exception as e:
+            log(f"no se pudo cargar {name}: {e}", "WARN")
+    return out
+
+
+# ============================================================
+# INDICADORES VECTORIZADOS
+# ============================================================
+
+def _ema_full(x: np.ndarray, period: int) -> np.ndarray:
+    # Igual que strategy._ema: semilla = primer valor, k = 2/(p+1).
+    if len(x) == 0:
+        return np.empty(0)
+    return pd.Series(x).ewm(span=float(period), adjust=False).mean().to_numpy()
+
+
+def _rma_full(x: np.ndarray, period: int) -> np.ndarray:
+    # Igual que strategy._rma: semilla = media simple de los primeros `period`.
+    n = len(x)
+    period = max(1, int(period))
+    if n == 0:
+        return np.empty(0)
+    if n < period:
+        return np.full(n, float(np.mean(x)))
+    seed = float(np.mean(x[:period]))
+    y = np.empty(n - period + 1)
+    y[0] = seed
+    y[1:] = x[period:]
+    r = pd.Series(y).ewm(alpha=1.0 / period, adjust=False).mean().to_numpy()
+    out = np.empty(n)
+    out[period - 1:] = r
+    out[: period - 1] = seed
+    return out
+
+
+def _true_range(h: np.ndarray, l: np.ndarray, c: np.ndarray) -> np.ndarray:
+    tr = np.zeros(len(c))
+    if len(c) > 1:
+        prev = c[:-1]
+        tr[1:] = np.maximum.reduce([h[1:] - l[1:], np.abs(h[1:] - prev), np.abs(l[1:] - prev)])
+    return tr
+
+
+def _adx_full(h: np.ndarray, l: np.ndarray, c: np.ndarray, period: int) -> np.ndarray:
+    n = len(c)
+    up = np.zeros(n)
+    down = np.zeros(n)
+    up[1:] = h[1:] - h[:-1]
+    down[1:] = l[:-1] - l[1:]
+    plus_dm = np.where((up > down) & (up > 0), up, 0.0)
+    minus_dm = np.where((down > up) & (down > 0), down, 0.0)
+    atr = _rma_full(_true_range(h, l, c), period)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        plus = np.where(atr != 0, 100.0 * _rma_full(plus_dm, period) / atr, 0.0)
+        minus = np.where(atr != 0, 100.0 * _rma_full(minus_dm, period) / atr, 0.0)
+        den = plus + minus
+        dx = np.where(den != 0, 100.0 * np.abs(plus - minus) / den, 0.0)
+    return _rma_full(dx, period)
+
+
+def _shift(x: np.ndarray, d: int, fill: float = np.nan) -> np.ndarray:
+    """y[t] = x[t-d]."""
+    if d == 0:
+        return x.copy()
+    out = np.full(len(x), fill, dtype=np.float64)
+    if d < len(x):
+        out[d:] = x[:-d]
+    return out
+
+
+def _rolling_prev(x: np.ndarray, window: int, fn) -> np.ndarray:
+    """y[i] = fn(x[i-window:i]) (ventana previa, sin incluir i)."""
+    n = len(x)
+    out = np.full(n, np.nan)
+    if n > window:
+        out[window:] = fn(np.lib.stride_tricks.sliding_window_view(x, window)[:-1], axis=1)
+    return out
+
+
+def _rolling_incl(x: np.ndarray, window: int, fn) -> np.ndarray:
+    """y[i] = fn(x[i-window+1:i+1])."""
+    n = len(x)
+    out = np.full(n, np.nan)
+    if n >= window:
+        out[window - 1:] = fn(np.lib.stride_tricks.sliding_window_view(x, window), axis=1)
+    return out
+
+
+def _relative_volume_full(v: np.ndarray, lookback: int = RVOL_LOOKBACK) -> np.ndarray:
+    # strategy._relative_volume: mediana de los volúmenes > 0 de las `lookback` velas previas.
+    lookback = max(lookback, 8)
+    n = len(v)
+    out = np.ones(n)
+    if n <= lookback:
+        return out
+    win = np.lib.stride_tricks.sliding_window_view(np.maximum(v, 0.0), lookback)[:-1]
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        base = np.nanmedian(np.where(win > 0.0, win, np.nan), axis=1)
+    base = np.where(np.isnan(base), 0.0, base)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rv = np.where(base > 0.0, np.maximum(0.0, v[lookback:] / np.where(base > 0.0, base, 1.0)), 1.0)
+    out[lookback:] = rv
+    return out
+
+
+def compute_indicators(candles: Dict[str, np.ndarray], params: Optional[Dict[str, Any]] = None) -> Dict[str, np.ndarray]:
+    """Indicadores de historia completa que no dependen de umbrales (reutilizables entre configs)."""
+    p = resolve_params(params)
+    o, h, l, c, v = candles["o"], candles["h"], candles["l"], candles["c"], candles["v"]
+    rng = np.maximum(h - l, 1e-12)
+    out = {
+        "ema_fast": _ema_full(c, p["EMA_FAST"]),
+        "ema_mid": _ema_full(c, p["EMA_MID"]),
+        "ema_slow": _ema_full(c, p["EMA_SLOW"]),
+        "atr": _rma_full(_true_range(h, l, c), p["ATR_PERIOD"]),
+        "adx": _adx_full(h, l, c, p["ADX_PERIOD"]),
+        "rvol": _relative_volume_full(v, RVOL_LOOKBACK),
+        "body": np.abs(c - o) / rng,
+        "close_pos": np.clip((c - l) / rng, 0.0, 1.0),
+        "lower_wick": np.clip((np.minimum(o, c) - l) / rng, 0.0, 1.0),
+        "upper_wick": np.clip((h - np.maximum(o, c)) / rng, 0.0, 1.0),
+        "hh_prev": _rolling_prev(h, int(p["BREAKOUT_LOOKBACK"]), np.max),
+        "ll_prev": _rolling_prev(l, int(p["BREAKOUT_LOOKBACK"]), np.min),
+        "swing_low": _rolling_incl(l, SWING_BARS, np.min),
+        "swing_high": _rolling_incl(h, SWING_BARS, np.max),
+        "nonzero_vol": (v > 0.0).astype(np.float64),
+    }
+    return out
+
+
+def _windowed_ema(full: np.ndarray, c: np.ndarray, period: int, window: int, d: int) -> np.ndarray:
+    """EMA de la ventana live (sembrada en t-window+1) evaluada en t-d, para cada t.
+
+    La recursión es lineal: W(g) - F(g) = (1-k)^(g-s) * (c[s] - F[s]).
+    """
+    a = 1.0 - 2.0 / (float(period) + 1.0)
+    seed_gap = _shift(c - full, window - 1)
+    return _shift(full, d) + (a ** (window - 1 - d)) * seed_gap
+
+
+# ============================================================
+# SEÑALES (misma lógica que strategy.get_entry_signal)
+# ============================================================
+
+def _round(x: np.ndarray, nd: int) -> np.ndarray:
+    return np.round(x, nd)
+
+
+def compute_signals(
+    candles: Dict[str, np.ndarray],
+    params: Optional[Dict[str, Any]] = None,
+    indicators: Optional[Dict[str, np.ndarray]] = None,
+) -> Dict[str, np.ndarray]:
+    """Señal en el cierre de cada vela t usando la ventana [t-LOOKBACK_5M+1, t].
+
+    Devuelve arrays: signal (bool), direction (+1/-1/0), score, strength, sl_pct, atr_pct.
+    """
+    p = resolve_params(params)
+    ind = indicators if indicators is not None else compute_indicators(candles, p)
+    o, h, l, c = candles["o"], candles["h"], candles["l"], candles["c"]
+    n = len(c)
+    W = int(p["LOOKBACK_5M"])
+
+    # Calidad de ventana: velas suficientes + ratio de volumen != 0 en las últimas MIN_CANDLES_REQUIRED.
+    idx = np.arange(n)
+    min_req = int(p["MIN_CANDLES_REQUIRED"])
+    nz_ratio = _rolling_incl(ind["nonzero_vol"], min_req, np.sum) / float(max(min_req, 1))
+    eligible = (idx >= W - 1) & (W >= min_req) & (nz_ratio >= float(p["MIN_NONZERO_VOLUME_RATIO"]))
+
+    atr = ind["atr"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        atr_pct = np.where(c > 0, atr / c, 0.0)
+    adx = ind["adx"]
+    gate = eligible & (atr_pct >= p["ATR_PCT_MIN"]) & (atr_pct <= p["ATR_PCT_MAX"]) & (adx >= p["ADX_MIN"])
+
+    slope_lb = int(p["EMA_SLOPE_LOOKBACK"])
+    e20 = _windowed_ema(ind["ema_fast"], c, p["EMA_FAST"], W, 0)
+    e50 = _windowed_ema(ind["ema_mid"], c, p["EMA_MID"], W, 0)
+    e50_prev = _windowed_ema(ind["ema_mid"], c, p["EMA_MID"], W, slope_lb)
+    e200 = _windowed_ema(ind["ema_slow"], c, p["EMA_SLOW"], W, 0)
+    e200_prev = _windowed_ema(ind["ema_slow"], c, p["EMA_SLOW"], W, slope_lb)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        e50_prev = np.where(e50_prev != 0, e50_prev, e50)
+        e200_prev = np.where(e200_prev != 0, e200_prev, e200)
+        slope50 = np.where(e50_prev != 0, (e50 - e50_prev) / e50_prev, 0.0)
+        slope200 = np.where(e200_prev != 0, (e200 - e200_prev) / e200_prev, 0.0)
+
+    long_trend = gate & (e20 > e50) & (c > e50) & (slope50 > 0.0002) & (slope200 > -0.0015)
+    short_trend = gate & ~long_trend & (e20 < e50) & (c < e50) & (slope50 < -0.0002) & (slope200 < 0.0015)
+
+    # Breakout más reciente dentro de las últimas BREAKOUT_MAX_AGE_BARS+1 velas (i = t-d).
+    safe_atr = np.maximum(atr, 1e-12)
+    buf = atr * float(p["BREAKOUT_MIN_ATR_FRAC"])
+    max_d = int(p["BREAKOUT_MAX_AGE_BARS"]) + 1
+    bo_d = np.zeros(n, dtype=np.int64)
+    bo_level = np.full(n, np.nan)
+    for d in range(max_d, 0, -1):
+        ci = _shift(c, d)
+        hi = _shift(h, d)
+        li = _shift(l, d)
+        body_i = _shift(ind["body"], d)
+        rvol_i = _shift(ind["rvol"], d)
+        e20_i = _windowed_ema(ind["ema_fast"], c, p["EMA_FAST"], W, d)
+        e50_i = _windowed_ema(ind["ema_mid"], c, p["EMA_MID"], W, d)
+        common = (body_i >= p["BREAKOUT_MIN_BODY_RATIO"]) & (rvol_i >= p["BREAKOUT_MIN_RVOL"])
+        lvl_long = _shift(ind["hh_prev"], d)
+        lvl_short = _shift(ind["ll_prev"], d)
+        cond_long = long_trend & common & (ci > lvl_long + buf) & (hi > lvl_long + buf) & (ci > e20_i) & (ci > e50_i) \
+            & ((ci - lvl_long) / safe_atr >= p["BREAKOUT_CONFIRM_CLOSE_ATR"])
+        cond_short = short_trend & common & (ci < lvl_short - buf) & (li < lvl_short - buf) & (ci < e20_i) & (ci < e50_i) \
+            & ((lvl_short - ci) / safe_atr >= p["BREAKOUT_CONFIRM_CLOSE_ATR"])
+        bo_d = np.where(cond_long | cond_short, d, bo_d)
+        bo_level = np.where(cond_long, lvl_long, np.where(cond_short, lvl_short, bo_level))
+
+    has_bo = bo_d > 0
+    is_long = long_trend & has_bo
+    is_short = short_trend & has_bo
+    level = np.where(has_bo, bo_level, 0.0)
+
+    # Estructura post-breakout: min/max de las velas (idx+1 .. t].
+    post_low = np.full(n, np.nan)
+    post_high = np.full(n, np.nan)
+    for d in range(1, max_d + 1):
+        m = bo_d == d
+        if m.any():
+            post_low = np.where(m, _rolling_incl(l, d, np.min), post_low)
+            post_high = np.where(m, _rolling_incl(h, d, np.max), post_high)
+
+    tol = atr * float(p["RETEST_TOL_ATR"])
+    hard = atr * float(p["RETEST_HARD_FAIL_ATR"])
+    body_ok = ind["body"] >= p["MIN_BODY_RATIO"]
+    rvol_ok = ind["rvol"] >= p["TRIGGER_MIN_RVOL"]
+    cpos = ind["close_pos"]
+
+    ok_long = is_long & ~(l < level - hard) & (post_low >= level - hard) & (l <= level + tol) \
+        & (c > level) & (c > o) & (c > e20) & body_ok & (cpos >= p["TRIGGER_CLOSE_POS_LONG_MIN"]) & rvol_ok \
+        & ((ind["lower_wick"] >= 0.12) | (cpos >= 0.72)) & ((c - level) <= atr * p["MAX_CHASE_ATR"])
+    ok_short = is_short & ~(h > level + hard) & (post_high <= level + hard) & (h >= level - tol) \
+        & (c < level) & (c < o) & (c < e20) & body_ok & (cpos <= p["TRIGGER_CLOSE_POS_SHORT_MAX"]) & rvol_ok \
+        & ((ind["upper_wick"] >= 0.12) | (cpos <= 0.28)) & ((level - c) <= atr * p["MAX_CHASE_ATR"])
+    setup_ok = ok_long | ok_short
+    direction = np.where(ok_long, 1, np.where(ok_short, -1, 0)).astype(np.int8)
+    sgn = direction.astype(np.float64)
+
+    # Scoring (mismos redondeos que el diag de strategy).
+    bo_idx_rvol = np.zeros(n)
+    bo_idx_body = np.zeros(n)
+    for d in range(1, max_d + 1):
+        m = bo_d == d
+        if m.any():
+            bo_idx_rvol = np.where(m, _shift(ind["rvol"], d, 0.0), bo_idx_rvol)
+            bo_idx_body = np.where(m, _shift(ind["body"], d, 0.0), bo_idx_body)
+
+    def _or(x, default):
+        return np.where(x != 0, x, default)
+
+    breakout_rvol = _or(_round(bo_idx_rvol, 4), 1.0)
+    trigger_rvol = _or(_round(ind["rvol"], 4), 1.0)
+    trigger_close_pos = _or(_round(cpos, 4), 0.5)
+    body_ratio = _round(ind["body"], 4)
+    breakout_body_ratio = _round(bo_idx_body, 4)
+    chase_atr = _round(sgn * (c - level) / safe_atr, 4)
+    retest_gap_atr = np.where(direction > 0, _round((l - level) / safe_atr, 4), _round((level - h) / safe_atr, 4))
+    bars_since = np.where(bo_d > 0, bo_d, int(p["BREAKOUT_MAX_AGE_BARS"])).astype(np.float64)
+    safe_c = np.maximum(c, 1e-12)
+    ema_stack_pct = np.abs(e20 - e50) / safe_c
+
+    def _cl(x):
+        return np.clip(x, 0.0, 1.0)
+
+    adx_q = _cl((adx - p["ADX_MIN"]) / 18.0)
+    slope_q = _cl((np.abs(slope50) - 0.0002) / 0.0078)
+    body_q = _cl(body_ratio / 0.72)
+    bo_body_q = _cl(breakout_body_ratio / 0.72)
+    volume_q = _cl(((breakout_rvol - 0.90) / 0.85) * 0.58 + ((trigger_rvol - 0.85) / 0.70) * 0.42)
+    loc_q = _cl(np.where(direction > 0, trigger_close_pos, 1.0 - trigger_close_pos))
+    prox_q = _cl(1.0 - (np.abs(retest_gap_atr) / max(p["RETEST_TOL_ATR"], 1e-12)))
+    stack_q = _cl((ema_stack_pct - p["TREND_STACK_MIN_PCT"]) / 0.0038)
+    ext_pen = _cl(np.abs(chase_atr) / p["MAX_CHASE_ATR"])
+    age_pen = _cl((bars_since - 1) / max(int(p["BREAKOUT_MAX_AGE_BARS"]) - 1, 1))
+    atr_q = 1.0 - _cl((atr_pct - p["ATR_PCT_MIN"]) / max(p["ATR_PCT_MAX"] - p["ATR_PCT_MIN"], 1e-12)) * 0.22
+    setup_quality = _cl(
+        (0.22 * adx_q) + (0.17 * slope_q) + (0.12 * body_q) + (0.09 * bo_body_q) + (0.18 * volume_q)
+        + (0.10 * loc_q) + (0.06 * prox_q) + (0.10 * stack_q) + (0.06 * atr_q)
+        - (0.06 * ext_pen) - (0.04 * age_pen)
+    )
+    score = _round(np.minimum(p["MAX_SCORE"], 64.0 + 36.0 * setup_quality), 2)
+    signal = setup_ok & (score >= p["MIN_SCORE_TO_SIGNAL"])
+
+    swing_dist = np.where(
+        direction > 0,
+        np.maximum(0.0, (c - ind["swing_low"]) / safe_c),
+        np.maximum(0.0, (ind["swing_high"] - c) / safe_c),
+    )
+    sl_pct = np.clip(
+        np.maximum(atr_pct * p["ATR_SL_MULT"], swing_dist + (atr / safe_c) * p["SWING_BUFFER_ATR"]),
+        p["ATR_SL_MIN_PCT"],
+        p["ATR_SL_MAX_PCT"],
+    )
+    strength = np.clip(score / 100.0, p["STRENGTH_MIN"], p["STRENGTH_MAX"])
+
+    return {
+        "signal": signal,
+        "direction": np.where(signal, direction, 0).astype(np.int8),
+        "score": np.where(signal, score, 0.0),
+        "strength": np.where(signal, strength, 0.0),
+        "sl_pct": np.where(signal, _round(sl_pct, 6), 0.0),
+        "atr_pct": atr_pct,
+    }
+
+
+# ============================================================
+# SIMULACIÓN DE GESTIÓN (reglas del manager del engine)
+# ============================================================
+
+def _bar_path(o: float, h: float, l: float, c: float) -> Tuple[float, float, float, float]:
+    if c >= o:
+        return (o, l, h, c)
+    return (o, h, l, c)
+
+
+def _bar_probe(sig: Dict[str, np.ndarray], j: int) -> Dict[str, Any]:
+    if not bool(sig["signal"][j]):
+        return {"signal": False, "reason": "NO_SIGNAL"}
+    return {
+        "signal": True,
+        "direction": "long" if int(sig["direction"][j]) > 0 else "short",
+        "strength": float(sig["strength"][j]),
+    }
+
+
+def _simulate_position(
+    *,
+    j0: int,
+    direction: int,
+    entry_px: float,
+    sl_pct: float,
+    mgmt: Dict[str, Any],
+    candles: Dict[str, np.ndarray],
+    sig: Dict[str, np.ndarray],
+    cfg: Dict[str, Any],
+) -> Dict[str, Any]:
+    """Recorre velas desde j0 con exit_manager (mismas reglas que el manager live)."""
+    o, h, l, c = candles["o"], candles["h"], candles["l"], candles["c"]
+    n = len(c)
+    slip = float(cfg["slippage_pct"])
+    stop_slip = float(cfg["stop_slippage_pct"])
+
+    def fill(kind: str, px: float) -> float:
+        return px * (1.0 - direction * (stop_slip if kind == "stop" else slip))
+
+    side = "long" if direction > 0 else "short"
+    state = exit_manager.init_exit_state(
+        direction=side,
+        entry_price=entry_px,
+        mgmt=mgmt,
+        sl_price_pct=sl_pct,
+        force_check_interval=0.0,
+    )
+    ledger = exit_manager.new_replay_ledger()
+    force_exit = bool(cfg.get("force_exit", True))
+
+    for j in range(j0, n):
+        exit_manager.replay_path(state, _bar_path(o[j], h[j], l[j], c[j]), ledger, interpolate=True, fill_fn=fill)
+        if ledger["closed"]:
+            return _close(ledger, j, state)
+        # Re-evaluación de fuerza al cierre de la vela (TP_FORCE_CHECK_INTERVAL << 5m).
+        if force_exit:
+            exit_manager.replay_path(
+                state, (c[j],), ledger, now_ts=float(j), strength_probe=lambda j=j: _bar_probe(sig, j), fill_fn=fill
+            )
+            if ledger["closed"]:
+                return _close(ledger, j, state)
+
+    exit_manager.close_ledger_at(ledger, "END_OF_DATA", c[n - 1])
+    return _close(ledger, n - 1, state)
+
+
+def _close(ledger: Dict[str, Any], j: int, state: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "fills": [(frac, px) for frac, px, _ in ledger["fills"]],
+        "exit_idx": int(j),
+        "exit_reason": ledger["exit_reason"],
+        "partial_tp_taken": bool(state["partial_tp_taken"]),
+        "break_even_armed": bool(state["break_even_armed"]),
+        "trailing_active": bool(state["trailing_active"]),
+        "mfe_pct": float(ledger["mfe_pct"]),
+        "mae_pct": float(ledger["mae_pct"]),
+    }
+
+
+def simulate_trades(
+    coin: str,
+    candles: Dict[str, np.ndarray],
+    sig: Dict[str, np.ndarray],
+    config: Optional[Dict[str, Any]] = None,
+    mgmt_fn=None,
+) -> List[Dict[str, Any]]:
+    cfg = resolve_config(config)
+    mgmt_fn = mgmt_fn or strategy.get_trade_management_params
+    t, o, c = candles["t"], candles["o"], candles["c"]
+    n = len(c)
+    fee = float(cfg["taker_fee_pct"])
+    slip = float(cfg["slippage_pct"])
+    cooldown = int(cfg["cooldown_bars"])
+    next_open = str(cfg["entry_fill"]) == "next_open"
+
+    trades: List[Dict[str, Any]] = []
+    j = 0
+    sig_idx = np.flatnonzero(sig["signal"])
+    pos = 0
+    while pos < len(sig_idx):
+        i = int(sig_idx[pos])
+        pos += 1
+        if i < j:
+            continue
+        entry_idx = i + 1 if next_open else i
+        if entry_idx >= n or i + 1 >= n:
+            break
+        direction = int(sig["direction"][i])
+        ref = o[entry_idx] if next_open else c[i]
+        entry_px = ref * (1.0 + direction * slip)
+        score = float(sig["score"][i])
+        strength = float(sig["strength"][i])
+        atr_pct = float(sig["atr_pct"][i])
+        mgmt = mgmt_fn(strength, score, atr_pct)
+        res = _simulate_position(
+            j0=i + 1,
+            direction=direction,
+            entry_px=entry_px,
+            sl_pct=float(sig["sl_pct"][i]),
+            mgmt=mgmt,
+            candles=candles,
+            sig=sig,
+            cfg=cfg,
+        )
+        gross = sum(frac * direction * (px - entry_px) / entry_px for frac, px in res["fills"])
+        exit_notional = sum(frac * px / entry_px for frac, px in res["fills"])
+        fees = fee * (1.0 + exit_notional)
+        exit_px = sum(frac * px for frac, px in res["fills"])
+        trades.append({
+            "coin": coin,
+            "direction": "long" if direction > 0 else "short",
+            "signal_t": int(t[i]),
+            "entry_t": int(t[entry_idx]),
+            "exit_t": int(t[res["exit_idx"]]),
+            "bars_held": int(res["exit_idx"] - i),
+            "entry_px": float(entry_px),
+            "exit_px": float(exit_px),
+            "exit_reason": res["exit_reason"],
+            "score": score,
+            "strength": strength,
+            "atr_pct": atr_pct,
+            "sl_pct": float(sig["sl_pct"][i]),
+            "bucket": str(mgmt.get("bucket", "")),
+            "vol_regime": str(mgmt.get("vol_regime", "")),
+            "partial_tp_taken": res["partial_tp_taken"],
+            "break_even_armed": res["break_even_armed"],
+            "trailing_active": res["trailing_active"],
+            "gross_pnl_pct": float(gross),
+            "fees_pct": float(fees),
+            "pnl_pct": float(gross - fees),
+            "mfe_pct": res["mfe_pct"],
+            "mae_pct": res["mae_pct"],
+        })
+        j = res["exit_idx"] + 1 + cooldown
+    return trades
+
+
+# ============================================================
+# MÉTRICAS
+# ============================================================
+
+def summarize_trades(trades: List[Dict[str, Any]]) -> Dict[str, Any]:
+    pnl = np.array([float(x["pnl_pct"]) for x in trades], dtype=np.float64)
+    out: Dict[str, Any] = {"trades": int(len(pnl))}
+    if not len(pnl):
+        out.update({"wins": 0, "losses": 0, "win_rate": 0.0, "profit_factor": 0.0, "expectancy_pct": 0.0, "total_pnl_pct": 0.0})
+        return out
+    gains = float(pnl[pnl > 0].sum())
+    losses = float(-pnl[pnl < 0].sum())
+    out.update({
+        "wins": int((pnl > 0).sum()),
+        "losses": int((pnl < 0).sum()),
+        "win_rate": float((pnl > 0).mean()),
+        "profit_factor": (gains / losses) if losses > 0 else (math.inf if gains > 0 else 0.0),
+        "expectancy_pct": float(pnl.mean()),
+        "total_pnl_pct": float(pnl.sum()),
+        "avg_win_pct": float(pnl[pnl > 0].mean()) if (pnl > 0).any() else 0.0,
+        "avg_loss_pct": float(pnl[pnl < 0].mean()) if (pnl < 0).any() else 0.0,
+    })
+    reasons: Dict[str, int] = {}
+    for x in trades:
+        reasons[x["exit_reason"]] = reasons.get(x["exit_reason"], 0) + 1
+    out["exit_reasons"] = reasons
+    return out
+
+
+def _summary_by(trades: List[Dict[str, Any]], key: str) -> Dict[str, Dict[str, Any]]:
+    groups: Dict[str, List[Dict[str, Any]]] = {}
+    for x in trades:
+        groups.setdefault(str(x.get(key, "")), []).append(x)
+    return {k: summarize_trades(v) for k, v in sorted(groups.items())}
+
+
+# ============================================================
+# API PRINCIPAL
+# ============================================================
+
+def backtest_coin(
+    coin: str,
+    candles: Dict[str, np.ndarray],
+    config: Optional[Dict[str, Any]] = None,
+    params: Optional[Dict[str, Any]] = None,
+    indicators: Optional[Dict[str, np.ndarray]] = None,
+) -> List[Dict[str, Any]]:
+    cfg = resolve_config(config)
+    coin = strategy.norm_coin(coin)
+    if cfg.get("apply_symbol_policy", True):
+        ok, reason, _ = strategy._symbol_policy_check(coin)
+        if not ok:
+            return []
+    sig = compute_signals(candles, params=params, indicators=indicators)
+    return simulate_trades(coin, candles, sig, cfg)
+
+
+def _backtest_coin_job(args: Tuple[str, Dict[str, np.ndarray], Dict[str, Any], Optional[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    coin, candles, cfg, params = args
+    return backtest_coin(coin, candles, cfg, params)
+
+
+def run_backtest(
+    candles_by_coin: Dict[str, Dict[str, np.ndarray]],
+    config: Optional[Dict[str, Any]] = None,
+    params: Optional[Dict[str, Any]] = None,
+    processes: int = 1,
+) -> Dict[str, Any]:
+    cfg = resolve_config(config)
+    started = time.time()
+    jobs = [(coin, cd, cfg, params) for coin, cd in candles_by_coin.items()]
+    trades: List[Dict[str, Any]] = []
+    if processes and processes > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=int(processes)) as pool:
+            for res in pool.map(_backtest_coin_job, jobs, chunksize=1):
+                trades.extend(res)
+    else:
+        for job in jobs:
+            trades.extend(_backtest_coin_job(job))
+    trades.sort(key=lambda x: (x["entry_t"], x["coin"]))
+    bars = int(sum(len(cd["c"]) for cd in candles_by_coin.values()))
+    elapsed = time.time() - started
+    return {
+        "trades": trades,
+        "summary": summarize_trades(trades),
+        "by_coin": _summary_by(trades, "coin"),
+        "by_bucket": _summary_by(trades, "bucket"),
+        "by_direction": _summary_by(trades, "direction"),
+        "bars": bars,
+        "elapsed_s": round(elapsed, 3),
+    }
+
+
+def verify_signals_against_strategy(
+    coin: str,
+    candles: Dict[str, np.ndarray],
+    bars: Optional[Iterable[int]] = None,
+    sample: int = 200,
+) -> List[Dict[str, Any]]:
+    """Compara la señal vectorizada con strategy.evaluate_entry_candles en velas concretas.
+
+    Usa las constantes actuales del módulo strategy. Devuelve la lista de discrepancias.
+    """
+    sig = compute_signals(candles)
+    W = int(strategy.LOOKBACK_5M)
+    n = len(candles["c"])
+    if bars is None:
+        cand = np.flatnonzero(sig["signal"]).tolist()
+        rest = np.arange(W - 1, n)
+        if len(rest):
+            step = max(1, len(rest) // max(int(sample), 1))
+            cand += rest[::step].tolist()
+        bars = sorted(set(cand))
+    mismatches: List[Dict[str, Any]] = []
+    keys = ("t", "o", "h", "l", "c", "v")
+    for t in bars:
+        if t < W - 1:
+            continue
+        rows = [{k: (int(candles[k][i]) if k == "t" else float(candles[k][i])) for k in keys} for i in range(t - W + 1, t + 1)]
+        live = strategy.evaluate_entry_candles(coin, rows, now_ms=float(candles["t"][t]) + 1.0)
+        vec_sig = bool(sig["signal"][t])
+        same = bool(live.get("signal")) == vec_sig
+        if same and vec_sig:
+            vec_dir = "long" if int(sig["direction"][t]) > 0 else "short"
+            same = (
+                live.get("direction") == vec_dir
+                and abs(float(live.get("score", 0.0)) - float(sig["score"][t])) < 1e-6
+                and abs(float(live.get("sl_price_pct", 0.0)) - float(sig["sl_pct"][t])) < 1e-6
+            )
+        if not same:
+            mismatches.append({"bar": int(t), "live": live, "vector": {k: sig[k][t].item() for k in sig}})
+    return mismatches
+
+
+# ============================================================
+# CLI
+# ============================================================
+
+def main(argv: Optional[List[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description="Backtest breakout_retest_5m sobre velas 5m guardadas")
+    ap.add_argument("--data", required=True, help="directorio con <COIN>.csv (t,o,h,l,c,v)")
+    ap.add_argument("--coins", default="", help="lista separada por comas (opcional)")
+    ap.add_argument("--processes", type=int, default=1)
+    ap.add_argument("--slippage", type=float, default=DEFAULT_BACKTEST_CONFIG["slippage_pct"])
+    ap.add_argument("--fee", type=float, default=DEFAULT_BACKTEST_CONFIG["taker_fee_pct"])
+    ap.add_argument("--entry-fill", choices=("close", "next_open"), default=DEFAULT_BACKTEST_CONFIG["entry_fill"])
+    ap.add_argument("--out", default="", help="CSV de trades (opcional)")
+    args = ap.parse_args(argv)
+
+    coins = [x for x in args.coins.split(",") if x.strip()] or None
+    data = load_candles_dir(args.data, coins)
+    cfg = {"slippage_pct": args.slippage, "taker_fee_pct": args.fee, "entry_fill": args.entry_fill}
+    res = run_backtest(data, config=cfg, processes=args.processes)
+    s = res["summary"]
+    log(
+        f"coins={len(data)} bars={res['bars']} trades={s['trades']} win_rate={s.get('win_rate', 0.0):.4f} "
+        f"pf={s.get('profit_factor', 0.0):.4f} expectancy_pct={s.get('expectancy_pct', 0.0):.6f} elapsed_s={res['elapsed_s']}"
+    )
+    for bucket, bs in res["by_bucket"].items():
+        log(f"bucket={bucket} trades={bs['trades']} win_rate={bs.get('win_rate', 0.0):.4f} pf={bs.get('profit_factor', 0.0):.4f}")
+    if args.out:
+        pd.DataFrame(res["trades"]).to_csv(args.out, index=False)
+        log(f"trades -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
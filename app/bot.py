@@ -59,8 +59,9 @@ from app.database import (
     reset_user_trade_stats_epoch,
 )
 
-from app.hyperliquid_client import get_balance
+from app.hyperliquid_client import get_balance, invalidate_user_fills, invalidate_user_signer
 from app.trading_loop import trading_loop
+from app.trading_engine import flatten_all_positions, resume_new_entries, entries_halted
 
 
 # ============================================================
@@ -263,12 +264,15 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     if context.user_data.get("awaiting_wallet"):
         save_user_wallet(user_id, text)
+        invalidate_user_fills(user_id)
         context.user_data.clear()
         await update.message.reply_text("✅ Wallet guardada.", reply_markup=main_menu(user_id))
         return
 
     if context.user_data.get("awaiting_pk"):
         save_user_private_key(user_id, text)
+        invalidate_user_signer(user_id)
+        invalidate_user_fills(user_id)
         context.user_data.clear()
         await update.message.reply_text("🔐 Private Key guardada.", reply_markup=main_menu(user_id))
         return
@@ -383,8 +387,11 @@ async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
         [InlineKeyboardButton("📊 Información Visual", callback_data="admin_visual")],
         [InlineKeyboardButton("📈 Estadísticas Trading", callback_data="admin_stats")],
         [InlineKeyboardButton("👤 Estadísticas por Usuario", callback_data="admin_user_stats_start")],
-        [InlineKeyboardButton("⬅ Volver", callback_data="back")],
+        [InlineKeyboardButton("🚨 Cerrar TODO (emergencia)", callback_data="admin_flatten_confirm")],
     ]
+    if entries_halted():
+        kb.append([InlineKeyboardButton("▶️ Reanudar entradas", callback_data="admin_resume_entries")])
+    kb.append([InlineKeyboardButton("⬅ Volver", callback_data="back")])
     await q.edit_message_text(
         "🛠 *PANEL DE ADMINISTRACIÓN*\nSelecciona una opción:",
         parse_mode="Markdown",
@@ -873,6 +880,97 @@ async def back_to_main(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await q.edit_message_text(msg, reply_markup=main_menu(user_id), parse_mode="Markdown")
 
 
+# ============================================================
+# ADMIN – FLATTEN DE EMERGENCIA
+# ============================================================
+
+async def admin_flatten_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    await q.answer()
+
+    if q.from_user.id != ADMIN_TELEGRAM_ID:
+        await q.edit_message_text("⛔ Acceso no autorizado.", reply_markup=main_menu(q.from_user.id))
+        return
+
+    kb = [[
+        InlineKeyboardButton("🚨 Sí, cerrar todo", callback_data="admin_flatten_do"),
+        InlineKeyboardButton("❌ Cancelar", callback_data="admin_panel"),
+    ]]
+
+    msg = (
+        "🚨 *CERRAR TODAS LAS POSICIONES*\n"
+        "───────────────────────────\n"
+        "Se detienen las nuevas entradas y se cierran a mercado\n"
+        "(reduceOnly) las posiciones de *todos* los usuarios,\n"
+        "cancelando sus órdenes pendientes.\n\n"
+        "Las entradas quedan detenidas hasta reanudarlas\n"
+        "desde el panel.\n"
+        "───────────────────────────\n"
+        "¿Confirmas?"
+    )
+
+    await q.edit_message_text(msg, parse_mode="Markdown", reply_markup=InlineKeyboardMarkup(kb))
+
+
+async def admin_flatten_do(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    await q.answer()
+
+    if q.from_user.id != ADMIN_TELEGRAM_ID:
+        await q.edit_message_text("⛔ Acceso no autorizado.", reply_markup=main_menu(q.from_user.id))
+        return
+
+    await q.edit_message_text("⏳ Cerrando todas las posiciones...")
+    back_kb = InlineKeyboardMarkup([
+        [InlineKeyboardButton("▶️ Reanudar entradas", callback_data="admin_resume_entries")],
+        [InlineKeyboardButton("⬅ Volver", callback_data="admin_panel")],
+    ])
+
+    try:
+        rep = await asyncio.to_thread(flatten_all_positions, reason=f"ADMIN_BOT:{q.from_user.id}")
+    except Exception as e:
+        await q.edit_message_text(f"⚠ Error en el cierre de emergencia: `{e}`", parse_mode="Markdown", reply_markup=back_kb)
+        return
+
+    outcomes = rep.get("outcomes") or {}
+    lines = [
+        "🚨 *CIERRE DE EMERGENCIA*",
+        "───────────────────────────",
+        f"{'✅ Todo plano' if rep.get('ok') else '⚠️ Con fallos'} — {rep.get('users', 0)} usuarios en {float(rep.get('elapsed_ms') or 0.0) / 1000.0:.1f}s",
+        "Resultado: " + ", ".join(f"`{k}={v}`" for k, v in sorted(outcomes.items())),
+    ]
+    shown = [r for r in rep.get("results") or [] if r.get("outcome") != "NOTHING"]
+    for r in shown[:25]:
+        detail = ""
+        if r.get("closed"):
+            detail += " cerradas=" + ",".join(r["closed"])
+        if r.get("failed"):
+            detail += " pendientes=" + ",".join(f"{f.get('coin')}({f.get('left')})" for f in r["failed"])
+        lines.append(f"`{r['user_id']}` `{r['outcome']}{detail}` ({float(r.get('latency_ms') or 0.0):.0f}ms)")
+    if len(shown) > 25:
+        lines.append(f"... y {len(shown) - 25} más (ver logs)")
+    lines.append("───────────────────────────")
+    lines.append("⏸ Nuevas entradas detenidas.")
+
+    await q.edit_message_text("\n".join(lines), parse_mode="Markdown", reply_markup=back_kb)
+
+
+async def admin_resume_entries(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    await q.answer()
+
+    if q.from_user.id != ADMIN_TELEGRAM_ID:
+        await q.edit_message_text("⛔ Acceso no autorizado.", reply_markup=main_menu(q.from_user.id))
+        return
+
+    was = resume_new_entries()
+    msg = "▶️ Entradas reanudadas." if was else "ℹ️ Las entradas no estaban detenidas."
+    await q.edit_message_text(
+        msg,
+        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅ Volver", callback_data="admin_panel")]]),
+    )
+
+
 # ============================================================
 # ROUTER
 # ============================================================
@@ -900,6 +998,9 @@ routes = {
     "admin_user_stats_30d": admin_user_stats_30d,
     "admin_user_stats_reset_confirm": admin_user_stats_reset_confirm,
     "admin_user_stats_reset_do": admin_user_stats_reset_do,
+    "admin_flatten_confirm": admin_flatten_confirm,
+    "admin_flatten_do": admin_flatten_do,
+    "admin_resume_entries": admin_resume_entries,
     "admin_panel": admin_panel,
     "info": info,
     "policies": policies,
@@ -44,9 +44,14 @@ if not MONGO_URI:
 # ============================================================
 
 HYPER_BASE_URL = "https://api.hyperliquid.xyz"
+HYPER_WS_URL = os.getenv("HYPER_WS_URL", "wss://api.hyperliquid.xyz/ws")
 DEFAULT_PAIR = "BTC-USDC"
 
 REQUEST_TIMEOUT = int(os.getenv("REQUEST_TIMEOUT", "10"))
+# /exchange: cada orden lleva cloid; ante fallo ambiguo se consulta por cloid antes de reenviar,
+# así que el timeout del camino crítico puede ser agresivo sin duplicar posiciones.
+EXCHANGE_REQUEST_TIMEOUT = float(os.getenv("EXCHANGE_REQUEST_TIMEOUT", str(REQUEST_TIMEOUT)))
+EXCHANGE_SEND_ATTEMPTS = int(os.getenv("EXCHANGE_SEND_ATTEMPTS", "4"))
 
 # ============================================================
 # SISTEMA DE SCANEO AUTOMÁTICO DE MERCADO (PROD)
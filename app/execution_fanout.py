@@ -0,0 +1,138 @@
+# ============================================================
+# EXECUTION FAN-OUT – Trading X Hyper Pro
+# Envío concurrente de órdenes para varios usuarios
+#
+# - Un pool fijo de workers procesa los jobs de todos los usuarios.
+# - Concurrencia acotada por wallet (semáforo por wallet, FANOUT_PER_WALLET).
+#   Los nonces ya no dependen de esto: app.nonce_manager los emite únicos
+#   y crecientes por firmante aunque varios threads firmen a la vez.
+# - Los resultados se recogen a medida que llegan (as_completed) y se
+#   reporta latencia (cola + ejecución) y outcome por usuario.
+# - El módulo es agnóstico: el engine pasa la función de trabajo y la
+#   clave de wallet (ver execute_trade_cycles_batch en trading_engine).
+# ============================================================
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+# ============================================================
+# CONFIG
+# ============================================================
+
+FANOUT_WORKERS = int(os.getenv("FANOUT_WORKERS", "16"))
+FANOUT_PER_WALLET = int(os.getenv("FANOUT_PER_WALLET", "1"))
+
+
+def log(msg: str, level: str = "INFO"):
+    print(f"[FANOUT {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')}] {level} {msg}")
+
+
+def _default_outcome(item: Dict[str, Any], result: Any) -> str:
+    if isinstance(result, dict):
+        return str(result.get("outcome") or result.get("event") or result.get("reason") or "OK")
+    return "NONE" if result is None else "OK"
+
+
+# ============================================================
+# FAN-OUT
+# ============================================================
+
+def fan_out(
+    items: Iterable[Dict[str, Any]],
+    work: Callable[[Dict[str, Any]], Any],
+    *,
+    wallet_of: Callable[[Dict[str, Any]], Optional[str]],
+    label: str = "batch",
+    workers: int = FANOUT_WORKERS,
+    per_wallet: int = FANOUT_PER_WALLET,
+    outcome_of: Callable[[Dict[str, Any], Any], str] = _default_outcome,
+    report_items: bool = True,
+) -> List[Dict[str, Any]]:
+    """
+    Ejecuta work(item) para cada item con concurrencia acotada (global y por wallet).
+
+    Retorna un reporte por item, en el orden de entrada:
+      {"item", "result", "error", "outcome", "queued_ms", "latency_ms"}
+    Un job que lanza excepción no corta el batch: queda con outcome=ERROR.
+    report_items=False deja solo la línea resumen en el log.
+    """
+    items = list(items)
+    reports: List[Dict[str, Any]] = [
+        {"item": it, "result": None, "error": None, "outcome": "PENDING", "queued_ms": 0.0, "latency_ms": 0.0}
+        for it in items
+    ]
+    if not items:
+        return reports
+
+    wallet_sems: Dict[str, threading.BoundedSemaphore] = {}
+    for it in items:
+        key = str(wallet_of(it) or "").lower()
+        if key and key not in wallet_sems:
+            wallet_sems[key] = threading.BoundedSemaphore(max(1, int(per_wallet)))
+
+    batch_started = time.time()
+
+    def _run(idx: int) -> int:
+        it = items[idx]
+        rep = reports[idx]
+        sem = wallet_sems.get(str(wallet_of(it) or "").lower())
+        if sem is not None:
+            sem.acquire()
+        started = time.time()
+        rep["queued_ms"] = round((started - batch_started) * 1000.0, 1)
+        try:
+            rep["result"] = work(it)
+            rep["outcome"] = outcome_of(it, rep["result"])
+        except Exception as e:
+            rep["error"] = str(e)
+            rep["outcome"] = "ERROR"
+            log(f"{label} job error item={_item_tag(it)} err={e}\n{traceback.format_exc()}", "ERROR")
+        finally:
+            rep["latency_ms"] = round((time.time() - started) * 1000.0, 1)
+            if sem is not None:
+                sem.release()
+        return idx
+
+    n_workers = max(1, min(int(workers), len(items)))
+    with ThreadPoolExecutor(max_workers=n_workers, thread_name_prefix=f"fanout-{label}") as pool:
+        futures = [pool.submit(_run, i) for i in range(len(items))]
+        for fut in as_completed(futures):
+            fut.result()
+
+    _log_report(label, reports, time.time() - batch_started, report_items)
+    return reports
+
+
+def _item_tag(item: Dict[str, Any]) -> str:
+    uid = item.get("user_id")
+    sym = item.get("symbol")
+    return f"user={uid}" + (f" symbol={sym}" if sym else "")
+
+
+def _log_report(label: str, reports: List[Dict[str, Any]], elapsed: float, report_items: bool) -> None:
+    if not reports:
+        return
+    lat = sorted(float(r["latency_ms"]) for r in reports)
+    p50 = lat[len(lat) // 2]
+    p_max = lat[-1]
+    outcomes: Dict[str, int] = {}
+    for r in reports:
+        outcomes[r["outcome"]] = outcomes.get(r["outcome"], 0) + 1
+    log(
+        f"{label}: jobs={len(reports)} elapsed_ms={round(elapsed * 1000.0, 1)} "
+        f"latency_p50_ms={p50} latency_max_ms={p_max} outcomes={outcomes}"
+    )
+    if not report_items:
+        return
+    for r in reports:
+        log(
+            f"{label}: {_item_tag(r['item'])} outcome={r['outcome']} "
+            f"queued_ms={r['queued_ms']} latency_ms={r['latency_ms']}"
+        )
@@ -0,0 +1,443 @@
+# ============================================================
+# EXIT MANAGER – Trading X Hyper Pro
+# Máquina de estados de salida: partial TP, break-even, trailing y
+# force-exit por pérdida de fuerza.
+#
+# - Pura: sin I/O ni reloj propio. El llamador pasa precio y timestamp
+#   y ejecuta las acciones (cierre parcial, armar BE, cerrar).
+# - La comparten el manager live (_TradeManagerSession) y el
+#   replayer offline (replay_path / backtester), así que lo que se mide
+#   offline es exactamente lo que corre en producción.
+# - El estado es un dict con los mismos campos que persiste active_trade.
+# ============================================================
+
+from __future__ import annotations
+
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+FORCE_CHECK_INTERVAL = 15.0   # TP_FORCE_CHECK_INTERVAL del engine
+TICK_SECONDS = 0.4            # PRICE_CHECK_INTERVAL del engine
+
+# Campos del estado que el engine persiste en active_trade.
+RUNTIME_FIELDS = (
+    "trailing_active",
+    "partial_tp_taken",
+    "break_even_armed",
+    "best_pnl_pct",
+    "trailing_stop_pnl",
+    "peak_price",
+    "strength_check_ts",
+)
+
+
+def pnl_pct_for(direction: str, entry_price: float, price: float) -> float:
+    if entry_price <= 0:
+        return 0.0
+    if str(direction).lower() == "long":
+        return (price - entry_price) / entry_price
+    return (entry_price - price) / entry_price
+
+
+def price_for_pnl(direction: str, entry_price: float, pnl_pct: float) -> float:
+    if str(direction).lower() == "long":
+        return entry_price * (1.0 + pnl_pct)
+    return entry_price * (1.0 - pnl_pct)
+
+
+def _f(src: Optional[dict], key: str, default: float = 0.0) -> float:
+    try:
+        return float((src or {}).get(key, default) or default)
+    except Exception:
+        return float(default)
+
+
+def init_exit_state(
+    *,
+    direction: str,
+    entry_price: float,
+    mgmt: Dict[str, Any],
+    runtime: Optional[Dict[str, Any]] = None,
+    strategy_managed: bool = True,
+    sl_price_pct: float = 0.0,
+    force_check_interval: float = FORCE_CHECK_INTERVAL,
+) -> Dict[str, Any]:
+    """Estado inicial. `runtime` (active_trade persistido) restaura flags y trailing tras un reinicio."""
+    rt = runtime or {}
+    tp_activate = _f(mgmt, "tp_activate_price", _f(mgmt, "tp_activation_price"))
+    trailing_stop_pnl = rt.get("trailing_stop_pnl", None)
+    try:
+        trailing_stop_pnl = float(trailing_stop_pnl) if trailing_stop_pnl is not None else None
+    except Exception:
+        trailing_stop_pnl = None
+    return {
+        "direction": str(direction).lower(),
+        "entry_price": float(entry_price),
+        "strategy_managed": bool(strategy_managed),
+        "sl_price_pct": float(sl_price_pct or 0.0),
+        "force_check_interval": float(force_check_interval),
+        "tp_activate_price": tp_activate,
+        "trail_retrace_price": _f(mgmt, "trail_retrace_price"),
+        "force_min_profit_price": _f(mgmt, "force_min_profit_price"),
+        "force_min_strength": _f(mgmt, "force_min_strength"),
+        "partial_tp_activation_price": _f(rt, "partial_tp_activation_price", _f(mgmt, "partial_tp_activation_price")),
+        "partial_tp_close_fraction": _f(rt, "partial_tp_close_fraction", _f(mgmt, "partial_tp_close_fraction")),
+        "break_even_activation_price": _f(rt, "break_even_activation_price", _f(mgmt, "break_even_activation_price")),
+        "break_even_offset_price": _f(rt, "break_even_offset_price", _f(mgmt, "break_even_offset_price")),
+        "trailing_active": bool(rt.get("trailing_active", False)),
+        "partial_tp_taken": bool(rt.get("partial_tp_taken", False)),
+        "break_even_armed": bool(rt.get("break_even_armed", False)),
+        "best_pnl_pct": _f(rt, "best_pnl_pct"),
+        "trailing_stop_pnl": trailing_stop_pnl,
+        "peak_price": _f(rt, "peak_price", float(entry_price)),
+        "strength_check_ts": _f(rt, "strength_check_ts"),
+        "last_price": float(entry_price),
+        "last_pnl_pct": 0.0,
+    }
+
+
+def runtime_fields(state: Dict[str, Any]) -> Dict[str, Any]:
+    out = {k: state[k] for k in RUNTIME_FIELDS}
+    out["trailing_stop_pnl"] = float(state["trailing_stop_pnl"]) if state["trailing_stop_pnl"] is not None else None
+    return out
+
+
+def strength_loss_decision(sig: Any, direction: str, force_min_strength: float) -> Tuple[bool, str, float]:
+    """Decide el force-exit con la señal re-evaluada. Devuelve (cerrar, motivo, fuerza_live)."""
+    if not isinstance(sig, dict):
+        return False, "", 0.0
+
+    same_dir = str(sig.get("direction") or "").lower() == str(direction or "").lower()
+    live_strength = float(sig.get("strength", 0.0) or 0.0)
+    min_strength = max(float(force_min_strength or 0.0), 0.0)
+
+    if not sig.get("signal"):
+        reason = str(sig.get("reason") or "WEAKNESS")
+        if reason.startswith("NO_TREND_1H") or reason.startswith("NO_STRUCTURE_1H") or reason.startswith("TIMING_5M"):
+            return True, f"FORCE_LOSS_{reason}", live_strength
+        return False, "", live_strength
+
+    if not same_dir:
+        return True, "FORCE_LOSS_DIRECTION_FLIP", live_strength
+
+    if live_strength <= min_strength:
+        return True, f"FORCE_LOSS_STRENGTH_{live_strength:.4f}", live_strength
+
+    return False, "", live_strength
+
+
+def step_exit_state(
+    state: Dict[str, Any],
+    *,
+    price: float,
+    now_ts: float,
+    strength_probe: Optional[Callable[[], Any]] = None,
+) -> Dict[str, Any]:
+    """Avanza un tick con el mismo orden que el manager live.
+
+    Orden: force-exit -> partial TP -> break-even -> trailing (activar/actualizar) -> salida por trailing.
+    `partial_tp` / `break_even` son peticiones: el estado solo cambia al confirmarlas con
+    mark_partial_tp_taken / mark_break_even_armed (en live la orden puede fallar y se reintenta).
+    """
+    pnl = pnl_pct_for(state["direction"], state["entry_price"], float(price))
+    state["last_price"] = float(price)
+    state["last_pnl_pct"] = pnl
+    out = {
+        "pnl_pct": pnl,
+        "exit": False,
+        "exit_reason": "",
+        "live_strength": 0.0,
+        "partial_tp": False,
+        "break_even": False,
+        "trail_event": "",
+    }
+    if not state["strategy_managed"]:
+        return out
+
+    if strength_probe is not None and (float(now_ts) - state["strength_check_ts"]) >= state["force_check_interval"]:
+        state["strength_check_ts"] = float(now_ts)
+        if pnl >= state["force_min_profit_price"]:
+            force, reason, live_strength = strength_loss_decision(strength_probe(), state["direction"], state["force_min_strength"])
+            out["live_strength"] = live_strength
+            if force:
+                out["exit"] = True
+                out["exit_reason"] = reason
+                return out
+
+    if (not state["partial_tp_taken"]) and state["partial_tp_activation_price"] > 0.0 and pnl >= state["partial_tp_activation_price"]:
+        out["partial_tp"] = True
+
+    if (not state["break_even_armed"]) and state["break_even_activation_price"] > 0.0 and pnl >= state["break_even_activation_price"]:
+        out["break_even"] = True
+
+    retrace = state["trail_retrace_price"]
+    if not state["trailing_active"]:
+        if pnl >= state["tp_activate_price"]:
+            state["trailing_active"] = True
+            state["best_pnl_pct"] = pnl
+            state["peak_price"] = float(price)
+            state["trailing_stop_pnl"] = pnl - retrace
+            out["trail_event"] = "ACTIVATED"
+    else:
+        if pnl > state["best_pnl_pct"]:
+            state["best_pnl_pct"] = pnl
+            state["peak_price"] = float(price)
+            state["trailing_stop_pnl"] = pnl - retrace
+            out["trail_event"] = "UPDATED"
+        if state["trailing_stop_pnl"] is not None and pnl <= state["trailing_stop_pnl"]:
+            out["exit"] = True
+            out["exit_reason"] = "TRAIL"
+    return out
+
+
+def mark_partial_tp_taken(state: Dict[str, Any]) -> None:
+    state["partial_tp_taken"] = True
+
+
+def mark_break_even_armed(state: Dict[str, Any]) -> None:
+    state["break_even_armed"] = True
+
+
+def exchange_stop_price(state: Dict[str, Any]) -> float:
+    """Stop que vive en el exchange: SL inicial o, con BE armado, entry -/+ offset (como lo coloca el engine)."""
+    pct = state["break_even_offset_price"] if state["break_even_armed"] else state["sl_price_pct"]
+    if pct <= 0.0:
+        return 0.0
+    return price_for_pnl(state["direction"], state["entry_price"], -pct)
+
+
+# Margen relativo de los niveles del índice de triggers: ante la duda el tick se procesa
+# (un tick de más no cambia nada; uno de menos perdería un cruce).
+_TRIGGER_PX_EPS = 1e-9
+
+
+def trigger_prices(state: Dict[str, Any]) -> Tuple[Optional[float], Optional[float], Optional[float]]:
+    """Niveles donde el próximo tick puede cambiar algo: (precio_arriba, precio_abajo, wake_ts).
+
+    Un tick con up > precio > down y now < wake_ts solo refresca last_price: step_exit_state
+    no pide nada. None = sin nivel en ese sentido.
+    """
+    if not state["strategy_managed"]:
+        return None, None, None
+    favorable: List[float] = []
+    if (not state["partial_tp_taken"]) and state["partial_tp_activation_price"] > 0.0:
+        favorable.append(state["partial_tp_activation_price"])
+    if (not state["break_even_armed"]) and state["break_even_activation_price"] > 0.0:
+        favorable.append(state["break_even_activation_price"])
+    adverse: Optional[float] = None
+    if not state["trailing_active"]:
+        favorable.append(state["tp_activate_price"])
+    else:
+        favorable.append(state["best_pnl_pct"])
+        if state["trailing_stop_pnl"] is not None:
+            adverse = float(state["trailing_stop_pnl"])
+
+    d = state["direction"]
+    e = state["entry_price"]
+    fav_px = price_for_pnl(d, e, min(favorable)) if favorable else None
+    adv_px = price_for_pnl(d, e, adverse) if adverse is not None else None
+    wake_ts = state["strength_check_ts"] + state["force_check_interval"]
+    if d == "long":
+        up = fav_px * (1.0 - _TRIGGER_PX_EPS) if fav_px is not None else None
+        down = adv_px * (1.0 + _TRIGGER_PX_EPS) if adv_px is not None else None
+    else:
+        up = adv_px * (1.0 - _TRIGGER_PX_EPS) if adv_px is not None else None
+        down = fav_px * (1.0 + _TRIGGER_PX_EPS) if fav_px is not None else None
+    return up, down, wake_ts
+
+
+# ============================================================
+# REPLAY OFFLINE
+# ============================================================
+
+def new_replay_ledger() -> Dict[str, Any]:
+    return {
+        "fills": [],          # [(fracción de la posición inicial, precio, motivo)]
+        "remaining": 1.0,
+        "closed": False,
+        "exit_reason": "",
+        "exit_price": 0.0,
+        "mfe_pct": 0.0,
+        "mae_pct": 0.0,
+        "ticks": 0,
+    }
+
+
+# Los niveles interpolados se empujan un epsilon en el sentido del tramo para que
+# el ida y vuelta pnl -> precio -> pnl no quede un ulp por debajo del umbral.
+_LEVEL_EPS = 1e-12
+
+
+def _crossing_levels(state: Dict[str, Any], p0: float, p1: float) -> List[float]:
+    """Precios umbral atravesados en el tramo p0 -> p1 (en orden de recorrido)."""
+    d = state["direction"]
+    e = state["entry_price"]
+    pnl0 = pnl_pct_for(d, e, p0)
+    pnl1 = pnl_pct_for(d, e, p1)
+    levels: List[float] = []
+    if pnl1 > pnl0:
+        for key in ("partial_tp_activation_price", "break_even_activation_price", "tp_activate_price"):
+            lv = state[key]
+            if lv > 0.0 and pnl0 < lv < pnl1:
+                levels.append(min(lv + _LEVEL_EPS, pnl1))
+        levels.sort()
+    elif pnl1 < pnl0:
+        stop_px = exchange_stop_price(state)
+        if stop_px > 0.0:
+            lv = pnl_pct_for(d, e, stop_px)
+            if pnl1 < lv < pnl0:
+                levels.append(max(lv - _LEVEL_EPS, pnl1))
+        if state["trailing_active"] and state["trailing_stop_pnl"] is not None:
+            lv = state["trailing_stop_pnl"]
+            if pnl1 < lv < pnl0:
+                levels.append(max(lv - _LEVEL_EPS, pnl1))
+        levels.sort(reverse=True)
+    return [price_for_pnl(d, e, lv) for lv in levels]
+
+
+def _stop_hit(state: Dict[str, Any], price: float) -> bool:
+    stop_px = exchange_stop_price(state)
+    if stop_px <= 0.0:
+        return False
+    return price <= stop_px if state["direction"] == "long" else price >= stop_px
+
+
+def replay_path(
+    state: Dict[str, Any],
+    prices: Iterable[float],
+    ledger: Optional[Dict[str, Any]] = None,
+    *,
+    now_ts: float = 0.0,
+    dt: float = TICK_SECONDS,
+    interpolate: bool = False,
+    strength_probe: Optional[Callable[[], Any]] = None,
+    fill_fn: Optional[Callable[[str, float], float]] = None,
+) -> Dict[str, Any]:
+    """Recorre una ruta de precios (ticks grabados o sintéticos) hasta cerrar o agotarla.
+
+    - El stop del exchange (exchange_stop_price) se evalúa antes del manager en cada tick.
+    - interpolate=True inserta los precios umbral que se cruzan entre puntos consecutivos
+      (rutas OHLC), así los fills ocurren en el nivel y no en el extremo de la vela.
+    - fill_fn(kind, precio) -> precio ejecutado (slippage); kind: "stop" | "market".
+    Se puede llamar repetidamente con el mismo ledger para continuar la ruta.
+    """
+    ledger = ledger if ledger is not None else new_replay_ledger()
+    if ledger["closed"]:
+        return ledger
+    fill = fill_fn or (lambda kind, px: px)
+    d = state["direction"]
+    e = state["entry_price"]
+    ts = float(now_ts)
+    prev: Optional[float] = None
+
+    for raw in prices:
+        raw = float(raw)
+        ticks = (_crossing_levels(state, prev, raw) if (interpolate and prev is not None) else []) + [raw]
+        for i, px in enumerate(ticks):
+            ledger["ticks"] += 1
+            pnl = pnl_pct_for(d, e, px)
+            if _stop_hit(state, px):
+                gapped = prev is None and i == 0
+                stop_px = px if gapped else exchange_stop_price(state)
+                reason = "BREAK_EVEN_STOP" if state["break_even_armed"] else "EXCHANGE_SL"
+                _close_ledger(ledger, reason, fill("stop", stop_px))
+                ledger["mae_pct"] = min(ledger["mae_pct"], pnl_pct_for(d, e, stop_px))
+                return ledger
+            ledger["mfe_pct"] = max(ledger["mfe_pct"], pnl)
+            ledger["mae_pct"] = min(ledger["mae_pct"], pnl)
+
+            decision = step_exit_state(state, price=px, now_ts=ts, strength_probe=strength_probe)
+            if decision["exit"] and decision["exit_reason"] != "TRAIL":
+                _close_ledger(ledger, decision["exit_reason"], fill("market", px))
+                return ledger
+            if decision["partial_tp"]:
+                frac = ledger["remaining"] * state["partial_tp_close_fraction"]
+                ledger["fills"].append((frac, fill("market", px), "PARTIAL_TP"))
+                ledger["remaining"] -= frac
+                mark_partial_tp_taken(state)
+            if decision["break_even"]:
+                mark_break_even_armed(state)
+            if decision["exit"]:
+                _close_ledger(ledger, "TRAIL", fill("market", px))
+                return ledger
+        prev = raw
+        ts += dt
+    return ledger
+
+
+def _close_ledger(ledger: Dict[str, Any], reason: str, price: float) -> None:
+    ledger["fills"].append((ledger["remaining"], float(price), reason))
+    ledger["remaining"] = 0.0
+    ledger["closed"] = True
+    ledger["exit_reason"] = reason
+    ledger["exit_price"] = float(price)
+
+
+def close_ledger_at(ledger: Dict[str, Any], reason: str, price: float) -> Dict[str, Any]:
+    """Cierra lo que quede abierto (fin de datos / cierre manual en el replay)."""
+    if not ledger["closed"]:
+        _close_ledger(ledger, reason, price)
+    return ledger
+
+
+def ledger_pnl_pct(ledger: Dict[str, Any], direction: str, entry_price: float) -> float:
+    """PnL bruto como fracción del notional inicial."""
+    return sum(frac * pnl_pct_for(direction, entry_price, px) for frac, px, _ in ledger["fills"])
+
+
+def _force_flag_probe(ledger: Dict[str, Any], flags: List[bool], direction: str) -> Callable[[], Any]:
+    opposite = "short" if direction == "long" else "long"
+
+    def probe() -> Any:
+        k = ledger["ticks"] - 1
+        if 0 <= k < len(flags) and flags[k]:
+            return {"signal": True, "direction": opposite, "strength": 0.0}
+        return None
+
+    return probe
+
+
+def replay_trades(
+    trades: Iterable[Dict[str, Any]],
+    mgmt_fn: Callable[[float, float, Optional[float]], Dict[str, Any]],
+    *,
+    interpolate: bool = False,
+    dt: float = TICK_SECONDS,
+) -> List[Dict[str, Any]]:
+    """Re-juega rutas de precio grabadas con otros parámetros de gestión.
+
+    Cada trade: direction, entry_price, sl_price_pct, strength, score, atr_pct, prices (lista)
+    y opcional force_flags (lista bool alineada con prices: en ese tick la re-evaluación
+    de la estrategia pide salir). Con force_flags el chequeo de fuerza se hace en cada tick.
+    """
+    out: List[Dict[str, Any]] = []
+    for tr in trades:
+        direction = str(tr["direction"]).lower()
+        entry = float(tr["entry_price"])
+        mgmt = mgmt_fn(float(tr.get("strength", 0.0)), float(tr.get("score", 0.0)), tr.get("atr_pct"))
+        flags = list(tr.get("force_flags") or [])
+        state = init_exit_state(
+            direction=direction,
+            entry_price=entry,
+            mgmt=mgmt,
+            sl_price_pct=float(tr.get("sl_price_pct", 0.0) or 0.0),
+            force_check_interval=0.0 if flags else FORCE_CHECK_INTERVAL,
+        )
+        prices = list(tr.get("prices") or [])
+        ledger = new_replay_ledger()
+        probe = _force_flag_probe(ledger, flags, direction) if (flags and not interpolate) else None
+        replay_path(state, prices, ledger, interpolate=interpolate, dt=dt, strength_probe=probe)
+        if not ledger["closed"] and prices:
+            close_ledger_at(ledger, "END_OF_PATH", prices[-1])
+        out.append({
+            "direction": direction,
+            "entry_price": entry,
+            "exit_reason": ledger["exit_reason"],
+            "pnl_pct": ledger_pnl_pct(ledger, direction, entry),
+            "partial_tp_taken": state["partial_tp_taken"],
+            "break_even_armed": state["break_even_armed"],
+            "trailing_active": state["trailing_active"],
+            "mfe_pct": ledger["mfe_pct"],
+            "mae_pct": ledger["mae_pct"],
+            "ticks": ledger["ticks"],
+        })
+    return out
@@ -0,0 +1,334 @@
+# ============================================================
+# FILLS INDEX – Trading X Hyper Pro
+# Índice incremental de fills por usuario (PnL realizado)
+#
+# - Por usuario se recuerda el cursor (time del último fill visto) y
+#   solo se piden fills nuevos desde ahí (userFillsByTime, paginado).
+# - Por coin, arrays compactos ordenados por tiempo (array 'q'/'d'):
+#   time, oid, closedPnl, fee + sumas prefijas de pnl y fee.
+#   "PnL cerrado desde T" = bisect + resta de prefijos: O(log n).
+# - Índice oid -> posiciones para aislar el último batch de cierre
+#   (misma semántica que get_last_closed_pnl).
+# - Solo se guardan fills con closedPnl != 0 o fee != 0 (los demás no
+#   cuentan en ningún cálculo de PnL).
+# ============================================================
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+# ============================================================
+# CONFIG
+# ============================================================
+
+FILLS_INDEX_PAGE_SIZE = 2000                     # máximo por respuesta de userFillsByTime
+FILLS_INDEX_MAX_PAGES = int(os.getenv("FILLS_INDEX_MAX_PAGES", "10"))
+FILLS_INDEX_MAX_PER_COIN = int(os.getenv("FILLS_INDEX_MAX_PER_COIN", "5000"))
+FILLS_INDEX_MIN_SYNC_SECONDS = float(os.getenv("FILLS_INDEX_MIN_SYNC_SECONDS", "0.5"))
+
+
+def log(msg: str, level: str = "INFO"):
+    print(f"[FILLS_INDEX {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')}] {level} {msg}")
+
+
+def _f(v: Any) -> float:
+    try:
+        return float(v) if v is not None else 0.0
+    except Exception:
+        return 0.0
+
+
+def _fill_time(f: Dict[str, Any]) -> int:
+    ts = f.get("time")
+    if ts is None:
+        ts = f.get("timestamp")
+    if ts is None:
+        ts = f.get("t")
+    try:
+        return int(ts)
+    except Exception:
+        return 0
+
+
+def _fill_oid(f: Dict[str, Any]) -> int:
+    oid = f.get("oid") or f.get("orderId") or f.get("order_id") or f.get("order") or None
+    try:
+        return int(oid) if oid is not None else 0
+    except Exception:
+        return 0
+
+
+def _fill_id(f: Dict[str, Any]) -> Any:
+    return f.get("tid") or f.get("hash") or (_fill_oid(f), _fill_time(f), f.get("px"), f.get("sz"))
+
+
+def _empty_pnl() -> Dict[str, float]:
+    return {"pnl": 0.0, "fees": 0.0, "net": 0.0, "fills": 0}
+
+
+def _rounded(pnl: float, fees: float, n: int) -> Dict[str, float]:
+    return {
+        "pnl": float(round(pnl, 10)),
+        "fees": float(round(fees, 10)),
+        "net": float(round(pnl - fees, 10)),
+        "fills": int(n),
+    }
+
+
+# ============================================================
+# ARRAYS POR COIN
+# ============================================================
+
+class _CoinFills:
+    __slots__ = ("times", "oids", "cps", "fees", "cum_cp", "cum_fee", "by_oid")
+
+    def __init__(self):
+        self.times = array("q")
+        self.oids = array("q")
+        self.cps = array("d")
+        self.fees = array("d")
+        # Prefijos: cum_x[i] = suma de x[0..i)
+        self.cum_cp = array("d", [0.0])
+        self.cum_fee = array("d", [0.0])
+        self.by_oid: Dict[int, array] = {}
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def add(self, ts: int, oid: int, cp: float, fee: float) -> None:
+        if not self.times or ts >= self.times[-1]:
+            self.times.append(ts)
+            self.oids.append(oid)
+            self.cps.append(cp)
+            self.fees.append(fee)
+            self.cum_cp.append(self.cum_cp[-1] + cp)
+            self.cum_fee.append(self.cum_fee[-1] + fee)
+            if oid:
+                self.by_oid.setdefault(oid, array("l")).append(len(self.times) - 1)
+            return
+        # Fuera de orden (raro: mismo lote con ms desordenados): inserta y reconstruye desde ahí.
+        i = bisect_right(self.times, ts)
+        self.times.insert(i, ts)
+        self.oids.insert(i, oid)
+        self.cps.insert(i, cp)
+        self.fees.insert(i, fee)
+        self._rebuild(from_idx=i)
+
+    def _rebuild(self, from_idx: int = 0) -> None:
+        del self.cum_cp[from_idx + 1:]
+        del self.cum_fee[from_idx + 1:]
+        for j in range(from_idx, len(self.times)):
+            self.cum_cp.append(self.cum_cp[-1] + self.cps[j])
+            self.cum_fee.append(self.cum_fee[-1] + self.fees[j])
+        self.by_oid = {}
+        for j, oid in enumerate(self.oids):
+            if oid:
+                self.by_oid.setdefault(oid, array("l")).append(j)
+
+    def prune(self, keep: int) -> None:
+        drop = len(self.times) - int(keep)
+        if drop <= 0:
+            return
+        del self.times[:drop]
+        del self.oids[:drop]
+        del self.cps[:drop]
+        del self.fees[:drop]
+        self.cum_cp = array("d", [0.0])
+        self.cum_fee = array("d", [0.0])
+        self._rebuild(from_idx=0)
+
+    # --------------------------------------------------------
+    # Consultas
+    # --------------------------------------------------------
+
+    def since(self, since_ms: int) -> Dict[str, float]:
+        i = bisect_left(self.times, int(since_ms))
+        n = len(self.times)
+        return _rounded(self.cum_cp[n] - self.cum_cp[i], self.cum_fee[n] - self.cum_fee[i], n - i)
+
+    def last_batch(self, since_ms: int, max_group_gap_ms: int) -> Dict[str, float]:
+        lo = bisect_left(self.times, int(since_ms))
+        hi = len(self.times)
+        if lo >= hi:
+            return _empty_pnl()
+
+        # Ancla: el fill más reciente con closedPnl != 0; si no hay, el más reciente.
+        anchor = hi - 1
+        for j in range(hi - 1, lo - 1, -1):
+            if self.cps[j] != 0.0:
+                anchor = j
+                break
+
+        oid = self.oids[anchor]
+        if oid:
+            idxs = [j for j in self.by_oid.get(oid, ()) if j >= lo]
+        else:
+            ts = self.times[anchor]
+            a = max(lo, bisect_left(self.times, ts - int(max_group_gap_ms)))
+            b = bisect_right(self.times, ts + int(max_group_gap_ms))
+            idxs = range(a, b)
+
+        pnl = 0.0
+        fees = 0.0
+        n = 0
+        for j in idxs:
+            pnl += self.cps[j]
+            fees += self.fees[j]
+            n += 1
+        return _rounded(pnl, fees, n)
+
+
+# ============================================================
+# ÍNDICE POR USUARIO
+# ============================================================
+
+class _UserFills:
+    __slots__ = ("lock", "start_ms", "cursor_ms", "cursor_ids", "coins", "synced_at")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start_ms: Optional[int] = None     # desde cuándo el índice está completo
+        self.cursor_ms = 0                      # time del último fill visto
+        self.cursor_ids: set = set()            # ids ya indexados con time == cursor_ms
+        self.coins: Dict[str, _CoinFills] = {}
+        self.synced_at = 0.0
+
+
+class FillsStore:
+    """
+    fetch(user_id, start_ms) -> lista de fills (orden ascendente, máx. FILLS_INDEX_PAGE_SIZE)
+    coin_key(str) -> coin normalizado (mismo criterio que el llamador)
+    """
+
+    def __init__(
+        self,
+        *,
+        fetch: Callable[[int, int], Any],
+        coin_key: Callable[[str], str] = lambda c: str(c or "").strip().upper(),
+    ):
+        self._fetch = fetch
+        self._coin_key = coin_key
+        self._lock = threading.Lock()
+        self._users: Dict[int, _UserFills] = {}
+
+    def _user(self, user_id: int) -> _UserFills:
+        with self._lock:
+            u = self._users.get(int(user_id))
+            if u is None:
+                u = _UserFills()
+                self._users[int(user_id)] = u
+            return u
+
+    def reset(self, user_id: int) -> None:
+        with self._lock:
+            self._users.pop(int(user_id), None)
+
+    # --------------------------------------------------------
+    # Sync incremental
+    # --------------------------------------------------------
+
+    def _ingest_locked(self, u: _UserFills, fills: List[Dict[str, Any]]) -> int:
+        added = 0
+        for f in fills:
+            if not isinstance(f, dict):
+                continue
+            ts = _fill_time(f)
+            fid = _fill_id(f)
+            if ts < u.cursor_ms or (ts == u.cursor_ms and fid in u.cursor_ids):
+                continue
+            if ts > u.cursor_ms:
+                u.cursor_ms = ts
+                u.cursor_ids = set()
+            u.cursor_ids.add(fid)
+
+            cp = _f(f.get("closedPnl"))
+            fee = _f(f.get("fee"))
+            if cp == 0.0 and fee == 0.0:
+                continue
+            coin = self._coin_key((f.get("coin") or f.get("symbol") or "").strip().upper())
+            cf = u.coins.get(coin)
+            if cf is None:
+                cf = _CoinFills()
+                u.coins[coin] = cf
+            cf.add(ts, _fill_oid(f), cp, fee)
+            added += 1
+            if len(cf) > FILLS_INDEX_MAX_PER_COIN * 2:
+                cf.prune(FILLS_INDEX_MAX_PER_COIN)
+        return added
+
+    def _fetch_from_locked(self, user_id: int, u: _UserFills, start_ms: int) -> bool:
+        cursor = int(start_ms)
+        for _ in range(max(1, FILLS_INDEX_MAX_PAGES)):
+            raw = self._fetch(int(user_id), cursor)
+            if not isinstance(raw, list):
+                if isinstance(raw, dict):
+                    raw = raw.get("fills") or raw.get("data") or raw.get("result") or []
+                else:
+                    return False
+            self._ingest_locked(u, raw)
+            if len(raw) < FILLS_INDEX_PAGE_SIZE:
+                return True
+            # Página llena: seguimos desde el último ms (los repetidos se descartan por id).
+            last = max((_fill_time(f) for f in raw if isinstance(f, dict)), default=cursor)
+            if last <= cursor:
+                return True
+            cursor = last
+        log(f"user={user_id} sync truncado a {FILLS_INDEX_MAX_PAGES} páginas desde {start_ms}", "WARN")
+        return True
+
+    def _ensure_locked(self, user_id: int, u: _UserFills, since_ms: int) -> bool:
+        since_ms = max(0, int(since_ms))
+        if u.start_ms is None or since_ms < u.start_ms:
+            # Primera vez (o consulta más vieja que el índice): carga completa desde since_ms.
+            u.start_ms = None
+            u.cursor_ms = 0
+            u.cursor_ids = set()
+            u.coins = {}
+            if not self._fetch_from_locked(user_id, u, since_ms):
+                return False
+            u.start_ms = since_ms
+            u.synced_at = time.time()
+            return True
+        if (time.time() - u.synced_at) < FILLS_INDEX_MIN_SYNC_SECONDS:
+            return True
+        ok = self._fetch_from_locked(user_id, u, max(u.cursor_ms, u.start_ms))
+        if ok:
+            u.synced_at = time.time()
+        return ok
+
+    # --------------------------------------------------------
+    # Consultas
+    # --------------------------------------------------------
+
+    def closed_pnl_since(self, user_id: int, coin: str, since_ms: int) -> Dict[str, float]:
+        """{"pnl","fees","net","fills"} de los fills de coin con time >= since_ms."""
+        u = self._user(user_id)
+        with u.lock:
+            if not self._ensure_locked(user_id, u, since_ms):
+                return _empty_pnl()
+            cf = u.coins.get(self._coin_key(coin))
+            return cf.since(since_ms) if cf is not None else _empty_pnl()
+
+    def last_close_batch(self, user_id: int, coin: str, lookback_ms: int, max_group_gap_ms: int = 4000) -> Dict[str, float]:
+        """Último batch de cierre de coin dentro de lookback_ms (agrupado por oid o cercanía temporal)."""
+        since_ms = max(0, int(time.time() * 1000) - int(lookback_ms))
+        u = self._user(user_id)
+        with u.lock:
+            if not self._ensure_locked(user_id, u, since_ms):
+                return _empty_pnl()
+            cf = u.coins.get(self._coin_key(coin))
+            return cf.last_batch(since_ms, max_group_gap_ms) if cf is not None else _empty_pnl()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            users = dict(self._users)
+        return {
+            "users": len(users),
+            "fills": sum(len(cf) for u in users.values() for cf in u.coins.values()),
+        }
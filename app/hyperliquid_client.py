@@ -7,13 +7,19 @@
 #  - Precio IOC desde L2 (best bid/ask) + slippage
 #  - Min notional >= 10 USDC post-rounding
 #  - + has_open_position(user_id): evitar múltiples posiciones abiertas
+#  - Órdenes con cloid determinista: ante timeout/5xx se consulta
+#    orderStatus por cloid antes de reenviar (sin dobles entradas)
 # ============================================================
 
 import time
 import threading
+import hashlib
 import httpx
+from email.utils import parsedate_to_datetime
+from collections import OrderedDict
+from functools import lru_cache
 from typing import Any, Dict, Optional, Tuple
-from decimal import Decimal, ROUND_DOWN, ROUND_UP, InvalidOperation
+from decimal import ROUND_DOWN, ROUND_UP
 
 # Si la posición abierta es menor que este notional, la tratamos como DUST.
 # En vez de bloquear al bot, intentamos cerrarla y devolvemos False.
@@ -22,10 +28,17 @@ OPEN_POSITION_MIN_NOTIONAL_USDC = 5.0
 from app.config import (
     HYPER_BASE_URL,
     REQUEST_TIMEOUT,
+    EXCHANGE_REQUEST_TIMEOUT,
+    EXCHANGE_SEND_ATTEMPTS,
     VERBOSE_LOGS,
     PRODUCTION_MODE,
 )
 
+from app.price_rules import PriceRules
+from app.fills_index import FillsStore
+from app.open_orders import OpenOrdersCache, has_positive_trigger
+from app.nonce_manager import NonceManager
+
 from app.database import (
     get_user_wallet,
     get_user_private_key,
@@ -67,6 +80,17 @@ def _get_http_client(timeout: float) -> httpx.Client:
                 pass
         return _http_client
 
+# Nonces de /exchange por firmante (ver app.nonce_manager).
+_NONCES = NonceManager()
+
+def _observe_server_date(r: Any) -> None:
+    try:
+        date = r.headers.get("date")
+        if date:
+            _NONCES.observe_server_time(int(parsedate_to_datetime(date).timestamp() * 1000))
+    except Exception:
+        pass
+
 def make_request(
     endpoint: str,
     payload: dict,
@@ -82,7 +106,8 @@ def make_request(
 
     for attempt in range(1, retries + 1):
         try:
-            r = client.post(url, json=payload)
+            r = client.post(url, json=payload, timeout=timeout)
+            _observe_server_date(r)
 
             if r.status_code == 429 or 500 <= r.status_code <= 599:
                 body = r.text if hasattr(r, "text") else "<no text>"
@@ -126,7 +151,7 @@ def norm_coin(symbol: str) -> str:
 # Cache meta + mids
 # ------------------------------------------------------------
 
-_META_CACHE: Dict[str, Any] = {"coin_to_asset": {}, "asset_to_sz": {}, "asset_to_tick": {}, "ts": 0.0}
+_META_CACHE: Dict[str, Any] = {"coin_to_asset": {}, "asset_to_sz": {}, "asset_to_tick": {}, "asset_to_rules": {}, "ts": 0.0}
 _MIDS_CACHE: Dict[str, Any] = {"mids": {}, "ts": 0.0}
 
 META_TTL = 60.0
@@ -147,6 +172,7 @@ def _refresh_meta_cache():
     coin_to_asset: Dict[str, int] = {}
     asset_to_sz: Dict[int, int] = {}
     asset_to_tick: Dict[int, float] = {}
+    asset_to_rules: Dict[int, PriceRules] = {}
 
     try:
         universe = r.get("universe") if isinstance(r.get("universe"), list) else []
@@ -178,11 +204,18 @@ def _refresh_meta_cache():
                 asset_to_tick[i] = float(tick_val) if tick_val > 0 else 0.0
             except Exception:
                 asset_to_tick[i] = 0.0
+            asset_to_rules[i] = PriceRules(
+                sz_decimals=asset_to_sz[i],
+                tick_size=asset_to_tick[i],
+                asset=i,
+                coin=str(name).upper() if name else "",
+            )
 
         with _cache_lock:
             _META_CACHE["coin_to_asset"] = coin_to_asset
             _META_CACHE["asset_to_sz"] = asset_to_sz
             _META_CACHE["asset_to_tick"] = asset_to_tick
+            _META_CACHE["asset_to_rules"] = asset_to_rules
             _META_CACHE["ts"] = now
     except Exception as e:
         safe_log("❌ Error meta:", str(e))
@@ -207,6 +240,16 @@ def get_tick_size(asset_index: int) -> float:
         except Exception:
             return 0.0
 
+def get_price_rules(symbol: str) -> Optional[PriceRules]:
+    """Reglas de precio/tamaño del asset (None si la meta no lo conoce)."""
+    _refresh_meta_cache()
+    coin = norm_coin(symbol)
+    with _cache_lock:
+        asset = _META_CACHE["coin_to_asset"].get(coin)
+        if asset is None:
+            return None
+        return _META_CACHE["asset_to_rules"].get(asset)
+
 def _refresh_mids_cache():
     now = time.time()
     with _cache_lock:
@@ -240,6 +283,12 @@ def get_price(symbol: str) -> float:
         px = _MIDS_CACHE["mids"].get(coin)
     return float(px) if px else 0.0
 
+def get_all_mids() -> Dict[str, float]:
+    """Tablero de precios compartido: copia de allMids (coin -> mid), mismo cache/TTL que get_price."""
+    _refresh_mids_cache()
+    with _cache_lock:
+        return dict(_MIDS_CACHE["mids"])
+
 # ------------------------------------------------------------
 # L2 Book -> best bid/ask
 # ------------------------------------------------------------
@@ -274,92 +323,32 @@ def get_best_bid_ask(symbol: str) -> Tuple[float, float]:
 # ------------------------------------------------------------
 # Formatting
 # ------------------------------------------------------------
+# Las reglas de precio/tamaño viven en app.price_rules (fuente única).
+# Estos wrappers mantienen la firma histórica para los call sites y
+# reutilizan el cuantizador ya construido (uno por szDecimals/tick).
 
-def _strip_trailing_zeros(num_str: str) -> str:
-    if "." not in num_str:
-        return num_str
-    num_str = num_str.rstrip("0").rstrip(".")
-    return num_str if num_str else "0"
-
-def _to_decimal(x: float) -> Decimal:
-    return Decimal(str(x))
-
-def _quant(sz_decimals: int) -> Decimal:
-    return Decimal("1") if sz_decimals <= 0 else Decimal("1").scaleb(-sz_decimals)
+@lru_cache(maxsize=256)
+def _rules_for(sz_decimals: int, tick_size: float) -> PriceRules:
+    return PriceRules(sz_decimals=sz_decimals, tick_size=tick_size)
 
 def _format_size_round(sz: float, sz_decimals: int, rounding) -> str:
-    try:
-        d = _to_decimal(sz)
-        q = _quant(sz_decimals)
-        out = d.quantize(q, rounding=rounding)
-        return _strip_trailing_zeros(format(out, "f"))
-    except (InvalidOperation, Exception):
-        return "0"
+    return _rules_for(int(sz_decimals or 0), 0.0).format_size(sz, round_up=(rounding == ROUND_UP))
 
 def _format_size(sz: float, sz_decimals: int) -> str:
     return _format_size_round(sz, sz_decimals, ROUND_DOWN)
 
 def _format_price_side(px: float, sz_decimals: int, is_buy: bool) -> str:
-    MAX_DECIMALS = 6
-    max_px_decimals = max(0, MAX_DECIMALS - int(sz_decimals or 0))
-    rnd = ROUND_UP if is_buy else ROUND_DOWN
-
-    try:
-        d = _to_decimal(px)
-        if d <= 0:
-            return "0"
-
-        if d >= 1:
-            int_part = int(d)
-            digits_before = len(str(abs(int_part))) if int_part != 0 else 1
-            if digits_before >= 5:
-                out = d.quantize(Decimal("1"), rounding=rnd)
-                return _strip_trailing_zeros(format(out, "f"))
-
-            allowed_sig_decimals = max(0, 5 - digits_before)
-            allowed_decimals = min(max_px_decimals, allowed_sig_decimals)
-            q = Decimal("1") if allowed_decimals <= 0 else Decimal("1").scaleb(-allowed_decimals)
-            out = d.quantize(q, rounding=rnd)
-            return _strip_trailing_zeros(format(out, "f"))
-
-        q = Decimal("1") if max_px_decimals <= 0 else Decimal("1").scaleb(-max_px_decimals)
-        out = d.quantize(q, rounding=rnd)
-        return _strip_trailing_zeros(format(out, "f"))
-
-    except (InvalidOperation, Exception):
-        return "0"
+    return _rules_for(int(sz_decimals or 0), 0.0).format_price(px, round_up=is_buy)
 
 
 def _format_price_tick(px: float, tick_size: float, sz_decimals: int, is_buy: bool) -> str:
     """
-    Formatea precio cumpliendo tickSize (múltiplo exacto).
-    - BUY: redondea hacia arriba al tick (más agresivo para llenar IOC)
-    - SELL: redondea hacia abajo al tick
-    Si tick_size no está disponible, cae al formateador por decimales.
+    Formatea precio cumpliendo tickSize (múltiplo exacto) y cifras significativas.
+    - BUY: redondea hacia arriba (más agresivo para llenar IOC)
+    - SELL: redondea hacia abajo
+    Si tick_size no está disponible, aplica solo la regla de decimales.
     """
-    try:
-        tick = float(tick_size or 0.0)
-        if tick <= 0:
-            return _format_price_side(px, sz_decimals, is_buy=is_buy)
-
-        d_px = _to_decimal(px)
-        if d_px <= 0:
-            return "0"
-
-        d_tick = _to_decimal(tick)
-
-        # nº de ticks (entero)
-        rnd = ROUND_UP if is_buy else ROUND_DOWN
-        ticks = (d_px / d_tick).to_integral_value(rounding=rnd)
-        out = ticks * d_tick
-
-        # normalizar a precisión del tick (evita 0.10000000000002)
-        q = d_tick
-        out = out.quantize(q, rounding=rnd)
-
-        return _strip_trailing_zeros(format(out, "f"))
-    except (InvalidOperation, Exception):
-        return _format_price_side(px, sz_decimals, is_buy=is_buy)
+    return _rules_for(int(sz_decimals or 0), float(tick_size or 0.0)).format_price(px, round_up=is_buy)
 
 # ------------------------------------------------------------
 # Balance
@@ -377,6 +366,7 @@ def get_balance(user_id: int) -> float:
         return 0.0
 
     r = make_request("/info", {"type": "clearinghouseState", "user": wallet})
+    _seed_leverage_cache(wallet, r)
     if not isinstance(r, dict):
         return 0.0
 
@@ -436,6 +426,30 @@ def get_user_fills(
     return r
 
 
+def _fetch_fills_by_time(user_id: int, start_time_ms: int) -> Any:
+    """
+    Fills del usuario con time >= start_time_ms, orden ascendente (máx. 2000 por respuesta).
+    Fuente: /info type=userFillsByTime (la paginación la hace FillsStore).
+    """
+    wallet = get_user_wallet(user_id)
+    if not wallet:
+        return []
+    return make_request(
+        "/info",
+        {"type": "userFillsByTime", "user": wallet, "startTime": int(start_time_ms), "aggregateByTime": False},
+    )
+
+
+# Índice incremental por usuario: cada consulta solo pide los fills posteriores al cursor.
+_FILLS_STORE = FillsStore(fetch=_fetch_fills_by_time, coin_key=norm_coin)
+
+
+def invalidate_user_fills(user_id: int) -> None:
+    """Descarta el índice de fills del usuario (al cambiar wallet o key desde el bot):
+    los fills de la wallet anterior no deben cruzarse con la nueva."""
+    _FILLS_STORE.reset(user_id)
+
+
 def get_recent_closed_pnl(
     user_id: int,
     symbol: str,
@@ -449,56 +463,9 @@ def get_recent_closed_pnl(
     - `closedPnl` viene del exchange (realized PnL)
     - `fee` viene del exchange (fees)
     - `net` = pnl - fees
+    - Solo cuentan fills relevantes (PnL o fee != 0)
     """
-    coin = norm_coin(symbol)
-    out = {"pnl": 0.0, "fees": 0.0, "net": 0.0, "fills": 0}
-
-    raw = get_user_fills(user_id, start_time_ms=since_ms)
-
-    if not isinstance(raw, list):
-        # Algunos wrappers pueden devolver {"fills":[...]} u otro contenedor
-        if isinstance(raw, dict):
-            raw = raw.get("fills") or raw.get("data") or raw.get("result") or []
-        else:
-            raw = []
-
-    for f in raw:
-        if not isinstance(f, dict):
-            continue
-
-        # Normalizaciones típicas: coin / symbol / asset
-        f_coin = (f.get("coin") or f.get("symbol") or "").strip().upper()
-        if coin and norm_coin(f_coin) != coin:
-            continue
-
-        # closedPnl puede venir como string/float
-        cp = f.get("closedPnl")
-        fee = f.get("fee")
-
-        try:
-            cp_f = float(cp) if cp is not None else 0.0
-        except Exception:
-            cp_f = 0.0
-
-        try:
-            fee_f = float(fee) if fee is not None else 0.0
-        except Exception:
-            fee_f = 0.0
-
-        # Solo contamos fills relevantes: cuando hay PnL o fee real
-        if cp_f == 0.0 and fee_f == 0.0:
-            continue
-
-        out["pnl"] += cp_f
-        out["fees"] += fee_f
-        out["fills"] += 1
-
-    out["net"] = out["pnl"] - out["fees"]
-    # redondeo suave para logs/DB
-    out["pnl"] = float(round(out["pnl"], 10))
-    out["fees"] = float(round(out["fees"], 10))
-    out["net"] = float(round(out["net"], 10))
-    return out
+    return _FILLS_STORE.closed_pnl_since(user_id, symbol, since_ms)
 
 
 def get_last_closed_pnl(
@@ -516,112 +483,66 @@ def get_last_closed_pnl(
 
     Retorna: {"pnl": float, "fees": float, "net": float, "fills": int}
 
-    Heurística robusta (esquema defensivo):
-      - Filtra por coin
-      - Ordena por timestamp descendente
-      - Encuentra el fill más reciente con `closedPnl` != 0 (o fee != 0)
+    Heurística (ver fills_index._CoinFills.last_batch):
+      - Ancla: el fill más reciente con `closedPnl` != 0 (o, si no hay, el más reciente con fee)
       - Agrupa los fills del mismo cierre por:
           * mismo orderId/oid si existe, o
           * timestamps cercanos (<= max_group_gap_ms) si no hay id
     """
-    coin = norm_coin(symbol)
-    out = {"pnl": 0.0, "fees": 0.0, "net": 0.0, "fills": 0}
+    return _FILLS_STORE.last_close_batch(user_id, symbol, lookback_ms, max_group_gap_ms)
 
-    now_ms = int(time.time() * 1000)
-    since_ms = max(0, int(now_ms - int(lookback_ms)))
+# ------------------------------------------------------------
+# Órdenes abiertas (cache indexado, ver app/open_orders.py)
+# ------------------------------------------------------------
 
-    raw = get_user_fills(user_id, start_time_ms=since_ms)
-    if not isinstance(raw, list):
-        if isinstance(raw, dict):
-            raw = raw.get("fills") or raw.get("data") or raw.get("result") or []
-        else:
-            raw = []
+def _fetch_frontend_open_orders(user_id: int) -> Optional[list]:
+    """Lee órdenes abiertas del usuario desde Hyperliquid.
+    Usamos frontendOpenOrders porque expone isTrigger/reduceOnly/triggerPx.
+    None = no se pudo leer (el cache no reemplaza su snapshot).
+    """
+    try:
+        wallet = get_user_wallet(user_id)
+        if not wallet:
+            return []
+        r = make_request("/info", {"type": "frontendOpenOrders", "user": wallet})
+        if isinstance(r, list):
+            return [x for x in r if isinstance(x, dict)]
+        return None
+    except Exception as e:
+        safe_log(f"frontendOpenOrders error user={user_id} err={e}")
+        return None
 
-    normed = []
-    for f in raw:
-        if not isinstance(f, dict):
-            continue
 
-        f_coin = (f.get("coin") or f.get("symbol") or "").strip().upper()
-        if coin and norm_coin(f_coin) != coin:
-            continue
+_OPEN_ORDERS = OpenOrdersCache(fetch=_fetch_frontend_open_orders, coin_key=norm_coin)
 
-        # timestamp (epoch ms) - soporta variantes
-        ts = f.get("time")
-        if ts is None:
-            ts = f.get("timestamp")
-        if ts is None:
-            ts = f.get("t")
-        try:
-            ts_i = int(ts)
-        except Exception:
-            ts_i = 0
 
-        # ids posibles
-        oid = f.get("oid") or f.get("orderId") or f.get("order_id") or f.get("order") or None
-        try:
-            oid_s = str(oid) if oid is not None else ""
-        except Exception:
-            oid_s = ""
+def get_open_orders(user_id: int, symbol: Optional[str] = None) -> list:
+    """Órdenes abiertas (cacheadas con TTL), opcionalmente filtradas por symbol."""
+    return _OPEN_ORDERS.orders(user_id, symbol)
 
-        cp = f.get("closedPnl")
-        fee = f.get("fee")
 
-        try:
-            cp_f = float(cp) if cp is not None else 0.0
-        except Exception:
-            cp_f = 0.0
+def has_live_stop_order(user_id: int, symbol: str, position_side: str) -> bool:
+    """True si hay un trigger reduceOnly con triggerPx > 0 que cierra la posición `position_side`."""
+    ps = (position_side or "").strip().lower()
+    close_side = "B" if ps in ("short", "sell") else "A"
+    return _OPEN_ORDERS.has(
+        user_id,
+        symbol,
+        is_trigger=True,
+        reduce_only=True,
+        side=close_side,
+        predicate=has_positive_trigger,
+    )
 
-        try:
-            fee_f = float(fee) if fee is not None else 0.0
-        except Exception:
-            fee_f = 0.0
 
-        # guardamos incluso si cp=0 pero fee!=0, porque puede formar parte del batch
-        if cp_f == 0.0 and fee_f == 0.0:
-            continue
+def apply_open_order_updates(user_id: int, updates: list) -> None:
+    """Hook para el stream orderUpdates (user_events)."""
+    _OPEN_ORDERS.apply_order_updates(user_id, updates)
 
-        normed.append({"ts": ts_i, "oid": oid_s, "cp": cp_f, "fee": fee_f})
 
-    if not normed:
-        return out
+def invalidate_open_orders(user_id: int) -> None:
+    _OPEN_ORDERS.invalidate(user_id)
 
-    normed.sort(key=lambda x: x["ts"], reverse=True)
-
-    # Seleccionamos el fill más reciente con un cierre real (closedPnl != 0) si existe.
-    anchor = None
-    for x in normed:
-        if abs(float(x.get("cp") or 0.0)) > 0.0:
-            anchor = x
-            break
-    if anchor is None:
-        # fallback: si no encontramos closedPnl, usamos el más reciente con fee (mejor que nada)
-        anchor = normed[0]
-
-    anchor_ts = int(anchor.get("ts") or 0)
-    anchor_oid = (anchor.get("oid") or "").strip()
-
-    batch = []
-    if anchor_oid:
-        for x in normed:
-            if (x.get("oid") or "").strip() == anchor_oid:
-                batch.append(x)
-    else:
-        # fallback por cercanía temporal
-        for x in normed:
-            if abs(int(x.get("ts") or 0) - anchor_ts) <= int(max_group_gap_ms):
-                batch.append(x)
-
-    for x in batch:
-        out["pnl"] += float(x.get("cp") or 0.0)
-        out["fees"] += float(x.get("fee") or 0.0)
-        out["fills"] += 1
-
-    out["net"] = out["pnl"] - out["fees"]
-    out["pnl"] = float(round(out["pnl"], 10))
-    out["fees"] = float(round(out["fees"], 10))
-    out["net"] = float(round(out["net"], 10))
-    return out
 
 def get_position_entry_price(user_id: int, coin: str) -> float:
     """
@@ -641,6 +562,7 @@ def get_position_entry_price(user_id: int, coin: str) -> float:
         return 0.0
 
     r = make_request("/info", {"type": "clearinghouseState", "user": wallet})
+    _seed_leverage_cache(wallet, r)
     if not isinstance(r, dict):
         return 0.0
 
@@ -695,6 +617,7 @@ def get_open_position_size(user_id: int, coin: str) -> float:
         return 0.0
 
     r = make_request("/info", {"type": "clearinghouseState", "user": wallet})
+    _seed_leverage_cache(wallet, r)
     if not isinstance(r, dict):
         return 0.0
 
@@ -729,6 +652,7 @@ def has_open_position(user_id: int) -> bool:
         return False
 
     r = make_request("/info", {"type": "clearinghouseState", "user": wallet})
+    _seed_leverage_cache(wallet, r)
     if not isinstance(r, dict):
         return False
 
@@ -785,6 +709,41 @@ def has_open_position(user_id: int) -> bool:
 
     return False
 
+def get_open_positions(user_id: int) -> Optional[list]:
+    """
+    Todas las posiciones abiertas del usuario (una lectura de clearinghouseState, incluye DUST):
+      [{"coin": "BTC", "szi": 0.01, "entry_px": 65000.0}, ...]
+    [] si no tiene wallet o no hay posiciones; None si no se pudo leer el estado.
+    """
+    wallet = get_user_wallet(user_id)
+    if not wallet:
+        return []
+
+    r = make_request("/info", {"type": "clearinghouseState", "user": wallet})
+    if not isinstance(r, dict) or r.get("_http_error"):
+        return None
+    _seed_leverage_cache(wallet, r)
+
+    out = []
+    for ap in r.get("assetPositions") or []:
+        if not isinstance(ap, dict):
+            continue
+        pos = ap.get("position")
+        if not isinstance(pos, dict):
+            continue
+        try:
+            szi = float(pos.get("szi", 0) or 0)
+        except Exception:
+            szi = 0.0
+        if szi == 0.0:
+            continue
+        try:
+            entry_px = float(pos.get("entryPx") or 0.0)
+        except Exception:
+            entry_px = 0.0
+        out.append({"coin": norm_coin(str(pos.get("coin") or ap.get("coin") or "")), "szi": szi, "entry_px": entry_px})
+    return out
+
 
 # ------------------------------------------------------------
 # Signer (SDK)
@@ -800,6 +759,10 @@ class HyperliquidSigner:
         except Exception as e:
             raise RuntimeError("Firma HL: instala hyperliquid-python-sdk") from e
 
+    @property
+    def address(self) -> str:
+        return str(self._account.address)
+
     def sign(
         self,
         action: dict,
@@ -814,6 +777,60 @@ class HyperliquidSigner:
             is_mainnet = (str(HYPER_BASE_URL).rstrip("/") == "https://api.hyperliquid.xyz")
         return self._sign_l1_action(self._account, action, vault_address, nonce_ms, expires_after_ms, is_mainnet)
 
+# ------------------------------------------------------------
+# Cache de signers por usuario
+# - Evita Account.from_key + lectura de la key en Mongo en cada acción firmada.
+# - LRU acotado + TTL; la key solo vive en memoria del proceso (dentro del signer).
+# - invalidate_user_signer() al cambiar la key desde el bot.
+# ------------------------------------------------------------
+
+SIGNER_CACHE_TTL = 15 * 60.0
+SIGNER_CACHE_MAX = 512
+_SIGNER_CACHE: "OrderedDict[int, Tuple[HyperliquidSigner, float]]" = OrderedDict()
+_SIGNER_STATS: Dict[str, int] = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+_signer_lock = threading.Lock()
+
+def get_user_signer(user_id: int) -> Optional[HyperliquidSigner]:
+    """Signer del usuario (cacheado). None si no tiene private key; lanza si no se puede construir."""
+    uid = int(user_id)
+    now = time.time()
+    with _signer_lock:
+        hit = _SIGNER_CACHE.get(uid)
+        if hit is not None and (now - hit[1]) <= SIGNER_CACHE_TTL:
+            _SIGNER_CACHE.move_to_end(uid)
+            _SIGNER_STATS["hits"] += 1
+            return hit[0]
+        if hit is not None:
+            _SIGNER_CACHE.pop(uid, None)
+            _SIGNER_STATS["evictions"] += 1
+        _SIGNER_STATS["misses"] += 1
+
+    private_key = get_user_private_key(uid)
+    if not private_key:
+        return None
+    signer = HyperliquidSigner(private_key)
+
+    with _signer_lock:
+        _SIGNER_CACHE[uid] = (signer, now)
+        _SIGNER_CACHE.move_to_end(uid)
+        while len(_SIGNER_CACHE) > SIGNER_CACHE_MAX:
+            _SIGNER_CACHE.popitem(last=False)
+            _SIGNER_STATS["evictions"] += 1
+    return signer
+
+def invalidate_user_signer(user_id: int) -> None:
+    with _signer_lock:
+        if _SIGNER_CACHE.pop(int(user_id), None) is not None:
+            _SIGNER_STATS["invalidations"] += 1
+
+def signer_cache_stats() -> Dict[str, Any]:
+    with _signer_lock:
+        out: Dict[str, Any] = dict(_SIGNER_STATS)
+        out["size"] = len(_SIGNER_CACHE)
+    lookups = out["hits"] + out["misses"]
+    out["hit_rate"] = round(out["hits"] / lookups, 4) if lookups else 0.0
+    return out
+
 # ------------------------------------------------------------
 # Parse REAL de /exchange: statuses
 # ------------------------------------------------------------
@@ -844,8 +861,13 @@ def _parse_status(status_obj: Any) -> Dict[str, Any]:
     """
     statuses[i] suele ser dict con UNA clave:
       {"filled": {...}} o {"error": "..."} o {"resting": {...}}
+    Los hijos TP/SL de un grupo normalTpsl pueden venir como string:
+      "waitingForFill" / "waitingForTrigger"
     """
     out = {"kind": "unknown", "error": "", "filled_sz": 0.0}
+    if isinstance(status_obj, str) and status_obj.lower().startswith("waitingfor"):
+        out["kind"] = "waiting"
+        return out
     if not isinstance(status_obj, dict) or not status_obj:
         return out
 
@@ -956,7 +978,7 @@ FORCE_ISOLATED = True
 FORCE_LEVERAGE = 5
 
 def _set_isolated_leverage(
-    private_key: str,
+    signer: "HyperliquidSigner",
     asset: int,
     leverage: int,
     vault_address: Optional[str] = None,
@@ -972,9 +994,6 @@ def _set_isolated_leverage(
     except Exception:
         lev = 1
 
-    nonce = int(time.time() * 1000)
-    expires_after_ms = nonce + 60_000
-
     action = {
         "type": "updateLeverage",
         "asset": asset,
@@ -983,32 +1002,265 @@ def _set_isolated_leverage(
     }
 
     try:
-        signer = HyperliquidSigner(private_key)
-        signature = signer.sign(
-            action,
-            nonce,
-            vault_address=vault_address,
-            expires_after_ms=expires_after_ms,
-        )
+        resp = _sign_and_send(signer, action, vault_address=vault_address)
     except Exception as e:
         return {"ok": False, "reason": "SIGN_ERROR", "raw": str(e)}
 
-    payload = {
-        "action": action,
-        "nonce": nonce,
-        "signature": signature,
-        "expiresAfter": expires_after_ms,
-    }
-    if vault_address:
-        payload["vaultAddress"] = vault_address
-
-    resp = make_request("/exchange", payload)
     st, inner = _unwrap_exchange(resp)
     if st == "ok":
         return {"ok": True, "reason": "OK", "raw": resp}
 
     return {"ok": False, "reason": str(inner), "raw": resp}
 
+# ------------------------------------------------------------
+# Cache de modo de margen / leverage por (wallet, asset)
+# - Se siembra con la info "leverage" de clearinghouseState.
+# - Se actualiza tras cada updateLeverage OK.
+# - Si el modo ya es isolated + FORCE_LEVERAGE, la orden no manda updateLeverage.
+# ------------------------------------------------------------
+
+LEVERAGE_CACHE_TTL = 30 * 60.0
+_LEVERAGE_CACHE: Dict[Tuple[str, int], Dict[str, Any]] = {}
+_leverage_lock = threading.Lock()
+# Frases de rechazo por modo de margen / leverage distinto al esperado. Nada de
+# "margin" suelto: "Insufficient margin" es falta de saldo y no se arregla
+# refrescando el leverage.
+_MARGIN_MODE_ERROR_TOKENS = (
+    "cross margin",
+    "isolated margin",
+    "margin mode",
+    "margin type",
+    "leverage type",
+    "invalid leverage",
+    "leverage mismatch",
+    "max leverage",
+    "maximum leverage",
+)
+
+def _leverage_cache_put(wallet: str, asset: int, is_cross: bool, leverage: int) -> None:
+    with _leverage_lock:
+        _LEVERAGE_CACHE[(str(wallet).lower(), int(asset))] = {
+            "is_cross": bool(is_cross),
+            "leverage": int(leverage),
+            "ts": time.time(),
+        }
+
+def _leverage_cache_invalidate(wallet: str, asset: int) -> None:
+    with _leverage_lock:
+        _LEVERAGE_CACHE.pop((str(wallet).lower(), int(asset)), None)
+
+def _leverage_is_forced(wallet: str, asset: int) -> bool:
+    with _leverage_lock:
+        st = _LEVERAGE_CACHE.get((str(wallet).lower(), int(asset)))
+    if not st or (time.time() - float(st["ts"])) > LEVERAGE_CACHE_TTL:
+        return False
+    return (not st["is_cross"]) and int(st["leverage"]) == int(FORCE_LEVERAGE)
+
+def _seed_leverage_cache(wallet: str, state: Any) -> None:
+    """Lee assetPositions[].position.leverage ({"type": "isolated", "value": 5}) de un clearinghouseState."""
+    if not wallet or not isinstance(state, dict):
+        return
+    aps = state.get("assetPositions")
+    if not isinstance(aps, list):
+        return
+    with _cache_lock:
+        coin_to_asset = dict(_META_CACHE["coin_to_asset"])
+    for ap in aps:
+        pos = ap.get("position") if isinstance(ap, dict) else None
+        if not isinstance(pos, dict):
+            continue
+        lev = pos.get("leverage")
+        asset = coin_to_asset.get(norm_coin(str(pos.get("coin") or "")))
+        if asset is None or not isinstance(lev, dict):
+            continue
+        try:
+            _leverage_cache_put(wallet, asset, str(lev.get("type") or "").lower() == "cross", int(float(lev.get("value") or 0)))
+        except Exception:
+            continue
+
+def _is_margin_mode_error(err: Any) -> bool:
+    e = str(err or "").lower()
+    if "insufficient" in e:
+        return False
+    return any(tok in e for tok in _MARGIN_MODE_ERROR_TOKENS)
+
+def _ensure_isolated_leverage(
+    wallet: str,
+    signer: "HyperliquidSigner",
+    asset: int,
+    vault_address: Optional[str] = None,
+    force: bool = False,
+) -> Dict[str, Any]:
+    """updateLeverage solo si el cache no confirma isolated + FORCE_LEVERAGE.
+    Devuelve {"ok": bool, "reason": str, "cached": bool}
+    """
+    if not force and _leverage_is_forced(wallet, asset):
+        return {"ok": True, "reason": "CACHED", "cached": True}
+
+    lev_resp = _set_isolated_leverage(
+        signer=signer,
+        asset=asset,
+        leverage=FORCE_LEVERAGE,
+        vault_address=vault_address,
+    )
+    if lev_resp.get("ok"):
+        _leverage_cache_put(wallet, asset, False, FORCE_LEVERAGE)
+    else:
+        _leverage_cache_invalidate(wallet, asset)
+    return {"ok": bool(lev_resp.get("ok")), "reason": lev_resp.get("reason"), "cached": False}
+
+# ------------------------------------------------------------
+# Envío idempotente a /exchange
+# - Cada orden (order / batchModify) lleva un cloid determinista: hash de
+#   (firmante, nonce de la intención, índice, contenido de la orden).
+#   Los reintentos de la MISMA intención reusan el cloid.
+# - Sin reintento ciego: un timeout / 5xx es ambiguo (la orden pudo entrar).
+#   Se consulta orderStatus por cloid; si alguna orden existe se arma la
+#   respuesta desde ese estado; si ninguna existe se reenvía el MISMO
+#   payload firmado (mismo nonce): si el primer envío aterriza tarde, el
+#   exchange descarta el repetido por nonce ya usado (nunca dos órdenes).
+#   Si la consulta también falla, NO se reenvía (mejor un error que una
+#   posición duplicada).
+# ------------------------------------------------------------
+
+def make_cloid(*parts: Any) -> str:
+    """Client order id (128 bits hex) determinista a partir de `parts`."""
+    h = hashlib.sha256("|".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+    return "0x" + h[:32]
+
+def _with_cloids(action: dict, owner: str, intent: int) -> Tuple[dict, list]:
+    """Copia de `action` con cloid en cada orden que no lo traiga. Retorna (acción, cloids)."""
+    typ = action.get("type")
+    if typ == "order":
+        wires = [dict(o) for o in action.get("orders") or []]
+        out = dict(action, orders=wires)
+    elif typ == "batchModify":
+        mods = [dict(m, order=dict(m.get("order") or {})) for m in action.get("modifies") or []]
+        wires = [m["order"] for m in mods]
+        out = dict(action, modifies=mods)
+    else:
+        return action, []
+    cloids = []
+    for i, w in enumerate(wires):
+        if not w.get("c"):
+            w["c"] = make_cloid(owner, intent, i, w.get("a"), w.get("b"), w.get("s"), w.get("r"), w.get("p"))
+        cloids.append(w["c"])
+    return out, cloids
+
+def _ambiguous_exchange_resp(resp: Any) -> bool:
+    """True si no sabemos si /exchange procesó la acción (timeout, sin respuesta, 5xx)."""
+    if not isinstance(resp, dict) or not resp.get("_http_error"):
+        return False
+    status = int(resp.get("_http_status") or 0)
+    return status == 0 or status == 429 or 500 <= status <= 599
+
+def _query_order_status(user_addr: str, cloid: str) -> Optional[Dict[str, Any]]:
+    """orderStatus por cloid: {"found": bool, "order": {...}, "status": str}. None si la consulta falló."""
+    r = make_request("/info", {"type": "orderStatus", "user": user_addr, "oid": cloid})
+    if not isinstance(r, dict) or r.get("_http_error"):
+        return None
+    if str(r.get("status") or "") == "unknownOid":
+        return {"found": False}
+    od = r.get("order")
+    if not isinstance(od, dict):
+        return None
+    return {"found": True, "order": od.get("order") if isinstance(od.get("order"), dict) else {}, "status": str(od.get("status") or "")}
+
+def _status_entry_from_query(q: Dict[str, Any]) -> Any:
+    """Traduce un orderStatus al formato de statuses[i] de /exchange (lo que parsea _parse_status)."""
+    if not q.get("found"):
+        return {"error": "unknownOid"}
+    od = q.get("order") or {}
+    status = q.get("status") or ""
+    try:
+        filled = float(od.get("origSz") or 0.0) - float(od.get("sz") or 0.0)
+    except Exception:
+        filled = 0.0
+    if filled > 0 or status == "filled":
+        return {"filled": {"totalSz": str(filled if filled > 0 else od.get("origSz")), "oid": od.get("oid"), "cloid": od.get("cloid")}}
+    if status in ("open", "triggered"):
+        return {"resting": {"oid": od.get("oid"), "cloid": od.get("cloid")}}
+    # iocCancelRejected -> _detect_fill lo lee como NO_FILL
+    return {"error": status or "unknown"}
+
+def _resolve_by_cloid(user_addr: str, cloids: list) -> Tuple[str, Any]:
+    """("landed", resp_sintética) | ("absent", None) | ("unknown", None)."""
+    entries = []
+    landed = False
+    for c in cloids:
+        q = _query_order_status(user_addr, c)
+        if q is None:
+            return "unknown", None
+        landed = landed or bool(q.get("found"))
+        entries.append(_status_entry_from_query(q))
+    if not landed:
+        return "absent", None
+    return "landed", {"status": "ok", "response": {"type": "order", "data": {"statuses": entries}}, "_resolved_by_cloid": True}
+
+def _sign_and_send(signer: "HyperliquidSigner", action: dict, vault_address: Optional[str] = None) -> Any:
+    """Firma `action` una vez (nonce del NonceManager) y la envía a /exchange.
+
+    Los reintentos reenvían el payload idéntico: el nonce ya usado hace que el
+    exchange descarte un duplicado aunque el primer envío aterrice tarde.
+    Lanza si falla la firma.
+    """
+    signer_key = signer.address.lower()
+    nonce = _NONCES.next(signer_key)
+    owner = vault_address or signer.address
+    action, cloids = _with_cloids(action, owner, nonce)
+    expires_after_ms = nonce + 60_000
+    signature = signer.sign(
+        action,
+        nonce,
+        vault_address=vault_address,
+        expires_after_ms=expires_after_ms,
+    )
+    payload = {"action": action, "nonce": nonce, "signature": signature, "expiresAfter": expires_after_ms}
+    if vault_address:
+        payload["vaultAddress"] = vault_address
+
+    attempts = max(1, int(EXCHANGE_SEND_ATTEMPTS))
+    r: Any = None
+    for attempt in range(1, attempts + 1):
+        r = make_request("/exchange", payload, retries=1, timeout=EXCHANGE_REQUEST_TIMEOUT)
+        if not _ambiguous_exchange_resp(r):
+            # Un reenvío rechazado (p.ej. nonce ya usado) puede significar que el
+            # primer envío sí entró: el estado real sale del cloid.
+            if attempt > 1 and cloids and _unwrap_exchange(r)[0] != "ok":
+                state, resolved = _resolve_by_cloid(owner, cloids)
+                if state == "landed":
+                    must_log(f"🟠 EXCHANGE_RETRY type={action.get('type')} attempt={attempt}/{attempts} -> reenvío rechazado, orden original en exchange (cloid={cloids[0]})")
+                    return resolved
+            return r
+
+        status = int(r.get("_http_status") or 0)
+        if cloids and status != 429:
+            state, resolved = _resolve_by_cloid(owner, cloids)
+            if state == "landed":
+                must_log(f"🟠 EXCHANGE_RETRY type={action.get('type')} attempt={attempt}/{attempts} http={status} -> orden ya en exchange (cloid={cloids[0]}), sin reenvío")
+                return resolved
+            if state == "unknown":
+                must_log(f"❌ EXCHANGE_RETRY type={action.get('type')} attempt={attempt}/{attempts} http={status} -> estado por cloid desconocido (cloid={cloids[0]}), no se reenvía")
+                return r
+            must_log(f"🟠 EXCHANGE_RETRY type={action.get('type')} attempt={attempt}/{attempts} http={status} -> cloid={cloids[0]} no existe, reenviando mismo payload (nonce={nonce})")
+        else:
+            must_log(f"🟠 EXCHANGE_RETRY type={action.get('type')} attempt={attempt}/{attempts} http={status} -> reenviando mismo payload (nonce={nonce})")
+        if attempt < attempts:
+            time.sleep(0.25 * attempt)
+    return r
+
+def _grouped_sl_info(resp: Any, sl_str: str) -> Dict[str, Any]:
+    """Estado del SL hijo (statuses[1]) de una acción entrada + SL con grouping normalTpsl."""
+    statuses = _extract_statuses(resp)
+    child = _parse_status(statuses[1]) if len(statuses) > 1 else {"kind": "missing", "error": ""}
+    return {
+        "sl_grouped": True,
+        "sl_ok": child["kind"] in ("resting", "waiting", "filled"),
+        "sl_reason": str(child["kind"]).upper(),
+        "sl_error": child.get("error", ""),
+        "sl_trigger_px": sl_str,
+    }
+
 def place_market_order(
     user_id: int,
     symbol: str,
@@ -1020,10 +1272,26 @@ def place_market_order(
     retry_delay_seconds: float = 0.35,
     slippage_step: float = 0.02,
     reduce_only: bool = False,
+    stop_loss_trigger: Optional[float] = None,
+    ref_book: Optional[Tuple[float, float]] = None,
 ):
+    """IOC a mercado (precio L2 + slippage).
+
+    ref_book: (bid, ask) ya leídos por el llamador (fan-out: un solo l2Book por
+    símbolo para todos los usuarios). Se usa en el primer intento; los
+    reintentos por NO_FILL vuelven a leer el libro.
+
+    stop_loss_trigger: si viene (solo entradas), el SL trigger reduceOnly viaja en la
+    misma acción que la entrada con grouping "normalTpsl". Si el exchange rechaza la
+    acción agrupada entera, se reenvía la entrada sola y el resultado lleva
+    sl_ok=False para que el llamador coloque el stop por el camino normal.
+    """
     wallet = get_user_wallet(user_id)
-    private_key = get_user_private_key(user_id)
-    if not wallet or not private_key:
+    try:
+        signer = get_user_signer(user_id)
+    except Exception as e:
+        return {"ok": False, "filled": False, "reason": "SIGN_ERROR", "error": str(e)}
+    if not wallet or signer is None:
         return {"ok": False, "filled": False, "reason": "NO_WALLET_OR_KEY"}
 
     coin = norm_coin(symbol)
@@ -1035,14 +1303,21 @@ def place_market_order(
     tick_size = get_tick_size(asset)
     is_buy = side.lower() == "buy"
 
-    # ✅ FORZAR ISOLATED + LEVERAGE (antes de ordenar)
+    sl_str = None
+    if stop_loss_trigger is not None and not reduce_only:
+        try:
+            if float(stop_loss_trigger) > 0:
+                # El SL va en sentido contrario a la entrada.
+                sl_str = _format_price_tick(float(stop_loss_trigger), tick_size, sz_decimals, is_buy=not is_buy)
+        except Exception:
+            sl_str = None
+    sl_info: Dict[str, Any] = {"sl_grouped": False, "sl_ok": False, "sl_reason": "NOT_REQUESTED" if sl_str is None else "PENDING"}
+
+    # ✅ FORZAR ISOLATED + LEVERAGE (antes de ordenar; se salta si el cache ya lo confirma)
+    lev_cached = False
     if FORCE_ISOLATED:
-        lev_resp = _set_isolated_leverage(
-            private_key=private_key,
-            asset=asset,
-            leverage=FORCE_LEVERAGE,
-            vault_address=vault_address,
-        )
+        lev_resp = _ensure_isolated_leverage(wallet, signer, asset, vault_address=vault_address)
+        lev_cached = bool(lev_resp.get("cached"))
         if not lev_resp.get("ok"):
             must_log(
                 f"❌ updateLeverage failed coin={coin} asset={asset} "
@@ -1056,9 +1331,17 @@ def place_market_order(
                 "error": lev_resp.get("reason"),
             }
 
-        safe_log(f"✅ Leverage set coin={coin} asset={asset} isolated=True lev={FORCE_LEVERAGE}x")
+        if not lev_cached:
+            safe_log(f"✅ Leverage set coin={coin} asset={asset} isolated=True lev={FORCE_LEVERAGE}x")
 
-    bid, ask = _get_best_bid_ask(coin)
+    shared_book = None
+    if ref_book is not None:
+        try:
+            shared_book = (float(ref_book[0] or 0.0), float(ref_book[1] or 0.0))
+        except Exception:
+            shared_book = None
+
+    bid, ask = shared_book if shared_book is not None else _get_best_bid_ask(coin)
     mid = float(get_price(coin) or 0.0)
 
     ref_px = (ask if is_buy else bid)
@@ -1073,7 +1356,10 @@ def place_market_order(
     total_attempts = 1 + max(0, int(max_no_fill_retries))
 
     for attempt in range(1, total_attempts + 1):
-        bid, ask = _get_best_bid_ask(coin)
+        if attempt == 1 and shared_book is not None:
+            bid, ask = shared_book
+        else:
+            bid, ask = _get_best_bid_ask(coin)
         mid = float(get_price(coin) or 0.0)
         ref_px = (ask if is_buy else bid)
         if ref_px <= 0:
@@ -1127,9 +1413,6 @@ def place_market_order(
                 "required_sz": float(required_sz),
             }
 
-        nonce = int(time.time() * 1000)
-        expires_after_ms = nonce + 60_000
-
         action = {
             "type": "order",
             "orders": [{
@@ -1142,25 +1425,55 @@ def place_market_order(
             }],
             "grouping": "na",
         }
+        if sl_str is not None:
+            action["orders"].append({
+                "a": asset,
+                "b": not is_buy,
+                "p": sl_str,
+                "s": s_str,
+                "r": True,
+                "t": {"trigger": {"isMarket": True, "triggerPx": sl_str, "tpsl": "sl"}},
+            })
+            action["grouping"] = "normalTpsl"
 
         try:
-            signer = HyperliquidSigner(private_key)
-            signature = signer.sign(
-                action,
-                nonce,
-                vault_address=vault_address,
-                expires_after_ms=expires_after_ms,
-            )
+            r = _sign_and_send(signer, action, vault_address=vault_address)
         except Exception as e:
             return {"ok": False, "filled": False, "reason": "SIGN_ERROR", "coin": coin, "error": str(e)}
 
-        payload = {"action": action, "nonce": nonce, "signature": signature, "expiresAfter": expires_after_ms}
-        if vault_address:
-            payload["vaultAddress"] = vault_address
-
-        r = make_request("/exchange", payload)
+        # Rechazo de la acción agrupada completa (nada colocado): entrada sola.
+        if sl_str is not None and _unwrap_exchange(r)[0] == "err":
+            must_log(f"🟠 GROUPED_ENTRY_SL rechazado coin={coin} err={_unwrap_exchange(r)[1]} — reenviando entrada sola")
+            sl_info = {"sl_grouped": False, "sl_ok": False, "sl_reason": "GROUP_REJECTED", "sl_error": str(_unwrap_exchange(r)[1])}
+            sl_str = None
+            action["orders"] = action["orders"][:1]
+            action["grouping"] = "na"
+            try:
+                r = _sign_and_send(signer, action, vault_address=vault_address)
+            except Exception as e:
+                return {"ok": False, "filled": False, "reason": "SIGN_ERROR", "coin": coin, "error": str(e)}
+        elif sl_str is not None:
+            sl_info = _grouped_sl_info(r, sl_str)
         det = _detect_fill(r)
 
+        # Rechazo por modo de margen con leverage tomado del cache: refresca y reintenta una vez.
+        if det["status"] == "ERROR" and lev_cached and _is_margin_mode_error(det.get("error")):
+            lev_cached = False
+            must_log(f"🟠 MARGIN_MODE_REJECT coin={coin} err={det.get('error')} — refrescando leverage y reintentando")
+            lev_resp = _ensure_isolated_leverage(wallet, signer, asset, vault_address=vault_address, force=True)
+            if lev_resp.get("ok"):
+                try:
+                    r = _sign_and_send(signer, action, vault_address=vault_address)
+                except Exception as e:
+                    return {"ok": False, "filled": False, "reason": "SIGN_ERROR", "coin": coin, "error": str(e)}
+                if sl_str is not None:
+                    sl_info = _grouped_sl_info(r, sl_str)
+                det = _detect_fill(r)
+
+        # El SL hijo del grupo no trae oid en la respuesta: el próximo lookup relee.
+        if sl_info.get("sl_grouped") and sl_info.get("sl_ok"):
+            _OPEN_ORDERS.invalidate(user_id)
+
         # ---- ERROR real del exchange
         if det["status"] == "ERROR":
             must_log(
@@ -1203,6 +1516,7 @@ def place_market_order(
                 "attempt": attempt,
                 "filled_sz": float(det.get("filled_sz") or 0.0),
                 "raw": r,
+                **sl_info,
             }
 
         # ---- NO_FILL (IOC cancel)
@@ -1227,6 +1541,7 @@ def place_market_order(
             "notional": float(notional),
             "error": det.get("error", ""),
             "raw": r,
+            **sl_info,
         }
 
     return {"ok": True, "filled": False, "reason": "NO_FILL", "coin": norm_coin(symbol)}
@@ -1237,6 +1552,24 @@ def place_market_order(
 # STOP LOSS REAL (trigger order) — ReduceOnly en exchange
 # ------------------------------------------------------------
 
+def _stop_order_wire(asset: int, is_buy: bool, trig_str: str, s_str: str) -> Dict[str, Any]:
+    """Orden trigger market reduceOnly (SL) en formato wire."""
+    return {
+        "a": asset,
+        "b": bool(is_buy),
+        "p": trig_str,
+        "s": s_str,
+        "r": True,  # reduceOnly SIEMPRE
+        "t": {
+            "trigger": {
+                "isMarket": True,
+                "triggerPx": trig_str,
+                "tpsl": "sl",
+            }
+        },
+    }
+
+
 def place_stop_loss(
     user_id: int,
     symbol: str,
@@ -1257,8 +1590,11 @@ def place_stop_loss(
       {"ok": False, "reason": "...", ...}               si el exchange lo rechazó
     """
     wallet = get_user_wallet(user_id)
-    private_key = get_user_private_key(user_id)
-    if not wallet or not private_key:
+    try:
+        signer = get_user_signer(user_id)
+    except Exception as e:
+        return {"ok": False, "reason": "SIGN_ERROR", "error": str(e)}
+    if not wallet or signer is None:
         return {"ok": False, "reason": "NO_WALLET_OR_KEY"}
 
     coin = norm_coin(symbol)
@@ -1290,45 +1626,17 @@ def place_stop_loss(
     qty = max(0.000001, float(qty))
     s_str = _format_size(qty, sz_decimals)
 
-    nonce = int(time.time() * 1000)
-    expires_after_ms = nonce + 60_000
-
     action = {
         "type": "order",
-        "orders": [{
-            "a": asset,
-            "b": bool(is_buy),
-            "p": trig_str,
-            "s": s_str,
-            "r": True,  # reduceOnly SIEMPRE
-            "t": {
-                "trigger": {
-                    "isMarket": True,
-                    "triggerPx": trig_str,
-                    "tpsl": "sl",
-                }
-            },
-        }],
+        "orders": [_stop_order_wire(asset, is_buy, trig_str, s_str)],
         "grouping": "na",
     }
 
     try:
-        signer = HyperliquidSigner(private_key)
-        signature = signer.sign(
-            action,
-            nonce,
-            vault_address=vault_address,
-            expires_after_ms=expires_after_ms,
-        )
+        r = _sign_and_send(signer, action, vault_address=vault_address)
     except Exception as e:
         return {"ok": False, "reason": "SIGN_ERROR", "coin": coin, "error": str(e)}
 
-    payload = {"action": action, "nonce": nonce, "signature": signature, "expiresAfter": expires_after_ms}
-    if vault_address:
-        payload["vaultAddress"] = vault_address
-
-    r = make_request("/exchange", payload)
-
     # Para trigger orders esperamos "resting" (aceptada y esperando) o "filled" (si se dispara instantáneo).
     st, inner = _unwrap_exchange(r)
     if st == "err":
@@ -1342,13 +1650,151 @@ def place_stop_loss(
         if first["kind"] == "filled":
             return {"ok": True, "reason": "FILLED", "coin": coin, "triggerPx": trig_str, "sz": s_str, "raw": r}
         if first["kind"] == "resting":
-            return {"ok": True, "reason": "RESTING", "coin": coin, "triggerPx": trig_str, "sz": s_str, "raw": r}
+            resting = statuses[0].get("resting") if isinstance(statuses[0], dict) else None
+            oid = resting.get("oid") if isinstance(resting, dict) else None
+            _OPEN_ORDERS.record_placed(
+                user_id,
+                oid,
+                {"coin": coin, "side": "B" if is_buy else "A", "isTrigger": True, "reduceOnly": True,
+                 "triggerPx": trig_str, "sz": s_str, "orderType": "Stop Market"},
+            )
+            return {"ok": True, "reason": "RESTING", "coin": coin, "triggerPx": trig_str, "sz": s_str, "oid": oid, "raw": r}
 
     return {"ok": False, "reason": "NO_STATUSES_IN_RESPONSE", "coin": coin, "raw": r}
 
 
 # ------------------------------------------------------------
 
+def modify_stop_loss(
+    user_id: int,
+    symbol: str,
+    oid: int,
+    position_side: str,
+    qty: float,
+    trigger_price: float,
+    vault_address: Optional[str] = None,
+):
+    """
+    Mueve un STOP LOSS existente (oid) a trigger_price con batchModify (sin ventana sin stop).
+
+    Retorna:
+      {"ok": True, "reason": "RESTING"|"FILLED", "oid": nuevo_oid, ...}
+      {"ok": False, "reason": "...", ...}  (p.ej. la orden ya no existe -> el llamador repone)
+    """
+    wallet = get_user_wallet(user_id)
+    try:
+        signer = get_user_signer(user_id)
+    except Exception as e:
+        return {"ok": False, "reason": "SIGN_ERROR", "error": str(e)}
+    if not wallet or signer is None:
+        return {"ok": False, "reason": "NO_WALLET_OR_KEY"}
+
+    coin = norm_coin(symbol)
+    asset = get_asset_index(coin)
+    if asset is None:
+        return {"ok": False, "reason": "NO_ASSET", "coin": coin}
+
+    try:
+        oid = int(oid)
+        trigger_price = float(trigger_price)
+    except Exception:
+        return {"ok": False, "reason": "BAD_ARGS", "coin": coin}
+    if trigger_price <= 0:
+        return {"ok": False, "reason": "BAD_TRIGGER_PRICE", "coin": coin}
+
+    sz_decimals = get_sz_decimals(asset)
+    tick_size = get_tick_size(asset)
+    is_buy = (position_side or "").strip().lower() in ("short", "sell")
+    trig_str = _format_price_tick(trigger_price, tick_size, sz_decimals, is_buy=is_buy)
+    s_str = _format_size(max(0.000001, float(qty)), sz_decimals)
+
+    action = {"type": "batchModify", "modifies": [{"oid": oid, "order": _stop_order_wire(asset, is_buy, trig_str, s_str)}]}
+    try:
+        r = _sign_and_send(signer, action, vault_address=vault_address)
+    except Exception as e:
+        return {"ok": False, "reason": "SIGN_ERROR", "coin": coin, "error": str(e)}
+
+    st, _ = _unwrap_exchange(r)
+    if st == "err":
+        _OPEN_ORDERS.invalidate(user_id)
+        return {"ok": False, "reason": "EXCHANGE_ERR", "coin": coin, "raw": r}
+
+    statuses = _extract_statuses(r)
+    first = _parse_status(statuses[0]) if statuses else {"kind": "unknown", "error": ""}
+    if first["kind"] == "error":
+        _OPEN_ORDERS.invalidate(user_id)
+        return {"ok": False, "reason": "EXCHANGE_ERROR", "coin": coin, "error": first.get("error", ""), "raw": r}
+
+    _OPEN_ORDERS.record_cancelled(user_id, oid=oid)
+    if first["kind"] == "filled":
+        return {"ok": True, "reason": "FILLED", "coin": coin, "triggerPx": trig_str, "sz": s_str, "raw": r}
+    resting = statuses[0].get("resting") if statuses and isinstance(statuses[0], dict) else None
+    new_oid = resting.get("oid") if isinstance(resting, dict) else None
+    if new_oid is not None:
+        _OPEN_ORDERS.record_placed(
+            user_id,
+            new_oid,
+            {"coin": coin, "side": "B" if is_buy else "A", "isTrigger": True, "reduceOnly": True,
+             "triggerPx": trig_str, "sz": s_str, "orderType": "Stop Market"},
+        )
+    else:
+        _OPEN_ORDERS.invalidate(user_id)
+    return {"ok": True, "reason": "RESTING", "coin": coin, "triggerPx": trig_str, "sz": s_str, "oid": new_oid, "raw": r}
+
+
+def find_stop_order(user_id: int, symbol: str, position_side: str) -> Optional[Dict[str, Any]]:
+    """Stop reduceOnly vivo que cierra `position_side` (del cache de órdenes abiertas), o None."""
+    ps = (position_side or "").strip().lower()
+    close_side = "B" if ps in ("short", "sell") else "A"
+    coin = norm_coin(symbol)
+    for od in _OPEN_ORDERS.orders(user_id, coin):
+        if (
+            bool(od.get("isTrigger"))
+            and bool(od.get("reduceOnly"))
+            and str(od.get("side") or "").upper() == close_side
+            and has_positive_trigger(od)
+        ):
+            return od
+    return None
+
+
+def cancel_order(
+    user_id: int,
+    symbol: str,
+    oid: int,
+    vault_address: Optional[str] = None,
+):
+    """Cancela una orden puntual por oid."""
+    wallet = get_user_wallet(user_id)
+    try:
+        signer = get_user_signer(user_id)
+    except Exception as e:
+        return {"ok": False, "reason": "SIGN_ERROR", "error": str(e)}
+    if not wallet or signer is None:
+        return {"ok": False, "reason": "NO_WALLET_OR_KEY"}
+
+    coin = norm_coin(symbol)
+    asset = get_asset_index(coin)
+    if asset is None:
+        return {"ok": False, "reason": "NO_ASSET", "coin": coin}
+
+    action = {"type": "cancel", "cancels": [{"a": asset, "o": int(oid)}]}
+    try:
+        r = _sign_and_send(signer, action, vault_address=vault_address)
+    except Exception as e:
+        return {"ok": False, "reason": "SIGN_ERROR", "coin": coin, "error": str(e)}
+
+    st, _ = _unwrap_exchange(r)
+    statuses = _extract_statuses(r)
+    parsed = _parse_status(statuses[0]) if statuses else {"kind": "unknown", "error": ""}
+    if st == "err" or parsed["kind"] == "error":
+        _OPEN_ORDERS.invalidate(user_id)
+        return {"ok": False, "reason": "EXCHANGE_ERROR", "coin": coin, "error": parsed.get("error", ""), "raw": r}
+
+    _OPEN_ORDERS.record_cancelled(user_id, oid=oid)
+    return {"ok": True, "reason": "CANCELLED", "coin": coin, "raw": r}
+
+
 # ------------------------------------------------------------
 # Cancelación de órdenes (limpieza) — opción A
 # - Útil para cancelar el STOP/órdenes pendientes cuando una posición se cierra.
@@ -1366,8 +1812,11 @@ def cancel_all_orders_for_symbol(
     que puedan quedar colgados después de cerrar la posición.
     """
     wallet = get_user_wallet(user_id)
-    private_key = get_user_private_key(user_id)
-    if not wallet or not private_key:
+    try:
+        signer = get_user_signer(user_id)
+    except Exception as e:
+        return {"ok": False, "reason": "SIGN_ERROR", "error": str(e)}
+    if not wallet or signer is None:
         return {"ok": False, "reason": "NO_WALLET_OR_KEY"}
 
     coin = norm_coin(symbol)
@@ -1375,29 +1824,16 @@ def cancel_all_orders_for_symbol(
     if asset is None:
         return {"ok": False, "reason": "NO_ASSET", "coin": coin}
 
-    nonce = int(time.time() * 1000)
-    expires_after_ms = nonce + 60_000
-
     action = {"type": "cancelAll", "asset": asset}
 
     try:
-        signer = HyperliquidSigner(private_key)
-        signature = signer.sign(
-            action,
-            nonce,
-            vault_address=vault_address,
-            expires_after_ms=expires_after_ms,
-        )
+        r = _sign_and_send(signer, action, vault_address=vault_address)
     except Exception as e:
         return {"ok": False, "reason": "SIGN_ERROR", "coin": coin, "error": str(e)}
 
-    payload = {"action": action, "nonce": nonce, "signature": signature, "expiresAfter": expires_after_ms}
-    if vault_address:
-        payload["vaultAddress"] = vault_address
-
-    r = make_request("/exchange", payload)
     st, _ = _unwrap_exchange(r)
     if st == "err":
+        _OPEN_ORDERS.invalidate(user_id)
         return {"ok": False, "reason": "EXCHANGE_ERR", "coin": coin, "raw": r}
 
     statuses = _extract_statuses(r)
@@ -1405,8 +1841,10 @@ def cancel_all_orders_for_symbol(
         for s in statuses:
             parsed = _parse_status(s)
             if parsed.get("kind") == "error":
+                _OPEN_ORDERS.invalidate(user_id)
                 return {"ok": False, "reason": "EXCHANGE_ERROR", "coin": coin, "error": parsed.get("error", ""), "raw": r}
 
+    _OPEN_ORDERS.record_cancelled(user_id, coin=coin)
     return {"ok": True, "reason": "CANCELLED", "coin": coin, "raw": r}
 
 # Wrappers
@@ -0,0 +1,402 @@
+# ============================================================
+# MGMT OPTIMIZER – Trading X Hyper Pro
+# Grid sobre los parámetros base de gestión por bucket
+# (strategy.MGMT_BUCKETS: act / retrace / force / partial_frac)
+#
+# - Entrada: rutas de precio guardadas por trade (tick o 1m), desde la
+#   entrada hasta la salida (mejor con algo de margen después).
+# - La derivación de _dynamic_trade_management_params (ajuste por
+#   volatilidad, partial, BE, offsets) se aplica vectorizada a
+#   todos los trades x todos los sets del grid.
+# - Las salidas (SL / BE / force / trailing) se resuelven con consultas
+#   "primer tick >= k donde x >= nivel" sobre sparse tables de máximos,
+#   O(log L) por (set, trade), en bloques de trades.
+# - Mismas reglas y mismo orden dentro del tick que exit_manager.replay_path
+#   (sin interpolación): stop exchange -> force -> partial -> BE -> trailing.
+#
+# Límite: si un set mantiene la posición más allá de la ruta guardada,
+# se cierra en el último precio (END_OF_PATH).
+# ============================================================
+
+from __future__ import annotations
+
+import argparse
+import itertools
+import json
+import math
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+import app.exit_manager as exit_manager
+import app.strategy as strategy
+
+# ============================================================
+# CONFIG
+# ============================================================
+
+GRID_FIELDS = ("act", "retrace", "force", "partial_frac")
+TRADE_CHUNK = 256               # trades por bloque (acota memoria: sets x TRADE_CHUNK)
+DEFAULT_COST_PCT = 0.0009 + 0.0005 * 2   # fees taker ida+vuelta + slippage
+
+EXIT_CODES = ("EXCHANGE_SL", "BREAK_EVEN_STOP", "FORCE_LOSS", "TRAIL", "END_OF_PATH")
+
+
+def log(msg: str, level: str = "INFO"):
+    print(f"[MGMT_OPT {time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())}] {level} {msg}")
+
+
+# ============================================================
+# DATOS
+# ============================================================
+
+def load_trade_paths(path: str) -> List[Dict[str, Any]]:
+    """JSONL: una línea por trade.
+
+    Campos: direction, entry_price, prices (lista), sl_price_pct, strength, score, atr_pct
+    y opcional force_flags (lista bool: en ese tick la re-evaluación pide salir).
+    """
+    out: List[Dict[str, Any]] = []
+    with open(path) as fh:
+        for line in fh:
+            line = line.strip()
+            if line:
+                out.append(json.loads(line))
+    return out
+
+
+def trade_paths_from_backtest(
+    candles: Dict[str, np.ndarray],
+    trades: List[Dict[str, Any]],
+    sig: Dict[str, np.ndarray],
+    extra_bars: int = 48,
+) -> List[Dict[str, Any]]:
+    """Rutas OHLC (4 puntos por vela) de trades del backtester, con `extra_bars` tras la salida.
+
+    force_flags se marca en el cierre de vela cuando la señal de esa vela forzaría la salida
+    (giro de dirección o fuerza <= force_min_strength del trade).
+    """
+    from app.backtester import _bar_path
+
+    t = candles["t"]
+    out: List[Dict[str, Any]] = []
+    for tr in trades:
+        i = int(np.searchsorted(t, tr["signal_t"]))
+        end = min(int(np.searchsorted(t, tr["exit_t"])) + int(extra_bars), len(t) - 1)
+        d = 1 if tr["direction"] == "long" else -1
+        force_min_strength = float(strategy.get_trade_management_params(tr["strength"], tr["score"], tr["atr_pct"])["force_min_strength"])
+        prices: List[float] = []
+        flags: List[bool] = []
+        for j in range(i + 1, end + 1):
+            path = _bar_path(candles["o"][j], candles["h"][j], candles["l"][j], candles["c"][j])
+            prices.extend(float(x) for x in path)
+            forced = bool(sig["signal"][j]) and (
+                int(sig["direction"][j]) != d or float(sig["strength"][j]) <= max(force_min_strength, 0.0)
+            )
+            flags.extend([False, False, False, forced])
+        out.append({
+            "direction": tr["direction"],
+            "entry_price": float(tr["entry_px"]),
+            "sl_price_pct": float(tr["sl_pct"]),
+            "strength": float(tr["strength"]),
+            "score": float(tr["score"]),
+            "atr_pct": float(tr["atr_pct"]),
+            "prices": prices,
+            "force_flags": flags,
+        })
+    return out
+
+
+def _pack_paths(trades: List[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+    T = len(trades)
+    lens = np.array([len(x.get("prices") or []) for x in trades], dtype=np.int64)
+    L = int(max(int(lens.max()) if T else 1, 1))
+    pnl = np.zeros((T, L))
+    force = np.full((T, L), -np.inf)
+    for k, tr in enumerate(trades):
+        n = int(lens[k])
+        if n == 0:
+            continue
+        px = np.asarray(tr["prices"], dtype=np.float64)
+        entry = float(tr["entry_price"])
+        sgn = 1.0 if str(tr["direction"]).lower() == "long" else -1.0
+        p = sgn * (px - entry) / entry
+        pnl[k, :n] = p
+        pnl[k, n:] = p[-1]
+        flags = tr.get("force_flags")
+        if flags:
+            f = np.asarray(flags[:n], dtype=bool)
+            force[k, : len(f)] = np.where(f, p[: len(f)], -np.inf)
+    return {
+        "pnl": pnl,
+        "force": force,
+        "lens": lens,
+        "sl": np.array([float(x.get("sl_price_pct", 0.0) or 0.0) for x in trades]),
+        "strength": np.array([float(x.get("strength", 0.0) or 0.0) for x in trades]),
+        "score": np.array([float(x.get("score", 0.0) or 0.0) for x in trades]),
+        "atr_pct": np.array([float(x.get("atr_pct", 0.0) or 0.0) for x in trades]),
+    }
+
+
+# ============================================================
+# DERIVACIÓN VECTORIZADA (= strategy._dynamic_trade_management_params)
+# ============================================================
+
+def _clamp(v, lo, hi):
+    # strategy._clamp: max(lo, min(hi, v)); lo gana si lo > hi.
+    return np.maximum(lo, np.minimum(hi, v))
+
+
+def derive_management_arrays(base: Dict[str, np.ndarray], atr_pct: np.ndarray, strength: np.ndarray) -> Dict[str, np.ndarray]:
+    """base: act/retrace/force/partial_frac con forma (G, 1); atr_pct/strength con forma (1, T)."""
+    vol_add = _clamp((atr_pct - 0.0050) * 0.16, -0.0005, 0.0008)
+    act = _clamp(base["act"] + vol_add, 0.0078, 0.0112)
+    retrace = _clamp(base["retrace"] + (vol_add * 0.85), 0.0038, 0.0059)
+    force = _clamp(base["force"] + (vol_add * 0.45), 0.0052, 0.0082)
+    partial_tp = _clamp(np.maximum(act * 0.93, act - 0.00055), 0.0068, act - 0.0002)
+    be_act = _clamp(np.maximum(act * 1.14, partial_tp + 0.0008), partial_tp + 0.0006, act + 0.0026)
+    be_off = _clamp(np.maximum(atr_pct * 0.10, act * 0.12), 0.0007, 0.0018)
+    force_strength = _clamp(np.maximum(0.16, strength * 0.64), 0.16, 0.88)
+    shape = np.broadcast(act, atr_pct).shape
+    return {
+        "tp_activation_price": np.broadcast_to(np.round(act, 6), shape),
+        "trail_retrace_price": np.broadcast_to(np.round(retrace, 6), shape),
+        "force_min_profit_price": np.broadcast_to(np.round(force, 6), shape),
+        "force_min_strength": np.broadcast_to(np.round(force_strength, 4), shape),
+        "partial_tp_activation_price": np.broadcast_to(np.round(partial_tp, 6), shape),
+        "partial_tp_close_fraction": np.broadcast_to(np.round(base["partial_frac"], 4), shape),
+        "break_even_activation_price": np.broadcast_to(np.round(be_act, 6), shape),
+        "break_even_offset_price": np.broadcast_to(np.round(be_off, 6), shape),
+    }
+
+
+# ============================================================
+# PRIMER TICK (sparse table de máximos)
+# ============================================================
+
+def _sparse_max(a: np.ndarray) -> List[np.ndarray]:
+    """levels[j][c, i] = max(a[c, i : min(i + 2**j, L)])."""
+    levels = [a]
+    L = a.shape[1]
+    span = 1
+    while span * 2 <= L:
+        prev = levels[-1]
+        nxt = prev.copy()
+        nxt[:, : L - span] = np.maximum(prev[:, : L - span], prev[:, span:])
+        levels.append(nxt)
+        span *= 2
+    return levels
+
+
+def _first_at_least(levels: List[np.ndarray], threshold: np.ndarray, start: np.ndarray) -> np.ndarray:
+    """Primer índice k >= start con a[k] >= threshold. Devuelve L si no hay. Formas (G, C)."""
+    L = levels[0].shape[1]
+    C = levels[0].shape[0]
+    rows = np.broadcast_to(np.arange(C)[None, :], threshold.shape)
+    pos = np.broadcast_to(start, threshold.shape).astype(np.int64).copy()
+    for j in range(len(levels) - 1, -1, -1):
+        live = pos < L
+        vals = levels[j][rows, np.minimum(pos, L - 1)]
+        skip = live & (vals < threshold)
+        pos = np.where(skip, pos + (1 << j), pos)
+    pos = np.minimum(pos, L)
+    hit = pos < L
+    ok = np.zeros(pos.shape, dtype=bool)
+    ok[hit] = levels[0][rows[hit], pos[hit]] >= threshold[hit]
+    return np.where(ok, pos, L)
+
+
+# ============================================================
+# EVALUACIÓN
+# ============================================================
+
+def evaluate_grid(
+    trades: List[Dict[str, Any]],
+    grid_sets: List[Dict[str, float]],
+    cost_pct: float = DEFAULT_COST_PCT,
+) -> Dict[str, np.ndarray]:
+    """PnL neto por (set, trade) y motivo de salida. Formas (G, T)."""
+    packed = _pack_paths(trades)
+    G = len(grid_sets)
+    T = len(trades)
+    base = {f: np.array([float(s[f]) for s in grid_sets])[:, None] for f in GRID_FIELDS}
+    pnl_out = np.zeros((G, T))
+    code_out = np.zeros((G, T), dtype=np.int8)
+    exit_idx_out = np.zeros((G, T), dtype=np.int64)
+
+    for c0 in range(0, T, TRADE_CHUNK):
+        c1 = min(T, c0 + TRADE_CHUNK)
+        pnl = packed["pnl"][c0:c1]
+        L = pnl.shape[1]
+        n = packed["lens"][c0:c1][None, :]
+        runmax = np.maximum.accumulate(pnl, axis=1)
+        up = _sparse_max(pnl)
+        down = _sparse_max(-pnl)
+        dd = _sparse_max(runmax - pnl)
+        force_lv = _sparse_max(packed["force"][c0:c1])
+
+        m = derive_management_arrays(base, packed["atr_pct"][c0:c1][None, :], packed["strength"][c0:c1][None, :])
+        shape = (G, c1 - c0)
+        zero = np.zeros(shape, dtype=np.int64)
+
+        def first(levels, thr, start=zero):
+            k = _first_at_least(levels, np.broadcast_to(thr, shape), start)
+            return np.where(k >= n, L, k)
+
+        k_partial = first(up, m["partial_tp_activation_price"])
+        k_be = first(up, m["break_even_activation_price"])
+        k_act = first(up, m["tp_activation_price"])
+        sl = np.broadcast_to(packed["sl"][c0:c1][None, :], shape)
+        k_sl = np.where(sl > 0.0, first(down, sl), L)
+        k_be_stop = first(down, m["break_even_offset_price"], np.minimum(k_be + 1, L))
+        sl_first = k_sl <= k_be
+        k_stop = np.where(sl_first, k_sl, k_be_stop)
+        k_force = first(force_lv, m["force_min_profit_price"])
+        k_trail = first(dd, m["trail_retrace_price"], np.minimum(k_act + 1, L))
+        k_end = np.broadcast_to(np.maximum(n - 1, 0), shape)
+
+        # Prioridad dentro del mismo tick: stop -> force -> trail -> fin de ruta.
+        cand = np.stack([k_stop, k_force, k_trail, np.where(k_end < L, k_end, L)])
+        which = np.argmin(cand, axis=0)
+        k_exit = np.take_along_axis(cand, which[None], axis=0)[0]
+        code = np.select(
+            [which == 0, which == 1, which == 2],
+            [np.where(sl_first, 0, 1), 2, 3],
+            4,
+        ).astype(np.int8)
+
+        rows = np.broadcast_to(np.arange(c1 - c0)[None, :], shape)
+        kx = np.minimum(k_exit, L - 1)
+        px_exit = pnl[rows, kx]
+        stop_level = np.where(sl_first, -sl, -m["break_even_offset_price"])
+        exit_pnl = np.where(which == 0, np.where(kx == 0, px_exit, stop_level), px_exit)
+
+        # El partial se ejecuta si su tick es anterior a la salida, o el mismo tick
+        # cuando la salida es por trailing / fin de ruta (force y stop van antes en el tick).
+        partial = (k_partial < k_exit) | ((k_partial == k_exit) & (code >= 3))
+        partial &= k_partial < L
+        frac = m["partial_tp_close_fraction"]
+        partial_pnl = pnl[rows, np.minimum(k_partial, L - 1)]
+        total = np.where(partial, frac * partial_pnl + (1.0 - frac) * exit_pnl, exit_pnl)
+
+        pnl_out[:, c0:c1] = total - float(cost_pct)
+        code_out[:, c0:c1] = code
+        exit_idx_out[:, c0:c1] = kx
+
+    return {"pnl": pnl_out, "exit_code": code_out, "exit_idx": exit_idx_out, "atr_pct": packed["atr_pct"], "score": packed["score"]}
+
+
+def _metrics(pnl: np.ndarray, mask: np.ndarray) -> Dict[str, np.ndarray]:
+    """Métricas por set (filas) sobre los trades con mask (columnas)."""
+    p = np.where(mask[None, :], pnl, 0.0)
+    n = int(mask.sum())
+    gains = np.where(p > 0, p, 0.0).sum(axis=1)
+    losses = -np.where(p < 0, p, 0.0).sum(axis=1)
+    wins = ((p > 0) & mask[None, :]).sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pf = np.where(losses > 0, gains / losses, np.where(gains > 0, np.inf, 0.0))
+    return {
+        "trades": np.full(p.shape[0], n),
+        "win_rate": wins / max(n, 1),
+        "profit_factor": pf,
+        "expectancy_pct": p.sum(axis=1) / max(n, 1),
+        "total_pnl_pct": p.sum(axis=1),
+    }
+
+
+def build_grid(grid: Dict[str, List[float]]) -> List[Dict[str, float]]:
+    for f in grid:
+        if f not in GRID_FIELDS:
+            raise KeyError(f"campo de grid desconocido: {f} (válidos: {GRID_FIELDS})")
+    return [dict(zip(grid.keys(), vals)) for vals in itertools.product(*grid.values())]
+
+
+def optimize_buckets(
+    trades: List[Dict[str, Any]],
+    grid: Dict[str, List[float]],
+    cost_pct: float = DEFAULT_COST_PCT,
+) -> pd.DataFrame:
+    """Superficies PF / expectancy por bucket y régimen de volatilidad.
+
+    Cada bucket se evalúa solo con sus trades; los campos que el grid no fija
+    toman el valor actual de strategy.MGMT_BUCKETS para ese bucket.
+    """
+    sets = build_grid(grid)
+    frames: List[pd.DataFrame] = []
+    buckets = np.array([strategy.mgmt_bucket_for_score(float(x.get("score", 0.0) or 0.0)) for x in trades])
+    regimes = np.array([strategy._volatility_regime_from_atr_pct(float(x.get("atr_pct", 0.0) or 0.0)) for x in trades])
+
+    for bucket, current in strategy.MGMT_BUCKETS.items():
+        idx = np.flatnonzero(buckets == bucket)
+        if not len(idx):
+            continue
+        full_sets = [{**current, **s} for s in sets]
+        started = time.time()
+        res = evaluate_grid([trades[i] for i in idx], full_sets, cost_pct=cost_pct)
+        log(f"bucket={bucket} trades={len(idx)} sets={len(full_sets)} elapsed_s={round(time.time() - started, 2)}")
+        sub_regimes = regimes[idx]
+        for regime in ["all"] + sorted(set(sub_regimes.tolist())):
+            mask = np.ones(len(idx), dtype=bool) if regime == "all" else (sub_regimes == regime)
+            met = _metrics(res["pnl"], mask)
+            df = pd.DataFrame(full_sets)
+            df.insert(0, "vol_regime", regime)
+            df.insert(0, "bucket", bucket)
+            for k, v in met.items():
+                df[k] = v
+            frames.append(df)
+
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
+
+
+def verify_against_replay(trades: List[Dict[str, Any]], grid_set: Optional[Dict[str, float]] = None, tol: float = 1e-9) -> List[int]:
+    """Compara evaluate_grid con exit_manager.replay_trades (derivación escalar de strategy).
+
+    Sin grid_set usa strategy.MGMT_BUCKETS tal cual. Devuelve índices de trades que difieren.
+    """
+    mismatches: List[int] = []
+    for k, tr in enumerate(trades):
+        bucket = strategy.mgmt_bucket_for_score(float(tr.get("score", 0.0) or 0.0))
+        base = {**strategy.MGMT_BUCKETS[bucket], **(grid_set or {})}
+        vec = evaluate_grid([tr], [base], cost_pct=0.0)["pnl"][0, 0]
+        saved = strategy.MGMT_BUCKETS[bucket]
+        strategy.MGMT_BUCKETS[bucket] = base
+        try:
+            ref = exit_manager.replay_trades([tr], strategy.get_trade_management_params)[0]["pnl_pct"]
+        finally:
+            strategy.MGMT_BUCKETS[bucket] = saved
+        if not math.isclose(vec, ref, rel_tol=0.0, abs_tol=tol):
+            mismatches.append(k)
+    return mismatches
+
+
+# ============================================================
+# CLI
+# ============================================================
+
+def main(argv: Optional[Iterable[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description="Grid de parámetros de gestión por bucket sobre rutas de precio guardadas")
+    ap.add_argument("--paths", required=True, help="JSONL de trades con rutas de precio")
+    ap.add_argument("--grid", required=True, help='JSON {"act": [...], "retrace": [...], "force": [...], "partial_frac": [...]}')
+    ap.add_argument("--out", required=True, help="CSV de superficies")
+    ap.add_argument("--cost", type=float, default=DEFAULT_COST_PCT)
+    args = ap.parse_args(list(argv) if argv is not None else None)
+
+    trades = load_trade_paths(args.paths)
+    with open(args.grid) as fh:
+        grid = json.load(fh)
+    df = optimize_buckets(trades, grid, cost_pct=args.cost)
+    df.to_csv(args.out, index=False)
+    if not df.empty:
+        top = df[df["vol_regime"] == "all"].sort_values("expectancy_pct", ascending=False).groupby("bucket").head(1)
+        for _, row in top.iterrows():
+            log(f"mejor bucket={row['bucket']} " + " ".join(f"{f}={row[f]}" for f in GRID_FIELDS) +
+                f" pf={row['profit_factor']:.4f} expectancy_pct={row['expectancy_pct']:.6f} trades={int(row['trades'])}")
+    log(f"superficies -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# ============================================================
+# NONCE MANAGER – Trading X Hyper Pro
+# Nonces de /exchange estrictamente crecientes por firmante
+#
+# - Hyperliquid exige nonces únicos por firmante (ms, ventana alrededor
+#   del tiempo del servidor). Con time.time()*1000, dos acciones de la
+#   misma wallet en el mismo ms colisionaban (cancel + cierre, partial
+#   TP + BE) y una se rechazaba.
+# - next(key) = max(reloj + offset, último + 1) bajo lock: únicos y
+#   crecientes aunque varios threads firmen a la vez para la misma wallet.
+# - Offset de reloj: se estima con la hora del servidor (header Date de
+#   las respuestas) y solo se aplica si el desvío supera
+#   NONCE_SKEW_TOLERANCE_MS (el header tiene resolución de 1s).
+# - Si el reloj local retrocede, el nonce no: sigue en último + 1.
+# ============================================================
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Hashable
+
+# ============================================================
+# CONFIG
+# ============================================================
+
+NONCE_SKEW_TOLERANCE_MS = int(os.getenv("NONCE_SKEW_TOLERANCE_MS", "2000"))
+NONCE_MAX_KEYS = int(os.getenv("NONCE_MAX_KEYS", "10000"))
+
+
+def log(msg: str, level: str = "INFO"):
+    print(f"[NONCES {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')}] {level} {msg}")
+
+
+class NonceManager:
+    def __init__(self, *, clock: Callable[[], float] = time.time, skew_tolerance_ms: int = NONCE_SKEW_TOLERANCE_MS):
+        self._clock = clock
+        self._tolerance = max(0, int(skew_tolerance_ms))
+        self._lock = threading.Lock()
+        self._last: Dict[Hashable, int] = {}
+        self._offset_ms = 0
+        self._stats = {"issued": 0, "bumped": 0, "skew_updates": 0}
+
+    def _now_ms(self) -> int:
+        return int(self._clock() * 1000) + self._offset_ms
+
+    def next(self, key: Hashable) -> int:
+        """Próximo nonce para `key` (dirección del firmante): > que cualquiera ya emitido."""
+        with self._lock:
+            now = self._now_ms()
+            last = self._last.get(key, 0)
+            n = now if now > last else last + 1
+            if n != now:
+                self._stats["bumped"] += 1
+            if key not in self._last and len(self._last) >= NONCE_MAX_KEYS:
+                self._evict_locked(now)
+            self._last[key] = n
+            self._stats["issued"] += 1
+            return n
+
+    def _evict_locked(self, now_ms: int) -> None:
+        # Claves cuyo último nonce ya quedó atrás del reloj: el próximo sale del reloj igual.
+        for k in [k for k, v in self._last.items() if v < now_ms]:
+            self._last.pop(k, None)
+
+    def observe_server_time(self, server_ms: int) -> None:
+        """Ajusta el offset si el reloj local se desvía del servidor más que la tolerancia."""
+        try:
+            server_ms = int(server_ms)
+        except Exception:
+            return
+        if server_ms <= 0:
+            return
+        with self._lock:
+            skew = server_ms - int(self._clock() * 1000)
+            new_offset = skew if abs(skew) > self._tolerance else 0
+            if new_offset != self._offset_ms:
+                self._offset_ms = new_offset
+                self._stats["skew_updates"] += 1
+                log(f"offset de reloj vs servidor = {new_offset}ms", "WARN" if new_offset else "INFO")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out = dict(self._stats)
+            out["keys"] = len(self._last)
+            out["offset_ms"] = self._offset_ms
+        return out
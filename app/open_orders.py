@@ -0,0 +1,272 @@
+# ============================================================
+# OPEN ORDERS CACHE – Trading X Hyper Pro
+# Cache por usuario de órdenes abiertas (frontendOpenOrders)
+#
+# - Índice (coin, isTrigger, reduceOnly, side) -> {oid: orden}: verificar
+#   "¿hay SL vivo?" es un lookup de dict, sin recorrer todas las órdenes.
+# - Refresco perezoso con TTL (solo se pide al exchange si el snapshot
+#   venció o quedó invalidado).
+# - Actualización local con nuestras propias respuestas (SL resting,
+#   cancelAll por coin) y con el stream orderUpdates (user_events).
+# - Un "no hay" viejo se reconfirma contra el exchange antes de
+#   devolverse: un falso negativo acabaría en un SL duplicado.
+# ============================================================
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# ============================================================
+# CONFIG
+# ============================================================
+
+OPEN_ORDERS_TTL_SECONDS = float(os.getenv("OPEN_ORDERS_TTL_SECONDS", "20"))
+OPEN_ORDERS_MISS_REFRESH_SECONDS = float(os.getenv("OPEN_ORDERS_MISS_REFRESH_SECONDS", "2"))
+
+# Estados de orderUpdates con los que la orden deja de estar abierta.
+_CLOSED_STATUSES = ("filled", "canceled", "triggered", "rejected", "marginCanceled")
+
+OrderKey = Tuple[str, bool, bool, str]
+
+
+def log(msg: str, level: str = "INFO"):
+    print(f"[OPEN_ORDERS {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')}] {level} {msg}")
+
+
+def _f(v: Any) -> float:
+    try:
+        return float(v) if v is not None else 0.0
+    except Exception:
+        return 0.0
+
+
+# ============================================================
+# ESTADO POR USUARIO
+# ============================================================
+
+class _UserOrders:
+    __slots__ = ("lock", "by_key", "key_of", "fetched_at", "stale")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.by_key: Dict[OrderKey, Dict[int, Dict[str, Any]]] = {}
+        self.key_of: Dict[int, OrderKey] = {}
+        self.fetched_at = 0.0
+        self.stale = True
+
+    def clear(self) -> None:
+        self.by_key = {}
+        self.key_of = {}
+
+    def put(self, key: OrderKey, oid: int, order: Dict[str, Any]) -> None:
+        self.remove(oid)
+        self.by_key.setdefault(key, {})[oid] = order
+        self.key_of[oid] = key
+
+    def remove(self, oid: int) -> bool:
+        key = self.key_of.pop(oid, None)
+        if key is None:
+            return False
+        bucket = self.by_key.get(key)
+        if bucket is not None:
+            bucket.pop(oid, None)
+            if not bucket:
+                self.by_key.pop(key, None)
+        return True
+
+
+class OpenOrdersCache:
+    """
+    fetch(user_id) -> lista cruda de frontendOpenOrders (o None si falló la lectura)
+    coin_key(str) -> coin normalizado (mismo criterio que el llamador)
+    """
+
+    def __init__(
+        self,
+        *,
+        fetch: Callable[[int], Optional[List[Dict[str, Any]]]],
+        coin_key: Callable[[str], str] = lambda c: str(c or "").strip().upper(),
+        ttl: float = OPEN_ORDERS_TTL_SECONDS,
+    ):
+        self._fetch = fetch
+        self._coin_key = coin_key
+        self._ttl = float(ttl)
+        self._lock = threading.Lock()
+        self._users: Dict[int, _UserOrders] = {}
+
+    def _user(self, user_id: int) -> _UserOrders:
+        with self._lock:
+            u = self._users.get(int(user_id))
+            if u is None:
+                u = _UserOrders()
+                self._users[int(user_id)] = u
+            return u
+
+    def _key(self, coin: str, is_trigger: bool, reduce_only: bool, side: str) -> OrderKey:
+        return (self._coin_key(coin), bool(is_trigger), bool(reduce_only), str(side or "").upper())
+
+    # --------------------------------------------------------
+    # Refresco
+    # --------------------------------------------------------
+
+    def _refresh_locked(self, user_id: int, u: _UserOrders) -> bool:
+        raw = self._fetch(int(user_id))
+        if not isinstance(raw, list):
+            return False
+        u.clear()
+        for od in raw:
+            if not isinstance(od, dict):
+                continue
+            try:
+                oid = int(od.get("oid"))
+            except Exception:
+                continue
+            key = self._key(str(od.get("coin") or ""), bool(od.get("isTrigger")), bool(od.get("reduceOnly")), str(od.get("side") or ""))
+            u.put(key, oid, od)
+        u.fetched_at = time.time()
+        u.stale = False
+        return True
+
+    def _ensure_locked(self, user_id: int, u: _UserOrders, max_age: float) -> bool:
+        if not u.stale and (time.time() - u.fetched_at) <= max_age:
+            return True
+        return self._refresh_locked(user_id, u)
+
+    # --------------------------------------------------------
+    # Consultas
+    # --------------------------------------------------------
+
+    def orders(self, user_id: int, coin: Optional[str] = None) -> List[Dict[str, Any]]:
+        u = self._user(user_id)
+        with u.lock:
+            self._ensure_locked(user_id, u, self._ttl)
+            coin_k = self._coin_key(coin) if coin else None
+            return [
+                od
+                for key, bucket in u.by_key.items()
+                if coin_k is None or key[0] == coin_k
+                for od in bucket.values()
+            ]
+
+    def has(
+        self,
+        user_id: int,
+        coin: str,
+        *,
+        is_trigger: bool,
+        reduce_only: bool,
+        side: str,
+        predicate: Optional[Callable[[Dict[str, Any]], bool]] = None,
+    ) -> bool:
+        """True si hay al menos una orden abierta con esa clave (y que cumpla predicate)."""
+        key = self._key(coin, is_trigger, reduce_only, side)
+        u = self._user(user_id)
+        with u.lock:
+            if not self._ensure_locked(user_id, u, self._ttl):
+                return False
+            if self._match(u, key, predicate):
+                return True
+            # Miss: solo lo damos por bueno si el snapshot es reciente.
+            if (time.time() - u.fetched_at) <= OPEN_ORDERS_MISS_REFRESH_SECONDS:
+                return False
+            if not self._refresh_locked(user_id, u):
+                return False
+            return self._match(u, key, predicate)
+
+    @staticmethod
+    def _match(u: _UserOrders, key: OrderKey, predicate: Optional[Callable[[Dict[str, Any]], bool]]) -> bool:
+        bucket = u.by_key.get(key)
+        if not bucket:
+            return False
+        if predicate is None:
+            return True
+        for od in bucket.values():
+            try:
+                if predicate(od):
+                    return True
+            except Exception:
+                continue
+        return False
+
+    # --------------------------------------------------------
+    # Actualización local
+    # --------------------------------------------------------
+
+    def record_placed(self, user_id: int, oid: Any, order: Dict[str, Any]) -> None:
+        """Alta de una orden que el exchange nos confirmó como resting."""
+        try:
+            oid_i = int(oid)
+        except Exception:
+            self.invalidate(user_id)
+            return
+        od = dict(order)
+        od["oid"] = oid_i
+        key = self._key(str(od.get("coin") or ""), bool(od.get("isTrigger")), bool(od.get("reduceOnly")), str(od.get("side") or ""))
+        u = self._user(user_id)
+        with u.lock:
+            u.put(key, oid_i, od)
+
+    def record_cancelled(self, user_id: int, *, oid: Any = None, coin: Optional[str] = None) -> None:
+        """Baja de una orden (oid) o de todas las de un coin (cancelAll por asset)."""
+        u = self._user(user_id)
+        with u.lock:
+            if oid is not None:
+                try:
+                    u.remove(int(oid))
+                except Exception:
+                    u.stale = True
+                return
+            if coin:
+                coin_k = self._coin_key(coin)
+                for key in [k for k in u.by_key if k[0] == coin_k]:
+                    for oid_i in list(u.by_key.get(key, {})):
+                        u.remove(oid_i)
+
+    def apply_order_updates(self, user_id: int, updates: List[Dict[str, Any]]) -> None:
+        """
+        Stream orderUpdates. Las bajas se aplican directo. Un alta desconocida
+        no trae isTrigger/reduceOnly, así que marca el snapshot como vencido.
+        """
+        u = self._user(user_id)
+        with u.lock:
+            for up in updates:
+                if not isinstance(up, dict):
+                    continue
+                order = up.get("order") if isinstance(up.get("order"), dict) else {}
+                try:
+                    oid = int(order.get("oid"))
+                except Exception:
+                    continue
+                status = str(up.get("status") or "")
+                if status in _CLOSED_STATUSES:
+                    u.remove(oid)
+                elif status == "open":
+                    key = u.key_of.get(oid)
+                    if key is None:
+                        u.stale = True
+                    elif order.get("sz") is not None:
+                        u.by_key[key][oid]["sz"] = order.get("sz")
+                else:
+                    u.stale = True
+
+    def invalidate(self, user_id: int) -> None:
+        u = self._user(user_id)
+        with u.lock:
+            u.stale = True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            users = dict(self._users)
+        return {
+            "users": len(users),
+            "orders": sum(len(u.key_of) for u in users.values()),
+            "stale": sum(1 for u in users.values() if u.stale),
+        }
+
+
+def has_positive_trigger(order: Dict[str, Any]) -> bool:
+    return _f(order.get("triggerPx")) > 0.0
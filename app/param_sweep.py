@@ -0,0 +1,237 @@
+# ============================================================
+# PARAM SWEEP – Trading X Hyper Pro
+# Barrido paralelo de constantes de strategy sobre el backtester
+#
+# - Las velas se cargan una sola vez en shared memory; los workers
+#   las leen como vistas numpy (zero-copy).
+# - Las combinaciones se ordenan por la clave de indicadores
+#   (EMA/ATR/ADX/lookback) y cada worker cachea esos arrays, así que
+#   solo se recalculan cuando la combinación cambia esa clave.
+# - Cada combinación terminada se escribe en el CSV de resultados
+#   (una fila, flush inmediato).
+# ============================================================
+
+from __future__ import annotations
+
+import argparse
+import csv
+import itertools
+import json
+import math
+import random
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+import app.backtester as bt
+
+# ============================================================
+# CONFIG
+# ============================================================
+
+COLUMNS = ("t", "o", "h", "l", "c", "v")
+INDICATOR_CACHE_KEYS = 2        # claves de indicadores retenidas por worker (todas las coins)
+MAX_INFLIGHT_PER_WORKER = 4     # tareas encoladas por worker (acota memoria de resultados)
+
+RESULT_METRICS = (
+    "trades", "wins", "losses", "win_rate", "profit_factor",
+    "expectancy_pct", "total_pnl_pct", "avg_win_pct", "avg_loss_pct",
+)
+
+
+def log(msg: str, level: str = "INFO"):
+    print(f"[SWEEP {time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())}] {level} {msg}")
+
+
+# ============================================================
+# SHARED MEMORY
+# ============================================================
+
+def _pack_candles(candles_by_coin: Dict[str, Dict[str, np.ndarray]]) -> Tuple[shared_memory.SharedMemory, Dict[str, Any]]:
+    """Copia todas las coins a un bloque (len(COLUMNS), total_bars) float64."""
+    coins = list(candles_by_coin.keys())
+    total = int(sum(len(candles_by_coin[c]["c"]) for c in coins))
+    shape = (len(COLUMNS), max(total, 1))
+    shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * 8)
+    block = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+    offsets: Dict[str, Tuple[int, int]] = {}
+    pos = 0
+    for coin in coins:
+        cd = candles_by_coin[coin]
+        n = len(cd["c"])
+        for row, col in enumerate(COLUMNS):
+            block[row, pos:pos + n] = cd[col]
+        offsets[coin] = (pos, pos + n)
+        pos += n
+    layout = {"name": shm.name, "shape": shape, "offsets": offsets}
+    return shm, layout
+
+
+def _attach_candles(layout: Dict[str, Any]) -> Tuple[shared_memory.SharedMemory, Dict[str, Dict[str, np.ndarray]]]:
+    shm = shared_memory.SharedMemory(name=layout["name"])
+    block = np.ndarray(layout["shape"], dtype=np.float64, buffer=shm.buf)
+    block.flags.writeable = False
+    views: Dict[str, Dict[str, np.ndarray]] = {}
+    for coin, (a, b) in layout["offsets"].items():
+        views[coin] = {col: block[row, a:b] for row, col in enumerate(COLUMNS)}
+    return shm, views
+
+
+# ============================================================
+# WORKER
+# ============================================================
+
+_W_SHM: Optional[shared_memory.SharedMemory] = None
+_W_CANDLES: Dict[str, Dict[str, np.ndarray]] = {}
+_W_CONFIG: Dict[str, Any] = {}
+_W_IND_CACHE: "OrderedDict[Tuple[Any, ...], Dict[str, Dict[str, np.ndarray]]]" = OrderedDict()
+
+
+def _worker_init(layout: Dict[str, Any], config: Dict[str, Any]) -> None:
+    global _W_SHM, _W_CANDLES, _W_CONFIG
+    _W_SHM, _W_CANDLES = _attach_candles(layout)
+    _W_CONFIG = dict(config)
+    _W_IND_CACHE.clear()
+
+
+def _indicators_for(key: Tuple[Any, ...], params: Dict[str, Any]) -> Dict[str, Dict[str, np.ndarray]]:
+    cached = _W_IND_CACHE.get(key)
+    if cached is not None:
+        _W_IND_CACHE.move_to_end(key)
+        return cached
+    ind = {coin: bt.compute_indicators(cd, params) for coin, cd in _W_CANDLES.items()}
+    _W_IND_CACHE[key] = ind
+    while len(_W_IND_CACHE) > INDICATOR_CACHE_KEYS:
+        _W_IND_CACHE.popitem(last=False)
+    return ind
+
+
+def _run_combo(task: Tuple[int, Dict[str, Any]]) -> Tuple[int, Dict[str, Any], Dict[str, Any]]:
+    combo_id, params = task
+    try:
+        key = bt.indicator_key(params)
+        ind = _indicators_for(key, params)
+        trades: List[Dict[str, Any]] = []
+        for coin, cd in _W_CANDLES.items():
+            trades.extend(bt.backtest_coin(coin, cd, _W_CONFIG, params, indicators=ind[coin]))
+        return combo_id, params, bt.summarize_trades(trades)
+    except Exception as e:
+        return combo_id, params, {"trades": 0, "error": str(e)[:180]}
+
+
+# ============================================================
+# COMBINACIONES
+# ============================================================
+
+def iter_grid(grid: Dict[str, List[Any]], max_combos: int = 0, seed: int = 0) -> List[Dict[str, Any]]:
+    """Producto cartesiano del grid (o muestra aleatoria de `max_combos`), ordenado por clave de indicadores."""
+    names = list(grid.keys())
+    for name in names:
+        bt.resolve_params({name: grid[name][0]})  # valida nombres
+    combos = [dict(zip(names, values)) for values in itertools.product(*(grid[n] for n in names))]
+    if max_combos and len(combos) > max_combos:
+        combos = random.Random(seed).sample(combos, int(max_combos))
+    combos.sort(key=lambda p: tuple(str(x) for x in bt.indicator_key(p)))
+    return combos
+
+
+def _result_row(combo_id: int, params: Dict[str, Any], summary: Dict[str, Any], names: List[str]) -> Dict[str, Any]:
+    row: Dict[str, Any] = {"combo_id": combo_id}
+    for name in names:
+        row[name] = params.get(name)
+    for m in RESULT_METRICS:
+        v = summary.get(m, 0)
+        row[m] = round(v, 6) if isinstance(v, float) and math.isfinite(v) else v
+    row["error"] = summary.get("error", "")
+    return row
+
+
+# ============================================================
+# API PRINCIPAL
+# ============================================================
+
+def run_sweep(
+    candles_by_coin: Dict[str, Dict[str, np.ndarray]],
+    grid: Dict[str, List[Any]],
+    out_path: str,
+    config: Optional[Dict[str, Any]] = None,
+    processes: int = 2,
+    max_combos: int = 0,
+    seed: int = 0,
+) -> Dict[str, Any]:
+    cfg = bt.resolve_config(config)
+    combos = iter_grid(grid, max_combos=max_combos, seed=seed)
+    names = list(grid.keys())
+    processes = max(1, int(processes))
+    started = time.time()
+    done = 0
+    best: Optional[Dict[str, Any]] = None
+
+    shm, layout = _pack_candles(candles_by_coin)
+    try:
+        with open(out_path, "w", newline="") as fh, ProcessPoolExecutor(
+            max_workers=processes, initializer=_worker_init, initargs=(layout, cfg)
+        ) as pool:
+            writer = csv.DictWriter(fh, fieldnames=["combo_id"] + names + list(RESULT_METRICS) + ["error"])
+            writer.writeheader()
+            fh.flush()
+
+            tasks: Iterator[Tuple[int, Dict[str, Any]]] = iter(enumerate(combos))
+            pending = set()
+            for task in itertools.islice(tasks, processes * MAX_INFLIGHT_PER_WORKER):
+                pending.add(pool.submit(_run_combo, task))
+
+            while pending:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    combo_id, params, summary = fut.result()
+                    row = _result_row(combo_id, params, summary, names)
+                    writer.writerow(row)
+                    fh.flush()
+                    done += 1
+                    if not row["error"] and (best is None or row["expectancy_pct"] > best["expectancy_pct"]):
+                        best = row
+                    nxt = next(tasks, None)
+                    if nxt is not None:
+                        pending.add(pool.submit(_run_combo, nxt))
+                if done and done % 50 == 0:
+                    log(f"{done}/{len(combos)} combos elapsed_s={round(time.time() - started, 1)}")
+    finally:
+        shm.close()
+        shm.unlink()
+
+    elapsed = time.time() - started
+    log(f"sweep terminado combos={done} elapsed_s={round(elapsed, 1)} out={out_path}")
+    return {"combos": done, "elapsed_s": round(elapsed, 3), "best": best, "out": out_path}
+
+
+# ============================================================
+# CLI
+# ============================================================
+
+def main(argv: Optional[Iterable[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description="Barrido de constantes de strategy sobre velas 5m guardadas")
+    ap.add_argument("--data", required=True, help="directorio con <COIN>.csv (t,o,h,l,c,v)")
+    ap.add_argument("--grid", required=True, help='JSON {"ADX_MIN": [16, 18, 20], ...}')
+    ap.add_argument("--out", required=True, help="CSV de resultados")
+    ap.add_argument("--coins", default="")
+    ap.add_argument("--processes", type=int, default=2)
+    ap.add_argument("--max-combos", type=int, default=0, help="muestra aleatoria del grid (0 = todo)")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args(list(argv) if argv is not None else None)
+
+    with open(args.grid) as fh:
+        grid = json.load(fh)
+    coins = [x for x in args.coins.split(",") if x.strip()] or None
+    data = bt.load_candles_dir(args.data, coins)
+    res = run_sweep(data, grid, args.out, processes=args.processes, max_combos=args.max_combos, seed=args.seed)
+    if res["best"]:
+        log(f"mejor expectancy: {res['best']}")
+
+
+if __name__ == "__main__":
+    main()
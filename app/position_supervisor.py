@@ -0,0 +1,404 @@
+# ============================================================
+# POSITION SUPERVISOR – Trading X Hyper Pro
+# Un solo supervisor para todas las posiciones abiertas
+#
+# - Un thread "driver" lee el tablero de precios (allMids) una vez
+#   por tick y reparte ese mismo precio a todas las sesiones.
+# - Las tareas periódicas (sync de size con el exchange) se agendan
+#   en un heap de timers, no con sleeps por trade.
+# - El trabajo de cada sesión (persistencia, órdenes, cierre) corre
+#   en un pool fijo de workers. Una sesión nunca tiene más de un job
+#   en vuelo: si sigue ocupada, ese tick se salta (gana el precio más
+#   reciente en el siguiente).
+# - finish() (cancel + cierre a mercado + registro, con esperas de red)
+#   corre en un executor propio (SUPERVISOR_CLOSE_WORKERS): con muchas
+#   salidas a la vez los cierres no hacen cola detrás de los ticks ni
+#   ocupan los workers de las demás sesiones.
+# - Sesiones con trigger_levels(): sus niveles van a un TriggerIndex por
+#   coin y solo se despiertan si el precio cruzó un nivel, toca sync o
+#   venció su wake_ts. El costo por tick es O(log n + cruzados) por coin
+#   en vez de O(posiciones abiertas).
+# - Cadencia adaptativa (SUPERVISOR_ADAPTIVE): el próximo tick y el
+#   próximo sync de cada sesión se eligen por distancia al nivel más
+#   cercano (trigger / stop en exchange) y la volatilidad reciente del
+#   coin, entre un mínimo (la cadencia fija de antes) y un máximo.
+#   Los intervalos elegidos quedan en stats()["cadence"] y en el log.
+#
+# Contrato de sesión (ver _TradeManagerSession en trading_engine):
+#   session.coin                         -> coin del tablero
+#   session.sync_interval                -> segundos entre syncs (0 = sin sync)
+#   session.tick(price, now_ts, sync)    -> True cuando la posición terminó
+#   session.finish()                     -> cierre/registro (una sola vez)
+#   session.trigger_levels()             -> opcional: (arriba, abajo, wake_ts)
+#                                           o None = procesar todos los ticks
+#   session.stop_price()                 -> opcional: stop vivo en el exchange
+#                                           (0.0 = desconocido; sync a cadencia fija)
+# ============================================================
+
+from __future__ import annotations
+
+import heapq
+import itertools
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.adaptive_cadence import VolatilityTracker, interval_for_distance
+from app.trigger_index import TriggerIndex
+
+# ============================================================
+# CONFIG
+# ============================================================
+
+SUPERVISOR_TICK_SECONDS = float(os.getenv("SUPERVISOR_TICK_SECONDS", "0.4"))
+SUPERVISOR_WORKERS = int(os.getenv("SUPERVISOR_WORKERS", "4"))
+SUPERVISOR_CLOSE_WORKERS = int(os.getenv("SUPERVISOR_CLOSE_WORKERS", "32"))
+SUPERVISOR_ADAPTIVE = os.getenv("SUPERVISOR_ADAPTIVE", "1").strip().lower() in ("1", "true", "yes")
+SUPERVISOR_TICK_MAX_SECONDS = float(os.getenv("SUPERVISOR_TICK_MAX_SECONDS", "2.0"))
+POSITION_SYNC_MAX_SECONDS = float(os.getenv("POSITION_SYNC_MAX_SECONDS", "10.0"))
+CADENCE_LOG_SECONDS = float(os.getenv("CADENCE_LOG_SECONDS", "60"))
+
+
+def log(msg: str, level: str = "INFO"):
+    print(f"[SUPERVISOR {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')}] {level} {msg}")
+
+
+# ============================================================
+# SUPERVISOR
+# ============================================================
+
+class PositionSupervisor:
+    def __init__(
+        self,
+        *,
+        price_board: Callable[[], Dict[str, float]],
+        tick_seconds: float = SUPERVISOR_TICK_SECONDS,
+        workers: int = SUPERVISOR_WORKERS,
+        close_workers: int = SUPERVISOR_CLOSE_WORKERS,
+        name: str = "pos-supervisor",
+        adaptive: bool = SUPERVISOR_ADAPTIVE,
+        tick_max_seconds: float = SUPERVISOR_TICK_MAX_SECONDS,
+        sync_max_seconds: float = POSITION_SYNC_MAX_SECONDS,
+    ):
+        self._price_board = price_board
+        self._tick_seconds = max(0.05, float(tick_seconds))
+        self._adaptive = bool(adaptive)
+        self._tick_max_seconds = max(self._tick_seconds, float(tick_max_seconds))
+        self._sync_max_seconds = float(sync_max_seconds)
+        self._workers = max(1, int(workers))
+        self._close_workers = max(1, int(close_workers))
+        self._name = name
+
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._sessions: Dict[Any, Any] = {}
+        self._meta: Dict[Any, Dict[str, Any]] = {}
+        self._busy: set = set()
+        self._sync_due: set = set()
+        self._wake_due: set = set()
+        self._wake_at: Dict[Any, float] = {}
+        # Sesiones sin niveles (o que aún no corrieron su primer tick): van en cada tick.
+        self._every_tick: set = set()
+        self._triggers = TriggerIndex()
+        self._vol = VolatilityTracker()
+        self._cadence: Dict[str, Any] = {"tick_s": self._tick_seconds, "coins": {}, "sync_s": {}}
+        self._cadence_logged_at = 0.0
+        self._timers: List[Tuple[float, int, Any, str]] = []
+        self._seq = itertools.count()
+        self._driver: Optional[threading.Thread] = None
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._closer: Optional[ThreadPoolExecutor] = None
+        self._closing: set = set()
+
+        self._stats = {"ticks": 0, "jobs": 0, "skipped_busy": 0, "skipped_idle": 0, "board_errors": 0, "session_errors": 0, "finishes": 0}
+
+    # --------------------------------------------------------
+    # Registro
+    # --------------------------------------------------------
+
+    def register(self, key: Any, session: Any, meta: Optional[Dict[str, Any]] = None) -> bool:
+        """Agrega una sesión. Retorna False si ya hay una viva para esa key."""
+        with self._lock:
+            if key in self._sessions:
+                return False
+            self._sessions[key] = session
+            self._meta[key] = dict(meta or {}, started_at=datetime.utcnow().isoformat())
+            # El primer sync se hace en el primer tick (igual que el loop por thread).
+            self._sync_due.add(key)
+            self._every_tick.add(key)
+            self._ensure_running_locked()
+        self._wake.set()
+        return True
+
+    def request_sync(self, key: Any) -> bool:
+        """Fuerza un sync de la sesión en el próximo tick (p.ej. tras cerrar la posición desde afuera)."""
+        with self._lock:
+            if key not in self._sessions:
+                return False
+            self._sync_due.add(key)
+        self._wake.set()
+        return True
+
+    def is_running(self, key: Any) -> bool:
+        with self._lock:
+            return key in self._sessions
+
+    def keys(self) -> List[Any]:
+        with self._lock:
+            return list(self._sessions.keys())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out = dict(self._stats)
+            out["sessions"] = len(self._sessions)
+            out["busy"] = len(self._busy)
+            out["closing"] = len(self._closing)
+            out["timers"] = len(self._timers)
+            out["every_tick"] = len(self._every_tick)
+            out["triggers"] = self._triggers.stats()
+            out["cadence"] = {
+                "adaptive": self._adaptive,
+                "tick_s": self._cadence["tick_s"],
+                "coins": {c: dict(v) for c, v in self._cadence["coins"].items()},
+                "sync_s": dict(self._cadence["sync_s"]),
+            }
+            out["meta"] = {k: dict(v) for k, v in self._meta.items()}
+        return out
+
+    def _drop_locked(self, key: Any) -> None:
+        self._sessions.pop(key, None)
+        self._meta.pop(key, None)
+        self._busy.discard(key)
+        self._closing.discard(key)
+        self._sync_due.discard(key)
+        self._wake_due.discard(key)
+        self._wake_at.pop(key, None)
+        self._every_tick.discard(key)
+        self._triggers.remove(key)
+        self._cadence["sync_s"].pop(key, None)
+
+    # --------------------------------------------------------
+    # Driver
+    # --------------------------------------------------------
+
+    def _ensure_running_locked(self) -> None:
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix=f"{self._name}-w")
+        if self._closer is None:
+            self._closer = ThreadPoolExecutor(max_workers=self._close_workers, thread_name_prefix=f"{self._name}-close")
+        if self._driver is None or not self._driver.is_alive():
+            self._driver = threading.Thread(target=self._run, name=self._name, daemon=True)
+            self._driver.start()
+
+    def _schedule_locked(self, key: Any, due_ts: float, kind: str = "sync") -> None:
+        heapq.heappush(self._timers, (float(due_ts), next(self._seq), key, kind))
+
+    def _pop_due_timers_locked(self, now_ts: float) -> None:
+        while self._timers and self._timers[0][0] <= now_ts:
+            due_ts, _, key, kind = heapq.heappop(self._timers)
+            if key not in self._sessions:
+                continue
+            if kind == "sync":
+                self._sync_due.add(key)
+            elif self._wake_at.get(key) == due_ts:
+                # Wake reprogramado después: la entrada vieja del heap se ignora.
+                self._wake_at.pop(key, None)
+                self._wake_due.add(key)
+
+    def _due_keys_locked(self, board: Dict[str, float]) -> set:
+        due = set(self._every_tick)
+        due |= self._sync_due
+        due |= self._wake_due
+        for coin in self._triggers.coins():
+            due |= self._triggers.crossed(coin, float(board.get(coin, 0.0) or 0.0))
+        return due
+
+    def _apply_levels(self, key: Any, session: Any) -> None:
+        """Tras un tick: registra los niveles nuevos de la sesión en el índice."""
+        levels_fn = getattr(session, "trigger_levels", None)
+        try:
+            levels = levels_fn() if levels_fn is not None else None
+        except Exception as e:
+            levels = None
+            log(f"trigger_levels error key={key} err={e}", "WARN")
+        with self._lock:
+            if self._sessions.get(key) is not session:
+                return
+            if levels is None:
+                self._every_tick.add(key)
+                self._triggers.remove(key)
+                return
+            up, down, wake_ts = levels
+            self._every_tick.discard(key)
+            self._triggers.set_levels(key, getattr(session, "coin", ""), up, down)
+            if wake_ts is not None and self._wake_at.get(key) != float(wake_ts):
+                self._wake_at[key] = float(wake_ts)
+                self._schedule_locked(key, float(wake_ts), kind="wake")
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                if not self._sessions:
+                    # Sin posiciones: el driver termina; register() lo relanza.
+                    self._driver = None
+                    self._timers.clear()
+                    self._cadence["coins"].clear()
+                    return
+
+            started = time.time()
+            try:
+                board = self._price_board() or {}
+            except Exception as e:
+                board = {}
+                with self._lock:
+                    self._stats["board_errors"] += 1
+                log(f"price board error err={e}", "WARN")
+
+            now_ts = time.time()
+            jobs: List[Tuple[Any, Any, float, bool]] = []
+            with self._lock:
+                self._stats["ticks"] += 1
+                if self._adaptive:
+                    for coin in {getattr(sess, "coin", "") for sess in self._sessions.values()}:
+                        self._vol.observe(coin, float(board.get(coin, 0.0) or 0.0), now_ts)
+                self._pop_due_timers_locked(now_ts)
+                due_keys = self._due_keys_locked(board)
+                self._stats["skipped_idle"] += len(self._sessions) - len(due_keys)
+                for key in due_keys:
+                    session = self._sessions.get(key)
+                    if session is None:
+                        continue
+                    if key in self._busy:
+                        self._stats["skipped_busy"] += 1
+                        continue
+                    self._wake_due.discard(key)
+                    do_sync = key in self._sync_due
+                    price = float(board.get(getattr(session, "coin", ""), 0.0) or 0.0)
+                    if do_sync:
+                        self._sync_due.discard(key)
+                        interval = self._sync_interval_locked(key, session, price)
+                        if interval > 0:
+                            self._schedule_locked(key, now_ts + interval)
+                    self._busy.add(key)
+                    jobs.append((key, session, price, do_sync))
+                self._stats["jobs"] += len(jobs)
+                pool = self._pool
+
+            for key, session, price, do_sync in jobs:
+                pool.submit(self._run_job, key, session, price, now_ts, do_sync)
+
+            # Primero la cadencia mínima (los jobs de este tick re-registran sus niveles);
+            # después, con los niveles al día, el resto del intervalo adaptativo.
+            self._wake.clear()
+            if self._wake.wait(max(0.0, self._tick_seconds - (time.time() - started))):
+                continue
+            if not self._adaptive:
+                continue
+            with self._lock:
+                interval = self._tick_interval_locked(board, time.time())
+            rest = interval - (time.time() - started)
+            if rest > 0:
+                self._wake.wait(rest)
+
+    # --------------------------------------------------------
+    # Cadencia adaptativa
+    # --------------------------------------------------------
+
+    def _tick_interval_locked(self, board: Dict[str, float], now_ts: float) -> float:
+        """Próximo tick: el mínimo entre coins indexados, timers pendientes y sesiones de cada tick."""
+        interval = self._tick_max_seconds
+        if self._every_tick or self._busy:
+            interval = self._tick_seconds
+        coins: Dict[str, Dict[str, Any]] = {}
+        for coin in self._triggers.coins():
+            price = float(board.get(coin, 0.0) or 0.0)
+            dist = self._triggers.nearest(coin, price)
+            sigma = self._vol.sigma(coin)
+            iv = interval_for_distance(dist, sigma, min_s=self._tick_seconds, max_s=self._tick_max_seconds)
+            coins[coin] = {
+                "interval_s": round(iv, 3),
+                "dist_pct": round(dist * 100.0, 4) if dist is not None else None,
+                "sigma_pct": round(sigma * 100.0, 5) if sigma is not None else None,
+            }
+            interval = min(interval, iv)
+        if self._timers:
+            interval = min(interval, max(self._tick_seconds, self._timers[0][0] - now_ts))
+        self._cadence["tick_s"] = round(interval, 3)
+        self._cadence["coins"] = coins
+        if CADENCE_LOG_SECONDS > 0 and (now_ts - self._cadence_logged_at) >= CADENCE_LOG_SECONDS:
+            self._cadence_logged_at = now_ts
+            syncs = sorted(self._cadence["sync_s"].values())
+            log(
+                f"cadence tick_s={self._cadence['tick_s']} coins={coins} "
+                f"sync_s_min={syncs[0] if syncs else None} sync_s_max={syncs[-1] if syncs else None} sessions={len(self._sessions)}"
+            )
+        return interval
+
+    def _sync_interval_locked(self, key: Any, session: Any, price: float) -> float:
+        """Próximo sync: más espaciado cuanto más lejos está el stop vivo en el exchange."""
+        base = float(getattr(session, "sync_interval", 0.0) or 0.0)
+        if base <= 0 or not self._adaptive:
+            return base
+        stop_fn = getattr(session, "stop_price", None)
+        try:
+            stop = float(stop_fn() or 0.0) if stop_fn is not None else 0.0
+        except Exception:
+            stop = 0.0
+        if stop <= 0 or price <= 0:
+            interval = base
+        else:
+            dist = abs(price - stop) / price
+            interval = interval_for_distance(
+                dist,
+                self._vol.sigma(getattr(session, "coin", "")),
+                min_s=base,
+                max_s=max(base, self._sync_max_seconds),
+            )
+        self._cadence["sync_s"][key] = round(interval, 3)
+        return interval
+
+    def _run_job(self, key: Any, session: Any, price: float, now_ts: float, do_sync: bool) -> None:
+        done = False
+        handed_off = False
+        try:
+            done = bool(session.tick(price, now_ts, do_sync))
+            if done:
+                # El cierre va al executor propio; la sesión sigue "busy" hasta que termine.
+                with self._lock:
+                    self._closing.add(key)
+                    closer = self._closer
+                closer.submit(self._finish_job, key, session)
+                handed_off = True
+        except Exception as e:
+            # Igual que la muerte de un thread de manager: la sesión sale del
+            # supervisor y el watchdog la relanza desde el estado persistido.
+            done = True
+            with self._lock:
+                self._stats["session_errors"] += 1
+            log(f"session error key={key} err={e}\n{traceback.format_exc()}", "CRITICAL")
+        finally:
+            if not handed_off:
+                if not done:
+                    self._apply_levels(key, session)
+                with self._lock:
+                    if done and self._sessions.get(key) is session:
+                        self._drop_locked(key)
+                    else:
+                        self._busy.discard(key)
+
+    def _finish_job(self, key: Any, session: Any) -> None:
+        try:
+            session.finish()
+        except Exception as e:
+            with self._lock:
+                self._stats["session_errors"] += 1
+            log(f"session finish error key={key} err={e}\n{traceback.format_exc()}", "CRITICAL")
+        finally:
+            with self._lock:
+                self._stats["finishes"] += 1
+                if self._sessions.get(key) is session:
+                    self._drop_locked(key)
@@ -0,0 +1,360 @@
+# ============================================================
+# PRICE RULES – Trading X Hyper Pro
+# Reglas de precio/tamaño por asset (fuente única)
+#
+# Reglas de Hyperliquid (perps):
+# - Tamaño: múltiplo de 10^-szDecimals.
+# - Precio: máximo 5 cifras significativas y máximo
+#   (6 - szDecimals) decimales. Un precio entero siempre es válido.
+# - Si la meta trae tickSz, el precio además debe ser múltiplo del tick.
+#
+# Con estas reglas el trigger de un stop se calcula válido de una vez
+# (dirección de redondeo + buffer vs precio actual), sin escalera de
+# reintentos contra /exchange.
+#
+# Cuantizadores: PriceRules se construye una vez por asset (refresh de
+# meta) con el tick como entero escalado y formatea con aritmética
+# entera: float -> (mantisa, exponente) desde repr, división entera con
+# el redondeo pedido y un formateador de punto fijo. El camino Decimal
+# (_reference_*) queda como referencia; verify_against_reference()
+# compara ambos sobre muestras aleatorias.
+# ============================================================
+
+from __future__ import annotations
+
+import argparse
+import random
+from datetime import datetime
+from decimal import Decimal, ROUND_DOWN, ROUND_UP, InvalidOperation
+from typing import Iterable, List, Optional, Tuple
+
+MAX_DECIMALS_PERP = 6
+MAX_SIG_FIGS = 5
+
+_ONE = Decimal("1")
+_POW10 = [10 ** i for i in range(64)]
+
+
+def log(msg: str, level: str = "INFO"):
+    print(f"[PRICE_RULES {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')}] {level} {msg}")
+
+
+# ============================================================
+# ARITMÉTICA ENTERA
+# ============================================================
+
+def _pow10(n: int) -> int:
+    return _POW10[n] if n < 64 else 10 ** n
+
+
+def _split(x: float) -> Optional[Tuple[bool, int, int]]:
+    """float -> (negativo, mantisa, exponente) exactos de repr(x), como Decimal(str(x)).
+    None si no es finito."""
+    s = repr(float(x))
+    neg = s[0] == "-"
+    if neg:
+        s = s[1:]
+    exp = 0
+    if "e" in s:
+        s, e = s.split("e")
+        exp = int(e)
+    ip, _, fp = s.partition(".")
+    try:
+        return neg, int(ip + fp), exp - len(fp)
+    except ValueError:
+        return None                          # inf / nan
+
+
+def _rescale(mant: int, exp: int, decimals: int, up: bool) -> int:
+    """mant*10^exp llevado a entero en escala 10^-decimals (magnitud; up = lejos de cero)."""
+    shift = exp + decimals
+    if shift >= 0:
+        return mant * _pow10(shift)
+    div = _pow10(-shift)
+    q, r = divmod(mant, div)
+    return q + 1 if (up and r) else q
+
+
+def _fixed(scaled: int, decimals: int, neg: bool = False) -> str:
+    """Entero en escala 10^-decimals -> string sin ceros finales (igual que format(Decimal,'f') + strip)."""
+    if decimals <= 0:
+        s = str(scaled)
+    else:
+        digits = str(scaled).rjust(decimals + 1, "0")
+        ip = digits[:-decimals]
+        fp = digits[-decimals:].rstrip("0")
+        s = f"{ip}.{fp}" if fp else ip
+    return f"-{s}" if neg else s
+
+
+# ============================================================
+# REFERENCIA DECIMAL
+# ============================================================
+
+def _strip_trailing_zeros(num_str: str) -> str:
+    if "." not in num_str:
+        return num_str
+    num_str = num_str.rstrip("0").rstrip(".")
+    return num_str if num_str else "0"
+
+
+def _to_decimal(x: float) -> Decimal:
+    return Decimal(str(x))
+
+
+def _quant(decimals: int) -> Decimal:
+    return _ONE if decimals <= 0 else _ONE.scaleb(-decimals)
+
+
+def _reference_price_decimals(d: Decimal, max_price_decimals: int) -> int:
+    int_digits = d.adjusted() + 1
+    if int_digits >= MAX_SIG_FIGS:
+        return 0
+    return max(0, min(max_price_decimals, MAX_SIG_FIGS - int_digits))
+
+
+def _reference_format_price(px: float, sz_decimals: int, tick_size: float, round_up: bool) -> str:
+    max_price_decimals = max(0, MAX_DECIMALS_PERP - int(sz_decimals or 0))
+    rnd = ROUND_UP if round_up else ROUND_DOWN
+    try:
+        d = _to_decimal(px)
+        if d <= 0:
+            return "0"
+        if tick_size and tick_size > 0:
+            d_tick = _to_decimal(tick_size)
+            ticks = (d / d_tick).to_integral_value(rounding=rnd)
+            out = (ticks * d_tick).quantize(d_tick, rounding=rnd)
+            if out <= 0:
+                return "0"
+            allowed = _reference_price_decimals(out, max_price_decimals)
+            if -out.normalize().as_tuple().exponent > allowed:
+                out = out.quantize(_quant(allowed), rounding=rnd)
+            return _strip_trailing_zeros(format(out, "f"))
+        out = d.quantize(_quant(_reference_price_decimals(d, max_price_decimals)), rounding=rnd)
+        return _strip_trailing_zeros(format(out, "f"))
+    except (InvalidOperation, Exception):
+        return "0"
+
+
+def _reference_format_size(sz: float, sz_decimals: int, round_up: bool) -> str:
+    try:
+        d = _to_decimal(sz)
+        out = d.quantize(_quant(int(sz_decimals or 0)), rounding=ROUND_UP if round_up else ROUND_DOWN)
+        return _strip_trailing_zeros(format(out, "f"))
+    except (InvalidOperation, Exception):
+        return "0"
+
+
+# ============================================================
+# REGLAS POR ASSET
+# ============================================================
+
+class PriceRules:
+    __slots__ = ("asset", "coin", "sz_decimals", "tick_size", "max_price_decimals", "_tick_int", "_tick_decimals")
+
+    def __init__(self, *, sz_decimals: int, tick_size: float = 0.0, asset: Optional[int] = None, coin: str = ""):
+        self.asset = asset
+        self.coin = coin
+        self.sz_decimals = max(0, int(sz_decimals or 0))
+        try:
+            tick = float(tick_size or 0.0)
+        except Exception:
+            tick = 0.0
+        self.tick_size = tick if tick > 0 and _split(tick) is not None else 0.0
+        self.max_price_decimals = max(0, MAX_DECIMALS_PERP - self.sz_decimals)
+
+        # Tick como entero escalado: tick = _tick_int * 10^-_tick_decimals
+        self._tick_int = 0
+        self._tick_decimals = 0
+        if self.tick_size > 0:
+            _, mant, exp = _split(self.tick_size)
+            while mant and mant % 10 == 0:
+                mant //= 10
+                exp += 1
+            if exp >= 0:
+                mant, exp = mant * _pow10(exp), 0
+            self._tick_int = mant
+            self._tick_decimals = -exp
+
+    def __repr__(self) -> str:
+        return (
+            f"PriceRules(coin={self.coin!r}, asset={self.asset}, sz_decimals={self.sz_decimals}, "
+            f"tick_size={self.tick_size}, max_price_decimals={self.max_price_decimals})"
+        )
+
+    # --------------------------------------------------------
+    # Precio
+    # --------------------------------------------------------
+
+    def _allowed_decimals(self, mant: int, exp: int) -> int:
+        """Decimales permitidos para mant*10^exp (cifras significativas + máx decimales)."""
+        int_digits = len(str(mant)) + exp       # 12.3 -> 2, 0.0123 -> -1
+        if int_digits >= MAX_SIG_FIGS:
+            return 0
+        return max(0, min(self.max_price_decimals, MAX_SIG_FIGS - int_digits))
+
+    def price_decimals(self, px: float) -> int:
+        parts = _split(px)
+        if parts is None or parts[0] or parts[1] == 0:
+            return 0
+        return self._allowed_decimals(parts[1], parts[2])
+
+    def format_price(self, px: float, *, round_up: bool) -> str:
+        """
+        Precio válido para el exchange.
+        - round_up=True (BUY): hacia arriba. round_up=False (SELL): hacia abajo.
+        - Con tick: múltiplo exacto del tick y, si aún sobran cifras
+          significativas, se recorta en la misma dirección.
+        """
+        try:
+            parts = _split(px)
+        except Exception:
+            return "0"
+        if parts is None:
+            return "0"
+        neg, mant, exp = parts
+        if neg or mant == 0:
+            return "0"
+
+        if self._tick_int:
+            td = self._tick_decimals
+            # nº de ticks = (mant*10^exp) / (tick_int*10^-td)
+            shift = exp + td
+            if shift >= 0:
+                num, den = mant * _pow10(shift), self._tick_int
+            else:
+                num, den = mant, self._tick_int * _pow10(-shift)
+            ticks, rem = divmod(num, den)
+            if round_up and rem:
+                ticks += 1
+            scaled = ticks * self._tick_int            # escala 10^-td
+            if scaled == 0:
+                return "0"
+            # decimales efectivos (sin ceros finales) vs permitidos
+            v, dec = scaled, td
+            while dec > 0 and v % 10 == 0:
+                v //= 10
+                dec -= 1
+            allowed = self._allowed_decimals(v, -dec)
+            if dec > allowed:
+                return _fixed(_rescale(v, -dec, allowed, round_up), allowed)
+            return _fixed(v, dec)
+
+        allowed = self._allowed_decimals(mant, exp)
+        return _fixed(_rescale(mant, exp, allowed, round_up), allowed)
+
+    # --------------------------------------------------------
+    # Tamaño
+    # --------------------------------------------------------
+
+    def format_size(self, sz: float, *, round_up: bool = False) -> str:
+        try:
+            parts = _split(sz)
+        except Exception:
+            return "0"
+        if parts is None:
+            return "0"
+        neg, mant, exp = parts
+        return _fixed(_rescale(mant, exp, self.sz_decimals, round_up), self.sz_decimals, neg)
+
+    # --------------------------------------------------------
+    # Stop loss
+    # --------------------------------------------------------
+
+    def stop_trigger(self, raw_trigger: float, *, direction: str, current_px: float = 0.0, buffer_pct: float = 0.0) -> str:
+        """
+        Trigger de SL válido al primer intento.
+        - LONG: SL es SELL -> redondeo hacia abajo, y nunca por encima de
+          current*(1-buffer).
+        - SHORT: SL es BUY -> redondeo hacia arriba, y nunca por debajo de
+          current*(1+buffer).
+        Devuelve "0" si no se puede calcular.
+        """
+        try:
+            px = float(raw_trigger or 0.0)
+            cur = float(current_px or 0.0)
+            buf = max(0.0, float(buffer_pct or 0.0))
+        except Exception:
+            return "0"
+        if px <= 0:
+            return "0"
+
+        is_short = str(direction or "").lower() == "short"
+        if cur > 0:
+            if is_short:
+                px = max(px, cur * (1.0 + buf))
+            else:
+                px = min(px, cur * (1.0 - buf))
+        if px <= 0:
+            return "0"
+        return self.format_price(px, round_up=is_short)
+
+
+# ============================================================
+# VERIFICACIÓN
+# ============================================================
+
+_VERIFY_TICKS = (0.0, 0.0, 1.0, 0.5, 0.1, 0.05, 0.01, 0.001, 0.0001, 0.25, 5.0, 1e-05)
+
+
+def _random_value(rng: random.Random, lo_exp: float, hi_exp: float) -> float:
+    v = 10 ** rng.uniform(lo_exp, hi_exp)
+    kind = rng.random()
+    if kind < 0.4:
+        return float(f"{v:.{rng.randint(1, 8)}g}")      # precios "redondos" tipo exchange
+    if kind < 0.5:
+        return float(round(v))
+    return v                                             # float arbitrario (17 dígitos)
+
+
+def verify_against_reference(samples: int = 100000, seed: int = 7) -> List[Tuple]:
+    """Compara los cuantizadores enteros con el camino Decimal. Devuelve las diferencias."""
+    rng = random.Random(seed)
+    mismatches: List[Tuple] = []
+    for _ in range(int(samples)):
+        szd = rng.randint(0, 6)
+        tick = rng.choice(_VERIFY_TICKS)
+        rules = PriceRules(sz_decimals=szd, tick_size=tick)
+        up = rng.random() < 0.5
+
+        px = _random_value(rng, -7, 7)
+        got = rules.format_price(px, round_up=up)
+        ref = _reference_format_price(px, szd, tick, up)
+        if got != ref:
+            mismatches.append(("price", px, szd, tick, up, got, ref))
+
+        sz = _random_value(rng, -8, 6)
+        if rng.random() < 0.05:
+            sz = -sz
+        got = rules.format_size(sz, round_up=up)
+        ref = _reference_format_size(sz, szd, up)
+        if got != ref:
+            mismatches.append(("size", sz, szd, up, got, ref))
+    for edge in (0.0, -0.0, -1.0, float("inf"), float("nan")):
+        for up in (False, True):
+            rules = PriceRules(sz_decimals=2, tick_size=0.01)
+            if rules.format_price(edge, round_up=up) != _reference_format_price(edge, 2, 0.01, up):
+                mismatches.append(("price_edge", edge, up))
+    return mismatches
+
+
+# ============================================================
+# CLI
+# ============================================================
+
+def main(argv: Optional[Iterable[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description="Verifica los cuantizadores enteros contra el camino Decimal")
+    ap.add_argument("--samples", type=int, default=100000)
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args(list(argv) if argv is not None else None)
+
+    mismatches = verify_against_reference(args.samples, args.seed)
+    for m in mismatches[:20]:
+        log(f"diferencia {m}", "ERROR")
+    log(f"verificación samples={args.samples} seed={args.seed} diferencias={len(mismatches)}")
+    if mismatches:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
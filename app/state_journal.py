@@ -0,0 +1,231 @@
+# ============================================================
+# STATE JOURNAL – Trading X Hyper Pro
+# Journal append-only para el fallback en disco del active trade
+#
+# - Un solo archivo; cada registro es [len u32][crc32 u32][json]
+#   con {"u": user_id, "s": seq, "op": "set"|"patch"|"del", "d": diff}.
+# - Al abrir se hace replay completo y se construye un índice en
+#   memoria (user_id -> estado); las lecturas salen de ese índice.
+# - Un registro cortado o corrupto al final (crash a mitad de write)
+#   se descarta y el archivo se trunca en el último registro válido.
+# - Compactación: cuando el journal crece más de COMPACT_RATIO veces
+#   el tamaño del estado vivo, se reescribe como un snapshot (un "set"
+#   por usuario) vía tmp + fsync + os.replace.
+# ============================================================
+
+from __future__ import annotations
+
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+# ============================================================
+# CONFIG
+# ============================================================
+
+JOURNAL_FSYNC_INTERVAL = float(os.getenv("STATE_JOURNAL_FSYNC_INTERVAL", "0.5"))   # 0 = fsync en cada append
+JOURNAL_COMPACT_MIN_BYTES = int(os.getenv("STATE_JOURNAL_COMPACT_MIN_BYTES", str(4 * 1024 * 1024)))
+JOURNAL_COMPACT_RATIO = float(os.getenv("STATE_JOURNAL_COMPACT_RATIO", "4.0"))
+
+_HEADER = struct.Struct(">II")
+_MAX_RECORD_BYTES = 16 * 1024 * 1024
+
+
+def log(msg: str, level: str = "INFO"):
+    print(f"[JOURNAL {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')}] {level} {msg}")
+
+
+def _encode(record: Dict[str, Any]) -> bytes:
+    body = json.dumps(record, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+    return _HEADER.pack(len(body), zlib.crc32(body) & 0xFFFFFFFF) + body
+
+
+def _iter_records(buf: bytes) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """Yield (offset_fin, record) hasta el primer registro inválido."""
+    pos = 0
+    n = len(buf)
+    while pos + _HEADER.size <= n:
+        length, crc = _HEADER.unpack_from(buf, pos)
+        start = pos + _HEADER.size
+        end = start + length
+        if length > _MAX_RECORD_BYTES or end > n:
+            return
+        body = buf[start:end]
+        if (zlib.crc32(body) & 0xFFFFFFFF) != crc:
+            return
+        try:
+            record = json.loads(body.decode("utf-8"))
+        except Exception:
+            return
+        if not isinstance(record, dict):
+            return
+        yield end, record
+        pos = end
+
+
+# ============================================================
+# JOURNAL
+# ============================================================
+
+class StateJournal:
+    def __init__(self, path: str):
+        self.path = os.path.abspath(path)
+        self._lock = threading.Lock()
+        self._index: Dict[int, Dict[str, Any]] = {}
+        self._seq: Dict[int, int] = {}
+        self._fh = None
+        self._bytes = 0
+        self._next_compact_check = JOURNAL_COMPACT_MIN_BYTES
+        self._last_fsync = 0.0
+        self._replay()
+
+    # --------------------------------------------------------
+    # Replay / apertura
+    # --------------------------------------------------------
+
+    def _apply(self, record: Dict[str, Any]) -> None:
+        try:
+            uid = int(record.get("u"))
+        except Exception:
+            return
+        op = record.get("op")
+        seq = int(record.get("s") or 0)
+        if op == "del":
+            self._index.pop(uid, None)
+        elif op == "set":
+            self._index[uid] = dict(record.get("d") or {})
+        elif op == "patch":
+            # Un patch sin estado previo (usuario ya borrado) no crea un doc parcial.
+            if uid not in self._index:
+                return
+            self._index[uid].update(record.get("d") or {})
+        else:
+            return
+        self._seq[uid] = max(self._seq.get(uid, 0), seq)
+
+    def _replay(self) -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        started = time.time()
+        valid_end = 0
+        records = 0
+        size = 0
+        if os.path.exists(self.path):
+            with open(self.path, "rb") as fh:
+                buf = fh.read()
+            size = len(buf)
+            for valid_end, record in _iter_records(buf):
+                self._apply(record)
+                records += 1
+
+        self._fh = open(self.path, "ab")
+        if valid_end < size:
+            log(f"cola inválida descartada path={self.path} bytes={size - valid_end}", "WARN")
+            self._fh.truncate(valid_end)
+            self._fh.flush()
+            os.fsync(self._fh.fileno())
+        self._bytes = valid_end
+        log(
+            f"replay path={self.path} records={records} users={len(self._index)} "
+            f"bytes={valid_end} elapsed_ms={round((time.time() - started) * 1000.0, 1)}"
+        )
+
+    # --------------------------------------------------------
+    # API
+    # --------------------------------------------------------
+
+    def get(self, user_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            data = self._index.get(int(user_id))
+            return dict(data) if data is not None else None
+
+    def users(self) -> list:
+        with self._lock:
+            return list(self._index.keys())
+
+    def put(self, user_id: int, data: Dict[str, Any]) -> None:
+        """Reemplaza el estado completo del usuario."""
+        self._append(int(user_id), "set", dict(data or {}))
+
+    def patch(self, user_id: int, diff: Dict[str, Any]) -> None:
+        """Aplica un diff de campos sobre el estado del usuario (no-op si no tiene estado)."""
+        if not diff:
+            return
+        with self._lock:
+            known = int(user_id) in self._index
+        if known:
+            self._append(int(user_id), "patch", dict(diff))
+
+    def delete(self, user_id: int) -> None:
+        with self._lock:
+            known = int(user_id) in self._index
+        if known:
+            self._append(int(user_id), "del", {})
+
+    def _append(self, uid: int, op: str, data: Dict[str, Any]) -> None:
+        with self._lock:
+            seq = self._seq.get(uid, 0) + 1
+            record = {"u": uid, "s": seq, "op": op, "d": data}
+            raw = _encode(record)
+            # El índice guarda la forma persistida (post JSON) para que get()
+            # devuelva lo mismo antes y después de un replay.
+            self._apply(json.loads(raw[_HEADER.size:].decode("utf-8")))
+            self._fh.write(raw)
+            self._fh.flush()
+            self._bytes += len(raw)
+            now = time.time()
+            if op != "patch" or (now - self._last_fsync) >= JOURNAL_FSYNC_INTERVAL:
+                os.fsync(self._fh.fileno())
+                self._last_fsync = now
+            if self._bytes >= self._next_compact_check:
+                self._maybe_compact_locked()
+
+    # --------------------------------------------------------
+    # Compactación
+    # --------------------------------------------------------
+
+    def _maybe_compact_locked(self) -> None:
+        live = b"".join(
+            _encode({"u": uid, "s": self._seq.get(uid, 0), "op": "set", "d": data})
+            for uid, data in self._index.items()
+        )
+        threshold = max(JOURNAL_COMPACT_MIN_BYTES, JOURNAL_COMPACT_RATIO * len(live))
+        if self._bytes < threshold:
+            self._next_compact_check = int(threshold)
+            return
+        self._rewrite_locked(live)
+
+    def compact(self) -> None:
+        with self._lock:
+            live = b"".join(
+                _encode({"u": uid, "s": self._seq.get(uid, 0), "op": "set", "d": data})
+                for uid, data in self._index.items()
+            )
+            self._rewrite_locked(live)
+
+    def _rewrite_locked(self, live: bytes) -> None:
+        tmp_path = f"{self.path}.compact.tmp"
+        before = self._bytes
+        with open(tmp_path, "wb") as fh:
+            fh.write(live)
+            fh.flush()
+            os.fsync(fh.fileno())
+        self._fh.close()
+        os.replace(tmp_path, self.path)
+        self._fh = open(self.path, "ab")
+        self._bytes = len(live)
+        self._next_compact_check = int(max(JOURNAL_COMPACT_MIN_BYTES, JOURNAL_COMPACT_RATIO * len(live)))
+        self._last_fsync = time.time()
+        log(f"compact path={self.path} bytes {before} -> {self._bytes} users={len(self._index)}")
+
+    def close(self) -> None:
+        with self._lock:
+            if self._fh is not None:
+                self._fh.flush()
+                os.fsync(self._fh.fileno())
+                self._fh.close()
+                self._fh = None
@@ -1,6 +1,7 @@
 
 import os
 import time
+import threading
 from typing import Dict, Any, List, Optional, Tuple
 from app.hyperliquid_client import make_request, norm_coin
 
@@ -60,6 +61,76 @@ STRENGTH_MIN = 0.20
 STRENGTH_MAX = 0.97
 
 LOG_SIGNAL_DIAGNOSTICS = True
+# Diagnóstico de rechazos en la etapa breakout/retest (línea BLOCK en logs).
+# Si está apagado, el diag redondeado de un rechazo ni siquiera se construye.
+LOG_BLOCK_DIAGNOSTICS = os.getenv("LOG_BLOCK_DIAGNOSTICS", "true").strip().lower() == "true"
+
+# Pre-filtros con el contexto del scanner (sin velas). Apagados por defecto (0):
+# no se derivan de los filtros de velas (una variación 24h alta no implica que el
+# ATR% de 5m falle ATR_PCT_MAX), así que activarlos cambia qué símbolos dan señal.
+PRESCREEN_MIN_DAY_NTL_VLM = float(os.getenv("PRESCREEN_MIN_DAY_NTL_VLM", "0"))
+PRESCREEN_MAX_ABS_CHANGE_24H = float(os.getenv("PRESCREEN_MAX_ABS_CHANGE_24H", "0"))
+
+
+# ============================================================
+# FUNNEL DE CANDIDATOS (etapas ordenadas por coste)
+# policy -> prescreen -> candles -> indicators -> breakout -> score
+# Cada etapa cuenta entradas, pases y rechazos por motivo.
+# ============================================================
+
+FUNNEL_STAGES = ("policy", "prescreen", "candles", "indicators", "breakout", "score")
+
+_funnel_lock = threading.Lock()
+_funnel_stats: Dict[str, Dict[str, Any]] = {}
+
+
+def reset_funnel_stats() -> None:
+    with _funnel_lock:
+        _funnel_stats.clear()
+        for stage in FUNNEL_STAGES:
+            _funnel_stats[stage] = {"in": 0, "pass": 0, "skipped": 0, "reject": {}}
+
+
+reset_funnel_stats()
+
+
+def _funnel_enter(stage: str) -> None:
+    with _funnel_lock:
+        _funnel_stats[stage]["in"] += 1
+
+
+def _funnel_pass(stage: str) -> None:
+    with _funnel_lock:
+        _funnel_stats[stage]["pass"] += 1
+
+
+def _funnel_skip(stage: str) -> None:
+    with _funnel_lock:
+        _funnel_stats[stage]["skipped"] += 1
+
+
+def _funnel_reject(stage: str, reason: str) -> None:
+    with _funnel_lock:
+        rejects = _funnel_stats[stage]["reject"]
+        rejects[reason] = int(rejects.get(reason, 0)) + 1
+
+
+def get_funnel_stats() -> Dict[str, Dict[str, Any]]:
+    """Copia de los contadores del funnel (para logs/diagnóstico)."""
+    with _funnel_lock:
+        return {stage: {**st, "reject": dict(st["reject"])} for stage, st in _funnel_stats.items()}
+
+
+def _blocked(coin: str, reason: str, debug: bool, diag_fn=None, **extra: Any) -> dict:
+    """Respuesta de rechazo. El diag solo se materializa si se pide (debug)."""
+    out = {"signal": False, "reason": reason, "coin": coin}
+    out.update(extra)
+    if debug and diag_fn is not None:
+        try:
+            out["diag"] = diag_fn()
+        except Exception:
+            pass
+    return out
 
 
 def _log(msg: str):
@@ -251,11 +322,12 @@ def _upper_wick_ratio(o: float, h: float, l: float, c: float) -> float:
     return _clamp((h - max(o, c)) / rng, 0.0, 1.0)
 
 
-def _is_stale(candles: List[dict], interval: str) -> Tuple[bool, float, int]:
+def _is_stale(candles: List[dict], interval: str, now_ms: Optional[float] = None) -> Tuple[bool, float, int]:
     if not candles:
         return True, 9e9, 0
     last_t = int(candles[-1]["t"])
-    age_s = max(0.0, (time.time() * 1000.0 - last_t) / 1000.0)
+    now_ms = float(now_ms) if now_ms is not None else time.time() * 1000.0
+    age_s = max(0.0, (now_ms - last_t) / 1000.0)
     interval_s = _interval_ms(interval) / 1000.0
     return age_s > (interval_s * 3.0), age_s, last_t
 
@@ -277,11 +349,54 @@ def _is_probable_meme_symbol(symbol: str) -> bool:
     return any(key in base for key in BLOCKED_MEME_KEYWORDS)
 
 
-def _validate_symbol_quality(coin: str, candles: List[dict]) -> Tuple[bool, str, Dict[str, Any]]:
+def _symbol_policy_check(coin: str) -> Tuple[bool, str, Dict[str, Any]]:
     if ALLOWED_SYMBOLS and coin.upper() not in ALLOWED_SYMBOLS:
         return False, "SYMBOL_NOT_ALLOWED", {"coin": coin}
     if _is_probable_meme_symbol(coin):
         return False, "MEME_SYMBOL_BLOCKED", {"coin": coin, "base": _base_coin(coin)}
+    return True, "OK", {}
+
+
+def _ctx_float(ctx: dict, *keys: str) -> Optional[float]:
+    for key in keys:
+        if key in ctx and ctx.get(key) is not None:
+            try:
+                return float(ctx.get(key))
+            except Exception:
+                continue
+    return None
+
+
+def _prescreen_scanner_ctx(ctx: Optional[dict]) -> Tuple[bool, str, Dict[str, Any]]:
+    """Pre-filtro con datos del scanner (fila de get_ranked_symbols o assetCtx crudo)."""
+    if not isinstance(ctx, dict) or not ctx:
+        return True, "NO_CTX", {}
+
+    day_ntl = _ctx_float(ctx, "volume", "dayNtlVlm")
+    if day_ntl is not None and PRESCREEN_MIN_DAY_NTL_VLM > 0 and day_ntl < PRESCREEN_MIN_DAY_NTL_VLM:
+        return False, "PRESCREEN_LOW_VOLUME", {"day_ntl_vlm": day_ntl, "min": PRESCREEN_MIN_DAY_NTL_VLM}
+
+    # Proxy de ATR: variación absoluta 24h. El scanner la expone en % (change_24h);
+    # el assetCtx crudo trae markPx/prevDayPx.
+    abs_change = None
+    change_pct = _ctx_float(ctx, "change_24h")
+    if change_pct is not None:
+        abs_change = abs(change_pct) / 100.0
+    else:
+        mark = _ctx_float(ctx, "markPx", "price")
+        prev = _ctx_float(ctx, "prevDayPx")
+        if mark and prev and prev > 0:
+            abs_change = abs(mark - prev) / prev
+    if abs_change is not None and PRESCREEN_MAX_ABS_CHANGE_24H > 0 and abs_change > PRESCREEN_MAX_ABS_CHANGE_24H:
+        return False, "PRESCREEN_ATR_PROXY_TOO_HIGH", {"abs_change_24h": abs_change, "max": PRESCREEN_MAX_ABS_CHANGE_24H}
+
+    return True, "OK", {}
+
+
+def _validate_symbol_quality(coin: str, candles: List[dict]) -> Tuple[bool, str, Dict[str, Any]]:
+    policy_ok, policy_reason, policy_diag = _symbol_policy_check(coin)
+    if not policy_ok:
+        return False, policy_reason, policy_diag
     if not candles or len(candles) < MIN_CANDLES_REQUIRED:
         return False, "NO_CANDLES", {"bars": len(candles) if candles else 0, "min_bars": MIN_CANDLES_REQUIRED}
     valid = [x for x in candles if float(x.get("c", 0.0) or 0.0) > 0.0 and float(x.get("h", 0.0) or 0.0) >= float(x.get("l", 0.0) or 0.0)]
@@ -309,7 +424,8 @@ def _body_ratio(o: float, h: float, l: float, c: float) -> float:
 
 
 def _detect_breakout_retest_long(
-    o: List[float], h: List[float], l: List[float], c: List[float], v: List[float], ema20: List[float], ema50: List[float], atr: float
+    o: List[float], h: List[float], l: List[float], c: List[float], v: List[float], ema20: List[float], ema50: List[float], atr: float,
+    want_diag: bool = True,
 ) -> Tuple[bool, str, Dict[str, Any]]:
     if len(c) < max(BREAKOUT_LOOKBACK + BREAKOUT_MAX_AGE_BARS + 4, 80):
         return False, "NOT_ENOUGH_BARS", {}
@@ -365,6 +481,28 @@ def _detect_breakout_retest_long(
     post_break_lows = min(l[breakout_idx + 1 : i + 1]) if i > breakout_idx else l[i]
     retained_structure = post_break_lows >= breakout_level - (atr * RETEST_HARD_FAIL_ATR)
 
+    if hard_fail or not retained_structure:
+        reason = "RETEST_TOO_DEEP"
+    elif not touched:
+        reason = "NO_RETEST_TOUCH"
+    elif not close_ok:
+        reason = "RETEST_CLOSE_BAD"
+    elif not body_ok:
+        reason = "TRIGGER_BODY_WEAK"
+    elif not close_loc_ok:
+        reason = "TRIGGER_CLOSE_LOCATION_BAD"
+    elif not trigger_rvol_ok:
+        reason = "RETEST_VOLUME_WEAK"
+    elif not wick_support_ok:
+        reason = "TRIGGER_REJECTION_WEAK"
+    elif not chase_ok:
+        reason = "TOO_EXTENDED_AFTER_RETEST"
+    else:
+        reason = "OK"
+    # El scoring necesita el diag en el caso OK; en rechazos solo si alguien lo va a leer.
+    if reason != "OK" and not want_diag:
+        return False, reason, {}
+
     diag = {
         "breakout_level": round(float(breakout_level), 8),
         "breakout_idx": int(breakout_idx),
@@ -383,27 +521,12 @@ def _detect_breakout_retest_long(
         "retest_gap_atr": round((retest_low - breakout_level) / max(atr, 1e-12), 4),
     }
 
-    if hard_fail or not retained_structure:
-        return False, "RETEST_TOO_DEEP", diag
-    if not touched:
-        return False, "NO_RETEST_TOUCH", diag
-    if not close_ok:
-        return False, "RETEST_CLOSE_BAD", diag
-    if not body_ok:
-        return False, "TRIGGER_BODY_WEAK", diag
-    if not close_loc_ok:
-        return False, "TRIGGER_CLOSE_LOCATION_BAD", diag
-    if not trigger_rvol_ok:
-        return False, "RETEST_VOLUME_WEAK", diag
-    if not wick_support_ok:
-        return False, "TRIGGER_REJECTION_WEAK", diag
-    if not chase_ok:
-        return False, "TOO_EXTENDED_AFTER_RETEST", diag
-    return True, "OK", diag
+    return reason == "OK", reason, diag
 
 
 def _detect_breakout_retest_short(
-    o: List[float], h: List[float], l: List[float], c: List[float], v: List[float], ema20: List[float], ema50: List[float], atr: float
+    o: List[float], h: List[float], l: List[float], c: List[float], v: List[float], ema20: List[float], ema50: List[float], atr: float,
+    want_diag: bool = True,
 ) -> Tuple[bool, str, Dict[str, Any]]:
     if len(c) < max(BREAKOUT_LOOKBACK + BREAKOUT_MAX_AGE_BARS + 4, 80):
         return False, "NOT_ENOUGH_BARS", {}
@@ -459,6 +582,28 @@ def _detect_breakout_retest_short(
     post_break_highs = max(h[breakout_idx + 1 : i + 1]) if i > breakout_idx else h[i]
     retained_structure = post_break_highs <= breakout_level + (atr * RETEST_HARD_FAIL_ATR)
 
+    if hard_fail or not retained_structure:
+        reason = "RETEST_TOO_DEEP"
+    elif not touched:
+        reason = "NO_RETEST_TOUCH"
+    elif not close_ok:
+        reason = "RETEST_CLOSE_BAD"
+    elif not body_ok:
+        reason = "TRIGGER_BODY_WEAK"
+    elif not close_loc_ok:
+        reason = "TRIGGER_CLOSE_LOCATION_BAD"
+    elif not trigger_rvol_ok:
+        reason = "RETEST_VOLUME_WEAK"
+    elif not wick_support_ok:
+        reason = "TRIGGER_REJECTION_WEAK"
+    elif not chase_ok:
+        reason = "TOO_EXTENDED_AFTER_RETEST"
+    else:
+        reason = "OK"
+    # El scoring necesita el diag en el caso OK; en rechazos solo si alguien lo va a leer.
+    if reason != "OK" and not want_diag:
+        return False, reason, {}
+
     diag = {
         "breakout_level": round(float(breakout_level), 8),
         "breakout_idx": int(breakout_idx),
@@ -477,23 +622,26 @@ def _detect_breakout_retest_short(
         "retest_gap_atr": round((breakout_level - retest_high) / max(atr, 1e-12), 4),
     }
 
-    if hard_fail or not retained_structure:
-        return False, "RETEST_TOO_DEEP", diag
-    if not touched:
-        return False, "NO_RETEST_TOUCH", diag
-    if not close_ok:
-        return False, "RETEST_CLOSE_BAD", diag
-    if not body_ok:
-        return False, "TRIGGER_BODY_WEAK", diag
-    if not close_loc_ok:
-        return False, "TRIGGER_CLOSE_LOCATION_BAD", diag
-    if not trigger_rvol_ok:
-        return False, "RETEST_VOLUME_WEAK", diag
-    if not wick_support_ok:
-        return False, "TRIGGER_REJECTION_WEAK", diag
-    if not chase_ok:
-        return False, "TOO_EXTENDED_AFTER_RETEST", diag
-    return True, "OK", diag
+    return reason == "OK", reason, diag
+
+
+# Paso 4: rehacer la asimetría de salida.
+# Objetivo: dejar correr más el remanente ganador y recortar menos pronto,
+# sin convertir el trade en "todo o nada".
+# Valores base por bucket de score (app/mgmt_optimizer.py barre estos mismos campos).
+MGMT_BUCKET_MIN_SCORE = (("strong", 90.0), ("base", 83.0), ("weak", float("-inf")))
+MGMT_BUCKETS: Dict[str, Dict[str, float]] = {
+    "strong": {"act": 0.0100, "retrace": 0.0054, "force": 0.0071, "partial_frac": 0.28},
+    "base": {"act": 0.0090, "retrace": 0.0048, "force": 0.0064, "partial_frac": 0.32},
+    "weak": {"act": 0.0081, "retrace": 0.0042, "force": 0.0058, "partial_frac": 0.35},
+}
+
+
+def mgmt_bucket_for_score(score: float) -> str:
+    for bucket, min_score in MGMT_BUCKET_MIN_SCORE:
+        if float(score or 0.0) >= min_score:
+            return bucket
+    return MGMT_BUCKET_MIN_SCORE[-1][0]
 
 
 def _dynamic_trade_management_params(strength: float, score: float, atr_pct: Optional[float] = None) -> Dict[str, Any]:
@@ -501,27 +649,12 @@ def _dynamic_trade_management_params(strength: float, score: float, atr_pct: Opt
     score = float(score or 0.0)
     strength = float(strength or 0.0)
 
-    # Paso 4: rehacer la asimetría de salida.
-    # Objetivo: dejar correr más el remanente ganador y recortar menos pronto,
-    # sin convertir el trade en "todo o nada".
-    if score >= 90.0:
-        bucket = "strong"
-        act = 0.0100
-        retrace = 0.0054
-        force = 0.0071
-        partial_frac = 0.28
-    elif score >= 83.0:
-        bucket = "base"
-        act = 0.0090
-        retrace = 0.0048
-        force = 0.0064
-        partial_frac = 0.32
-    else:
-        bucket = "weak"
-        act = 0.0081
-        retrace = 0.0042
-        force = 0.0058
-        partial_frac = 0.35
+    bucket = mgmt_bucket_for_score(score)
+    base = MGMT_BUCKETS[bucket]
+    act = float(base["act"])
+    retrace = float(base["retrace"])
+    force = float(base["force"])
+    partial_frac = float(base["partial_frac"])
 
     # Ajuste por volatilidad: subir ligeramente el nivel donde se activa el runner
     # y dar algo más de respiración al trailing en regímenes rápidos.
@@ -558,46 +691,108 @@ def get_trade_management_params(strength: float, score: float, atr_pct: Optional
     return _dynamic_trade_management_params(strength, score, atr_pct)
 
 
-def get_entry_signal(symbol: str) -> dict:
+def get_entry_signal(symbol: str, scanner_ctx: Optional[dict] = None, debug: bool = False) -> dict:
+    """Evalúa el setup breakout/retest 5m de `symbol` como un funnel por coste.
+
+    - scanner_ctx: fila del scanner (o assetCtx) para pre-filtrar antes de pedir velas.
+    - debug: incluye el diag de rechazo en la respuesta (por defecto no se construye).
+    """
     try:
         coin = norm_coin(symbol)
         if not coin:
             return {"signal": False, "reason": "BAD_SYMBOL"}
 
+        # 1) Política de símbolo: allowlist / memecoins. Sin red ni CPU.
+        _funnel_enter("policy")
+        policy_ok, policy_reason, policy_diag = _symbol_policy_check(coin)
+        if not policy_ok:
+            _funnel_reject("policy", policy_reason)
+            return _blocked(coin, policy_reason, debug, lambda: policy_diag)
+        _funnel_pass("policy")
+
+        # 2) Pre-filtros con el contexto del scanner (volumen 24h, proxy de ATR).
+        _funnel_enter("prescreen")
+        if isinstance(scanner_ctx, dict) and scanner_ctx:
+            pre_ok, pre_reason, pre_diag = _prescreen_scanner_ctx(scanner_ctx)
+            if not pre_ok:
+                _funnel_reject("prescreen", pre_reason)
+                return _blocked(coin, pre_reason, debug, lambda: pre_diag)
+            _funnel_pass("prescreen")
+        else:
+            _funnel_skip("prescreen")
+
+        # 3) Velas: fetch + calidad + frescura.
+        _funnel_enter("candles")
         c5, st5 = _fetch_candles(coin, TF_5M, LOOKBACK_5M)
         if st5 in ("API_FAIL", "BAD_SYMBOL", "BAD_INTERVAL"):
-            return {"signal": False, "reason": "CANDLES_FETCH_FAIL", "detail": {"5m": st5}, "coin": coin}
+            _funnel_reject("candles", "CANDLES_FETCH_FAIL")
+            return _blocked(coin, "CANDLES_FETCH_FAIL", debug, detail={"5m": st5})
+        return _evaluate_entry_candles(coin, c5, debug=debug)
+    except Exception as e:
+        return {"signal": False, "reason": "STRATEGY_EXCEPTION", "error": str(e)[:180]}
+
+
+def evaluate_entry_candles(symbol: str, candles: List[dict], now_ms: Optional[float] = None, debug: bool = False) -> dict:
+    """Evalúa la estrategia sobre velas ya disponibles (backtest / verificación offline).
+
+    Mismo código que get_entry_signal desde la etapa de velas en adelante; `now_ms`
+    fija el reloj para el chequeo de velas stale.
+    """
+    try:
+        coin = norm_coin(symbol)
+        if not coin:
+            return {"signal": False, "reason": "BAD_SYMBOL"}
+        _funnel_enter("candles")
+        return _evaluate_entry_candles(coin, candles, debug=debug, now_ms=now_ms)
+    except Exception as e:
+        return {"signal": False, "reason": "STRATEGY_EXCEPTION", "error": str(e)[:180]}
+
+
+def _evaluate_entry_candles(coin: str, c5: List[dict], debug: bool = False, now_ms: Optional[float] = None) -> dict:
+    try:
         if not c5:
-            return {"signal": False, "reason": "NO_CANDLES", "coin": coin}
+            _funnel_reject("candles", "NO_CANDLES")
+            return _blocked(coin, "NO_CANDLES", debug)
 
         quality_ok, quality_reason, quality_diag = _validate_symbol_quality(coin, c5)
         if not quality_ok:
-            return {"signal": False, "reason": quality_reason, "coin": coin, "diag": quality_diag}
+            _funnel_reject("candles", quality_reason)
+            return _blocked(coin, quality_reason, debug, lambda: quality_diag)
 
-        stale5, age5, t5 = _is_stale(c5, TF_5M)
+        stale5, age5, t5 = _is_stale(c5, TF_5M, now_ms=now_ms)
         if stale5:
-            return {"signal": False, "reason": "STALE_CANDLES", "coin": coin, "age_s": {"5m": round(age5, 1)}, "last_t": {"5m": t5}}
+            _funnel_reject("candles", "STALE_CANDLES")
+            return _blocked(coin, "STALE_CANDLES", debug, age_s={"5m": round(age5, 1)}, last_t={"5m": t5})
 
         o5, h5, l5, cl5, v5 = _extract(c5)
         if not cl5:
-            return {"signal": False, "reason": "BAD_CANDLES_PARSE", "coin": coin}
-
-        ema20 = _ema(cl5, EMA_FAST)
-        ema50 = _ema(cl5, EMA_MID)
-        ema200 = _ema(cl5, EMA_SLOW)
-        if not ema20 or not ema50 or not ema200:
-            return {"signal": False, "reason": "NO_TREND_DATA", "coin": coin}
+            _funnel_reject("candles", "BAD_CANDLES_PARSE")
+            return _blocked(coin, "BAD_CANDLES_PARSE", debug)
+        _funnel_pass("candles")
 
+        # 4) Indicadores, del más barato al más caro: ATR -> ADX -> EMAs/tendencia.
+        _funnel_enter("indicators")
         close5 = float(cl5[-1])
-        adx5 = float(_last(_adx(h5, l5, cl5, ADX_PERIOD)) or 0.0)
         atr5 = float(_atr(h5, l5, cl5, ATR_PERIOD) or 0.0)
         atr_pct = atr5 / close5 if close5 > 0 else 0.0
         if atr_pct < ATR_PCT_MIN:
-            return {"signal": False, "reason": "ATR_TOO_LOW", "coin": coin, "diag": {"atr_pct": round(atr_pct, 6)}}
+            _funnel_reject("indicators", "ATR_TOO_LOW")
+            return _blocked(coin, "ATR_TOO_LOW", debug, lambda: {"atr_pct": round(atr_pct, 6)})
         if atr_pct > ATR_PCT_MAX:
-            return {"signal": False, "reason": "ATR_TOO_HIGH", "coin": coin, "diag": {"atr_pct": round(atr_pct, 6)}}
+            _funnel_reject("indicators", "ATR_TOO_HIGH")
+            return _blocked(coin, "ATR_TOO_HIGH", debug, lambda: {"atr_pct": round(atr_pct, 6)})
+
+        adx5 = float(_last(_adx(h5, l5, cl5, ADX_PERIOD)) or 0.0)
         if adx5 < ADX_MIN:
-            return {"signal": False, "reason": "ADX_TOO_LOW", "coin": coin, "diag": {"adx5": round(adx5, 2)}}
+            _funnel_reject("indicators", "ADX_TOO_LOW")
+            return _blocked(coin, "ADX_TOO_LOW", debug, lambda: {"adx5": round(adx5, 2)})
+
+        ema20 = _ema(cl5, EMA_FAST)
+        ema50 = _ema(cl5, EMA_MID)
+        ema200 = _ema(cl5, EMA_SLOW)
+        if not ema20 or not ema50 or not ema200:
+            _funnel_reject("indicators", "NO_TREND_DATA")
+            return _blocked(coin, "NO_TREND_DATA", debug)
 
         slope50 = _pct_change(float(ema50[-1]), float(ema50[max(0, len(ema50) - 1 - EMA_SLOPE_LOOKBACK)] or ema50[-1]))
         slope200 = _pct_change(float(ema200[-1]), float(ema200[max(0, len(ema200) - 1 - EMA_SLOPE_LOOKBACK)] or ema200[-1]))
@@ -605,20 +800,30 @@ def get_entry_signal(symbol: str) -> dict:
         long_trend = ema20[-1] > ema50[-1] and close5 > ema50[-1] and slope50 > 0.0002 and slope200 > -0.0015
         short_trend = ema20[-1] < ema50[-1] and close5 < ema50[-1] and slope50 < -0.0002 and slope200 < 0.0015
 
+        if not long_trend and not short_trend:
+            _funnel_reject("indicators", "NO_TREND_STACK_5M")
+            return _blocked(coin, "NO_TREND_STACK_5M", debug, lambda: {"slope50": round(slope50, 5), "slope200": round(slope200, 5)})
+        _funnel_pass("indicators")
+
+        # 5) Detección breakout/retest.
+        _funnel_enter("breakout")
+        want_diag = bool(debug or LOG_BLOCK_DIAGNOSTICS)
         if long_trend:
             direction = "long"
-            ok, reason5, diag5 = _detect_breakout_retest_long(o5, h5, l5, cl5, v5, ema20, ema50, atr5)
-        elif short_trend:
-            direction = "short"
-            ok, reason5, diag5 = _detect_breakout_retest_short(o5, h5, l5, cl5, v5, ema20, ema50, atr5)
+            ok, reason5, diag5 = _detect_breakout_retest_long(o5, h5, l5, cl5, v5, ema20, ema50, atr5, want_diag=want_diag)
         else:
-            return {"signal": False, "reason": "NO_TREND_STACK_5M", "coin": coin, "diag": {"slope50": round(slope50, 5), "slope200": round(slope200, 5)}}
+            direction = "short"
+            ok, reason5, diag5 = _detect_breakout_retest_short(o5, h5, l5, cl5, v5, ema20, ema50, atr5, want_diag=want_diag)
 
         if not ok:
-            if LOG_SIGNAL_DIAGNOSTICS:
+            _funnel_reject("breakout", reason5)
+            if LOG_BLOCK_DIAGNOSTICS:
                 _log(f"BLOCK coin={coin} dir={direction} reason={reason5} diag={diag5}")
-            return {"signal": False, "reason": f"BREAKOUT_RETEST_{reason5}", "coin": coin, "diag": diag5}
+            return _blocked(coin, f"BREAKOUT_RETEST_{reason5}", debug, lambda: diag5)
+        _funnel_pass("breakout")
 
+        # 6) Scoring.
+        _funnel_enter("score")
         if direction == "long":
             swing_low = min(l5[-10:])
             swing_dist_pct = max(0.0, (close5 - swing_low) / max(close5, 1e-12))
@@ -665,11 +870,12 @@ def get_entry_signal(symbol: str) -> dict:
         )
         score = round(min(MAX_SCORE, 64.0 + (36.0 * setup_quality)), 2)
         if score < MIN_SCORE_TO_SIGNAL:
-            return {
-                "signal": False,
-                "reason": "SCORE_TOO_LOW",
-                "coin": coin,
-                "diag": {
+            _funnel_reject("score", "SCORE_TOO_LOW")
+            return _blocked(
+                coin,
+                "SCORE_TOO_LOW",
+                debug,
+                lambda: {
                     "score": score,
                     "min_score": MIN_SCORE_TO_SIGNAL,
                     "breakout_rvol": round(breakout_rvol, 4),
@@ -677,7 +883,8 @@ def get_entry_signal(symbol: str) -> dict:
                     "bars_since_breakout": bars_since_breakout,
                     "ema_stack_pct": round(ema_stack_pct, 6),
                 },
-            }
+            )
+        _funnel_pass("score")
 
         strength = _clamp(score / 100.0, STRENGTH_MIN, STRENGTH_MAX)
         mgmt = _dynamic_trade_management_params(strength, score, atr_pct)
@@ -0,0 +1,267 @@
+# ============================================================
+# TIMER WHEEL – Trading X Hyper Pro
+# Deadlines del engine en una rueda de timers jerárquica
+#
+# - TIMER_WHEEL_LEVELS niveles de TIMER_WHEEL_SLOTS slots; resolución
+#   TIMER_WHEEL_TICK_SECONDS. Alta/baja/reprogramación O(1); al avanzar,
+#   los timers de niveles altos bajan (cascade) al nivel que les toca.
+# - Timers con clave: reprogramar una clave reemplaza su deadline
+#   (cooldowns, re-chequeos). active(key)/remaining(key) son O(1).
+# - Un thread dueño duerme hasta el próximo vencimiento (sin timers:
+#   espera indefinida, CPU ~0) y ejecuta los callbacks fuera del lock.
+# - Un callback que lanza excepción no afecta al resto.
+# ============================================================
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+import traceback
+from datetime import datetime
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+# ============================================================
+# CONFIG
+# ============================================================
+
+TIMER_WHEEL_TICK_SECONDS = float(os.getenv("TIMER_WHEEL_TICK_SECONDS", "0.05"))
+TIMER_WHEEL_SLOTS = 64          # potencia de 2
+TIMER_WHEEL_LEVELS = 5          # 64^5 ticks de 50ms ~ 1.7 años de horizonte
+
+
+def log(msg: str, level: str = "INFO"):
+    print(f"[TIMERS {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')}] {level} {msg}")
+
+
+class _Timer:
+    __slots__ = ("key", "expiry_tick", "deadline", "callback", "level", "slot")
+
+    def __init__(self, key: Hashable, expiry_tick: int, deadline: float, callback: Optional[Callable[[Hashable], Any]]):
+        self.key = key
+        self.expiry_tick = expiry_tick
+        self.deadline = deadline
+        self.callback = callback
+        self.level = -1
+        self.slot = -1
+
+
+# ============================================================
+# RUEDA
+# ============================================================
+
+class TimerWheel:
+    def __init__(
+        self,
+        *,
+        tick_seconds: float = TIMER_WHEEL_TICK_SECONDS,
+        slots: int = TIMER_WHEEL_SLOTS,
+        levels: int = TIMER_WHEEL_LEVELS,
+        clock: Callable[[], float] = time.time,
+        name: str = "timer-wheel",
+    ):
+        if slots & (slots - 1):
+            raise ValueError("slots debe ser potencia de 2")
+        self._tick = max(0.001, float(tick_seconds))
+        self._slots = int(slots)
+        self._bits = self._slots.bit_length() - 1
+        self._mask = self._slots - 1
+        self._levels = max(1, int(levels))
+        self._clock = clock
+        self._name = name
+
+        self._cond = threading.Condition()
+        self._wheel: List[List[Dict[Hashable, _Timer]]] = [
+            [dict() for _ in range(self._slots)] for _ in range(self._levels)
+        ]
+        self._timers: Dict[Hashable, _Timer] = {}
+        self._current = self._to_tick(self._clock())
+        self._thread: Optional[threading.Thread] = None
+        self._stats = {"scheduled": 0, "fired": 0, "cancelled": 0, "callback_errors": 0}
+
+    # --------------------------------------------------------
+    # Helpers
+    # --------------------------------------------------------
+
+    def _to_tick(self, ts: float) -> int:
+        return int(float(ts) / self._tick)
+
+    def _place_locked(self, t: _Timer) -> None:
+        delta = t.expiry_tick - self._current
+        if delta < 0:
+            delta = 0
+        level = 0
+        while level < self._levels - 1 and delta >= (1 << (self._bits * (level + 1))):
+            level += 1
+        # Más allá del horizonte: se estaciona en el último slot alcanzable del nivel alto.
+        tick = min(t.expiry_tick, self._current + (1 << (self._bits * self._levels)) - 1)
+        slot = (max(tick, self._current) >> (self._bits * level)) & self._mask
+        t.level = level
+        t.slot = slot
+        self._wheel[level][slot][t.key] = t
+
+    def _unlink_locked(self, t: _Timer) -> None:
+        if t.level >= 0:
+            self._wheel[t.level][t.slot].pop(t.key, None)
+        t.level = -1
+        t.slot = -1
+
+    # --------------------------------------------------------
+    # API
+    # --------------------------------------------------------
+
+    def schedule(self, key: Hashable, delay_seconds: float, callback: Optional[Callable[[Hashable], Any]] = None) -> float:
+        """Programa (o reprograma) `key` para dentro de delay_seconds. Retorna el deadline (epoch s)."""
+        deadline = self._clock() + max(0.0, float(delay_seconds))
+        return self.schedule_at(key, deadline, callback)
+
+    def schedule_at(self, key: Hashable, deadline: float, callback: Optional[Callable[[Hashable], Any]] = None) -> float:
+        # ceil: un timer nunca dispara antes de su deadline.
+        expiry_tick = -int(-float(deadline) // self._tick)
+        with self._cond:
+            old = self._timers.pop(key, None)
+            if old is not None:
+                self._unlink_locked(old)
+            t = _Timer(key, expiry_tick, float(deadline), callback)
+            self._timers[key] = t
+            self._place_locked(t)
+            self._stats["scheduled"] += 1
+            self._ensure_running_locked()
+            self._cond.notify_all()
+        return float(deadline)
+
+    def cancel(self, key: Hashable) -> bool:
+        with self._cond:
+            t = self._timers.pop(key, None)
+            if t is None:
+                return False
+            self._unlink_locked(t)
+            self._stats["cancelled"] += 1
+            return True
+
+    def active(self, key: Hashable) -> bool:
+        with self._cond:
+            t = self._timers.get(key)
+            return t is not None and t.deadline > self._clock()
+
+    def deadline(self, key: Hashable) -> Optional[float]:
+        with self._cond:
+            t = self._timers.get(key)
+            return t.deadline if t is not None else None
+
+    def remaining(self, key: Hashable) -> float:
+        """Segundos hasta el deadline de key (0.0 si no existe o ya venció)."""
+        d = self.deadline(key)
+        return max(0.0, d - self._clock()) if d is not None else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            out = dict(self._stats)
+            out["pending"] = len(self._timers)
+            out["per_level"] = [sum(len(s) for s in lvl) for lvl in self._wheel]
+        return out
+
+    # --------------------------------------------------------
+    # Avance
+    # --------------------------------------------------------
+
+    def advance(self, now: Optional[float] = None) -> int:
+        """Avanza hasta `now` y ejecuta los callbacks vencidos. Retorna cuántos dispararon."""
+        now_ts = self._clock() if now is None else float(now)
+        with self._cond:
+            due = self._collect_due_locked(self._to_tick(now_ts))
+        return self._fire(due)
+
+    def _collect_due_locked(self, target: int) -> List[_Timer]:
+        due: List[_Timer] = []
+        while self._current <= target:
+            tick = self._current
+            # Cascade: al cerrar una vuelta del nivel l-1, el slot actual del nivel l baja.
+            for level in range(1, self._levels):
+                if tick & ((1 << (self._bits * level)) - 1):
+                    break
+                bucket = self._wheel[level][(tick >> (self._bits * level)) & self._mask]
+                if bucket:
+                    moved = list(bucket.values())
+                    bucket.clear()
+                    for t in moved:
+                        self._place_locked(t)
+            bucket = self._wheel[0][tick & self._mask]
+            if bucket:
+                for t in list(bucket.values()):
+                    if t.expiry_tick <= tick:
+                        bucket.pop(t.key, None)
+                        self._timers.pop(t.key, None)
+                        t.level = -1
+                        due.append(t)
+            if tick == target:
+                break
+            nxt = self._next_occupied_tick_locked(target)
+            self._current = nxt if nxt is not None else target
+        return due
+
+    def _next_occupied_tick_locked(self, limit: int) -> Optional[int]:
+        """Próximo tick (<= limit) con trabajo: slot ocupado de nivel 0 o borde de cascade."""
+        cur = self._current
+        best = limit
+        for level in range(self._levels):
+            shift = self._bits * level
+            span = 1 << shift
+            base = (cur >> shift)
+            lvl = self._wheel[level]
+            for i in range(1, self._slots + 1):
+                idx = base + i
+                if idx * span > best:
+                    break
+                if lvl[idx & self._mask]:
+                    best = min(best, idx * span)
+                    break
+        return best if best > cur else cur + 1
+
+    def _next_deadline_locked(self) -> Optional[float]:
+        if not self._timers:
+            return None
+        # Vencidos ya estacionados en el slot actual (deadline en el pasado).
+        if self._wheel[0][self._current & self._mask]:
+            return self._current * self._tick
+        nxt = self._next_occupied_tick_locked(self._current + (1 << (self._bits * self._levels)))
+        return nxt * self._tick
+
+    def _fire(self, due: List[_Timer]) -> int:
+        for t in due:
+            if t.callback is None:
+                continue
+            try:
+                t.callback(t.key)
+            except Exception as e:
+                with self._cond:
+                    self._stats["callback_errors"] += 1
+                log(f"callback error key={t.key!r} err={e}\n{traceback.format_exc()}", "ERROR")
+        if due:
+            with self._cond:
+                self._stats["fired"] += len(due)
+        return len(due)
+
+    # --------------------------------------------------------
+    # Thread dueño
+    # --------------------------------------------------------
+
+    def _ensure_running_locked(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                nxt = self._next_deadline_locked()
+                now = self._clock()
+                if nxt is None:
+                    self._current = max(self._current, self._to_tick(now))
+                    self._cond.wait()
+                    continue
+                if nxt > now:
+                    self._cond.wait(nxt - now)
+                    continue
+                due = self._collect_due_locked(self._to_tick(now))
+            self._fire(due)
@@ -24,15 +24,33 @@ import json
 import threading
 import traceback
 from datetime import datetime, timedelta, date, timezone
-from typing import Any, Optional
+from typing import Any, Callable, Optional
 from collections import deque
 
 from app.market_scanner import get_ranked_symbols, mark_symbol_recent
 from app.strategy import get_entry_signal, get_trade_management_params
+from app.exit_manager import (
+    init_exit_state,
+    step_exit_state,
+    mark_partial_tp_taken,
+    mark_break_even_armed,
+    pnl_pct_for,
+    price_for_pnl,
+    runtime_fields as exit_runtime_fields,
+    trigger_prices,
+    exchange_stop_price,
+)
+from app.position_supervisor import PositionSupervisor
+from app.timer_wheel import TimerWheel
+from app.execution_fanout import FANOUT_PER_WALLET, fan_out
+from app.user_events import UserEventHub
 from app.risk import validate_trade_conditions
-from app.hyperliquid_client import place_market_order, place_stop_loss, cancel_all_orders_for_symbol, get_price, get_balance, has_open_position, get_position_entry_price, get_open_position_size, make_request, get_recent_closed_pnl, get_last_closed_pnl
+from app.state_journal import StateJournal
+from app.active_trade import ActiveTrade, ActiveTradeSchemaError
+from app.hyperliquid_client import place_market_order, place_stop_loss, cancel_all_orders_for_symbol, get_price, get_all_mids, get_balance, has_open_position, get_position_entry_price, get_open_position_size, make_request, get_recent_closed_pnl, get_last_closed_pnl, get_price_rules, get_best_bid_ask, has_live_stop_order, apply_open_order_updates, find_stop_order, modify_stop_loss, cancel_order, get_open_positions, get_open_orders
 
 from app.database import (
+    get_all_users,
     user_is_ready,
     register_trade,
     add_daily_admin_fee,
@@ -136,6 +154,8 @@ def _risk_record_close(user_id: int, profit: float) -> None:
                 if pf < USER_RISK_MIN_PF:
                     st["cooldown_until"] = max(float(st.get("cooldown_until") or 0.0), now_ts + USER_RISK_PF_COOLDOWN_SECONDS)
                     st["cooldown_reason"] = f"USER_PF_{pf:.2f}_WIN{len(st['results'])}"
+        if float(st.get("cooldown_until") or 0.0) > now_ts:
+            _timers.schedule_at(("risk_user", user_id), float(st["cooldown_until"]), _on_risk_cooldown_end)
 
         # global triggers
         if int(_global_risk_state.get("consec_losses", 0)) >= GLOBAL_RISK_MAX_CONSEC_LOSSES:
@@ -147,6 +167,22 @@ def _risk_record_close(user_id: int, profit: float) -> None:
                 if pf_g < GLOBAL_RISK_MIN_PF:
                     _global_risk_state["cooldown_until"] = max(float(_global_risk_state.get("cooldown_until") or 0.0), now_ts + GLOBAL_RISK_PF_COOLDOWN_SECONDS)
                     _global_risk_state["cooldown_reason"] = f"GLOBAL_PF_{pf_g:.2f}_WIN{len(_global_risk_state['results'])}"
+        if float(_global_risk_state.get("cooldown_until") or 0.0) > now_ts:
+            _timers.schedule_at(("risk_global",), float(_global_risk_state["cooldown_until"]), _on_risk_cooldown_end)
+
+
+def _on_risk_cooldown_end(key: tuple) -> None:
+    """Deadline del risk governor: limpia el cooldown vencido (el chequeo de entrada sigue comparando el deadline)."""
+    now_ts = time.time()
+    with _risk_lock:
+        st = _global_risk_state if key[0] == "risk_global" else _user_risk_state.get(key[1])
+        if not st or float(st.get("cooldown_until") or 0.0) > now_ts:
+            return
+        reason = str(st.get("cooldown_reason") or "")
+        st["cooldown_until"] = 0.0
+        st["cooldown_reason"] = ""
+    who = "GLOBAL" if key[0] == "risk_global" else f"user={key[1]}"
+    log(f"RISK_GOV cooldown terminado {who} reason={reason}", "INFO")
 
 
 def _risk_governor_allows_new_entries(user_id: int) -> tuple[bool, str]:
@@ -211,32 +247,104 @@ STRENGTH_STRONG_THRESHOLD = 0.30  # umbral para "fuerte"
 
 
 # user_id -> { "CC-PERP": expiry_dt, ... }
+# Solo contiene cooldowns vivos: cada uno es un deadline en _timers que lo borra al vencer.
 user_symbol_cooldowns: dict[int, dict[str, datetime]] = {}
+_cooldown_lock = threading.Lock()
+
+# Deadlines del engine (cooldowns, re-chequeos ADOPT): un solo thread que duerme
+# hasta el próximo vencimiento, en vez de comparar relojes en cada ciclo.
+_timers = TimerWheel(name="engine-timers")
+# Usuarios a los que ya se aplicó el startup grace en este proceso.
+_startup_grace_applied: set[int] = set()
+
+# Halt global de NUEVAS entradas (flatten de emergencia / admin). Las posiciones
+# abiertas se siguen gestionando; solo se corta la apertura.
+_entries_halt: dict[str, Any] = {}
+_entries_halt_lock = threading.Lock()
+FLATTEN_WORKERS = int(os.getenv("FLATTEN_WORKERS", "32"))
+FLATTEN_CLOSE_ATTEMPTS = int(os.getenv("FLATTEN_CLOSE_ATTEMPTS", "2"))  # IOC reduceOnly por coin (reintenta el remanente)
 
 # ✅ Lock por usuario
 _user_locks: dict[int, threading.Lock] = {}
 
-# ✅ Manager threads por usuario (para NO bloquear el ciclo durante horas)
-# Mantiene un watcher por usuario mientras exista una posición abierta.
-_user_manager_threads: dict[int, threading.Thread] = {}
-_user_manager_meta: dict[int, dict] = {}
-_user_manager_guard = threading.Lock()
+# ✅ Manager de posiciones (para NO bloquear el ciclo durante horas)
+# Un solo supervisor con pool fijo gestiona todas las posiciones abiertas
+# (una sesión por usuario), alimentado por el tablero de precios compartido.
+_position_supervisor = PositionSupervisor(price_board=get_all_mids, tick_seconds=PRICE_CHECK_INTERVAL)
+
+
+def _on_user_order_updates(user_id: int, updates: list) -> None:
+    """orderUpdates del stream: cache de órdenes abiertas y, si se ejecutó un trigger
+    (stop / TP en exchange), sync de la sesión en el próximo tick."""
+    apply_open_order_updates(user_id, updates)
+    for up in updates:
+        order = up.get("order") if isinstance(up, dict) and isinstance(up.get("order"), dict) else {}
+        if str(up.get("status") or "") in ("triggered", "filled") and (order.get("isTrigger") or float(order.get("triggerPx") or 0.0) > 0):
+            _position_supervisor.request_sync(int(user_id))
+            return
+
+
+# Stream de fills/órdenes/posiciones por wallet (ver app.user_events); sin stream live -> polling.
+_user_events = UserEventHub(on_order_updates=_on_user_order_updates)
+_manager_start_guard = threading.Lock()
 
 # Estado en memoria de trades activos para reconciliación post-cierre.
 # Esto NO reemplaza la DB; solo evita perder el registro si el manager muere
 # o si el exchange cierra la posición fuera del flujo normal del bot.
-_user_active_trades: dict[int, dict[str, Any]] = {}
+_user_active_trades: dict[int, ActiveTrade] = {}
 _user_active_trade_guard = threading.Lock()
 
 POSITION_SYNC_INTERVAL = 2.0
+
+# Write-behind del estado runtime: la memoria es la fuente de verdad, los campos
+# cambiados se marcan dirty y se persisten como $set coalescido cada
+# ACTIVE_TRADE_FLUSH_INTERVAL. Las transiciones críticas se persisten al instante.
+ACTIVE_TRADE_FLUSH_INTERVAL = float(os.getenv("ACTIVE_TRADE_FLUSH_INTERVAL", "5.0"))
+# Runtime que se conserva al relanzar el manager sobre la misma posición.
+ACTIVE_TRADE_CARRIED_RUNTIME_FIELDS = (
+    "partial_tp_taken",
+    "break_even_armed",
+    "trailing_active",
+    "best_pnl_pct",
+    "trailing_stop_pnl",
+    "peak_price",
+    "exchange_stop_price",
+)
+ACTIVE_TRADE_CRITICAL_FIELDS = frozenset({
+    "trailing_active",
+    "partial_tp_taken",
+    "break_even_armed",
+    "close_in_progress",
+    "close_finalized",
+    "sl_in_exchange",
+    "exchange_stop_price",
+})
+_user_active_trade_dirty: dict[int, set[str]] = {}
+_user_active_trade_flushed_ts: dict[int, float] = {}
+# Usuarios cuya última escritura a Mongo falló: el próximo flush manda el doc completo.
+_user_active_trade_resync: set[int] = set()
+# Generación por usuario (sube en set/clear): una escritura tomada antes de un
+# clear no recrea el doc. El lock por usuario serializa escritura vs borrado.
+_user_active_trade_gen: dict[int, int] = {}
+_user_active_trade_write_locks: dict[int, threading.Lock] = {}
 ADOPT_EMERGENCY_SL_PCT_RAW = float(os.getenv("ADOPT_EMERGENCY_SL_PCT", "0.012"))  # valor solicitado para ADOPT antes del cap del engine
 ADOPT_EMERGENCY_SL_PCT = float(ADOPT_EMERGENCY_SL_PCT_RAW)
 ADOPT_STOP_BUFFER_PCT = float(os.getenv("ADOPT_STOP_BUFFER_PCT", "0.003"))  # buffer mínimo vs precio actual para SL adoptado/recuperado
 ACTIVE_TRADE_STATE_DIR = os.path.abspath(os.getenv("ACTIVE_TRADE_STATE_DIR", "runtime_state/active_trades"))
 ACTIVE_TRADES_COLLECTION = os.getenv("ACTIVE_TRADES_COLLECTION", "active_trades")
 ACTIVE_TRADE_STATE_FALLBACK_DIR = os.path.abspath(os.getenv("ACTIVE_TRADE_STATE_FALLBACK_DIR", ACTIVE_TRADE_STATE_DIR))
+ACTIVE_TRADE_JOURNAL_FILE = os.getenv("ACTIVE_TRADE_JOURNAL_FILE", "active_trades.journal")
 ADOPT_RELOG_SECONDS = float(os.getenv("ADOPT_RELOG_SECONDS", "300"))
 ADOPT_SL_RECHECK_SECONDS = float(os.getenv("ADOPT_SL_RECHECK_SECONDS", "120"))
+GROUPED_ENTRY_SL = os.getenv("GROUPED_ENTRY_SL", "1").strip().lower() not in ("0", "false", "no")  # entrada + SL en una sola acción (normalTpsl)
+# Stop residente en el exchange: el trigger sigue al trailing / BE vía modify (cancel-replace
+# si el modify falla). El cierre TRAIL del cliente queda como respaldo.
+EXCHANGE_TRAILING_STOP = os.getenv("EXCHANGE_TRAILING_STOP", "0").strip().lower() in ("1", "true", "yes")
+EXCHANGE_TRAIL_MIN_STEP_PCT = float(os.getenv("EXCHANGE_TRAIL_MIN_STEP_PCT", "0.002"))        # mover solo si el stop avanza >= 0.2%
+EXCHANGE_TRAIL_MIN_INTERVAL_SECONDS = float(os.getenv("EXCHANGE_TRAIL_MIN_INTERVAL_SECONDS", "5.0"))
+USER_EVENTS_FILL_WAIT = float(os.getenv("USER_EVENTS_FILL_WAIT", "1.5"))     # espera máx. del fill de entrada por stream
+USER_EVENTS_CLOSE_WAIT = float(os.getenv("USER_EVENTS_CLOSE_WAIT", "3.0"))   # espera máx. de los fills de cierre por stream
+USER_EVENTS_CLOCK_SKEW_MS = int(os.getenv("USER_EVENTS_CLOCK_SKEW_MS", "2000"))  # margen reloj local vs exchange
 STOP_TRIGGER_DECIMALS_FALLBACK = int(os.getenv("STOP_TRIGGER_DECIMALS_FALLBACK", "6"))
 STOP_TRIGGER_DECIMALS_MIN = int(os.getenv("STOP_TRIGGER_DECIMALS_MIN", "4"))
 STOP_TRIGGER_DECIMALS_MAX = int(os.getenv("STOP_TRIGGER_DECIMALS_MAX", "8"))
@@ -289,11 +397,6 @@ def _log_trade_plan(*, context: str, user_id: int, symbol: str, direction: str,
 
 
 
-def _active_trade_state_path(user_id: int) -> str:
-    safe_user_id = str(int(user_id))
-    return os.path.join(ACTIVE_TRADE_STATE_FALLBACK_DIR, f"{safe_user_id}.json")
-
-
 def _safe_jsonable_dict(payload: Optional[dict[str, Any]]) -> dict[str, Any]:
     base = dict(payload or {})
     try:
@@ -338,19 +441,24 @@ def _resolve_active_trades_collection():
         return getattr(db_obj, ACTIVE_TRADES_COLLECTION, None)
 
 
-def _persist_active_trade_mongo(user_id: int, trade_data: dict[str, Any]) -> bool:
+def _persist_active_trade_mongo(user_id: int, trade_data: dict[str, Any], upsert: bool = True) -> bool:
+    """$set de trade_data. upsert solo con snapshot completo: un diff sobre un doc
+    que ya no existe no lo recrea a medias (retorna False -> resync completo)."""
     collection = _resolve_active_trades_collection()
     if collection is None:
         return False
-    payload = _safe_jsonable_dict(trade_data)
+    payload = dict(trade_data)
     payload["user_id"] = int(user_id)
     payload["persisted_at"] = datetime.utcnow().isoformat()
     try:
-        collection.update_one(
+        res = collection.update_one(
             {"user_id": int(user_id)},
             {"$set": payload},
-            upsert=True,
+            upsert=upsert,
         )
+        if not upsert and int(getattr(res, "matched_count", 1) or 0) == 0:
+            log(f"persist_active_trade_mongo diff sin doc user={user_id} — se reenvía completo", "WARN")
+            return False
         return True
     except Exception as e:
         log(f"persist_active_trade_mongo error user={user_id} err={e}", "ERROR")
@@ -382,52 +490,58 @@ def _delete_persisted_active_trade_mongo(user_id: int) -> None:
         log(f"delete_persisted_active_trade_mongo error user={user_id} err={e}", "WARN")
 
 
-def _persist_active_trade_fallback_file(user_id: int, trade_data: dict[str, Any]) -> None:
-    tmp_path = None
-    try:
-        final_path = os.path.abspath(_active_trade_state_path(user_id))
-        final_dir = os.path.dirname(final_path)
-        os.makedirs(final_dir, exist_ok=True)
+_active_trade_journal_obj: Optional[StateJournal] = None
+_active_trade_journal_guard = threading.Lock()
 
-        payload = _safe_jsonable_dict(trade_data)
-        payload["user_id"] = int(user_id)
-        payload["persisted_at"] = datetime.utcnow().isoformat()
 
-        import tempfile
-        fd, tmp_path = tempfile.mkstemp(
-            prefix=f"{int(user_id)}_",
-            suffix=".json.tmp",
-            dir=final_dir,
-        )
+def _active_trade_journal() -> StateJournal:
+    """Journal único del fallback en disco (replay + índice en memoria al primer uso).
+
+    Importa una sola vez los <user_id>.json del formato anterior que sigan en el directorio.
+    """
+    global _active_trade_journal_obj
+    with _active_trade_journal_guard:
+        if _active_trade_journal_obj is not None:
+            return _active_trade_journal_obj
+        journal = StateJournal(os.path.join(ACTIVE_TRADE_STATE_FALLBACK_DIR, ACTIVE_TRADE_JOURNAL_FILE))
         try:
-            with os.fdopen(fd, "w", encoding="utf-8") as fh:
-                json.dump(payload, fh, ensure_ascii=False, separators=(",", ":"), default=str)
-                fh.flush()
+            for name in sorted(os.listdir(ACTIVE_TRADE_STATE_FALLBACK_DIR)):
+                stem, ext = os.path.splitext(name)
+                if ext != ".json" or not stem.isdigit():
+                    continue
+                path = os.path.join(ACTIVE_TRADE_STATE_FALLBACK_DIR, name)
                 try:
-                    os.fsync(fh.fileno())
-                except Exception:
-                    pass
+                    with open(path, "r", encoding="utf-8") as fh:
+                        data = json.load(fh)
+                    if isinstance(data, dict) and journal.get(int(stem)) is None:
+                        journal.put(int(stem), data)
+                    os.remove(path)
+                    log(f"active_trade fallback legacy importado user={stem}", "WARN")
+                except Exception as e:
+                    log(f"active_trade fallback legacy import error file={name} err={e}", "WARN")
+        except Exception as e:
+            log(f"active_trade fallback legacy scan error err={e}", "WARN")
+        _active_trade_journal_obj = journal
+        return journal
 
-            os.replace(tmp_path, final_path)
-            tmp_path = None
-        finally:
-            try:
-                if tmp_path and os.path.exists(tmp_path):
-                    os.remove(tmp_path)
-            except Exception:
-                pass
+
+def _persist_active_trade_fallback_file(user_id: int, trade_data: dict[str, Any], changed: Optional[dict[str, Any]] = None) -> None:
+    """Append al journal: snapshot completo ("set") o solo el diff ("patch")."""
+    try:
+        payload = dict((trade_data or {}) if changed is None else changed)
+        payload["user_id"] = int(user_id)
+        payload["persisted_at"] = datetime.utcnow().isoformat()
+        if changed is None:
+            _active_trade_journal().put(user_id, payload)
+        else:
+            _active_trade_journal().patch(user_id, payload)
     except Exception as e:
         log(f"persist_active_trade_fallback_file error user={user_id} err={e}", "ERROR")
 
 
 def _load_persisted_active_trade_fallback_file(user_id: int) -> Optional[dict[str, Any]]:
     try:
-        path = _active_trade_state_path(user_id)
-        if not os.path.exists(path):
-            return None
-        with open(path, "r", encoding="utf-8") as fh:
-            data = json.load(fh)
-        return dict(data) if isinstance(data, dict) else None
+        return _active_trade_journal().get(user_id)
     except Exception as e:
         log(f"load_persisted_active_trade_fallback_file error user={user_id} err={e}", "WARN")
         return None
@@ -435,25 +549,35 @@ def _load_persisted_active_trade_fallback_file(user_id: int) -> Optional[dict[st
 
 def _delete_persisted_active_trade_fallback_file(user_id: int) -> None:
     try:
-        path = _active_trade_state_path(user_id)
-        if os.path.exists(path):
-            os.remove(path)
+        _active_trade_journal().delete(user_id)
     except Exception as e:
         log(f"delete_persisted_active_trade_fallback_file error user={user_id} err={e}", "WARN")
 
 
-def _persist_active_trade_snapshot(user_id: int, trade_data: dict[str, Any]) -> None:
-    persisted_in_mongo = _persist_active_trade_mongo(user_id, trade_data)
+def _persist_active_trade_snapshot(user_id: int, trade_data: Optional[dict[str, Any]], changed: Optional[dict[str, Any]] = None) -> bool:
+    """Persiste el doc completo (trade_data) o, si viene `changed`, solo ese diff.
+
+    Retorna False solo si Mongo está configurado y la escritura falló (el llamador
+    debe reenviar: con $set de diffs, lo no escrito no se vuelve a mandar solo).
+    """
+    persisted_in_mongo = _persist_active_trade_mongo(user_id, trade_data if changed is None else changed, upsert=changed is None)
     if not persisted_in_mongo:
         log(f"active_trade persistence fallback=user={user_id} backend=file", "WARN")
-    _persist_active_trade_fallback_file(user_id, trade_data)
+    _persist_active_trade_fallback_file(user_id, trade_data, changed=changed)
+    return bool(persisted_in_mongo) or _resolve_active_trades_collection() is None
 
 
-def _load_persisted_active_trade_snapshot(user_id: int) -> Optional[dict[str, Any]]:
-    mongo_state = _load_persisted_active_trade_mongo(user_id)
-    if isinstance(mongo_state, dict):
-        return mongo_state
-    return _load_persisted_active_trade_fallback_file(user_id)
+def _load_persisted_active_trade_snapshot(user_id: int) -> Optional[ActiveTrade]:
+    """Carga y valida el estado persistido (Mongo y luego journal). Un doc inválido se descarta con log."""
+    for backend, loader in (("mongo", _load_persisted_active_trade_mongo), ("file", _load_persisted_active_trade_fallback_file)):
+        doc = loader(user_id)
+        if not isinstance(doc, dict):
+            continue
+        try:
+            return ActiveTrade.from_doc(doc)
+        except ActiveTradeSchemaError as e:
+            log(f"active_trade persistido inválido user={user_id} backend={backend} err={e}", "CRITICAL")
+    return None
 
 
 def _delete_persisted_active_trade_snapshot(user_id: int) -> None:
@@ -461,38 +585,144 @@ def _delete_persisted_active_trade_snapshot(user_id: int) -> None:
     _delete_persisted_active_trade_fallback_file(user_id)
 
 
+def _active_trade_write_lock(user_id: int) -> threading.Lock:
+    with _user_active_trade_guard:
+        return _user_active_trade_write_locks.setdefault(int(user_id), threading.Lock())
+
+
 def _set_active_trade(user_id: int, trade_data: dict[str, Any]) -> None:
-    snapshot = dict(trade_data or {})
+    trade = ActiveTrade.from_dict(trade_data)
+    doc = trade.to_doc()
+    with _user_active_trade_guard:
+        _user_active_trades[user_id] = trade
+        _user_active_trade_dirty.pop(user_id, None)
+        _user_active_trade_resync.discard(user_id)
+        _user_active_trade_flushed_ts[user_id] = time.time()
+        gen = _user_active_trade_gen[user_id] = _user_active_trade_gen.get(user_id, 0) + 1
+    _write_active_trade(user_id, gen, doc, None)
+
+
+def _schedule_active_trade_flush(user_id: int, delay: float) -> None:
+    """Flush por timer de lo que quede dirty (sin esperar a otro update)."""
+    key = ("active_trade_flush", int(user_id))
+    if not _timers.active(key):
+        _timers.schedule(key, max(0.0, float(delay)), lambda _k: _flush_active_trade(user_id))
+
+
+def _take_active_trade_flush_locked(user_id: int, now: float) -> Optional[tuple[int, Optional[dict[str, Any]], Optional[dict[str, Any]]]]:
+    """(gen, doc_completo, None) tras un fallo previo, (gen, None, diff) si hay dirty, o None."""
+    current = _user_active_trades.get(user_id)
+    if current is None:
+        return None
+    gen = _user_active_trade_gen.get(user_id, 0)
+    dirty = _user_active_trade_dirty.pop(user_id, None)
+    if user_id in _user_active_trade_resync:
+        _user_active_trade_resync.discard(user_id)
+        _user_active_trade_flushed_ts[user_id] = now
+        return gen, current.to_doc(), None
+    if not dirty:
+        return None
+    _user_active_trade_flushed_ts[user_id] = now
+    return gen, None, current.doc_fields(dirty)
+
+
+def _write_active_trade(user_id: int, gen: int, doc: Optional[dict[str, Any]], diff: Optional[dict[str, Any]]) -> None:
+    with _active_trade_write_lock(user_id):
+        with _user_active_trade_guard:
+            if _user_active_trade_gen.get(user_id, 0) != gen:
+                return                      # cleared / reemplazado después de tomar la escritura
+        ok = _persist_active_trade_snapshot(user_id, doc, changed=diff)
+    if ok:
+        return
     with _user_active_trade_guard:
-        _user_active_trades[user_id] = snapshot
-    _persist_active_trade_snapshot(user_id, snapshot)
+        if user_id not in _user_active_trades or _user_active_trade_gen.get(user_id, 0) != gen:
+            return
+        _user_active_trade_resync.add(user_id)
+    _schedule_active_trade_flush(user_id, ACTIVE_TRADE_FLUSH_INTERVAL)
 
 
 def _update_active_trade_fields(user_id: int, **fields: Any) -> None:
-    current = _get_active_trade(user_id) or {}
-    current.update(fields)
-    _set_active_trade(user_id, current)
+    """Actualiza el estado en memoria y persiste en write-behind.
 
+    Flush inmediato si cambia un campo crítico; si no, como mucho uno cada
+    ACTIVE_TRADE_FLUSH_INTERVAL con todos los campos dirty acumulados (por timer
+    si no llega otro update). Una escritura fallida se reenvía como doc completo.
+    """
+    with _user_active_trade_guard:
+        loaded = user_id in _user_active_trades
+    if not loaded and _get_active_trade_model(user_id) is None:
+        _set_active_trade(user_id, fields)
+        return
 
-def _get_active_trade(user_id: int) -> Optional[dict[str, Any]]:
+    now = time.time()
+    with _user_active_trade_guard:
+        current = _user_active_trades.get(user_id)
+        if current is None:
+            current = _user_active_trades[user_id] = ActiveTrade()
+        # Campo a campo: un valor con tipo inválido se descarta (con log) sin
+        # perder los demás ni romper el tick del manager.
+        changed: list[str] = []
+        for k, v in fields.items():
+            try:
+                changed.extend(current.update({k: v}))
+            except ActiveTradeSchemaError as e:
+                log(f"active_trade campo inválido ignorado user={user_id} {e} valor={v!r}", "WARN")
+        if not changed:
+            return
+        dirty = _user_active_trade_dirty.setdefault(user_id, set())
+        dirty.update(changed)
+        critical = any(k in ACTIVE_TRADE_CRITICAL_FIELDS for k in changed)
+        wait = float(ACTIVE_TRADE_FLUSH_INTERVAL) - (now - _user_active_trade_flushed_ts.get(user_id, 0.0))
+        taken = _take_active_trade_flush_locked(user_id, now) if (critical or wait <= 0) else None
+    if taken is None:
+        _schedule_active_trade_flush(user_id, wait)
+        return
+    _write_active_trade(user_id, *taken)
+
+
+def _flush_active_trade(user_id: int) -> None:
+    """Persiste ya los campos dirty pendientes (si hay)."""
+    with _user_active_trade_guard:
+        taken = _take_active_trade_flush_locked(user_id, time.time())
+    if taken is not None:
+        _write_active_trade(user_id, *taken)
+
+
+def _get_active_trade_model(user_id: int) -> Optional[ActiveTrade]:
+    """Copia tipada del trade activo (memoria; si no, carga validada desde persistencia)."""
     with _user_active_trade_guard:
-        data = _user_active_trades.get(user_id)
-        if isinstance(data, dict):
-            return dict(data)
+        trade = _user_active_trades.get(user_id)
+        if trade is not None:
+            return trade.copy()
 
     persisted = _load_persisted_active_trade_snapshot(user_id)
-    if isinstance(persisted, dict):
+    if persisted is not None:
         with _user_active_trade_guard:
-            _user_active_trades[user_id] = dict(persisted)
-        return dict(persisted)
+            _user_active_trades[user_id] = persisted
+        return persisted.copy()
 
     return None
 
 
+def _get_active_trade(user_id: int) -> Optional[dict[str, Any]]:
+    with _user_active_trade_guard:
+        trade = _user_active_trades.get(user_id)
+        if trade is not None:
+            return trade.to_dict()
+    trade = _get_active_trade_model(user_id)
+    return trade.to_dict() if trade is not None else None
+
+
 def _clear_active_trade(user_id: int) -> None:
     with _user_active_trade_guard:
         _user_active_trades.pop(user_id, None)
-    _delete_persisted_active_trade_snapshot(user_id)
+        _user_active_trade_dirty.pop(user_id, None)
+        _user_active_trade_flushed_ts.pop(user_id, None)
+        _user_active_trade_resync.discard(user_id)
+        _user_active_trade_gen[user_id] = _user_active_trade_gen.get(user_id, 0) + 1
+    _timers.cancel(("active_trade_flush", int(user_id)))
+    with _active_trade_write_lock(user_id):
+        _delete_persisted_active_trade_snapshot(user_id)
 
 def _infer_price_decimals(*values: Any) -> int:
     decimals: list[int] = []
@@ -562,6 +792,32 @@ def _build_stop_trigger_candidates(*, raw_trigger: float, current_px: float, dir
     return candidates
 
 
+def _stop_trigger_plan(*, symbol_for_exec: str, raw_trigger: float, current_px: float, direction: str) -> list[float]:
+    """Trigger(s) de SL a enviar.
+    Con reglas del asset (meta): un único trigger ya válido (tick / cifras
+    significativas / decimales + buffer). Sin meta: escalera legacy.
+    """
+    if raw_trigger <= 0.0:
+        return []
+    rules = None
+    try:
+        rules = get_price_rules(symbol_for_exec)
+    except Exception as e:
+        log(f"price rules no disponibles symbol={symbol_for_exec} err={e}", "WARN")
+    if rules is not None:
+        trigger = float(
+            rules.stop_trigger(
+                float(raw_trigger),
+                direction=str(direction),
+                current_px=float(current_px),
+                buffer_pct=max(0.0005, float(ADOPT_STOP_BUFFER_PCT)),
+            )
+        )
+        if trigger > 0.0:
+            return [trigger]
+    return _build_stop_trigger_candidates(raw_trigger=raw_trigger, current_px=current_px, direction=direction)
+
+
 def _same_live_position(active_trade: Optional[dict[str, Any]], *, symbol: str, direction: str, entry_price: float) -> bool:
     if not isinstance(active_trade, dict):
         return False
@@ -580,44 +836,9 @@ def _same_live_position(active_trade: Optional[dict[str, Any]], *, symbol: str,
     return diff_pct <= 0.005
 
 
-def _fetch_frontend_open_orders(user_id: int) -> list[dict[str, Any]]:
-    """Lee órdenes abiertas del usuario desde Hyperliquid.
-    Usamos frontendOpenOrders porque expone isTrigger/reduceOnly/triggerPx.
-    """
-    try:
-        wallet = get_user_wallet(user_id)
-        if not wallet:
-            return []
-        r = make_request("/info", {"type": "frontendOpenOrders", "user": wallet})
-        if isinstance(r, list):
-            return [x for x in r if isinstance(x, dict)]
-        return []
-    except Exception as e:
-        log(f"frontendOpenOrders error user={user_id} err={e}", "WARN")
-        return []
-
-
 def _has_live_exchange_stop(user_id: int, symbol_for_exec: str, direction: str) -> bool:
-    coin = _norm_coin(symbol_for_exec)
-    expected_side = "A" if str(direction).lower() == "long" else "B"
-    orders = _fetch_frontend_open_orders(user_id)
-    for od in orders:
-        try:
-            if _norm_coin(str(od.get("coin") or "")) != coin:
-                continue
-            if not bool(od.get("isTrigger")):
-                continue
-            if not bool(od.get("reduceOnly")):
-                continue
-            if str(od.get("side") or "").upper() != expected_side:
-                continue
-            trig = float(od.get("triggerPx") or 0.0)
-            if trig <= 0.0:
-                continue
-            return True
-        except Exception:
-            continue
-    return False
+    # Lookup en el cache indexado de órdenes abiertas (relee al exchange si el snapshot venció).
+    return has_live_stop_order(user_id, symbol_for_exec, str(direction).lower())
 
 
 def _ensure_exchange_stop_loss(
@@ -650,7 +871,8 @@ def _ensure_exchange_stop_loss(
         except Exception:
             current_px = 0.0
 
-        trigger_candidates = _build_stop_trigger_candidates(
+        trigger_candidates = _stop_trigger_plan(
+            symbol_for_exec=symbol_for_exec,
             raw_trigger=float(raw_entry_trigger),
             current_px=float(current_px),
             direction=str(direction),
@@ -692,12 +914,41 @@ def _ensure_exchange_stop_loss(
         return False
 
 
+def _cancel_orphan_grouped_stop(user_id: int, symbol_for_exec: str, open_resp: Any) -> None:
+    """Si la entrada llevó SL agrupado pero no queda posición, retira el stop colgado."""
+    if not (isinstance(open_resp, dict) and open_resp.get("sl_grouped") and open_resp.get("sl_ok")):
+        return
+    try:
+        cancel_all_orders_for_symbol(user_id, symbol_for_exec)
+    except Exception as e:
+        log(f"cancel SL agrupado huérfano error user={user_id} symbol={symbol_for_exec} err={e}", "WARN")
+
+
+def _user_events_watch(user_id: int) -> bool:
+    """Asegura el stream de eventos del usuario. False = seguirá por polling."""
+    try:
+        return _user_events.watch(user_id, get_user_wallet(user_id))
+    except Exception as e:
+        log(f"user events watch error user={user_id} err={e}", "WARN")
+        return False
+
+
+def _exchange_position_size(user_id: int, symbol_for_exec: str) -> Optional[float]:
+    """szi leído de clearinghouseState (nunca del ledger). None si no se pudo leer."""
+    positions = get_open_positions(user_id)
+    if positions is None:
+        return None
+    coin = _norm_coin(symbol_for_exec)
+    for pos in positions:
+        if pos.get("coin") == coin:
+            return float(pos.get("szi") or 0.0)
+    return 0.0
+
+
 def _manager_is_running(user_id: int) -> bool:
-    with _user_manager_guard:
-        th = _user_manager_threads.get(user_id)
-        return bool(th and th.is_alive())
+    return _position_supervisor.is_running(user_id)
 
-def _start_manager_thread(
+def _start_trade_manager(
     *,
     user_id: int,
     symbol: str,
@@ -715,88 +966,125 @@ def _start_manager_thread(
     mgmt: Optional[dict[str, Any]] = None,
     opened_at_ms: Optional[int] = None,
 ) -> bool:
-    """Arranca un manager en background si no existe uno vivo para el usuario.
-    Retorna True si se creó, False si ya había uno corriendo.
+    """Registra la posición en el supervisor si no hay una sesión viva para el usuario.
+    Retorna True si se creó, False si ya había una corriendo.
     """
-    with _user_manager_guard:
-        existing = _user_manager_threads.get(user_id)
-        if existing and existing.is_alive():
-            # Ya hay manager corriendo
-            return False
+    with _manager_start_guard:
+        return _start_trade_manager_locked(
+            user_id=user_id,
+            symbol=symbol,
+            symbol_for_exec=symbol_for_exec,
+            direction=direction,
+            side=side,
+            opposite=opposite,
+            entry_price=entry_price,
+            qty_coin_for_log=qty_coin_for_log,
+            qty_usdc_for_profit=qty_usdc_for_profit,
+            best_score=best_score,
+            entry_strength=entry_strength,
+            mode=mode,
+            sl_price_pct=sl_price_pct,
+            mgmt=mgmt,
+            opened_at_ms=opened_at_ms,
+        )
 
-        def _runner():
-            try:
-                _user_manager_meta[user_id] = {
-                    "symbol": symbol,
-                    "mode": mode,
-                    "started_at": datetime.utcnow().isoformat(),
-            "opened_at_ms": int(opened_at_ms) if opened_at_ms else int(time.time() * 1000),
-                }
-                _manage_trade_until_close(
-                    user_id=user_id,
-                    symbol=symbol,
-                    symbol_for_exec=symbol_for_exec,
-                    direction=direction,
-                    side=side,
-                    opposite=opposite,
-                    entry_price=float(entry_price),
-                    qty_coin_for_log=float(qty_coin_for_log),
-                    qty_usdc_for_profit=float(qty_usdc_for_profit),
-                    best_score=float(best_score),
-                    entry_strength=float(entry_strength),
-                    mode=mode,
-                    sl_price_pct=float(sl_price_pct),
-                    mgmt=mgmt,
-                )
-            except Exception as e:
-                log(f"MANAGER THREAD error user={user_id} symbol={symbol} err={e}\n{traceback.format_exc()}", "CRITICAL")
-            finally:
-                with _user_manager_guard:
-                    _user_manager_threads.pop(user_id, None)
-                    _user_manager_meta.pop(user_id, None)
+def _start_trade_manager_locked(
+    *,
+    user_id: int,
+    symbol: str,
+    symbol_for_exec: str,
+    direction: str,
+    side: str,
+    opposite: str,
+    entry_price: float,
+    qty_coin_for_log: float,
+    qty_usdc_for_profit: float,
+    best_score: float,
+    entry_strength: float,
+    mode: str,
+    sl_price_pct: float,
+    mgmt: Optional[dict[str, Any]],
+    opened_at_ms: Optional[int],
+) -> bool:
+    if _position_supervisor.is_running(user_id):
+        return False
 
-        _set_active_trade(user_id, {
-            "symbol": symbol,
-            "symbol_for_exec": symbol_for_exec,
-            "direction": direction,
-            "side": side,
-            "opposite": opposite,
-            "entry_price": float(entry_price),
-            "qty_coin_for_log": float(qty_coin_for_log),
-            "qty_usdc_for_profit": float(qty_usdc_for_profit),
-            "best_score": float(best_score),
-            "entry_strength": float(entry_strength),
-            "mode": mode,
-            "sl_price_pct": float(sl_price_pct),
-            "started_at": datetime.utcnow().isoformat(),
-            "opened_at_ms": int(opened_at_ms) if opened_at_ms else int(time.time() * 1000),
-            "tp_activation_price": float((mgmt or {}).get("tp_activate_price", (mgmt or {}).get("tp_activation_price", 0.0)) or 0.0),
-            "trail_retrace_price": float((mgmt or {}).get("trail_retrace_price", 0.0) or 0.0),
-            "force_min_profit_price": float((mgmt or {}).get("force_min_profit_price", 0.0) or 0.0),
-            "force_min_strength": float((mgmt or {}).get("force_min_strength", 0.0) or 0.0),
-            "partial_tp_activation_price": float((mgmt or {}).get("partial_tp_activation_price", 0.0) or 0.0),
-            "partial_tp_close_fraction": float((mgmt or {}).get("partial_tp_close_fraction", 0.0) or 0.0),
-            "break_even_activation_price": float((mgmt or {}).get("break_even_activation_price", 0.0) or 0.0),
-            "break_even_offset_price": float((mgmt or {}).get("break_even_offset_price", 0.0) or 0.0),
-            "bucket": str((mgmt or {}).get("bucket", "")),
-            "partial_tp_taken": False,
-            "break_even_armed": False,
-            "trailing_active": False,
-            "best_pnl_pct": 0.0,
-            "trailing_stop_pnl": None,
-            "peak_price": float(entry_price),
-            "last_price": float(entry_price),
-            "last_pnl_pct": 0.0,
-            "strength_check_ts": 0.0,
-            "manager_heartbeat_ts": time.time(),
-            "close_in_progress": False,
-            "close_finalized": False,
-        })
+    _user_events_watch(user_id)
 
-        th = threading.Thread(target=_runner, name=f"mgr-{user_id}", daemon=True)
-        _user_manager_threads[user_id] = th
-        th.start()
-        return True
+    # Relanzamiento (watchdog / ADOPT) sobre la MISMA posición: el progreso del manager
+    # (BE armado, trailing, partial TP, stop residente) no vuelve a cero.
+    prior = _get_active_trade(user_id)
+    carried: dict[str, Any] = {}
+    if _same_live_position(prior, symbol=symbol, direction=direction, entry_price=float(entry_price)) and not prior.get("close_finalized"):
+        carried = {k: prior[k] for k in ACTIVE_TRADE_CARRIED_RUNTIME_FIELDS if prior.get(k) is not None}
+        if carried:
+            log(f"MANAGER[{mode}] runtime conservado user={user_id} symbol={symbol} fields={sorted(carried)}", "WARN")
+
+    _set_active_trade(user_id, {
+        "symbol": symbol,
+        "symbol_for_exec": symbol_for_exec,
+        "direction": direction,
+        "side": side,
+        "opposite": opposite,
+        "entry_price": float(entry_price),
+        "qty_coin_for_log": float(qty_coin_for_log),
+        "qty_usdc_for_profit": float(qty_usdc_for_profit),
+        "best_score": float(best_score),
+        "entry_strength": float(entry_strength),
+        "mode": mode,
+        "sl_price_pct": float(sl_price_pct),
+        "started_at": datetime.utcnow().isoformat(),
+        "opened_at_ms": int(opened_at_ms) if opened_at_ms else int(time.time() * 1000),
+        "tp_activation_price": float((mgmt or {}).get("tp_activate_price", (mgmt or {}).get("tp_activation_price", 0.0)) or 0.0),
+        "trail_retrace_price": float((mgmt or {}).get("trail_retrace_price", 0.0) or 0.0),
+        "force_min_profit_price": float((mgmt or {}).get("force_min_profit_price", 0.0) or 0.0),
+        "force_min_strength": float((mgmt or {}).get("force_min_strength", 0.0) or 0.0),
+        "partial_tp_activation_price": float((mgmt or {}).get("partial_tp_activation_price", 0.0) or 0.0),
+        "partial_tp_close_fraction": float((mgmt or {}).get("partial_tp_close_fraction", 0.0) or 0.0),
+        "break_even_activation_price": float((mgmt or {}).get("break_even_activation_price", 0.0) or 0.0),
+        "break_even_offset_price": float((mgmt or {}).get("break_even_offset_price", 0.0) or 0.0),
+        "bucket": str((mgmt or {}).get("bucket", "")),
+        "partial_tp_taken": False,
+        "break_even_armed": False,
+        "trailing_active": False,
+        "best_pnl_pct": 0.0,
+        "trailing_stop_pnl": None,
+        "peak_price": float(entry_price),
+        "last_price": float(entry_price),
+        "last_pnl_pct": 0.0,
+        "strength_check_ts": 0.0,
+        "manager_heartbeat_ts": time.time(),
+        "close_in_progress": False,
+        "close_finalized": False,
+        **carried,
+    })
+
+    try:
+        session = _TradeManagerSession(
+            user_id=user_id,
+            symbol=symbol,
+            symbol_for_exec=symbol_for_exec,
+            direction=direction,
+            side=side,
+            opposite=opposite,
+            entry_price=float(entry_price),
+            qty_coin_for_log=float(qty_coin_for_log),
+            qty_usdc_for_profit=float(qty_usdc_for_profit),
+            best_score=float(best_score),
+            entry_strength=float(entry_strength),
+            mode=mode,
+            sl_price_pct=float(sl_price_pct),
+            mgmt=mgmt,
+        )
+    except Exception as e:
+        log(f"MANAGER start error user={user_id} symbol={symbol} err={e}\n{traceback.format_exc()}", "CRITICAL")
+        return False
+
+    return _position_supervisor.register(user_id, session, meta={
+        "symbol": symbol,
+        "mode": mode,
+        "opened_at_ms": int(opened_at_ms) if opened_at_ms else int(time.time() * 1000),
+    })
 
 
 def _try_begin_trade_finalize(user_id: int, source: str) -> Optional[dict[str, Any]]:
@@ -970,30 +1258,29 @@ def _extract_fill_price(obj: Any) -> Optional[float]:
 # ============================================================
 
 def _get_excluded_symbols(user_id: int) -> set[str]:
-    now = datetime.utcnow()
-    m = user_symbol_cooldowns.get(user_id) or {}
-
-    alive: dict[str, datetime] = {}
-    exclude: set[str] = set()
-
-    for sym, exp in m.items():
-        try:
-            if exp and now < exp:
-                alive[sym] = exp
-                exclude.add(sym)
-        except Exception:
-            continue
-
-    user_symbol_cooldowns[user_id] = alive
-    return exclude
+    # Los vencidos ya los borró su timer: no hay que recorrer ni comparar fechas.
+    with _cooldown_lock:
+        return set(user_symbol_cooldowns.get(user_id) or ())
+
+def _expire_symbol_cooldown(key: tuple) -> None:
+    _, user_id, sym = key
+    with _cooldown_lock:
+        m = user_symbol_cooldowns.get(user_id)
+        if m is None:
+            return
+        m.pop(sym, None)
+        if not m:
+            user_symbol_cooldowns.pop(user_id, None)
 
 def _cooldown_symbol(user_id: int, symbol: str, seconds: int = SYMBOL_NOFILL_COOLDOWN_SECONDS):
     try:
         sym = str(symbol or "").upper()
         if not sym:
             return
-        m = user_symbol_cooldowns.setdefault(user_id, {})
-        m[sym] = datetime.utcnow() + timedelta(seconds=int(seconds))
+        with _cooldown_lock:
+            m = user_symbol_cooldowns.setdefault(user_id, {})
+            m[sym] = datetime.utcnow() + timedelta(seconds=int(seconds))
+        _timers.schedule(("symbol_cooldown", user_id, sym), int(seconds), _expire_symbol_cooldown)
     except Exception:
         pass
 
@@ -1008,9 +1295,12 @@ def _can_trade_now(user_id: int) -> tuple[bool, str]:
     now = datetime.utcnow()
     # Per-user startup grace: prevents an immediate entry right after a deploy/restart.
     # We only set this once per process and per user, so normal cooldown rules still apply afterwards.
-    if STARTUP_GRACE_SECONDS > 0 and user_id not in user_next_trade_time:
-        user_next_trade_time[user_id] = PROCESS_START_TIME_UTC + timedelta(seconds=STARTUP_GRACE_SECONDS)
-        log(f"Startup grace activo ({STARTUP_GRACE_SECONDS}s) para usuario {user_id}", "INFO")
+    if STARTUP_GRACE_SECONDS > 0 and user_id not in _startup_grace_applied:
+        _startup_grace_applied.add(user_id)
+        grace_until = PROCESS_START_TIME_UTC + timedelta(seconds=STARTUP_GRACE_SECONDS)
+        if user_id not in user_next_trade_time and now < grace_until:
+            _set_user_trade_cooldown(user_id, grace_until)
+            log(f"Startup grace activo ({STARTUP_GRACE_SECONDS}s) para usuario {user_id}", "INFO")
 
 
     next_time = user_next_trade_time.get(user_id)
@@ -1068,14 +1358,26 @@ def _register_trade_attempt(user_id: int):
     state["hour_count"] += 1
     state["day_count"] += 1
 
-    user_next_trade_time[user_id] = now + timedelta(seconds=USER_TRADE_COOLDOWN_SECONDS)
+    _set_user_trade_cooldown(user_id, now + timedelta(seconds=USER_TRADE_COOLDOWN_SECONDS))
+
+
+def _set_user_trade_cooldown(user_id: int, until: datetime) -> None:
+    """Registra el cooldown entre trades como deadline; al vencer, su timer lo borra."""
+    user_next_trade_time[user_id] = until
+    _timers.schedule(("trade_cooldown", user_id), (until - datetime.utcnow()).total_seconds(), _expire_user_trade_cooldown)
+
 
+def _expire_user_trade_cooldown(key: tuple) -> None:
+    user_id = key[1]
+    until = user_next_trade_time.get(user_id)
+    if until is not None and datetime.utcnow() >= until:
+        user_next_trade_time.pop(user_id, None)
 
 
 def _register_post_close_cooldown(user_id: int):
     """Aplica cooldown DESPUÉS de cerrar un trade (evita re-entrada inmediata al finalizar)."""
     try:
-        user_next_trade_time[user_id] = datetime.utcnow() + timedelta(seconds=USER_TRADE_COOLDOWN_SECONDS)
+        _set_user_trade_cooldown(user_id, datetime.utcnow() + timedelta(seconds=USER_TRADE_COOLDOWN_SECONDS))
     except Exception:
         # Nunca romper el engine por un fallo de cooldown
         pass
@@ -1240,49 +1542,6 @@ def _coalesce_management_params(
     return _disabled_management_params()
 
 
-def _should_close_on_strength_loss(
-
-    *,
-    symbol: str,
-    direction: str,
-    pnl_pct: float,
-    entry_strength: float,
-    force_min_profit_price: float,
-    force_min_strength: float,
-    last_check_ts: float,
-) -> tuple[bool, str, float, float]:
-    """Re-evalúa la estrategia abierta con umbrales definidos por estrategia."""
-    _ = entry_strength
-    now_ts = time.time()
-    if (now_ts - float(last_check_ts)) < float(TP_FORCE_CHECK_INTERVAL):
-        return False, "", 0.0, last_check_ts
-
-    if float(pnl_pct) < float(force_min_profit_price):
-        return False, "", 0.0, now_ts
-
-    sig = get_entry_signal(symbol)
-    if not isinstance(sig, dict):
-        return False, "", 0.0, now_ts
-
-    same_dir = str(sig.get("direction") or "").lower() == str(direction or "").lower()
-    live_strength = float(sig.get("strength", 0.0) or 0.0)
-    min_strength = max(float(force_min_strength or 0.0), 0.0)
-
-    if (not sig.get("signal")):
-        reason = str(sig.get("reason") or "WEAKNESS")
-        if reason.startswith("NO_TREND_1H") or reason.startswith("NO_STRUCTURE_1H") or reason.startswith("TIMING_5M"):
-            return True, f"FORCE_LOSS_{reason}", live_strength, now_ts
-        return False, "", live_strength, now_ts
-
-    if not same_dir:
-        return True, "FORCE_LOSS_DIRECTION_FLIP", live_strength, now_ts
-
-    if live_strength <= min_strength:
-        return True, f"FORCE_LOSS_STRENGTH_{live_strength:.4f}", live_strength, now_ts
-
-    return False, "", live_strength, now_ts
-
-
 def _iso_utc_to_epoch_ms(value: Any) -> Optional[int]:
     if value in (None, ""):
         return None
@@ -1318,6 +1577,29 @@ def _active_trade_opened_since_ms(active_trade: Optional[dict[str, Any]]) -> Opt
 
 def _read_trade_realized_pnl(user_id: int, symbol: str, active_trade: Optional[dict[str, Any]]) -> Optional[dict[str, float]]:
     since_ms = _active_trade_opened_since_ms(active_trade)
+    ledger = _user_events.live_ledger(user_id)
+    if since_ms is not None and ledger is not None:
+        try:
+            ev_since = max(0, int(since_ms) - USER_EVENTS_CLOCK_SKEW_MS)
+            ledger.wait_flat(symbol, ev_since, timeout=USER_EVENTS_CLOSE_WAIT)
+            ev = ledger.closed_pnl(symbol, ev_since)
+            if ev is not None and int(ev.get("fills", 0) or 0) > 0:
+                payload = {
+                    "pnl": round(float(ev["pnl"]), 6),
+                    "fees": round(float(ev["fees"]), 6),
+                    "net": round(float(ev["net"]), 6),
+                    "fills": int(ev["fills"]),
+                    "since_ms": int(since_ms),
+                    "source": "user_events",
+                }
+                log(
+                    f"PnL_REAL_STREAM {symbol}={payload['net']} gross={payload['pnl']} fees={payload['fees']} fills={payload['fills']} since_ms={since_ms}",
+                    "INFO",
+                )
+                return payload
+        except Exception as e:
+            log(f"No se pudo leer PnL desde user events para {symbol}: {e}", "WARN")
+
     if since_ms is not None:
         try:
             diag_pnl = get_recent_closed_pnl(user_id, symbol, since_ms=since_ms)
@@ -1523,12 +1805,14 @@ def _finalize_trade_close(
         log(f"active_trade finalize mark error {symbol} src={source} err={e}", "WARN")
 
     _clear_active_trade(user_id)
+    # Libera el cupo de stream (límite de usuarios por IP); la próxima entrada lo reabre.
+    _user_events.unwatch(user_id)
     return float(profit)
 
 
 def _ensure_manager_watchdog(user_id: int) -> Optional[dict]:
-    active = _get_active_trade(user_id)
-    if not active:
+    trade = _get_active_trade_model(user_id)
+    if trade is None:
         return None
     if _manager_is_running(user_id):
         return None
@@ -1542,21 +1826,22 @@ def _ensure_manager_watchdog(user_id: int) -> Optional[dict]:
     if not still_open:
         return None
 
-    symbol = str(active.get("symbol") or "")
-    symbol_for_exec = str(active.get("symbol_for_exec") or _norm_coin(symbol))
-    direction = str(active.get("direction") or "")
-    side = str(active.get("side") or "")
-    opposite = str(active.get("opposite") or ("sell" if side == "buy" else "buy"))
-    entry_price = float(active.get("entry_price") or 0.0)
-    qty_coin_for_log = float(active.get("qty_coin_for_log") or 0.0)
-    qty_usdc_for_profit = float(active.get("qty_usdc_for_profit") or 0.0)
-    best_score = float(active.get("best_score") or 0.0)
-    entry_strength = float(active.get("entry_strength") or 0.0)
-    sl_price_pct = float(active.get("sl_price_pct") or 0.0)
+    active = trade.to_dict()
+    symbol = trade.symbol or ""
+    symbol_for_exec = trade.symbol_for_exec or _norm_coin(symbol)
+    direction = trade.direction or ""
+    side = trade.side or ""
+    opposite = trade.opposite or ("sell" if side == "buy" else "buy")
+    entry_price = trade.entry_price or 0.0
+    qty_coin_for_log = trade.qty_coin_for_log or 0.0
+    qty_usdc_for_profit = trade.qty_usdc_for_profit or 0.0
+    best_score = trade.best_score or 0.0
+    entry_strength = trade.entry_strength or 0.0
+    sl_price_pct = trade.sl_price_pct or 0.0
     mgmt = _coalesce_management_params(active_trade=active, entry_strength=entry_strength, best_score=best_score)
 
     log(f"WATCHDOG: manager muerto; relanzando user={user_id} symbol={symbol}", "CRITICAL")
-    started = _start_manager_thread(
+    started = _start_trade_manager(
         user_id=user_id,
         symbol=symbol,
         symbol_for_exec=symbol_for_exec,
@@ -1568,7 +1853,7 @@ def _ensure_manager_watchdog(user_id: int) -> Optional[dict]:
         qty_usdc_for_profit=qty_usdc_for_profit,
         best_score=best_score,
         entry_strength=entry_strength,
-        mode=str(active.get("mode") or "WATCHDOG"),
+        mode=trade.mode or "WATCHDOG",
         sl_price_pct=sl_price_pct,
         mgmt=mgmt,
         opened_at_ms=int((_active_trade_opened_since_ms(active) or int(time.time() * 1000))),
@@ -1577,8 +1862,8 @@ def _ensure_manager_watchdog(user_id: int) -> Optional[dict]:
 
 
 def _reconcile_orphan_closed_trade(user_id: int) -> bool:
-    active = _get_active_trade(user_id)
-    if not active:
+    trade = _get_active_trade_model(user_id)
+    if trade is None:
         return False
 
     try:
@@ -1590,14 +1875,14 @@ def _reconcile_orphan_closed_trade(user_id: int) -> bool:
     if still_open:
         return False
 
-    symbol = str(active.get("symbol") or "")
-    entry_price = float(active.get("entry_price") or 0.0)
-    qty_usdc_for_profit = float(active.get("qty_usdc_for_profit") or 0.0)
-    qty_coin_for_log = float(active.get("qty_coin_for_log") or 0.0)
-    direction = str(active.get("direction") or "")
-    side = str(active.get("side") or "")
-    best_score = float(active.get("best_score") or 0.0)
-    symbol_for_exec = str(active.get("symbol_for_exec") or _norm_coin(symbol))
+    symbol = trade.symbol or ""
+    entry_price = trade.entry_price or 0.0
+    qty_usdc_for_profit = trade.qty_usdc_for_profit or 0.0
+    qty_coin_for_log = trade.qty_coin_for_log or 0.0
+    direction = trade.direction or ""
+    side = trade.side or ""
+    best_score = trade.best_score or 0.0
+    symbol_for_exec = trade.symbol_for_exec or _norm_coin(symbol)
 
     exit_price = float(get_price(symbol_for_exec) or entry_price or 0.0)
     exit_pnl_pct = 0.0
@@ -1648,229 +1933,414 @@ def _attempt_partial_take_profit(*, user_id: int, symbol: str, symbol_for_exec:
     return True
 
 
-def _arm_break_even_stop(*, user_id: int, symbol: str, symbol_for_exec: str, direction: str, entry_price: float, break_even_offset_price: float) -> bool:
-    try:
-        size_signed = float(get_open_position_size(user_id, symbol_for_exec) or 0.0)
-    except Exception:
-        size_signed = 0.0
-    qty = abs(size_signed)
-    if qty <= 0.0:
-        return False
-    try:
-        cancel_all_orders_for_symbol(user_id, symbol_for_exec)
-    except Exception:
-        pass
-    ok = _ensure_exchange_stop_loss(
-        user_id=user_id,
-        symbol=symbol,
-        symbol_for_exec=symbol_for_exec,
-        direction=direction,
-        entry_price=float(entry_price),
-        qty_coin=float(qty),
-        sl_price_pct=float(break_even_offset_price),
-        context="BREAK_EVEN",
-    )
-    if ok:
-        be_abs = _pct_to_abs_price(entry_price, float(break_even_offset_price), direction, kind="force_min_profit")
-        log(f"BREAK_EVEN_ARMED user={user_id} symbol={symbol} dir={direction} be_offset_pct={float(break_even_offset_price):.6f} break_even_price={be_abs:.8f}", "WARN")
-    return ok
+def _stop_is_tighter(direction: str, new_px: float, cur_px: float) -> bool:
+    if cur_px <= 0.0:
+        return new_px > 0.0
+    return new_px > cur_px if direction == "long" else new_px < cur_px
 
 
-def _manage_trade_until_close(
+def _move_exchange_stop(
     *,
     user_id: int,
     symbol: str,
     symbol_for_exec: str,
     direction: str,
-    side: str,
-    opposite: str,
-    entry_price: float,
-    qty_coin_for_log: float,
-    qty_usdc_for_profit: float,
-    best_score: float,
-    entry_strength: float,
-    mode: str,
-    sl_price_pct: float | None = None,
-    mgmt: Optional[dict[str, Any]] = None,
-) -> None:
-    """Gestiona una posición (SL + trailing) hasta cerrarla. Corre en thread daemon.
-    mode: 'NEW' o 'ADOPT' para logs.
+    raw_trigger: float,
+    current_stop: float,
+    context: str,
+) -> float:
+    """Lleva el stop residente a raw_trigger (ajustado a las reglas del asset).
+
+    modify sobre el oid vivo; si no hay stop o el modify falla: coloca el nuevo y
+    luego cancela el viejo (nunca queda la posición sin stop). Nunca afloja el stop:
+    se compara contra current_stop y contra el triggerPx de la orden viva (la memoria
+    puede estar atrasada tras un relanzamiento del manager).
+    Retorna el nivel del stop vivo tras la operación (0.0 si no se movió ni se confirmó).
     """
-    # Aceptamos sl_price_pct para compatibilidad con el launcher del manager.
-    # El stop real sigue viviendo en el exchange; aquí no cambiamos la lógica de cierre.
-    _ = sl_price_pct
-    active_runtime = _get_active_trade(user_id) or {}
-    if mgmt is None:
-        mgmt = _coalesce_management_params(active_trade=active_runtime, entry_strength=float(entry_strength), best_score=float(best_score))
-    else:
-        mgmt = _coalesce_management_params(signal=mgmt, active_trade=active_runtime, entry_strength=float(entry_strength), best_score=float(best_score))
-    tp_activate_price = float(mgmt["tp_activate_price"])
-    trail_retrace_price = float(mgmt["trail_retrace_price"])
-    strategy_managed = str(mgmt.get("bucket") or "") != "exchange_only"
+    try:
+        qty = abs(float(get_open_position_size(user_id, symbol_for_exec) or 0.0))
+    except Exception:
+        qty = 0.0
+    if qty <= 0.0 or raw_trigger <= 0.0:
+        return 0.0
+    try:
+        current_px = float(get_price(symbol_for_exec) or 0.0)
+    except Exception:
+        current_px = 0.0
+    plan = _stop_trigger_plan(symbol_for_exec=symbol_for_exec, raw_trigger=float(raw_trigger), current_px=current_px, direction=direction)
+    trigger = float(plan[0]) if plan else float(raw_trigger)
+    if not _stop_is_tighter(direction, trigger, float(current_stop)):
+        return 0.0
+
+    live = None
+    try:
+        live = find_stop_order(user_id, symbol_for_exec, direction)
+    except Exception as e:
+        log(f"{context}: lookup stop vivo falló symbol={symbol} err={e}", "WARN")
+    old_oid = live.get("oid") if isinstance(live, dict) else None
+    try:
+        live_px = float((live or {}).get("triggerPx") or 0.0)
+    except Exception:
+        live_px = 0.0
+    if live_px > 0.0 and not _stop_is_tighter(direction, trigger, live_px):
+        log(
+            f"{context}: stop vivo ya igual o más ajustado symbol={symbol} dir={direction} "
+            f"live={live_px:.8f} pedido={trigger:.8f} memoria={float(current_stop):.8f} -> sin cambios",
+            "INFO",
+        )
+        return live_px
 
-    # El stop real vive en el exchange; el manager no usa un SL interno fijo para evitar inconsistencias.
+    if old_oid is not None:
+        resp = modify_stop_loss(user_id, symbol_for_exec, old_oid, direction, qty, trigger)
+        if isinstance(resp, dict) and resp.get("ok"):
+            log(
+                f"EXCHANGE_STOP_MOVED[{context}] user={user_id} symbol={symbol} dir={direction} via=modify "
+                f"from={float(current_stop):.8f} to={trigger:.8f} trigger={resp.get('triggerPx')} qty={qty:.8f}",
+                "INFO",
+            )
+            return trigger
+        log(f"{context}: modify stop falló symbol={symbol} oid={old_oid} resp={(resp or {}).get('reason') if isinstance(resp, dict) else resp} -> cancel-replace", "WARN")
+
+    resp = place_stop_loss(user_id=user_id, symbol=symbol_for_exec, position_side=direction, qty=qty, trigger_price=trigger)
+    if not (isinstance(resp, dict) and resp.get("ok")):
+        log(f"{context}: no se pudo colocar stop nuevo symbol={symbol} trigger={trigger:.8f} resp={resp}", "ERROR")
+        return 0.0
+    if old_oid is not None:
+        try:
+            cancel_order(user_id, symbol_for_exec, old_oid)
+        except Exception as e:
+            log(f"{context}: cancel stop viejo falló symbol={symbol} oid={old_oid} err={e}", "WARN")
     log(
-        f"🧠 MANAGER[{mode}] start user={user_id} {symbol} dir={direction} "
-        f"entry={entry_price} qty_coin~{qty_coin_for_log} notional~{qty_usdc_for_profit:.4f} "
-        f"(bucket={mgmt['bucket']}, partial_tp={float(mgmt.get('partial_tp_activation_price', 0.0)):.6f}, TP_activa={tp_activate_price:.6f}, retrace={trail_retrace_price:.6f}, "
-        f"be_act={float(mgmt.get('break_even_activation_price', 0.0)):.6f}, be_offset={float(mgmt.get('break_even_offset_price', 0.0)):.6f}, "
-        f"force_min_profit={float(mgmt['force_min_profit_price']):.6f}, force_min_strength={float(mgmt['force_min_strength']):.4f})",
-        "WARN",
+        f"EXCHANGE_STOP_MOVED[{context}] user={user_id} symbol={symbol} dir={direction} via=replace "
+        f"from={float(current_stop):.8f} to={trigger:.8f} trigger={resp.get('triggerPx')} qty={qty:.8f}",
+        "INFO",
     )
-    _log_trade_plan(
-        context=(f"MANAGER_{mode}_FROZEN" if _has_frozen_trade_plan(active_runtime) else f"MANAGER_{mode}"),
+    return trigger
+
+
+def _arm_break_even_stop(*, user_id: int, symbol: str, symbol_for_exec: str, direction: str, entry_price: float, break_even_offset_price: float) -> bool:
+    try:
+        size_signed = float(get_open_position_size(user_id, symbol_for_exec) or 0.0)
+    except Exception:
+        size_signed = 0.0
+    qty = abs(size_signed)
+    if qty <= 0.0:
+        return False
+    try:
+        cancel_all_orders_for_symbol(user_id, symbol_for_exec)
+    except Exception:
+        pass
+    ok = _ensure_exchange_stop_loss(
         user_id=user_id,
         symbol=symbol,
+        symbol_for_exec=symbol_for_exec,
         direction=direction,
         entry_price=float(entry_price),
-        sl_price_pct=float((_get_active_trade(user_id) or {}).get("sl_price_pct", sl_price_pct or 0.0) or 0.0),
-        tp_activate_price=float(tp_activate_price),
-        trail_retrace_price=float(trail_retrace_price),
-        force_min_profit_price=float(mgmt["force_min_profit_price"]),
-        force_min_strength=float(mgmt["force_min_strength"]),
-        qty_coin=float(qty_coin_for_log),
-        notional_usdc=float(qty_usdc_for_profit),
-        bucket=str(mgmt.get("bucket", "")),
+        qty_coin=float(qty),
+        sl_price_pct=float(break_even_offset_price),
+        context="BREAK_EVEN",
     )
+    if ok:
+        be_abs = _pct_to_abs_price(entry_price, float(break_even_offset_price), direction, kind="force_min_profit")
+        log(f"BREAK_EVEN_ARMED user={user_id} symbol={symbol} dir={direction} be_offset_pct={float(break_even_offset_price):.6f} break_even_price={be_abs:.8f}", "WARN")
+    return ok
 
-    trailing_active = bool(active_runtime.get("trailing_active", False))
-    partial_tp_taken = bool(active_runtime.get("partial_tp_taken", False))
-    break_even_armed = bool(active_runtime.get("break_even_armed", False))
-    partial_tp_activation_price = float((active_runtime.get("partial_tp_activation_price", mgmt.get("partial_tp_activation_price", 0.0)) or 0.0))
-    partial_tp_close_fraction = float((active_runtime.get("partial_tp_close_fraction", mgmt.get("partial_tp_close_fraction", 0.0)) or 0.0))
-    break_even_activation_price = float((active_runtime.get("break_even_activation_price", mgmt.get("break_even_activation_price", 0.0)) or 0.0))
-    break_even_offset_price = float((active_runtime.get("break_even_offset_price", mgmt.get("break_even_offset_price", 0.0)) or 0.0))
-    best_pnl_pct = float(active_runtime.get("best_pnl_pct", 0.0) or 0.0)
-    trailing_stop_pnl = active_runtime.get("trailing_stop_pnl", None)
-    try:
-        trailing_stop_pnl = float(trailing_stop_pnl) if trailing_stop_pnl is not None else None
-    except Exception:
-        trailing_stop_pnl = None
-    peak_price = float(active_runtime.get("peak_price", entry_price) or entry_price)
-    strength_check_ts = float(active_runtime.get("strength_check_ts", 0.0) or 0.0)
-    last_pos_sync_ts = 0.0
-    last_runtime_flush_ts = 0.0
 
-    if trailing_active:
+class _TradeManagerSession:
+    """Gestión de una posición (SL + trailing) hasta cerrarla.
+
+    No tiene loop propio: el PositionSupervisor llama tick() con el precio del
+    tablero compartido (y sync=True cada POSITION_SYNC_INTERVAL) y finish() una
+    vez que tick() devuelve True.
+    mode: 'NEW' o 'ADOPT' para logs.
+    """
+
+    def __init__(
+        self,
+        *,
+        user_id: int,
+        symbol: str,
+        symbol_for_exec: str,
+        direction: str,
+        side: str,
+        opposite: str,
+        entry_price: float,
+        qty_coin_for_log: float,
+        qty_usdc_for_profit: float,
+        best_score: float,
+        entry_strength: float,
+        mode: str,
+        sl_price_pct: float | None = None,
+        mgmt: Optional[dict[str, Any]] = None,
+    ) -> None:
+        # El stop real sigue viviendo en el exchange; aquí no cambiamos la lógica de cierre.
+        active_runtime = _get_active_trade(user_id) or {}
+        if mgmt is None:
+            mgmt = _coalesce_management_params(active_trade=active_runtime, entry_strength=float(entry_strength), best_score=float(best_score))
+        else:
+            mgmt = _coalesce_management_params(signal=mgmt, active_trade=active_runtime, entry_strength=float(entry_strength), best_score=float(best_score))
+
+        self.user_id = user_id
+        self.symbol = symbol
+        self.symbol_for_exec = symbol_for_exec
+        self.coin = _norm_coin(symbol_for_exec)
+        self.direction = direction
+        self.side = side
+        self.opposite = opposite
+        self.entry_price = float(entry_price)
+        self.qty_coin_for_log = float(qty_coin_for_log)
+        self.qty_usdc_for_profit = float(qty_usdc_for_profit)
+        self.best_score = float(best_score)
+        self.mode = mode
+        self.sl_price_pct = sl_price_pct
+        self.mgmt = mgmt
+        self.sync_interval = float(POSITION_SYNC_INTERVAL)
+        self.tp_activate_price = float(mgmt["tp_activate_price"])
+        self.trail_retrace_price = float(mgmt["trail_retrace_price"])
+        self.strategy_managed = str(mgmt.get("bucket") or "") != "exchange_only"
+
         log(
-            f"MANAGER[{mode}] restored runtime user={user_id} symbol={symbol} trailing_active={trailing_active} "
-            f"best_pnl_pct={best_pnl_pct:.6f} trailing_stop_pnl={float(trailing_stop_pnl or 0.0):.6f} peak_price={peak_price:.8f}",
+            f"🧠 MANAGER[{mode}] start user={user_id} {symbol} dir={direction} "
+            f"entry={entry_price} qty_coin~{qty_coin_for_log} notional~{qty_usdc_for_profit:.4f} "
+            f"(bucket={mgmt['bucket']}, partial_tp={float(mgmt.get('partial_tp_activation_price', 0.0)):.6f}, TP_activa={self.tp_activate_price:.6f}, retrace={self.trail_retrace_price:.6f}, "
+            f"be_act={float(mgmt.get('break_even_activation_price', 0.0)):.6f}, be_offset={float(mgmt.get('break_even_offset_price', 0.0)):.6f}, "
+            f"force_min_profit={float(mgmt['force_min_profit_price']):.6f}, force_min_strength={float(mgmt['force_min_strength']):.4f})",
             "WARN",
         )
+        _log_trade_plan(
+            context=(f"MANAGER_{mode}_FROZEN" if _has_frozen_trade_plan(active_runtime) else f"MANAGER_{mode}"),
+            user_id=user_id,
+            symbol=symbol,
+            direction=direction,
+            entry_price=float(entry_price),
+            sl_price_pct=float((_get_active_trade(user_id) or {}).get("sl_price_pct", sl_price_pct or 0.0) or 0.0),
+            tp_activate_price=float(self.tp_activate_price),
+            trail_retrace_price=float(self.trail_retrace_price),
+            force_min_profit_price=float(mgmt["force_min_profit_price"]),
+            force_min_strength=float(mgmt["force_min_strength"]),
+            qty_coin=float(qty_coin_for_log),
+            notional_usdc=float(qty_usdc_for_profit),
+            bucket=str(mgmt.get("bucket", "")),
+        )
 
-    _update_active_trade_fields(
-        user_id,
-        trailing_active=bool(trailing_active),
-        best_pnl_pct=float(best_pnl_pct),
-        trailing_stop_pnl=trailing_stop_pnl,
-        peak_price=float(peak_price),
-        last_price=float(entry_price),
-        last_pnl_pct=0.0,
-        strength_check_ts=float(strength_check_ts),
-        manager_heartbeat_ts=time.time(),
-    )
+        self.exit_state = init_exit_state(
+            direction=direction,
+            entry_price=float(entry_price),
+            mgmt=mgmt,
+            runtime=active_runtime,
+            strategy_managed=self.strategy_managed,
+            sl_price_pct=float(active_runtime.get("sl_price_pct", sl_price_pct or 0.0) or 0.0),
+            force_check_interval=float(TP_FORCE_CHECK_INTERVAL),
+        )
+        self.last_runtime_flush_ts = 0.0
+        # Stop residente ya movido por trailing/BE (se conserva al relanzar el manager
+        # sobre la misma posición; ver _start_trade_manager_locked).
+        self.exchange_stop_px = float(active_runtime.get("exchange_stop_price") or 0.0) if EXCHANGE_TRAILING_STOP else 0.0
+        self.exchange_stop_moved_ts = 0.0
 
-    exit_price = entry_price
-    exit_reason = "UNKNOWN"
-    exit_pnl_pct = 0.0
+        if self.exit_state["trailing_active"]:
+            log(
+                f"MANAGER[{mode}] restored runtime user={user_id} symbol={symbol} trailing_active={self.exit_state['trailing_active']} "
+                f"best_pnl_pct={self.exit_state['best_pnl_pct']:.6f} trailing_stop_pnl={float(self.exit_state['trailing_stop_pnl'] or 0.0):.6f} "
+                f"peak_price={self.exit_state['peak_price']:.8f}",
+                "WARN",
+            )
 
-    while True:
-        now_ts = time.time()
-        if (now_ts - float(last_pos_sync_ts)) >= float(POSITION_SYNC_INTERVAL):
-            last_pos_sync_ts = now_ts
-            try:
-                live_size_signed = float(get_open_position_size(user_id, symbol_for_exec) or 0.0)
-            except Exception as e:
-                live_size_signed = None
-                log(f"MANAGER[{mode}] sync size error {symbol} err={e}", "WARN")
-
-            if live_size_signed == 0.0:
-                exit_reason = "EXCHANGE_POSITION_CLOSED"
-                exit_price = float(get_price(symbol_for_exec) or entry_price or 0.0)
-                if entry_price > 0 and exit_price > 0:
-                    if direction == "long":
-                        exit_pnl_pct = (exit_price - entry_price) / entry_price
-                    else:
-                        exit_pnl_pct = (entry_price - exit_price) / entry_price
-                sl_abs = _pct_to_abs_price(entry_price, float((_get_active_trade(user_id) or {}).get("sl_price_pct", sl_price_pct or 0.0) or 0.0), direction, kind="sl")
-                log(
-                    f"EXCHANGE_POSITION_CLOSED[{mode}] user={user_id} symbol={symbol} dir={direction} entry={float(entry_price):.8f} "
-                    f"observed_exit_price={float(exit_price):.8f} observed_pnl_pct={float(exit_pnl_pct):.6f} configured_sl_price={sl_abs:.8f}",
-                    "CRITICAL",
-                )
-                break
+        _update_active_trade_fields(
+            user_id,
+            trailing_active=bool(self.exit_state["trailing_active"]),
+            best_pnl_pct=float(self.exit_state["best_pnl_pct"]),
+            trailing_stop_pnl=self.exit_state["trailing_stop_pnl"],
+            peak_price=float(self.exit_state["peak_price"]),
+            last_price=float(entry_price),
+            last_pnl_pct=0.0,
+            strength_check_ts=float(self.exit_state["strength_check_ts"]),
+            manager_heartbeat_ts=time.time(),
+        )
+
+        self.last_px = 0.0
+        self.exit_price = self.entry_price
+        self.exit_reason = "UNKNOWN"
+        self.exit_pnl_pct = 0.0
+
+    def _strength_probe(self) -> Any:
+        return get_entry_signal(self.symbol)
+
+    def stop_price(self) -> float:
+        """Stop vivo en el exchange (SL inicial o BE armado); el supervisor espacia los syncs según su distancia."""
+        base = exchange_stop_price(self.exit_state)
+        if self.exchange_stop_px > 0.0 and _stop_is_tighter(self.direction, self.exchange_stop_px, base):
+            return self.exchange_stop_px
+        return base
+
+    def _advance_exchange_stop(self, target_px: float, now_ts: float, *, context: str, force: bool = False) -> bool:
+        """Acerca el stop residente a target_px. True si ya está ahí o más ajustado.
+        Sin force, solo con paso >= EXCHANGE_TRAIL_MIN_STEP_PCT y cada EXCHANGE_TRAIL_MIN_INTERVAL_SECONDS."""
+        cur = self.stop_price()
+        if target_px <= 0.0 or not _stop_is_tighter(self.direction, target_px, cur):
+            return True
+        if not force:
+            if cur > 0.0 and abs(target_px - cur) / target_px < float(EXCHANGE_TRAIL_MIN_STEP_PCT):
+                return False
+            if (now_ts - self.exchange_stop_moved_ts) < float(EXCHANGE_TRAIL_MIN_INTERVAL_SECONDS):
+                return False
+        self.exchange_stop_moved_ts = now_ts
+        placed = _move_exchange_stop(
+            user_id=self.user_id,
+            symbol=self.symbol,
+            symbol_for_exec=self.symbol_for_exec,
+            direction=self.direction,
+            raw_trigger=float(target_px),
+            current_stop=cur,
+            context=context,
+        )
+        if placed <= 0.0:
+            return False
+        self.exchange_stop_px = placed
+        _update_active_trade_fields(self.user_id, exchange_stop_price=float(placed))
+        return True
+
+    def trigger_levels(self) -> Optional[tuple]:
+        """Niveles para el TriggerIndex del supervisor: los de gestión (exit_manager)
+        más, con stream live, los triggers vivos en el exchange (stop / TP) según el
+        ledger. Cruzar uno despierta la sesión y el tick confirma el cierre; un trigger
+        ejecutado además pide sync vía orderUpdates (_on_user_order_updates)."""
+        up, down, wake_ts = trigger_prices(self.exit_state)
+        ledger = _user_events.live_ledger(self.user_id)
+        if ledger is None:
+            return up, down, wake_ts
+        ref = self.last_px if self.last_px > 0 else self.entry_price
+        for order in ledger.open_orders(self.symbol_for_exec):
+            px = float(order.get("trigger_px") or 0.0)
+            if not order.get("is_trigger") or px <= 0:
+                continue
+            if px > ref:
+                up = px if up is None else min(up, px)
+            else:
+                down = px if down is None else max(down, px)
+        return up, down, wake_ts
+
+    def _ledger_flat(self) -> bool:
+        """Lectura en memoria del stream: True si ya marca la posición en 0."""
+        ledger = _user_events.live_ledger(self.user_id)
+        return ledger is not None and ledger.position_size(self.symbol_for_exec) == 0.0
+
+    def _sync_position(self) -> bool:
+        """True si el exchange ya no tiene la posición.
+
+        Un ledger con size != 0 basta para seguir; el "flat" siempre se confirma con
+        clearinghouseState antes de cerrar (finish cancela órdenes, incluido el stop).
+        """
+        ledger = _user_events.live_ledger(self.user_id)
+        ledger_size = ledger.position_size(self.symbol_for_exec) if ledger is not None else None
+        if ledger_size is not None and ledger_size != 0.0:
+            return False
+        try:
+            live_size_signed = _exchange_position_size(self.user_id, self.symbol_for_exec)
+        except Exception as e:
+            log(f"MANAGER[{self.mode}] sync size error {self.symbol} err={e}", "WARN")
+            return False
+
+        if live_size_signed is None:
+            log(f"MANAGER[{self.mode}] sync size no confirmado {self.symbol} (clearinghouseState ilegible)", "WARN")
+            return False
+        if live_size_signed != 0.0:
+            if ledger_size == 0.0:
+                log(f"MANAGER[{self.mode}] ledger flat pero exchange szi={live_size_signed} {self.symbol} — se sigue gestionando", "WARN")
+            return False
+
+        entry_price = self.entry_price
+        self.exit_reason = "EXCHANGE_POSITION_CLOSED"
+        self.exit_price = 0.0
+        ledger = _user_events.live_ledger(self.user_id)
+        opened_ms = _active_trade_opened_since_ms(_get_active_trade(self.user_id))
+        if ledger is not None and opened_ms is not None:
+            ev_since = max(0, int(opened_ms) - USER_EVENTS_CLOCK_SKEW_MS)
+            if ledger.stop_triggered(self.symbol_for_exec, ev_since) is not None:
+                self.exit_reason = "EXCHANGE_STOP_TRIGGERED"
+            ev = ledger.closed_pnl(self.symbol_for_exec, ev_since)
+            if ev is not None and float(ev.get("exit_px") or 0.0) > 0:
+                self.exit_price = float(ev["exit_px"])
+        if self.exit_price <= 0:
+            self.exit_price = float(get_price(self.symbol_for_exec) or entry_price or 0.0)
+        if entry_price > 0 and self.exit_price > 0:
+            self.exit_pnl_pct = pnl_pct_for(self.direction, entry_price, self.exit_price)
+        sl_abs = _pct_to_abs_price(entry_price, float((_get_active_trade(self.user_id) or {}).get("sl_price_pct", self.sl_price_pct or 0.0) or 0.0), self.direction, kind="sl")
+        log(
+            f"EXCHANGE_POSITION_CLOSED[{self.mode}] user={self.user_id} symbol={self.symbol} dir={self.direction} entry={float(entry_price):.8f} "
+            f"observed_exit_price={float(self.exit_price):.8f} observed_pnl_pct={float(self.exit_pnl_pct):.6f} configured_sl_price={sl_abs:.8f}",
+            "CRITICAL",
+        )
+        return True
+
+    def tick(self, price: float, now_ts: float, sync: bool = False) -> bool:
+        """Procesa un tick del tablero. Retorna True cuando hay que cerrar (finish)."""
+        user_id = self.user_id
+        symbol = self.symbol
+        direction = self.direction
+        entry_price = self.entry_price
+        mode = self.mode
+        mgmt = self.mgmt
+        exit_state = self.exit_state
+
+        # El stream (si está live) detecta el cierre en el mismo tick, sin esperar al sync.
+        if (sync or self._ledger_flat()) and self._sync_position():
+            return True
 
-        price = float(get_price(symbol_for_exec) or 0.0)
+        price = float(price or 0.0)
         if price <= 0:
-            time.sleep(PRICE_CHECK_INTERVAL)
-            continue
+            return False
+        self.last_px = price
 
-        if direction == "long":
-            pnl_pct = (price - entry_price) / entry_price
-        else:
-            pnl_pct = (entry_price - price) / entry_price
+        pnl_pct = pnl_pct_for(direction, entry_price, price)
 
-        if (now_ts - float(last_runtime_flush_ts)) >= float(max(POSITION_SYNC_INTERVAL, 2.0)):
-            last_runtime_flush_ts = now_ts
+        if (now_ts - float(self.last_runtime_flush_ts)) >= float(max(POSITION_SYNC_INTERVAL, 2.0)):
+            self.last_runtime_flush_ts = now_ts
             _update_active_trade_fields(
                 user_id,
                 last_price=float(price),
                 last_pnl_pct=float(pnl_pct),
-                trailing_active=bool(trailing_active),
-                partial_tp_taken=bool(partial_tp_taken),
-                break_even_armed=bool(break_even_armed),
-                best_pnl_pct=float(best_pnl_pct),
-                trailing_stop_pnl=(float(trailing_stop_pnl) if trailing_stop_pnl is not None else None),
-                peak_price=float(peak_price),
-                strength_check_ts=float(strength_check_ts),
+                **exit_runtime_fields(exit_state),
                 manager_heartbeat_ts=time.time(),
             )
 
-        # El SL de emergencia está en el exchange. Aquí solo gestionamos TP dinámico / trailing.
-        should_force_close = False
-        force_reason = ""
-        live_strength = 0.0
-        if strategy_managed:
-            should_force_close, force_reason, live_strength, strength_check_ts = _should_close_on_strength_loss(
-                symbol=symbol,
-                direction=direction,
-                pnl_pct=float(pnl_pct),
-                entry_strength=float(entry_strength),
-                force_min_profit_price=float(mgmt["force_min_profit_price"]),
-                force_min_strength=float(mgmt["force_min_strength"]),
-                last_check_ts=float(strength_check_ts),
-            )
-            _update_active_trade_fields(
-                user_id,
-                strength_check_ts=float(strength_check_ts),
-                last_price=float(price),
-                last_pnl_pct=float(pnl_pct),
-                manager_heartbeat_ts=time.time(),
+        # El SL de emergencia está en el exchange. Aquí solo gestionamos TP dinámico / trailing
+        # (reglas en app.exit_manager, compartidas con el replay offline).
+        decision = step_exit_state(exit_state, price=price, now_ts=time.time(), strength_probe=self._strength_probe)
+        if not self.strategy_managed:
+            return False
+
+        _update_active_trade_fields(
+            user_id,
+            strength_check_ts=float(exit_state["strength_check_ts"]),
+            last_price=float(price),
+            last_pnl_pct=float(pnl_pct),
+            manager_heartbeat_ts=time.time(),
+        )
+        if decision["exit"] and decision["exit_reason"] != "TRAIL":
+            self.exit_price = price
+            self.exit_pnl_pct = pnl_pct
+            self.exit_reason = decision["exit_reason"]
+            force_trigger_price = _pct_to_abs_price(entry_price, float(mgmt["force_min_profit_price"]), direction, kind="force_min_profit")
+            log(
+                f"FORCE_EXIT[{mode}] user={user_id} symbol={symbol} dir={direction} entry={float(entry_price):.8f} current={float(price):.8f} "
+                f"pnl_pct={pnl_pct:.6f} live_strength={float(decision['live_strength']):.4f} trigger_profit_pct={float(mgmt['force_min_profit_price']):.6f} "
+                f"trigger_profit_price={force_trigger_price:.8f} min_strength={float(mgmt['force_min_strength']):.4f} reason={self.exit_reason}",
+                "WARN",
             )
-            if should_force_close:
-                exit_price = price
-                exit_pnl_pct = pnl_pct
-                exit_reason = force_reason
-                force_trigger_price = _pct_to_abs_price(entry_price, float(mgmt["force_min_profit_price"]), direction, kind="force_min_profit")
-                log(
-                    f"FORCE_EXIT[{mode}] user={user_id} symbol={symbol} dir={direction} entry={float(entry_price):.8f} current={float(price):.8f} "
-                    f"pnl_pct={pnl_pct:.6f} live_strength={live_strength:.4f} trigger_profit_pct={float(mgmt['force_min_profit_price']):.6f} "
-                    f"trigger_profit_price={force_trigger_price:.8f} min_strength={float(mgmt['force_min_strength']):.4f} reason={force_reason}",
-                    "WARN",
-                )
-                break
+            return True
 
-        if strategy_managed and (not partial_tp_taken) and partial_tp_activation_price > 0.0 and pnl_pct >= partial_tp_activation_price:
+        if decision["partial_tp"]:
             partial_done = _attempt_partial_take_profit(
                 user_id=user_id,
                 symbol=symbol,
-                symbol_for_exec=symbol_for_exec,
+                symbol_for_exec=self.symbol_for_exec,
                 direction=direction,
-                opposite=opposite,
-                close_fraction=float(partial_tp_close_fraction),
+                opposite=self.opposite,
+                close_fraction=float(exit_state["partial_tp_close_fraction"]),
             )
             if partial_done:
-                partial_tp_taken = True
+                mark_partial_tp_taken(exit_state)
                 _update_active_trade_fields(
                     user_id,
                     partial_tp_taken=True,
@@ -1879,17 +2349,21 @@ def _manage_trade_until_close(
                     manager_heartbeat_ts=time.time(),
                 )
 
-        if strategy_managed and (not break_even_armed) and break_even_activation_price > 0.0 and pnl_pct >= break_even_activation_price:
-            be_done = _arm_break_even_stop(
-                user_id=user_id,
-                symbol=symbol,
-                symbol_for_exec=symbol_for_exec,
-                direction=direction,
-                entry_price=float(entry_price),
-                break_even_offset_price=float(break_even_offset_price),
-            )
+        if decision["break_even"]:
+            if EXCHANGE_TRAILING_STOP:
+                be_px = price_for_pnl(direction, entry_price, -float(exit_state["break_even_offset_price"]))
+                be_done = self._advance_exchange_stop(be_px, now_ts, context="BREAK_EVEN", force=True)
+            else:
+                be_done = _arm_break_even_stop(
+                    user_id=user_id,
+                    symbol=symbol,
+                    symbol_for_exec=self.symbol_for_exec,
+                    direction=direction,
+                    entry_price=float(entry_price),
+                    break_even_offset_price=float(exit_state["break_even_offset_price"]),
+                )
             if be_done:
-                break_even_armed = True
+                mark_break_even_armed(exit_state)
                 _update_active_trade_fields(
                     user_id,
                     break_even_armed=True,
@@ -1898,131 +2372,145 @@ def _manage_trade_until_close(
                     manager_heartbeat_ts=time.time(),
                 )
 
-        if strategy_managed and not trailing_active:
-            if pnl_pct >= tp_activate_price:
-                trailing_active = True
-                best_pnl_pct = pnl_pct
-                peak_price = float(price)
-                trailing_stop_pnl = best_pnl_pct - float(trail_retrace_price)
-                trailing_exit_price = _trail_exit_price_from_price(price, float(trail_retrace_price), direction)
-                _update_active_trade_fields(
-                    user_id,
-                    trailing_active=True,
-                    partial_tp_taken=bool(partial_tp_taken),
-                    break_even_armed=bool(break_even_armed),
-                    best_pnl_pct=float(best_pnl_pct),
-                    trailing_stop_pnl=float(trailing_stop_pnl),
-                    peak_price=float(peak_price),
-                    last_price=float(price),
-                    last_pnl_pct=float(pnl_pct),
-                    strength_check_ts=float(strength_check_ts),
-                    manager_heartbeat_ts=time.time(),
-                )
-                tp_activation_abs = _pct_to_abs_price(entry_price, float(tp_activate_price), direction, kind="tp_activate")
+        if decision["trail_event"]:
+            _update_active_trade_fields(
+                user_id,
+                **exit_runtime_fields(exit_state),
+                last_price=float(price),
+                last_pnl_pct=float(pnl_pct),
+                manager_heartbeat_ts=time.time(),
+            )
+            trailing_exit_price = _trail_exit_price_from_price(price, float(self.trail_retrace_price), direction)
+            if decision["trail_event"] == "ACTIVATED":
+                tp_activation_abs = _pct_to_abs_price(entry_price, float(self.tp_activate_price), direction, kind="tp_activate")
                 log(
                     f"TP_ACTIVATED[{mode}] user={user_id} symbol={symbol} dir={direction} entry={float(entry_price):.8f} current={float(price):.8f} "
-                    f"tp_activation_pct={float(tp_activate_price):.6f} tp_activation_price={tp_activation_abs:.8f} "
-                    f"peak_price={float(price):.8f} trailing_exit_price={trailing_exit_price:.8f} retrace_pct={float(trail_retrace_price):.6f}",
+                    f"tp_activation_pct={float(self.tp_activate_price):.6f} tp_activation_price={tp_activation_abs:.8f} "
+                    f"peak_price={float(price):.8f} trailing_exit_price={trailing_exit_price:.8f} retrace_pct={float(self.trail_retrace_price):.6f}",
                     "WARN",
                 )
-        elif strategy_managed:
-            if pnl_pct > best_pnl_pct:
-                best_pnl_pct = pnl_pct
-                peak_price = float(price)
-                trailing_stop_pnl = best_pnl_pct - float(trail_retrace_price)
-                trailing_exit_price = _trail_exit_price_from_price(price, float(trail_retrace_price), direction)
-                _update_active_trade_fields(
-                    user_id,
-                    trailing_active=True,
-                    partial_tp_taken=bool(partial_tp_taken),
-                    break_even_armed=bool(break_even_armed),
-                    best_pnl_pct=float(best_pnl_pct),
-                    trailing_stop_pnl=float(trailing_stop_pnl),
-                    peak_price=float(peak_price),
-                    last_price=float(price),
-                    last_pnl_pct=float(pnl_pct),
-                    strength_check_ts=float(strength_check_ts),
-                    manager_heartbeat_ts=time.time(),
-                )
+            else:
                 log(
                     f"TRAIL_UPDATE[{mode}] user={user_id} symbol={symbol} dir={direction} peak_price={float(price):.8f} "
-                    f"best_pnl_pct={best_pnl_pct:.6f} retrace_pct={float(trail_retrace_price):.6f} trailing_exit_price={trailing_exit_price:.8f}",
+                    f"best_pnl_pct={exit_state['best_pnl_pct']:.6f} retrace_pct={float(self.trail_retrace_price):.6f} trailing_exit_price={trailing_exit_price:.8f}",
                     "INFO",
                 )
+            if EXCHANGE_TRAILING_STOP and not decision["exit"] and exit_state["trailing_stop_pnl"] is not None:
+                self._advance_exchange_stop(
+                    price_for_pnl(direction, entry_price, float(exit_state["trailing_stop_pnl"])),
+                    now_ts,
+                    context="TRAIL",
+                )
 
-            if trailing_stop_pnl is not None and pnl_pct <= trailing_stop_pnl:
-                exit_price = price
-                exit_pnl_pct = pnl_pct
-                exit_reason = "TRAIL"
-                break
+        if decision["exit"]:
+            self.exit_price = price
+            self.exit_pnl_pct = pnl_pct
+            self.exit_reason = "TRAIL"
+            return True
 
-        time.sleep(PRICE_CHECK_INTERVAL)
+        return False
 
-    log(f"Cerrando posición (MANAGER[{mode}]) {symbol} reason={exit_reason}", "WARN")
+    def finish(self) -> None:
+        user_id = self.user_id
+        symbol = self.symbol
+        symbol_for_exec = self.symbol_for_exec
+        mode = self.mode
+        exit_reason = self.exit_reason
 
-    # Siempre intentamos cancelar órdenes pendientes (incluye el STOP en exchange si quedó resting).
-    try:
-        cancel_all_orders_for_symbol(user_id, symbol_for_exec)
-    except Exception as e:
-        log(f"MANAGER[{mode}] cancel_all_orders error {symbol} err={e}", "ERROR")
+        log(f"Cerrando posición (MANAGER[{mode}]) {symbol} reason={exit_reason}", "WARN")
+        _flush_active_trade(user_id)
+
+        # Antes de tocar órdenes (incluye el STOP en exchange) el size sale de
+        # clearinghouseState: sin lectura confirmada el stop se queda puesto.
+        try:
+            size_before = _exchange_position_size(user_id, symbol_for_exec)
+        except Exception as e:
+            log(f"MANAGER[{mode}] position read error {symbol} err={e}", "ERROR")
+            size_before = None
+        if size_before is None:
+            log(f"MANAGER[{mode}] {symbol}: posición no confirmada en exchange — no se cancelan órdenes (stop intacto)", "CRITICAL")
+            return
+
+        try:
+            cancel_all_orders_for_symbol(user_id, symbol_for_exec)
+        except Exception as e:
+            log(f"MANAGER[{mode}] cancel_all_orders error {symbol} err={e}", "ERROR")
 
-    try:
-        size_signed_now = float(get_open_position_size(user_id, symbol_for_exec) or 0.0)
-    except Exception:
         size_signed_now = 0.0
+        if size_before != 0.0:
+            # Relectura tras cancelar: el stop pudo ejecutarse entre medio.
+            try:
+                size_after = _exchange_position_size(user_id, symbol_for_exec)
+            except Exception:
+                size_after = None
+            size_signed_now = size_before if size_after is None else size_after
+
+        # Si ya no hay size, asumimos que el exchange la cerró (por STOP/liq/manual) y registramos el trade.
+        if size_signed_now == 0.0:
+            log(f"MANAGER[{mode}] {symbol}: size=0 al cerrar — asumiendo ya cerrado en exchange", "WARN")
+            _finalize_trade_close(
+                user_id=user_id,
+                symbol=symbol,
+                direction=self.direction,
+                side=self.side,
+                entry_price=float(self.entry_price),
+                exit_price=float(self.exit_price),
+                qty_coin=float(self.qty_coin_for_log),
+                qty_usdc_for_profit=float(self.qty_usdc_for_profit),
+                best_score=float(self.best_score),
+                exit_reason=str(exit_reason),
+                exit_pnl_pct=float(self.exit_pnl_pct),
+                source=f"MANAGER[{mode}]_EXCHANGE",
+            )
+            return
+
+        close_qty = abs(size_signed_now)
+        close_side = "sell" if size_signed_now > 0 else "buy"
+
+        close_resp = place_market_order(user_id, symbol_for_exec, close_side, close_qty, reduce_only=True)
+
+        if not close_resp or (not _resp_ok(close_resp)) or (not _is_filled_exchange_response(close_resp)):
+            log(f"MANAGER[{mode}]: cierre NO confirmado por exchange ({symbol}) — revisa en Hyperliquid", "CRITICAL")
+            return
+
+        # Limpieza: cancelar órdenes pendientes (incluye STOP en exchange) para evitar 'órdenes colgadas'
+        try:
+            cxl = cancel_all_orders_for_symbol(user_id, symbol_for_exec)
+            if isinstance(cxl, dict) and cxl.get("ok"):
+                log(f"Órdenes canceladas en exchange para {symbol} (MANAGER[{mode}])", "INFO")
+            else:
+                log(f"No se pudieron cancelar órdenes para {symbol} (MANAGER[{mode}]) resp={cxl}", "WARN")
+        except Exception as e:
+            log(f"Error cancelando órdenes para {symbol} (MANAGER[{mode}]) err={e}", "WARN")
 
-    # Si ya no hay size, asumimos que el exchange la cerró (por STOP/liq/manual) y registramos el trade.
-    if size_signed_now == 0.0:
-        log(f"MANAGER[{mode}] {symbol}: size=0 al cerrar — asumiendo ya cerrado en exchange", "WARN")
         _finalize_trade_close(
             user_id=user_id,
             symbol=symbol,
-            direction=direction,
-            side=side,
-            entry_price=float(entry_price),
-            exit_price=float(exit_price),
-            qty_coin=float(qty_coin_for_log),
-            qty_usdc_for_profit=float(qty_usdc_for_profit),
-            best_score=float(best_score),
+            direction=self.direction,
+            side=self.side,
+            entry_price=float(self.entry_price),
+            exit_price=float(self.exit_price),
+            qty_coin=float(close_qty),
+            qty_usdc_for_profit=float(self.qty_usdc_for_profit),
+            best_score=float(self.best_score),
             exit_reason=str(exit_reason),
-            exit_pnl_pct=float(exit_pnl_pct),
-            source=f"MANAGER[{mode}]_EXCHANGE",
+            exit_pnl_pct=float(self.exit_pnl_pct),
+            source=f"MANAGER[{mode}]",
         )
-        return
 
-    close_qty = abs(size_signed_now)
-    close_side = "sell" if size_signed_now > 0 else "buy"
 
-    close_resp = place_market_order(user_id, symbol_for_exec, close_side, close_qty, reduce_only=True)
-
-    if not close_resp or (not _resp_ok(close_resp)) or (not _is_filled_exchange_response(close_resp)):
-        log(f"MANAGER[{mode}]: cierre NO confirmado por exchange ({symbol}) — revisa en Hyperliquid", "CRITICAL")
-        return
-
-    # Limpieza: cancelar órdenes pendientes (incluye STOP en exchange) para evitar 'órdenes colgadas'
-    try:
-        cxl = cancel_all_orders_for_symbol(user_id, symbol_for_exec)
-        if isinstance(cxl, dict) and cxl.get("ok"):
-            log(f"Órdenes canceladas en exchange para {symbol} (MANAGER[{mode}])", "INFO")
-        else:
-            log(f"No se pudieron cancelar órdenes para {symbol} (MANAGER[{mode}]) resp={cxl}", "WARN")
-    except Exception as e:
-        log(f"Error cancelando órdenes para {symbol} (MANAGER[{mode}]) err={e}", "WARN")
+def _adopt_deadline_due(key: tuple, last_ts: float, interval: float) -> bool:
+    """True si venció el deadline `key`. Tras un restart se siembra desde el último ts persistido."""
+    if not last_ts:
+        return True
+    if _timers.active(key):
+        return False
+    remaining = float(interval) - (time.time() - float(last_ts))
+    if remaining > 0:
+        _timers.schedule(key, remaining)
+        return False
+    return True
 
-    _finalize_trade_close(
-        user_id=user_id,
-        symbol=symbol,
-        direction=direction,
-        side=side,
-        entry_price=float(entry_price),
-        exit_price=float(exit_price),
-        qty_coin=float(close_qty),
-        qty_usdc_for_profit=float(qty_usdc_for_profit),
-        best_score=float(best_score),
-        exit_reason=str(exit_reason),
-        exit_pnl_pct=float(exit_pnl_pct),
-        source=f"MANAGER[{mode}]",
-    )
 
 def _manage_existing_open_position(user_id: int) -> Optional[dict]:
     """Adopta una posición ya abierta en el exchange y asegura que el manager esté corriendo en background.
@@ -2131,7 +2619,7 @@ def _manage_existing_open_position(user_id: int) -> Optional[dict]:
 
     now_ts = time.time()
     last_plan_logged_at = float(snapshot.get("adopt_plan_logged_at", 0.0) or 0.0)
-    should_log_plan = (not same_position) or (not manager_running) or ((now_ts - last_plan_logged_at) >= float(ADOPT_RELOG_SECONDS))
+    should_log_plan = (not same_position) or (not manager_running) or _adopt_deadline_due(("adopt_relog", user_id), last_plan_logged_at, ADOPT_RELOG_SECONDS)
     if should_log_plan:
         _log_trade_plan(
             context=("ADOPT_FROZEN" if frozen_plan else "ADOPT"),
@@ -2149,10 +2637,11 @@ def _manage_existing_open_position(user_id: int) -> Optional[dict]:
             bucket=str(adopt_mgmt.get("bucket", "")),
         )
         _update_active_trade_fields(user_id, adopt_plan_logged_at=now_ts)
+        _timers.schedule(("adopt_relog", user_id), float(ADOPT_RELOG_SECONDS))
 
     last_sl_checked_at = float(snapshot.get("adopt_sl_checked_at", 0.0) or 0.0)
     sl_known_ok = bool(snapshot.get("sl_in_exchange", False))
-    should_recheck_sl = (not sl_known_ok) or (not same_position) or ((now_ts - last_sl_checked_at) >= float(ADOPT_SL_RECHECK_SECONDS))
+    should_recheck_sl = (not sl_known_ok) or (not same_position) or _adopt_deadline_due(("adopt_sl_recheck", user_id), last_sl_checked_at, ADOPT_SL_RECHECK_SECONDS)
 
     adopt_sl_ok = sl_known_ok
     if should_recheck_sl:
@@ -2171,6 +2660,7 @@ def _manage_existing_open_position(user_id: int) -> Optional[dict]:
             sl_in_exchange=bool(adopt_sl_ok),
             adopt_sl_checked_at=now_ts,
         )
+        _timers.schedule(("adopt_sl_recheck", user_id), float(ADOPT_SL_RECHECK_SECONDS))
         if adopt_sl_ok:
             log(
                 f"🛡️ ADOPT protección SL validada user={user_id} symbol={symbol} dir={direction} entry={float(entry_price):.8f} "
@@ -2188,7 +2678,7 @@ def _manage_existing_open_position(user_id: int) -> Optional[dict]:
         _update_active_trade_fields(user_id, manager_heartbeat_ts=now_ts, adopt_last_seen_ts=now_ts)
         return {"event": "MANAGER", "manager": {"symbol": symbol, "started": False, "already_running": True}}
 
-    started = _start_manager_thread(
+    started = _start_trade_manager(
         user_id=user_id,
         symbol=symbol,
         symbol_for_exec=symbol_for_exec,
@@ -2234,7 +2724,7 @@ def _candidate_rank_tuple(signal: dict, scanner_row: dict) -> tuple:
     )
 
 
-def _select_best_signal_from_scanner_shortlist(user_id: int, exclude_symbols: set[str]) -> dict | None:
+def _select_best_signal_from_scanner_shortlist(user_id: int, exclude_symbols: set[str], signal_cache: Optional[dict[str, Any]] = None) -> dict | None:
     limit = _signal_candidate_limit()
     shortlist = get_ranked_symbols(exclude_symbols=exclude_symbols, limit=limit)
     if not shortlist:
@@ -2249,11 +2739,17 @@ def _select_best_signal_from_scanner_shortlist(user_id: int, exclude_symbols: se
         if not symbol:
             continue
 
-        try:
-            signal = get_entry_signal(symbol)
-        except Exception as e:
-            blocked_samples.append(f"{symbol}:STRATEGY_EXCEPTION:{str(e)[:80]}")
-            continue
+        # Batch (fan-out): la señal de un símbolo se evalúa una sola vez para todos los usuarios.
+        if signal_cache is not None and symbol in signal_cache:
+            signal = signal_cache[symbol]
+        else:
+            try:
+                signal = get_entry_signal(symbol, scanner_ctx=candidate)
+            except Exception as e:
+                blocked_samples.append(f"{symbol}:STRATEGY_EXCEPTION:{str(e)[:80]}")
+                continue
+            if signal_cache is not None:
+                signal_cache[symbol] = signal
 
         if not isinstance(signal, dict):
             blocked_samples.append(f"{symbol}:INVALID_SIGNAL")
@@ -2309,226 +2805,322 @@ def _select_best_signal_from_scanner_shortlist(user_id: int, exclude_symbols: se
     return best_choice
 
 
-def execute_trade_cycle(user_id: int) -> dict | None:
-    lock = _user_locks.setdefault(user_id, threading.Lock())
-    if not lock.acquire(blocking=False):
-        log(f"Usuario {user_id} — ciclo ya en ejecución, se salta", "WARN")
-        return None
+def _prepare_trade_cycle(user_id: int, signal_cache: Optional[dict[str, Any]] = None) -> tuple[Optional[dict], Optional[dict]]:
+    """Fase previa a la entrada (reconcile, watchdog, manager, guards, señal).
 
-    try:
-        log(f"Usuario {user_id} — inicio ciclo")
+    Retorna (resultado, None) si el ciclo termina aquí, o (None, intent) con
+    todo lo necesario para _execute_entry.
+    """
+    log(f"Usuario {user_id} — inicio ciclo")
 
-        if not user_is_ready(user_id):
-            log(f"Usuario {user_id} no listo")
-            return None
+    if not user_is_ready(user_id):
+        log(f"Usuario {user_id} no listo")
+        return None, None
 
-        # Reconciliación defensiva: si el exchange ya no tiene posición pero el bot
-        # conserva estado activo en memoria, registramos el cierre y activamos cooldown.
-        try:
-            if _reconcile_orphan_closed_trade(user_id):
-                log(f"Usuario {user_id} — cierre reconciliado desde exchange", "CRITICAL")
-                return {"event": "RECONCILE_CLOSED"}
-        except Exception as e:
-            log(f"Reconcile error user={user_id} err={e}\n{traceback.format_exc()}", "ERROR")
-
-        watchdog_resp = _ensure_manager_watchdog(user_id)
-        if watchdog_resp:
-            return watchdog_resp
-
-        # ✅ Capital operativo REAL (exchange). Interés compuesto natural.
-        # Se usa balance withdrawable para sizing seguro
-        capital = float(get_balance(user_id) or 0.0)
-        log(f"Capital (Exchange/withdrawable): {capital}")
-
-        # ✅ Si ya existe posición abierta en el exchange, SIEMPRE priorizamos modo MANAGER.
-        # Importante: con posiciones abiertas el balance withdrawable puede verse bajo,
-        # así que NO debemos bloquear por MIN_CAPITAL_USDC (si no, se pierde la reanudación).
-        if has_open_position(user_id):
-            log("Ya hay una posición abierta en el exchange — entrando en modo MANAGER (SL/TRAIL)", "WARN")
-            return _manage_existing_open_position(user_id)
-
-        # ✅ Guard: capital mínimo (evita órdenes ridículas) — solo aplica cuando NO hay posición abierta
-        if capital < float(MIN_CAPITAL_USDC):
-            log(f"Capital insuficiente ({capital} USDC) < {MIN_CAPITAL_USDC} — no se ejecuta trading", "WARN")
-            return None
+    # Reconciliación defensiva: si el exchange ya no tiene posición pero el bot
+    # conserva estado activo en memoria, registramos el cierre y activamos cooldown.
+    try:
+        if _reconcile_orphan_closed_trade(user_id):
+            log(f"Usuario {user_id} — cierre reconciliado desde exchange", "CRITICAL")
+            return {"event": "RECONCILE_CLOSED"}, None
+    except Exception as e:
+        log(f"Reconcile error user={user_id} err={e}\n{traceback.format_exc()}", "ERROR")
+
+    watchdog_resp = _ensure_manager_watchdog(user_id)
+    if watchdog_resp:
+        return watchdog_resp, None
+
+    halt = entries_halted()
+    if halt:
+        log(f"Usuario {user_id} — entradas detenidas ({halt.get('reason')})", "WARN")
+        return None, None
+
+    # ✅ Capital operativo REAL (exchange). Interés compuesto natural.
+    # Se usa balance withdrawable para sizing seguro
+    capital = float(get_balance(user_id) or 0.0)
+    log(f"Capital (Exchange/withdrawable): {capital}")
+
+    # ✅ Si ya existe posición abierta en el exchange, SIEMPRE priorizamos modo MANAGER.
+    # Importante: con posiciones abiertas el balance withdrawable puede verse bajo,
+    # así que NO debemos bloquear por MIN_CAPITAL_USDC (si no, se pierde la reanudación).
+    if has_open_position(user_id):
+        log("Ya hay una posición abierta en el exchange — entrando en modo MANAGER (SL/TRAIL)", "WARN")
+        return _manage_existing_open_position(user_id), None
+
+    # ✅ Guard: capital mínimo (evita órdenes ridículas) — solo aplica cuando NO hay posición abierta
+    if capital < float(MIN_CAPITAL_USDC):
+        log(f"Capital insuficiente ({capital} USDC) < {MIN_CAPITAL_USDC} — no se ejecuta trading", "WARN")
+        return None, None
+
+
+    ok_trade, reason_trade = _can_trade_now(user_id)
+    if not ok_trade:
+        log(f"Bloqueo responsable: {reason_trade}", "INFO")
+        return None, None
+
+    ok_risk, reason_risk = _risk_governor_allows_new_entries(user_id)
+    if not ok_risk:
+        log(f"Bloqueo responsable: {reason_risk}", "INFO")
+        return None, None
+
+    exclude = _get_excluded_symbols(user_id)
+    selected = _select_best_signal_from_scanner_shortlist(user_id, exclude, signal_cache=signal_cache)
+    if not selected:
+        return None, None
+
+    symbol = str(selected["symbol"]).upper()
+    symbol_for_exec = str(selected["symbol_for_exec"]).upper()
+    signal = dict(selected["signal"] or {})
+    strength = float(selected["strength"] or 0.0)
+    direction = str(selected["direction"] or "").lower()
+    scanner_meta = dict(selected.get("scanner") or {})
+
+    if strength < MIN_TRADE_STRENGTH:
+        log(f"Señal débil bloqueada: strength={strength:.4f} < {MIN_TRADE_STRENGTH}", "INFO")
+        return None, None
+
+    if direction not in ("long", "short"):
+        log(f"Dirección inválida en señal: {direction}", "ERROR")
+        return None, None
 
+    side = "buy" if direction == "long" else "sell"
+    opposite = "sell" if side == "buy" else "buy"
 
-        ok_trade, reason_trade = _can_trade_now(user_id)
-        if not ok_trade:
-            log(f"Bloqueo responsable: {reason_trade}", "INFO")
-            return None
+    log(
+        f"SEÑAL CONFIRMADA {symbol} {direction.upper()} strength={signal.get('strength')} score={signal.get('score')} "
+        f"scanner_score={scanner_meta.get('score')} model={signal.get('strategy_model', 'strategy')}",
+        "INFO",
+    )
 
-        ok_risk, reason_risk = _risk_governor_allows_new_entries(user_id)
-        if not ok_risk:
-            log(f"Bloqueo responsable: {reason_risk}", "INFO")
-            return None
+    risk = validate_trade_conditions(capital, strength)
+    if not risk.get("ok"):
+        log(f"Trade cancelado: {risk.get('reason')}", "WARN")
+        return None, None
+    mgmt = _coalesce_management_params(signal=signal, entry_strength=float(strength), best_score=float(signal.get("score", 0.0) or 0.0))
+    try:
+        mgmt["strategy_model"] = str(signal.get("strategy_model", ""))
+        mgmt["atr_pct"] = float(signal.get("atr_pct", 0.0) or 0.0)
+    except Exception:
+        pass
+    tp_activate_price = float(mgmt["tp_activate_price"])
+    strategy_sl_price_pct = float(signal.get("sl_price_pct", 0.0) or 0.0)
+    if strategy_sl_price_pct <= 0.0:
+        log("Señal sin sl_price_pct válido", "ERROR")
+        return None, None
 
-        exclude = _get_excluded_symbols(user_id)
-        selected = _select_best_signal_from_scanner_shortlist(user_id, exclude)
-        if not selected:
-            return None
+    sl_price_pct = float(strategy_sl_price_pct)
 
-        symbol = str(selected["symbol"]).upper()
-        symbol_for_exec = str(selected["symbol_for_exec"]).upper()
-        signal = dict(selected["signal"] or {})
-        strength = float(selected["strength"] or 0.0)
-        direction = str(selected["direction"] or "").lower()
-        scanner_meta = dict(selected.get("scanner") or {})
+    log(
+        f"Riesgo dinámico por trade: bucket={mgmt['bucket']} TP activa trailing={tp_activate_price:.6f}, "
+        f"retrace={float(mgmt['trail_retrace_price']):.6f}, strategy_sl={strategy_sl_price_pct:.6f}, SL(exchange)={sl_price_pct:.6f}, "
+        f"force_min_profit={float(mgmt['force_min_profit_price']):.6f}, force_min_strength={float(mgmt['force_min_strength']):.4f}",
+        "INFO",
+    )
+    margin_usdc = float(FIXED_MARGIN_USDC)
+    target_notional_usdc = float(margin_usdc) * float(LEVERAGE)
+    # ✅ Modo defensa: margen fijo por operación; el notional efectivo sí usa el leverage.
+    if margin_usdc <= 0:
+        log(f"Margen fijo inválido ({margin_usdc} USDC) — skip", "WARN")
+        return None, None
+    if target_notional_usdc < float(MIN_NOTIONAL_USDC):
+        log(f"Notional objetivo inválido ({target_notional_usdc} USDC) < {MIN_NOTIONAL_USDC} — skip", "WARN")
+        return None, None
+    if float(capital) < float(MIN_CAPITAL_USDC):
+        log(f"Capital demasiado bajo para operar ({capital} USDC) < {MIN_CAPITAL_USDC}", "WARN")
+        return None, None
+
+    return None, {
+        "user_id": user_id,
+        "wallet": get_user_wallet(user_id),
+        "symbol": symbol,
+        "symbol_for_exec": symbol_for_exec,
+        "signal": signal,
+        "strength": float(strength),
+        "direction": direction,
+        "side": side,
+        "opposite": opposite,
+        "mgmt": mgmt,
+        "sl_price_pct": float(sl_price_pct),
+        "margin_usdc": float(margin_usdc),
+        "target_notional_usdc": float(target_notional_usdc),
+    }
 
-        if strength < MIN_TRADE_STRENGTH:
-            log(f"Señal débil bloqueada: strength={strength:.4f} < {MIN_TRADE_STRENGTH}", "INFO")
-            return None
 
-        if direction not in ("long", "short"):
-            log(f"Dirección inválida en señal: {direction}", "ERROR")
-            return None
+def _execute_entry(intent: dict[str, Any], *, ref_book: Optional[tuple[float, float]] = None, preview_price: float = 0.0) -> dict | None:
+    """Entrada a mercado + SL + manager para un intent de _prepare_trade_cycle.
 
-        side = "buy" if direction == "long" else "sell"
-        opposite = "sell" if side == "buy" else "buy"
+    Deja el outcome (FILLED / NO_FILL:... / REJECTED:... / ...) en intent["outcome"].
+    """
+    user_id = int(intent["user_id"])
+    symbol = intent["symbol"]
+    symbol_for_exec = intent["symbol_for_exec"]
+    signal = intent["signal"]
+    strength = float(intent["strength"])
+    direction = intent["direction"]
+    side = intent["side"]
+    opposite = intent["opposite"]
+    mgmt = intent["mgmt"]
+    sl_price_pct = float(intent["sl_price_pct"])
+    margin_usdc = float(intent["margin_usdc"])
+    target_notional_usdc = float(intent["target_notional_usdc"])
+
+    # Un flatten pudo detener las entradas después de preparar este intent.
+    halt = entries_halted()
+    if halt:
+        log(f"Usuario {user_id} — entrada descartada: entradas detenidas ({halt.get('reason')})", "WARN")
+        intent["outcome"] = "HALTED"
+        return None
 
-        log(
-            f"SEÑAL CONFIRMADA {symbol} {direction.upper()} strength={signal.get('strength')} score={signal.get('score')} "
-            f"scanner_score={scanner_meta.get('score')} model={signal.get('strategy_model', 'strategy')}",
-            "INFO",
-        )
+    # Fan-out: precio previo compartido por todos los usuarios del mismo símbolo.
+    entry_price_preview = float(preview_price or 0.0) or float(get_price(symbol_for_exec) or 0.0)
+    if entry_price_preview <= 0:
+        log("No se pudo obtener precio para calcular qty_coin", "ERROR")
+        intent["outcome"] = "NO_PRICE"
+        return None
 
-        risk = validate_trade_conditions(capital, strength)
-        if not risk.get("ok"):
-            log(f"Trade cancelado: {risk.get('reason')}", "WARN")
-            return None
-        mgmt = _coalesce_management_params(signal=signal, entry_strength=float(strength), best_score=float(signal.get("score", 0.0) or 0.0))
-        try:
-            mgmt["strategy_model"] = str(signal.get("strategy_model", ""))
-            mgmt["atr_pct"] = float(signal.get("atr_pct", 0.0) or 0.0)
-        except Exception:
-            pass
-        tp_activate_price = float(mgmt["tp_activate_price"])
-        strategy_sl_price_pct = float(signal.get("sl_price_pct", 0.0) or 0.0)
-        if strategy_sl_price_pct <= 0.0:
-            log("Señal sin sl_price_pct válido", "ERROR")
-            return None
+    qty_coin = round(target_notional_usdc / entry_price_preview, 8)
+    if qty_coin <= 0:
+        log("qty_coin inválido tras conversión", "ERROR")
+        intent["outcome"] = "BAD_QTY"
+        return None
 
-        sl_price_pct = float(strategy_sl_price_pct)
+    # ✅ Guard: qty mínimo en coin (evita 0.0 / tamaños ridículos)
+    if qty_coin < float(MIN_QTY_COIN):
+        log(f"qty_coin demasiado pequeño ({qty_coin}) < {MIN_QTY_COIN} — skip", "WARN")
+        intent["outcome"] = "MIN_QTY"
+        return None
 
-        log(
-            f"Riesgo dinámico por trade: bucket={mgmt['bucket']} TP activa trailing={tp_activate_price:.6f}, "
-            f"retrace={float(mgmt['trail_retrace_price']):.6f}, strategy_sl={strategy_sl_price_pct:.6f}, SL(exchange)={sl_price_pct:.6f}, "
-            f"force_min_profit={float(mgmt['force_min_profit_price']):.6f}, force_min_strength={float(mgmt['force_min_strength']):.4f}",
-            "INFO",
+    # ✅ SL agrupado con la entrada (normalTpsl): el stop viaja en la misma acción.
+    # Trigger calculado sobre el precio previo; si el grupo falla se usa el camino normal post-fill.
+    grouped_sl_trigger = None
+    if GROUPED_ENTRY_SL:
+        raw_preview_trigger = (entry_price_preview * (1.0 - sl_price_pct)) if direction == "long" else (entry_price_preview * (1.0 + sl_price_pct))
+        preview_candidates = _stop_trigger_plan(
+            symbol_for_exec=symbol_for_exec,
+            raw_trigger=float(raw_preview_trigger),
+            current_px=float(entry_price_preview),
+            direction=str(direction),
         )
-        margin_usdc = float(FIXED_MARGIN_USDC)
-        target_notional_usdc = float(margin_usdc) * float(LEVERAGE)
-        # ✅ Modo defensa: margen fijo por operación; el notional efectivo sí usa el leverage.
-        if margin_usdc <= 0:
-            log(f"Margen fijo inválido ({margin_usdc} USDC) — skip", "WARN")
-            return None
-        if target_notional_usdc < float(MIN_NOTIONAL_USDC):
-            log(f"Notional objetivo inválido ({target_notional_usdc} USDC) < {MIN_NOTIONAL_USDC} — skip", "WARN")
-            return None
-        if float(capital) < float(MIN_CAPITAL_USDC):
-            log(f"Capital demasiado bajo para operar ({capital} USDC) < {MIN_CAPITAL_USDC}", "WARN")
-            return None
+        grouped_sl_trigger = float(preview_candidates[0]) if preview_candidates else None
 
-        entry_price_preview = float(get_price(symbol_for_exec) or 0.0)
-        if entry_price_preview <= 0:
-            log("No se pudo obtener precio para calcular qty_coin", "ERROR")
-            return None
-
-        qty_coin = round(target_notional_usdc / entry_price_preview, 8)
-        if qty_coin <= 0:
-            log("qty_coin inválido tras conversión", "ERROR")
-            return None
+    log(f"Ejecutando orden {symbol} {side} qty_coin={qty_coin} (fixed_margin~{margin_usdc} USDC -> target_notional~{target_notional_usdc} USDC, lev={LEVERAGE}x)")
+    _user_events_watch(user_id)
+    entry_started_at_ms = int(time.time() * 1000)
+    open_resp = place_market_order(user_id, symbol_for_exec, side, qty_coin, stop_loss_trigger=grouped_sl_trigger, ref_book=ref_book)
 
-        # ✅ Guard: qty mínimo en coin (evita 0.0 / tamaños ridículos)
-        if qty_coin < float(MIN_QTY_COIN):
-            log(f"qty_coin demasiado pequeño ({qty_coin}) < {MIN_QTY_COIN} — skip", "WARN")
-            return None
-
-        log(f"Ejecutando orden {symbol} {side} qty_coin={qty_coin} (fixed_margin~{margin_usdc} USDC -> target_notional~{target_notional_usdc} USDC, lev={LEVERAGE}x)")
-        entry_started_at_ms = int(time.time() * 1000)
-        open_resp = place_market_order(user_id, symbol_for_exec, side, qty_coin)
-
-        if not open_resp:
-            log("Orden OPEN sin respuesta/empty del exchange — abortando trade", "ERROR")
-            _cooldown_symbol(user_id, symbol, SYMBOL_NOFILL_COOLDOWN_SECONDS)
-            return None
-
-        if not _resp_ok(open_resp):
-            reason = _resp_reason(open_resp) or "EXCHANGE_REJECTED"
-            log(f"OPEN no OK (reason={reason}) -> cooldown {SYMBOL_NOFILL_COOLDOWN_SECONDS}s para {symbol}", "ERROR")
-            _cooldown_symbol(user_id, symbol, SYMBOL_NOFILL_COOLDOWN_SECONDS)
-            return None
+    if not open_resp:
+        log("Orden OPEN sin respuesta/empty del exchange — abortando trade", "ERROR")
+        _cooldown_symbol(user_id, symbol, SYMBOL_NOFILL_COOLDOWN_SECONDS)
+        intent["outcome"] = "OPEN_EMPTY"
+        return None
 
-        if not _is_filled_exchange_response(open_resp):
-            reason = _resp_reason(open_resp) or "NO_FILL"
-            log(f"OPEN sin FIL (reason={reason}) -> cooldown {SYMBOL_NOFILL_COOLDOWN_SECONDS}s para {symbol}", "WARN")
-            _cooldown_symbol(user_id, symbol, SYMBOL_NOFILL_COOLDOWN_SECONDS)
-            return None
+    if not _resp_ok(open_resp):
+        reason = _resp_reason(open_resp) or "EXCHANGE_REJECTED"
+        log(f"OPEN no OK (reason={reason}) -> cooldown {SYMBOL_NOFILL_COOLDOWN_SECONDS}s para {symbol}", "ERROR")
+        _cooldown_symbol(user_id, symbol, SYMBOL_NOFILL_COOLDOWN_SECONDS)
+        intent["outcome"] = f"REJECTED:{reason}"
+        return None
 
-        _register_trade_attempt(user_id)
-        mark_symbol_recent(symbol)
+    if not _is_filled_exchange_response(open_resp):
+        reason = _resp_reason(open_resp) or "NO_FILL"
+        log(f"OPEN sin FIL (reason={reason}) -> cooldown {SYMBOL_NOFILL_COOLDOWN_SECONDS}s para {symbol}", "WARN")
+        _cooldown_symbol(user_id, symbol, SYMBOL_NOFILL_COOLDOWN_SECONDS)
+        intent["outcome"] = f"NO_FILL:{reason}"
+        return None
 
-        # ✅ ENTRY PRICE: primero intento sacar el fill real del open_resp
-        # ✅ ENTRY PRICE REAL (NO inventar con px/limit):
-        # 1) Leer entryPx desde clearinghouseState (fuente del exchange).
-        entry_state = float(get_position_entry_price(user_id, symbol_for_exec) or 0.0)
-        if entry_state > 0:
-            entry_price = entry_state
-            log(f"Entry price (STATE REAL): {entry_price}", "INFO")
+    _register_trade_attempt(user_id)
+    mark_symbol_recent(symbol)
+
+    # ✅ ENTRY PRICE REAL (NO inventar con px/limit):
+    # 0) Fills del stream de eventos (sin request extra) si está live.
+    entry_ev = None
+    ledger = _user_events.live_ledger(user_id)
+    if ledger is not None:
+        entry_ev = ledger.entry_fill(
+            symbol_for_exec,
+            max(0, entry_started_at_ms - USER_EVENTS_CLOCK_SKEW_MS),
+            timeout=USER_EVENTS_FILL_WAIT,
+        )
+    # 1) Leer entryPx desde clearinghouseState (fuente del exchange).
+    entry_state = float(entry_ev["entry_px"]) if entry_ev else float(get_position_entry_price(user_id, symbol_for_exec) or 0.0)
+    if entry_ev and entry_state > 0:
+        entry_price = entry_state
+        log(f"Entry price (USER_EVENTS fills={entry_ev['fills']}): {entry_price}", "INFO")
+    elif entry_state > 0:
+        entry_price = entry_state
+        log(f"Entry price (STATE REAL): {entry_price}", "INFO")
+    else:
+        # 2) fallback: intentar extraer avgPx/fillPx real del open_resp (si viene)
+        entry_fill = _extract_fill_price(open_resp)
+        if entry_fill and entry_fill > 0:
+            entry_price = float(entry_fill)
+            log(f"Entry price (FILL REAL): {entry_price}", "INFO")
         else:
-            # 2) fallback: intentar extraer avgPx/fillPx real del open_resp (si viene)
-            entry_fill = _extract_fill_price(open_resp)
-            if entry_fill and entry_fill > 0:
-                entry_price = float(entry_fill)
-                log(f"Entry price (FILL REAL): {entry_price}", "INFO")
-            else:
-                # 3) último recurso: mid/mark de get_price (solo para no crashear)
-                entry_price = float(get_price(symbol_for_exec) or 0.0)
-                log(f"Entry price (fallback get_price): {entry_price}", "WARN")
+            # 3) último recurso: mid/mark de get_price (solo para no crashear)
+            entry_price = float(get_price(symbol_for_exec) or 0.0)
+            log(f"Entry price (fallback get_price): {entry_price}", "WARN")
 
-        if entry_price <= 0:
-            log("Precio de entrada inválido", "ERROR")
-            return None
+    if entry_price <= 0:
+        log("Precio de entrada inválido", "ERROR")
+        intent["outcome"] = "BAD_ENTRY_PRICE"
+        return None
 
-        # ✅ Estado del trailing por %PnL
-        # ✅ SANITY CHECK POST-FILL (ANTI-ÓRDENES RIDÍCULAS / DUST)
-        size_real_signed = float(get_open_position_size(user_id, symbol_for_exec) or 0.0)
-        size_real = abs(size_real_signed)
+    # ✅ Estado del trailing por %PnL
+    # ✅ SANITY CHECK POST-FILL (ANTI-ÓRDENES RIDÍCULAS / DUST)
+    size_real_signed = float(entry_ev["szi"]) if entry_ev else float(get_open_position_size(user_id, symbol_for_exec) or 0.0)
+    size_real = abs(size_real_signed)
 
-        if size_real <= 0.0:
-            log("OPEN OK pero sin posición real (size=0) — treat as NO_FILL", "WARN")
-            _cooldown_symbol(user_id, symbol, SYMBOL_NOFILL_COOLDOWN_SECONDS)
-            return None
+    if size_real <= 0.0:
+        log("OPEN OK pero sin posición real (size=0) — treat as NO_FILL", "WARN")
+        _cancel_orphan_grouped_stop(user_id, symbol_for_exec, open_resp)
+        _cooldown_symbol(user_id, symbol, SYMBOL_NOFILL_COOLDOWN_SECONDS)
+        intent["outcome"] = "SIZE_ZERO"
+        return None
 
-        notional_real = float(entry_price) * float(size_real)
-        if (notional_real < float(MIN_NOTIONAL_USDC)) or (size_real < float(MIN_QTY_COIN)):
-            log(f"FILL demasiado pequeño (size={size_real}, notional~{notional_real:.4f} USDC) — cerrando polvo y skip", "WARN")
-            close_side = "sell" if side == "buy" else "buy"
-            try:
-                place_market_order(user_id, symbol_for_exec, close_side, round(size_real, 8))
-            except Exception:
-                pass
-            _cooldown_symbol(user_id, symbol, SYMBOL_NOFILL_COOLDOWN_SECONDS)
-            return None
+    notional_real = float(entry_price) * float(size_real)
+    if (notional_real < float(MIN_NOTIONAL_USDC)) or (size_real < float(MIN_QTY_COIN)):
+        log(f"FILL demasiado pequeño (size={size_real}, notional~{notional_real:.4f} USDC) — cerrando polvo y skip", "WARN")
+        close_side = "sell" if side == "buy" else "buy"
+        try:
+            place_market_order(user_id, symbol_for_exec, close_side, round(size_real, 8))
+        except Exception:
+            pass
+        _cancel_orphan_grouped_stop(user_id, symbol_for_exec, open_resp)
+        _cooldown_symbol(user_id, symbol, SYMBOL_NOFILL_COOLDOWN_SECONDS)
+        intent["outcome"] = "DUST"
+        return None
 
-        _log_trade_plan(
-            context="OPEN",
-            user_id=user_id,
-            symbol=symbol,
-            direction=direction,
-            entry_price=float(entry_price),
-            sl_price_pct=float(sl_price_pct),
-            tp_activate_price=float(mgmt["tp_activate_price"]),
-            trail_retrace_price=float(mgmt["trail_retrace_price"]),
-            force_min_profit_price=float(mgmt["force_min_profit_price"]),
-            force_min_strength=float(mgmt["force_min_strength"]),
-            qty_coin=float(size_real),
-            notional_usdc=float(notional_real),
-            bucket=str(mgmt.get("bucket", "")),
-        )
+    _log_trade_plan(
+        context="OPEN",
+        user_id=user_id,
+        symbol=symbol,
+        direction=direction,
+        entry_price=float(entry_price),
+        sl_price_pct=float(sl_price_pct),
+        tp_activate_price=float(mgmt["tp_activate_price"]),
+        trail_retrace_price=float(mgmt["trail_retrace_price"]),
+        force_min_profit_price=float(mgmt["force_min_profit_price"]),
+        force_min_strength=float(mgmt["force_min_strength"]),
+        qty_coin=float(size_real),
+        notional_usdc=float(notional_real),
+        bucket=str(mgmt.get("bucket", "")),
+    )
 
-        # ✅ STOP LOSS REAL EN EXCHANGE (BANK GRADE):
-        # Se calcula dinámicamente por trade y se coloca en el exchange al abrir.
+    # ✅ STOP LOSS REAL EN EXCHANGE (BANK GRADE):
+    # Se calcula dinámicamente por trade y se coloca en el exchange al abrir.
+    if isinstance(open_resp, dict) and open_resp.get("sl_grouped") and open_resp.get("sl_ok"):
+        log(
+            f"STOP_LOSS_HIT_PLAN[OPEN_GROUPED] coin={symbol} dir={direction} entry={float(entry_price):.8f} sl_pct={float(sl_price_pct):.6f} "
+            f"sl_price={open_resp.get('sl_trigger_px')} qty={float(size_real):.8f} status={open_resp.get('sl_reason')} preview={entry_price_preview:.8f}",
+            "WARN",
+        )
+    else:
+        if grouped_sl_trigger is not None:
+            log(
+                f"OPEN: SL agrupado no confirmado coin={symbol} reason={(open_resp or {}).get('sl_reason')} "
+                f"err={(open_resp or {}).get('sl_error', '')} — camino normal",
+                "WARN",
+            )
         _ensure_exchange_stop_loss(
             user_id=user_id,
             symbol=symbol,
@@ -2540,40 +3132,344 @@ def execute_trade_cycle(user_id: int) -> dict | None:
             context="OPEN",
         )
 
-        # ✅ IMPORTANTÍSIMO:
-        # No bloqueamos el ciclo gestionando el trade aquí (puede durar horas).
-        # Arrancamos un MANAGER en background y devolvemos control al loop.
-        started = _start_manager_thread(
-            user_id=user_id,
-            symbol=symbol,
-            symbol_for_exec=symbol_for_exec,
-            direction=direction,
-            side=side,
-            opposite=opposite,
-            entry_price=entry_price,
-            qty_coin_for_log=float(size_real),
-            qty_usdc_for_profit=float(notional_real),
-            best_score=float(signal.get("score", 0.0) or 0.0),
-            entry_strength=float(strength),
-            mode="NEW",
-            sl_price_pct=float(sl_price_pct),
-            mgmt=mgmt,
-            opened_at_ms=int(entry_started_at_ms),
-        )
+    # ✅ IMPORTANTÍSIMO:
+    # No bloqueamos el ciclo gestionando el trade aquí (puede durar horas).
+    # Arrancamos un MANAGER en background y devolvemos control al loop.
+    started = _start_trade_manager(
+        user_id=user_id,
+        symbol=symbol,
+        symbol_for_exec=symbol_for_exec,
+        direction=direction,
+        side=side,
+        opposite=opposite,
+        entry_price=entry_price,
+        qty_coin_for_log=float(size_real),
+        qty_usdc_for_profit=float(notional_real),
+        best_score=float(signal.get("score", 0.0) or 0.0),
+        entry_strength=float(strength),
+        mode="NEW",
+        sl_price_pct=float(sl_price_pct),
+        mgmt=mgmt,
+        opened_at_ms=int(entry_started_at_ms),
+    )
 
-        if started:
-            log(f"MANAGER iniciado en background para {symbol} (user={user_id})", "WARN")
-        else:
-            log(f"MANAGER ya estaba corriendo para user={user_id} (skip start)", "INFO")
+    if started:
+        log(f"MANAGER iniciado en background para {symbol} (user={user_id})", "WARN")
+    else:
+        log(f"MANAGER ya estaba corriendo para user={user_id} (skip start)", "INFO")
 
-        return {
-            "event": "OPEN",
-            "open": {"message": f"🟢 Trade abierto {symbol} ({direction.upper()})"},
-            "manager": {"started": started, "symbol": symbol},
-        }
+    intent["outcome"] = "FILLED"
+    return {
+        "event": "OPEN",
+        "open": {"message": f"🟢 Trade abierto {symbol} ({direction.upper()})"},
+        "manager": {"started": started, "symbol": symbol},
+    }
+
+
+def execute_trade_cycle(user_id: int) -> dict | None:
+    lock = _user_locks.setdefault(user_id, threading.Lock())
+    if not lock.acquire(blocking=False):
+        log(f"Usuario {user_id} — ciclo ya en ejecución, se salta", "WARN")
+        return None
+
+    try:
+        result, intent = _prepare_trade_cycle(user_id)
+        if intent is None:
+            return result
+        return _execute_entry(intent)
 
     finally:
         try:
             lock.release()
         except Exception:
             pass
+
+
+def execute_trade_cycles_batch(
+    user_ids: list[int],
+    on_result: Optional[Callable[[int, Optional[dict]], None]] = None,
+) -> dict[int, Optional[dict]]:
+    """Ciclo de todos los usuarios listos con fan-out de las entradas.
+
+    1) Cada usuario corre su fase previa (señales compartidas por símbolo) y,
+       si queda una entrada, la envía en el mismo job: un prepare lento no
+       retrasa las entradas de los demás.
+    2) Un solo l2Book + precio por símbolo para todas las entradas (lo lee la
+       primera entrada de ese símbolo).
+    3) Entradas con concurrencia acotada por wallet, con latencia y outcome
+       por usuario.
+
+    on_result(user_id, result) se llama una vez por usuario (desde el worker)
+    apenas su resultado es final.
+    """
+    results: dict[int, Optional[dict]] = {}
+
+    def _deliver(uid: int, res: Optional[dict]) -> None:
+        results[uid] = res
+        if on_result is None:
+            return
+        try:
+            on_result(uid, res)
+        except Exception as e:
+            log(f"fan-out: on_result error user={uid} err={e}", "ERROR")
+
+    locked: list[tuple[int, threading.Lock]] = []
+    for uid in user_ids:
+        lock = _user_locks.setdefault(uid, threading.Lock())
+        if not lock.acquire(blocking=False):
+            log(f"Usuario {uid} — ciclo ya en ejecución, se salta", "WARN")
+            _deliver(uid, None)
+            continue
+        locked.append((uid, lock))
+
+    signal_cache: dict[str, Any] = {}
+    shared_lock = threading.Lock()
+    coin_locks: dict[str, threading.Lock] = {}
+    books: dict[str, Optional[tuple[float, float]]] = {}
+    mids: dict[str, float] = {}
+    wallet_sems: dict[str, threading.BoundedSemaphore] = {}
+
+    def _shared_book(coin: str) -> tuple[Optional[tuple[float, float]], float]:
+        with shared_lock:
+            coin_lock = coin_locks.setdefault(coin, threading.Lock())
+        with coin_lock:
+            if coin not in books:
+                try:
+                    books[coin] = get_best_bid_ask(coin)
+                    mids[coin] = float(get_price(coin) or 0.0)
+                except Exception as e:
+                    books[coin], mids[coin] = None, 0.0
+                    log(f"fan-out: precio compartido no disponible coin={coin} err={e}", "WARN")
+        return books[coin], mids[coin]
+
+    def _cycle(item: dict[str, Any]) -> Optional[dict]:
+        uid = int(item["user_id"])
+        res: Optional[dict] = None
+        try:
+            prepared = _prepare_trade_cycle(uid, signal_cache=signal_cache)
+            res, intent = prepared if isinstance(prepared, tuple) else (None, None)
+            if intent is None:
+                item["outcome"] = "DONE"
+                return res
+
+            item["symbol"] = intent.get("symbol")
+            book, mid = _shared_book(intent["symbol_for_exec"])
+            wallet = str(intent.get("wallet") or "").lower()
+            sem = None
+            if wallet:
+                with shared_lock:
+                    sem = wallet_sems.setdefault(wallet, threading.BoundedSemaphore(max(1, int(FANOUT_PER_WALLET))))
+            queued = time.time()
+            if sem is not None:
+                sem.acquire()
+            started = time.time()
+            try:
+                res = _execute_entry(intent, ref_book=book, preview_price=mid)
+            finally:
+                if sem is not None:
+                    sem.release()
+            item["outcome"] = str(intent.get("outcome") or ("FILLED" if isinstance(res, dict) and res.get("event") == "OPEN" else "NO_ENTRY"))
+            log(
+                f"fan-out entry user={uid} symbol={item['symbol']} outcome={item['outcome']} "
+                f"queued_ms={round((started - queued) * 1000.0, 1)} latency_ms={round((time.time() - started) * 1000.0, 1)}",
+                "INFO",
+            )
+            return res
+        finally:
+            _deliver(uid, res)
+
+    try:
+        fan_out(
+            [{"user_id": uid} for uid, _ in locked],
+            _cycle,
+            wallet_of=lambda it: None,
+            label="cycles",
+            report_items=False,
+            outcome_of=lambda it, r: str(it.get("outcome") or "DONE"),
+        )
+        return results
+
+    finally:
+        for _, lock in locked:
+            try:
+                lock.release()
+            except Exception:
+                pass
+
+
+# ============================================================
+# FLATTEN DE EMERGENCIA (todos los usuarios)
+# ============================================================
+
+def halt_new_entries(reason: str) -> None:
+    with _entries_halt_lock:
+        _entries_halt.clear()
+        _entries_halt.update({"reason": str(reason), "since": datetime.utcnow().isoformat()})
+    log(f"ENTRIES_HALTED reason={reason}", "CRITICAL")
+
+
+def resume_new_entries() -> bool:
+    with _entries_halt_lock:
+        was = bool(_entries_halt)
+        _entries_halt.clear()
+    if was:
+        log("ENTRIES_RESUMED", "WARN")
+    return was
+
+
+def entries_halted() -> Optional[dict[str, Any]]:
+    with _entries_halt_lock:
+        return dict(_entries_halt) if _entries_halt else None
+
+
+def _close_reduce_only(user_id: int, coin: str, szi: float) -> float:
+    """IOC reduceOnly hasta FLATTEN_CLOSE_ATTEMPTS veces sobre lo que quede. Retorna el size llenado."""
+    side = "sell" if szi > 0 else "buy"
+    remaining = abs(float(szi))
+    filled_total = 0.0
+    for _ in range(max(1, int(FLATTEN_CLOSE_ATTEMPTS))):
+        try:
+            resp = place_market_order(user_id, coin, side, remaining, reduce_only=True, max_no_fill_retries=2)
+        except Exception as e:
+            resp = {"ok": False, "reason": "EXCEPTION", "error": str(e)}
+        filled = 0.0
+        if _resp_ok(resp) and _is_filled_exchange_response(resp):
+            try:
+                filled = float((resp or {}).get("filled_sz") or 0.0)
+            except Exception:
+                filled = 0.0
+        if filled <= 0.0:
+            log(f"FLATTEN no fill user={user_id} coin={coin} remaining={remaining} resp={resp}", "ERROR")
+            break
+        filled_total += filled
+        remaining -= filled
+        if remaining <= abs(float(szi)) * 1e-9:
+            break
+    return filled_total
+
+
+def _flatten_user(user_id: int) -> dict[str, Any]:
+    """Cierra (reduceOnly IOC) todas las posiciones del usuario y cancela sus órdenes.
+
+    Las órdenes de un coin se cancelan solo si una relectura del exchange confirma
+    la posición en cero: con un fill parcial o un cierre fallido el stop del exchange
+    sigue protegiendo el remanente. Coins con órdenes y sin posición se cancelan directo.
+    """
+    positions = get_open_positions(user_id)
+    if positions is None:
+        return {"outcome": "READ_ERROR", "closed": [], "failed": [], "cancelled": []}
+
+    filled_by_coin: dict[str, float] = {}
+    for pos in positions:
+        coin = str(pos["coin"])
+        filled_by_coin[coin] = _close_reduce_only(user_id, coin, float(pos["szi"]))
+
+    after = get_open_positions(user_id) if positions else []
+    left_by_coin = {str(p["coin"]): abs(float(p["szi"])) for p in (after or [])}
+
+    closed: list[str] = []
+    failed: list[dict[str, Any]] = []
+    for pos in positions:
+        coin = str(pos["coin"])
+        szi = float(pos["szi"])
+        if after is None:
+            # Sin relectura no hay confirmación: no se tocan sus órdenes.
+            left, reason = max(0.0, abs(szi) - filled_by_coin[coin]), "UNCONFIRMED"
+        else:
+            left, reason = left_by_coin.get(coin, 0.0), ("PARTIAL_FILL" if filled_by_coin[coin] > 0 else "NO_FILL")
+        if after is not None and left == 0.0:
+            closed.append(coin)
+            log(f"FLATTEN_CLOSED user={user_id} coin={coin} szi={szi}", "CRITICAL")
+        else:
+            failed.append({"coin": coin, "szi": szi, "filled": filled_by_coin[coin], "left": left, "reason": reason})
+            log(f"FLATTEN_INCOMPLETE user={user_id} coin={coin} szi={szi} filled={filled_by_coin[coin]} left={left} reason={reason}", "ERROR")
+
+    failed_coins = {f["coin"] for f in failed}
+    cancelled: list[str] = []
+    order_coins = {_norm_coin(str(o.get("coin") or "")) for o in (get_open_orders(user_id) or []) if isinstance(o, dict)}
+    for coin in sorted((set(closed) | order_coins) - failed_coins):
+        try:
+            if (cancel_all_orders_for_symbol(user_id, coin) or {}).get("ok"):
+                cancelled.append(coin)
+        except Exception as e:
+            log(f"FLATTEN cancel error user={user_id} coin={coin} err={e}", "WARN")
+
+    # El manager registra el cierre (PnL, fees) en su próximo sync: lo adelantamos.
+    if any(v > 0 for v in filled_by_coin.values()):
+        _position_supervisor.request_sync(user_id)
+
+    if failed:
+        outcome = "PARTIAL" if (closed or any(f["filled"] > 0 for f in failed)) else "FAILED"
+    elif closed:
+        outcome = "FLAT"
+    else:
+        outcome = "NOTHING"
+    return {"outcome": outcome, "closed": closed, "failed": failed, "cancelled": cancelled}
+
+
+def flatten_all_positions(
+    user_ids: Optional[list[int]] = None,
+    *,
+    reason: str = "ADMIN",
+    halt: bool = True,
+    workers: int = FLATTEN_WORKERS,
+) -> dict[str, Any]:
+    """Cierra todas las posiciones de todos los usuarios en paralelo (concurrencia acotada).
+
+    1) Detiene las nuevas entradas (halt) para que el loop no reabra mientras tanto.
+    2) Por usuario, vía execution_fanout: lee posiciones del exchange, cierra
+       reduceOnly y cancela órdenes residentes.
+    Retorna {"ok", "reason", "users", "outcomes", "elapsed_ms", "results": [...]}
+    con outcome y timing por usuario. Las entradas quedan detenidas hasta resume_new_entries().
+    """
+    started = time.time()
+    if halt:
+        halt_new_entries(reason)
+
+    if user_ids is None:
+        uids: set[int] = set(_position_supervisor.keys())
+        try:
+            uids.update(int(u["user_id"]) for u in (get_all_users() or []) if u.get("user_id") is not None)
+        except Exception as e:
+            log(f"FLATTEN: no se pudo listar usuarios err={e}", "ERROR")
+        user_ids = sorted(uids)
+
+    items = []
+    for uid in user_ids:
+        try:
+            wallet = get_user_wallet(uid)
+        except Exception:
+            wallet = None
+        if wallet:
+            items.append({"user_id": int(uid), "wallet": wallet})
+
+    log(f"FLATTEN_ALL start reason={reason} users={len(items)}", "CRITICAL")
+    reports = fan_out(
+        items,
+        lambda it: _flatten_user(it["user_id"]),
+        wallet_of=lambda it: it.get("wallet"),
+        label="flatten",
+        workers=workers,
+        outcome_of=lambda it, r: str((r or {}).get("outcome") or "NONE"),
+        report_items=False,
+    )
+
+    results = []
+    outcomes: dict[str, int] = {}
+    for rep in reports:
+        res = rep["result"] if isinstance(rep["result"], dict) else {}
+        outcomes[rep["outcome"]] = outcomes.get(rep["outcome"], 0) + 1
+        results.append({
+            "user_id": rep["item"]["user_id"],
+            "outcome": rep["outcome"],
+            "closed": res.get("closed", []),
+            "failed": res.get("failed", []),
+            "cancelled": res.get("cancelled", []),
+            "error": rep["error"],
+            "queued_ms": rep["queued_ms"],
+            "latency_ms": rep["latency_ms"],
+        })
+    elapsed_ms = round((time.time() - started) * 1000.0, 1)
+    ok = all(r["outcome"] in ("FLAT", "NOTHING") for r in results)
+    log(f"FLATTEN_ALL done reason={reason} ok={ok} users={len(results)} outcomes={outcomes} elapsed_ms={elapsed_ms}", "CRITICAL")
+    return {"ok": ok, "reason": reason, "users": len(results), "outcomes": outcomes, "elapsed_ms": elapsed_ms, "results": results}
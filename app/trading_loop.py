@@ -21,7 +21,7 @@ from app.database import (
     save_last_open,
     save_last_close,
 )
-from app.trading_engine import execute_trade_cycle
+from app.trading_engine import execute_trade_cycle, execute_trade_cycles_batch
 from app.config import SCAN_INTERVAL
 
 # ============================================================
@@ -38,6 +38,11 @@ STARTUP_GRACE_SECONDS = 20        # espera inicial antes de escanear/operar
 # ✅ FIX: reparte llamadas (evita picos, evita todos al mismo símbolo al mismo tiempo)
 USER_JITTER_MAX_SECONDS = 2.0     # jitter aleatorio por usuario antes de ejecutar su ciclo
 
+# Fan-out: todos los usuarios listos en un solo batch (señal y libro compartidos,
+# entradas concurrentes). False = ciclo por usuario con semáforo + jitter.
+# Cada resultado se entrega apenas llega, con el mismo TRADE_TIMEOUT_SECONDS por usuario.
+EXECUTION_FANOUT = True
+
 # ============================================================
 # STATE
 # ============================================================
@@ -142,6 +147,84 @@ async def execute_user_cycle(user_id: int, semaphore: asyncio.Semaphore):
                 log(f"Error crítico usuario {user_id}: {e}", "ERROR")
                 return None
 
+async def handle_cycle_result(app: Application, user_id: int, result) -> None:
+    """Guarda last_open / last_close y avisa por Telegram."""
+    if isinstance(result, Exception):
+        log(f"Error ciclo usuario {user_id}: {result}", "ERROR")
+        return
+
+    if not isinstance(result, dict):
+        return
+
+    # ================================
+    # GUARDAR INFO OPERACIÓN (OPEN)
+    # ================================
+    if result.get("event") in ("OPEN", "BOTH"):
+        open_data = result.get("open") or {}
+        try:
+            save_last_open(user_id, open_data)
+        except Exception as e:
+            log(f"Error guardando last_open user {user_id}: {e}", "ERROR")
+
+        msg = open_data.get("message")
+        if msg:
+            await send_message_safe(app, user_id, msg)
+
+    # ================================
+    # GUARDAR INFO OPERACIÓN (CLOSE)
+    # ================================
+    if result.get("event") in ("CLOSE", "BOTH"):
+        close_data = result.get("close") or {}
+        try:
+            save_last_close(user_id, close_data)
+        except Exception as e:
+            log(f"Error guardando last_close user {user_id}: {e}", "ERROR")
+
+        msg = close_data.get("message")
+        if msg:
+            await send_message_safe(app, user_id, msg)
+
+async def execute_users_batch(app: Application, user_ids: list[int]) -> None:
+    """Ciclo de todos los usuarios vía fan-out.
+
+    Cada resultado se procesa apenas el engine lo entrega (on_result), con
+    timeout por usuario: un usuario lento no retiene los OPEN/CLOSE del resto.
+    """
+    loop = asyncio.get_running_loop()
+    pending = {uid: loop.create_future() for uid in user_ids}
+
+    def _set(uid: int, result) -> None:
+        fut = pending.get(uid)
+        if fut is not None and not fut.done():
+            fut.set_result(result)
+
+    def _on_result(uid: int, result) -> None:
+        # Llamado desde los workers del engine.
+        loop.call_soon_threadsafe(_set, uid, result)
+
+    batch = loop.run_in_executor(None, execute_trade_cycles_batch, list(user_ids), _on_result)
+
+    def _batch_done(f: asyncio.Future) -> None:
+        if f.cancelled():
+            return
+        err = f.exception()
+        if err is not None:
+            log(f"Error crítico batch fan-out: {err}", "ERROR")
+            for uid in user_ids:
+                _set(uid, None)
+
+    batch.add_done_callback(_batch_done)
+
+    async def _deliver(uid: int) -> None:
+        try:
+            result = await asyncio.wait_for(asyncio.shield(pending[uid]), timeout=TRADE_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            log(f"Timeout ejecución usuario {uid}", "WARN")
+            return
+        await handle_cycle_result(app, uid, result)
+
+    await asyncio.gather(*(_deliver(uid) for uid in user_ids), return_exceptions=True)
+
 # ============================================================
 # LOOP PRINCIPAL
 # ============================================================
@@ -163,13 +246,13 @@ async def trading_loop(app: Application):
             if STARTUP_GRACE_SECONDS > 0:
                 elapsed = time.time() - float(_loop_started_at or time.time())
                 if elapsed < float(STARTUP_GRACE_SECONDS):
-                    await asyncio.sleep(1.0)
+                    # Una sola espera hasta el fin del grace (sin polling por segundo).
+                    await asyncio.sleep(float(STARTUP_GRACE_SECONDS) - elapsed)
                     continue
 
             users = get_all_users() or []
             log(f"Usuarios activos: {len(users)}")
 
-            tasks = []
             task_user_ids = []
 
             for user in users:
@@ -202,51 +285,19 @@ async def trading_loop(app: Application):
                     log(f"Error verificando readiness usuario {user_id}: {e}", "ERROR")
                     continue
 
-                tasks.append(execute_user_cycle(user_id, semaphore))
                 task_user_ids.append(user_id)
 
-            if not tasks:
+            if not task_user_ids:
                 await asyncio.sleep(max(1, int(SCAN_INTERVAL or 1)))
                 continue
 
-            results = await asyncio.gather(*tasks, return_exceptions=True)
-
-            for user_id, result in zip(task_user_ids, results):
-                if isinstance(result, Exception):
-                    log(f"Error ciclo usuario {user_id}: {result}", "ERROR")
-                    continue
-
-                if not isinstance(result, dict):
-                    continue
-
-
-                # ================================
-                # GUARDAR INFO OPERACIÓN (OPEN)
-                # ================================
-                if result.get("event") in ("OPEN", "BOTH"):
-                    open_data = result.get("open") or {}
-                    try:
-                        save_last_open(user_id, open_data)
-                    except Exception as e:
-                        log(f"Error guardando last_open user {user_id}: {e}", "ERROR")
-
-                    msg = open_data.get("message")
-                    if msg:
-                        await send_message_safe(app, user_id, msg)
-
-                # ================================
-                # GUARDAR INFO OPERACIÓN (CLOSE)
-                # ================================
-                if result.get("event") in ("CLOSE", "BOTH"):
-                    close_data = result.get("close") or {}
-                    try:
-                        save_last_close(user_id, close_data)
-                    except Exception as e:
-                        log(f"Error guardando last_close user {user_id}: {e}", "ERROR")
-
-                    msg = close_data.get("message")
-                    if msg:
-                        await send_message_safe(app, user_id, msg)
+            if EXECUTION_FANOUT:
+                await execute_users_batch(app, task_user_ids)
+            else:
+                tasks = [execute_user_cycle(user_id, semaphore) for user_id in task_user_ids]
+                results = await asyncio.gather(*tasks, return_exceptions=True)
+                for user_id, result in zip(task_user_ids, results):
+                    await handle_cycle_result(app, user_id, result)
 
         except Exception as e:
             log(f"FALLO SISTÉMICO trading_loop: {e}", "CRITICAL")
@@ -0,0 +1,149 @@
+# ============================================================
+# TRIGGER INDEX – Trading X Hyper Pro
+# Índice por coin de los niveles de gestión de todas las posiciones
+#
+# - Cada posición (key) registra a lo sumo un nivel "arriba" (precio >=
+#   nivel la despierta) y uno "abajo" (precio <= nivel). Ver
+#   exit_manager.trigger_prices: TP activation, partial TP, break-even,
+#   nuevo pico y trailing stop, ya llevados a precio.
+# - Por coin, dos arrays ordenados (arriba / abajo) + keys paralelas.
+#   crossed(coin, price) = bisect + slice: O(log n + cruzados), sin
+#   recorrer las posiciones abiertas en ese coin.
+# - Un nivel cruzado sigue armado hasta que su posición lo reemplaza
+#   tras procesar el tick: si la sesión estaba ocupada, el cruce se
+#   reporta otra vez en el tick siguiente (no se pierde).
+# ============================================================
+
+from __future__ import annotations
+
+import threading
+from bisect import bisect_left, bisect_right
+from typing import Any, Dict, Hashable, List, Optional, Set, Tuple
+
+
+class _Side:
+    """Array ordenado de precios con las keys en paralelo."""
+
+    __slots__ = ("prices", "keys")
+
+    def __init__(self):
+        self.prices: List[float] = []
+        self.keys: List[Hashable] = []
+
+    def add(self, price: float, key: Hashable) -> None:
+        i = bisect_right(self.prices, price)
+        self.prices.insert(i, price)
+        self.keys.insert(i, key)
+
+    def remove(self, price: float, key: Hashable) -> None:
+        i = bisect_left(self.prices, price)
+        j = bisect_right(self.prices, price)
+        for k in range(i, j):
+            if self.keys[k] == key:
+                del self.prices[k]
+                del self.keys[k]
+                return
+
+    def __len__(self) -> int:
+        return len(self.prices)
+
+
+class _Coin:
+    __slots__ = ("up", "down")
+
+    def __init__(self):
+        self.up = _Side()
+        self.down = _Side()
+
+
+class TriggerIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._coins: Dict[str, _Coin] = {}
+        self._entries: Dict[Hashable, Tuple[str, Optional[float], Optional[float]]] = {}
+
+    def set_levels(self, key: Hashable, coin: str, up: Optional[float], down: Optional[float]) -> None:
+        """Reemplaza los niveles de key (None = sin nivel en ese sentido)."""
+        with self._lock:
+            old = self._entries.get(key)
+            if old is not None and old == (coin, up, down):
+                return
+            self._remove_locked(key)
+            c = self._coins.get(coin)
+            if c is None:
+                c = _Coin()
+                self._coins[coin] = c
+            if up is not None:
+                c.up.add(float(up), key)
+            if down is not None:
+                c.down.add(float(down), key)
+            self._entries[key] = (coin, up, down)
+
+    def remove(self, key: Hashable) -> None:
+        with self._lock:
+            self._remove_locked(key)
+
+    def _remove_locked(self, key: Hashable) -> None:
+        old = self._entries.pop(key, None)
+        if old is None:
+            return
+        coin, up, down = old
+        c = self._coins.get(coin)
+        if c is None:
+            return
+        if up is not None:
+            c.up.remove(float(up), key)
+        if down is not None:
+            c.down.remove(float(down), key)
+        if not c.up and not c.down:
+            self._coins.pop(coin, None)
+
+    def coins(self) -> List[str]:
+        with self._lock:
+            return list(self._coins.keys())
+
+    def crossed(self, coin: str, price: float) -> Set[Hashable]:
+        """Keys con nivel arriba <= price o nivel abajo >= price."""
+        if not price or price <= 0:
+            return set()
+        with self._lock:
+            c = self._coins.get(coin)
+            if c is None:
+                return set()
+            out = set(c.up.keys[:bisect_right(c.up.prices, price)])
+            out.update(c.down.keys[bisect_left(c.down.prices, price):])
+            return out
+
+    def nearest(self, coin: str, price: float) -> Optional[float]:
+        """Distancia relativa al nivel armado más cercano del coin (0.0 si ya hay uno cruzado)."""
+        if not price or price <= 0:
+            return None
+        with self._lock:
+            c = self._coins.get(coin)
+            if c is None:
+                return None
+            best: Optional[float] = None
+            i = bisect_right(c.up.prices, price)
+            if i > 0:
+                return 0.0
+            if c.up.prices:
+                best = (c.up.prices[0] - price) / price
+            j = bisect_left(c.down.prices, price)
+            if j < len(c.down.prices):
+                return 0.0
+            if c.down.prices:
+                d = (price - c.down.prices[-1]) / price
+                best = d if best is None else min(best, d)
+            return best
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "keys": len(self._entries),
+                "coins": len(self._coins),
+                "levels": sum(len(c.up) + len(c.down) for c in self._coins.values()),
+            }
@@ -0,0 +1,557 @@
+# ============================================================
+# USER EVENTS – Trading X Hyper Pro
+# Stream de eventos por wallet (fills / órdenes / posiciones)
+#
+# - Una conexión WebSocket por wallet vigilada, con las suscripciones
+#   userFills, orderUpdates y webData2 (clearinghouseState).
+# - Cada stream alimenta un UserLedger en memoria: fills recientes,
+#   tamaño de posición por coin, estados de órdenes y stops disparados.
+#   El engine lee de ahí entry price, size, PnL realizado y triggers
+#   sin hacer requests extra.
+# - El ledger solo se considera "live" con la conexión arriba y los
+#   snapshots iniciales recibidos; si no, el engine vuelve al polling.
+# - orderUpdates se reenvía además a on_order_updates (cache de órdenes
+#   abiertas del client), si se configuró.
+# - Hyperliquid limita los usuarios distintos con suscripciones de
+#   usuario por IP: por encima de USER_EVENTS_MAX_USERS no se abre
+#   stream (polling para ese usuario).
+# - Transporte inyectable: websocket-client en producción y
+#   LocalEventBus como stand-in local (mismo formato de mensajes).
+# ============================================================
+
+from __future__ import annotations
+
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from app.config import HYPER_WS_URL
+
+try:
+    import websocket  # websocket-client (dependencia de hyperliquid-python-sdk)
+except Exception:
+    websocket = None
+
+# ============================================================
+# CONFIG
+# ============================================================
+
+USER_EVENTS_ENABLED = os.getenv("USER_EVENTS_ENABLED", "1").strip().lower() not in ("0", "false", "no")
+USER_EVENTS_MAX_USERS = int(os.getenv("USER_EVENTS_MAX_USERS", "10"))
+USER_EVENTS_MAX_FILLS = int(os.getenv("USER_EVENTS_MAX_FILLS", "2000"))
+USER_EVENTS_RECV_TIMEOUT = float(os.getenv("USER_EVENTS_RECV_TIMEOUT", "5"))
+USER_EVENTS_PING_SECONDS = float(os.getenv("USER_EVENTS_PING_SECONDS", "30"))
+USER_EVENTS_RECONNECT_MAX_SECONDS = float(os.getenv("USER_EVENTS_RECONNECT_MAX_SECONDS", "30"))
+
+_SUBSCRIPTIONS = ("userFills", "orderUpdates", "webData2")
+
+
+def log(msg: str, level: str = "INFO"):
+    print(f"[USER_EVENTS {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')}] {level} {msg}")
+
+
+def _f(v: Any) -> float:
+    try:
+        return float(v)
+    except Exception:
+        return 0.0
+
+
+def _coin(v: Any) -> str:
+    c = str(v or "").strip().upper()
+    for suffix in ("-PERP", "_PERP", "-USDC", "_USDC", "/USDC"):
+        if c.endswith(suffix):
+            c = c[: -len(suffix)]
+    return c
+
+
+# ============================================================
+# LEDGER
+# ============================================================
+
+class UserLedger:
+    """Estado en memoria de una wallet, alimentado por el stream."""
+
+    def __init__(self, user_id: int, wallet: str):
+        self.user_id = int(user_id)
+        self.wallet = str(wallet or "").lower()
+        self._cond = threading.Condition()
+        self._fills: Deque[Dict[str, Any]] = deque(maxlen=max(100, USER_EVENTS_MAX_FILLS))
+        self._fill_ids: set = set()
+        self._positions: Dict[str, Dict[str, float]] = {}
+        self._orders: Dict[int, Dict[str, Any]] = {}
+        self._stops: Deque[Dict[str, Any]] = deque(maxlen=200)
+        self._connected = False
+        self._fills_synced = False
+        self._positions_synced = False
+        self._subscribed_at_ms = 0
+        self._positions_ts_ms = 0
+        self.last_event_ts = 0.0
+
+    # --------------------------------------------------------
+    # Estado de conexión
+    # --------------------------------------------------------
+
+    def set_connected(self, connected: bool) -> None:
+        with self._cond:
+            self._connected = bool(connected)
+            if connected:
+                self._subscribed_at_ms = int(time.time() * 1000)
+            else:
+                # Tras un corte no sabemos qué nos perdimos: se espera al snapshot nuevo.
+                self._fills_synced = False
+                self._positions_synced = False
+            self._cond.notify_all()
+
+    @property
+    def live(self) -> bool:
+        with self._cond:
+            return self._connected and self._fills_synced and self._positions_synced
+
+    def covers(self, since_ms: int) -> bool:
+        """True si el ledger tiene todos los fills desde since_ms."""
+        with self._cond:
+            if not (self._connected and self._fills_synced):
+                return False
+            if self._subscribed_at_ms and self._subscribed_at_ms <= int(since_ms):
+                return True
+            return bool(self._fills) and int(self._fills[0]["time"]) <= int(since_ms)
+
+    # --------------------------------------------------------
+    # Aplicar eventos
+    # --------------------------------------------------------
+
+    def apply_fills(self, fills: List[Dict[str, Any]], snapshot: bool = False) -> int:
+        added = 0
+        with self._cond:
+            for raw in sorted((f for f in fills if isinstance(f, dict)), key=lambda f: int(_f(f.get("time")))):
+                fid = raw.get("tid") or raw.get("hash") or (raw.get("oid"), raw.get("time"), raw.get("px"), raw.get("sz"))
+                if fid in self._fill_ids:
+                    continue
+                if len(self._fills) == self._fills.maxlen:
+                    old = self._fills[0]
+                    self._fill_ids.discard(old["id"])
+                sz = _f(raw.get("sz"))
+                side = str(raw.get("side") or "").upper()
+                signed = sz if side == "B" else -sz
+                fill = {
+                    "id": fid,
+                    "coin": _coin(raw.get("coin")),
+                    "px": _f(raw.get("px")),
+                    "sz": sz,
+                    "side": side,
+                    "time": int(_f(raw.get("time"))),
+                    "oid": raw.get("oid"),
+                    "start_position": _f(raw.get("startPosition")),
+                    "closed_pnl": _f(raw.get("closedPnl")),
+                    "fee": _f(raw.get("fee")),
+                    "dir": str(raw.get("dir") or ""),
+                }
+                fill["end_position"] = fill["start_position"] + signed
+                self._fills.append(fill)
+                self._fill_ids.add(fid)
+                added += 1
+                # El fill es más nuevo que el último snapshot de posiciones: manda el fill.
+                if not snapshot and fill["time"] >= self._positions_ts_ms:
+                    pos = self._positions.setdefault(fill["coin"], {"szi": 0.0, "entry_px": 0.0})
+                    pos["szi"] = fill["end_position"]
+                    if fill["end_position"] == 0.0:
+                        pos["entry_px"] = 0.0
+            if snapshot:
+                # Tras reconectar el snapshot trae historia anterior a fills ya vistos:
+                # se reordena para que _fills[0] siga siendo el más viejo (covers()).
+                if added:
+                    self._fills = deque(sorted(self._fills, key=lambda f: f["time"]), maxlen=self._fills.maxlen)
+                self._fills_synced = True
+            self.last_event_ts = time.time()
+            self._cond.notify_all()
+        return added
+
+    def apply_order_updates(self, updates: List[Dict[str, Any]]) -> None:
+        with self._cond:
+            for up in updates:
+                if not isinstance(up, dict):
+                    continue
+                order = up.get("order") if isinstance(up.get("order"), dict) else {}
+                try:
+                    oid = int(order.get("oid"))
+                except Exception:
+                    continue
+                status = str(up.get("status") or "")
+                rec = {
+                    "oid": oid,
+                    "coin": _coin(order.get("coin")),
+                    "side": str(order.get("side") or "").upper(),
+                    "status": status,
+                    "ts": int(_f(up.get("statusTimestamp") or order.get("timestamp"))),
+                    "trigger_px": _f(order.get("triggerPx")),
+                    "is_trigger": bool(order.get("isTrigger")) or _f(order.get("triggerPx")) > 0,
+                    "reduce_only": bool(order.get("reduceOnly")),
+                }
+                self._orders[oid] = rec
+                if status == "triggered":
+                    self._stops.append(rec)
+                elif status in ("filled", "canceled", "rejected", "marginCanceled"):
+                    # Terminal: no hace falta seguir indexándola.
+                    self._orders.pop(oid, None)
+                    if status == "filled" and rec["is_trigger"]:
+                        self._stops.append(rec)
+            self.last_event_ts = time.time()
+            self._cond.notify_all()
+
+    def apply_web_data(self, data: Dict[str, Any]) -> None:
+        state = data.get("clearinghouseState") if isinstance(data, dict) else None
+        if not isinstance(state, dict):
+            return
+        positions: Dict[str, Dict[str, float]] = {}
+        for ap in state.get("assetPositions") or []:
+            pos = ap.get("position") if isinstance(ap, dict) else None
+            if not isinstance(pos, dict):
+                continue
+            szi = _f(pos.get("szi"))
+            if szi != 0.0:
+                positions[_coin(pos.get("coin"))] = {"szi": szi, "entry_px": _f(pos.get("entryPx"))}
+        server_ms = int(_f(data.get("serverTime"))) or int(time.time() * 1000)
+        with self._cond:
+            if server_ms < self._positions_ts_ms:
+                return
+            # Fills posteriores al snapshot (llegados antes que él) siguen mandando.
+            for f in self._fills:
+                if f["time"] > server_ms:
+                    positions[f["coin"]] = {"szi": f["end_position"], "entry_px": positions.get(f["coin"], {}).get("entry_px", 0.0)}
+            self._positions = positions
+            self._positions_ts_ms = server_ms
+            self._positions_synced = True
+            self.last_event_ts = time.time()
+            self._cond.notify_all()
+
+    # --------------------------------------------------------
+    # Lecturas
+    # --------------------------------------------------------
+
+    def position_size(self, coin: str) -> Optional[float]:
+        """szi firmado de la posición; None si el ledger no es fiable ahora."""
+        with self._cond:
+            if not (self._connected and self._fills_synced and self._positions_synced):
+                return None
+            pos = self._positions.get(_coin(coin))
+            return float(pos["szi"]) if pos else 0.0
+
+    def _fills_since(self, coin: str, since_ms: int) -> List[Dict[str, Any]]:
+        c = _coin(coin)
+        return [f for f in self._fills if f["coin"] == c and f["time"] >= int(since_ms)]
+
+    def entry_fill(self, coin: str, since_ms: int, timeout: float = 0.0) -> Optional[Dict[str, Any]]:
+        """Fills de apertura desde since_ms: {"entry_px" (vwap), "sz", "szi", "fills"}.
+
+        Espera hasta `timeout` segundos a que llegue el primer fill. None si no llegó
+        o si el ledger no es live.
+        """
+        deadline = time.time() + max(0.0, float(timeout))
+        with self._cond:
+            while True:
+                if not (self._connected and self._fills_synced):
+                    return None
+                fills = [f for f in self._fills_since(coin, since_ms) if abs(f["end_position"]) > abs(f["start_position"])]
+                if fills:
+                    break
+                left = deadline - time.time()
+                if left <= 0:
+                    return None
+                self._cond.wait(left)
+            sz = sum(f["sz"] for f in fills)
+            vwap = sum(f["px"] * f["sz"] for f in fills) / sz if sz > 0 else 0.0
+            return {"entry_px": vwap, "sz": sz, "szi": fills[-1]["end_position"], "fills": len(fills)}
+
+    def wait_flat(self, coin: str, since_ms: int, timeout: float = 0.0) -> bool:
+        """True cuando un fill posterior a since_ms dejó la posición de coin en 0."""
+        deadline = time.time() + max(0.0, float(timeout))
+        with self._cond:
+            while True:
+                if not (self._connected and self._fills_synced):
+                    return False
+                fills = self._fills_since(coin, since_ms)
+                if fills and fills[-1]["end_position"] == 0.0:
+                    return True
+                left = deadline - time.time()
+                if left <= 0:
+                    return False
+                self._cond.wait(left)
+
+    def closed_pnl(self, coin: str, since_ms: int) -> Optional[Dict[str, Any]]:
+        """Como get_recent_closed_pnl, desde el ledger. Incluye exit_px (vwap de los fills que reducen)."""
+        if not self.covers(since_ms):
+            return None
+        with self._cond:
+            fills = self._fills_since(coin, since_ms)
+        out = {"pnl": 0.0, "fees": 0.0, "net": 0.0, "fills": 0, "exit_px": 0.0}
+        red_sz = 0.0
+        red_ntl = 0.0
+        for f in fills:
+            if f["closed_pnl"] == 0.0 and f["fee"] == 0.0:
+                continue
+            out["pnl"] += f["closed_pnl"]
+            out["fees"] += f["fee"]
+            out["fills"] += 1
+            if abs(f["end_position"]) < abs(f["start_position"]):
+                red_sz += f["sz"]
+                red_ntl += f["sz"] * f["px"]
+        out["net"] = out["pnl"] - out["fees"]
+        out["pnl"] = float(round(out["pnl"], 10))
+        out["fees"] = float(round(out["fees"], 10))
+        out["net"] = float(round(out["net"], 10))
+        out["exit_px"] = (red_ntl / red_sz) if red_sz > 0 else 0.0
+        return out
+
+    def stop_triggered(self, coin: str, since_ms: int) -> Optional[Dict[str, Any]]:
+        """Último stop (orden trigger) disparado/llenado para coin desde since_ms."""
+        c = _coin(coin)
+        with self._cond:
+            for rec in reversed(self._stops):
+                if rec["coin"] == c and rec["ts"] >= int(since_ms):
+                    return dict(rec)
+        return None
+
+    def open_orders(self, coin: Optional[str] = None) -> List[Dict[str, Any]]:
+        c = _coin(coin) if coin else None
+        with self._cond:
+            return [dict(o) for o in self._orders.values() if c is None or o["coin"] == c]
+
+
+# ============================================================
+# TRANSPORTES
+# ============================================================
+
+class _WebSocketTransport:
+    def __init__(self, url: str):
+        if websocket is None:
+            raise RuntimeError("websocket-client no instalado")
+        self._ws = websocket.create_connection(url, timeout=USER_EVENTS_RECV_TIMEOUT)
+
+    def send(self, text: str) -> None:
+        self._ws.send(text)
+
+    def recv(self) -> Optional[str]:
+        try:
+            return self._ws.recv()
+        except websocket.WebSocketTimeoutException:
+            return None
+
+    def close(self) -> None:
+        try:
+            self._ws.close()
+        except Exception:
+            pass
+
+
+def _default_transport_factory() -> Any:
+    return _WebSocketTransport(HYPER_WS_URL)
+
+
+class LocalEventBus:
+    """Stand-in local del WebSocket: publica mensajes con el formato de Hyperliquid."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conns: List["_LocalTransport"] = []
+
+    def connect(self) -> "_LocalTransport":
+        conn = _LocalTransport(self)
+        with self._lock:
+            self._conns.append(conn)
+        return conn
+
+    def _drop(self, conn: "_LocalTransport") -> None:
+        with self._lock:
+            if conn in self._conns:
+                self._conns.remove(conn)
+
+    def publish(self, wallet: str, channel: str, data: Any) -> int:
+        """Entrega {"channel", "data"} a las conexiones suscritas a (channel, wallet)."""
+        key = (channel, str(wallet or "").lower())
+        raw = json.dumps({"channel": channel, "data": data})
+        delivered = 0
+        with self._lock:
+            conns = list(self._conns)
+        for conn in conns:
+            if key in conn.subscriptions:
+                conn.inbox.put(raw)
+                delivered += 1
+        return delivered
+
+    def disconnect_all(self) -> None:
+        with self._lock:
+            conns = list(self._conns)
+        for conn in conns:
+            conn.inbox.put(None)
+            conn.closed = True
+
+
+class _LocalTransport:
+    def __init__(self, bus: LocalEventBus):
+        self.bus = bus
+        self.inbox: "queue.Queue[Optional[str]]" = queue.Queue()
+        self.subscriptions: set = set()
+        self.closed = False
+
+    def send(self, text: str) -> None:
+        msg = json.loads(text)
+        if msg.get("method") == "subscribe":
+            sub = msg.get("subscription") or {}
+            self.subscriptions.add((sub.get("type"), str(sub.get("user") or "").lower()))
+            self.inbox.put(json.dumps({"channel": "subscriptionResponse", "data": msg}))
+        elif msg.get("method") == "ping":
+            self.inbox.put(json.dumps({"channel": "pong"}))
+
+    def recv(self) -> Optional[str]:
+        try:
+            item = self.inbox.get(timeout=0.2)
+        except queue.Empty:
+            return None
+        if item is None or self.closed:
+            raise ConnectionError("local transport cerrado")
+        return item
+
+    def close(self) -> None:
+        self.closed = True
+        self.bus._drop(self)
+
+
+# ============================================================
+# STREAM POR WALLET
+# ============================================================
+
+class _UserStream:
+    def __init__(
+        self,
+        ledger: UserLedger,
+        transport_factory: Callable[[], Any],
+        on_order_updates: Optional[Callable[[int, List[Dict[str, Any]]], None]] = None,
+    ):
+        self.ledger = ledger
+        self._factory = transport_factory
+        self._on_order_updates = on_order_updates
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"user-events-{ledger.user_id}", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _dispatch(self, raw: str) -> None:
+        msg = json.loads(raw)
+        channel = msg.get("channel")
+        data = msg.get("data")
+        if channel == "userFills" and isinstance(data, dict):
+            self.ledger.apply_fills(data.get("fills") or [], snapshot=bool(data.get("isSnapshot")))
+        elif channel == "orderUpdates" and isinstance(data, list):
+            self.ledger.apply_order_updates(data)
+            if self._on_order_updates is not None:
+                self._on_order_updates(self.ledger.user_id, data)
+        elif channel == "webData2" and isinstance(data, dict):
+            self.ledger.apply_web_data(data)
+
+    def _run(self) -> None:
+        backoff = 1.0
+        wallet = self.ledger.wallet
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = self._factory()
+                for sub in _SUBSCRIPTIONS:
+                    conn.send(json.dumps({"method": "subscribe", "subscription": {"type": sub, "user": wallet}}))
+                self.ledger.set_connected(True)
+                log(f"stream conectado user={self.ledger.user_id}")
+                backoff = 1.0
+                last_ping = time.time()
+                while not self._stop.is_set():
+                    raw = conn.recv()
+                    if raw is not None:
+                        self._dispatch(raw)
+                    if time.time() - last_ping >= USER_EVENTS_PING_SECONDS:
+                        conn.send(json.dumps({"method": "ping"}))
+                        last_ping = time.time()
+            except Exception as e:
+                if not self._stop.is_set():
+                    log(f"stream caído user={self.ledger.user_id} err={e} — reconexión en {backoff:.0f}s", "WARN")
+            finally:
+                self.ledger.set_connected(False)
+                if conn is not None:
+                    conn.close()
+            if self._stop.wait(backoff):
+                break
+            backoff = min(USER_EVENTS_RECONNECT_MAX_SECONDS, backoff * 2.0)
+
+
+# ============================================================
+# HUB
+# ============================================================
+
+class UserEventHub:
+    def __init__(
+        self,
+        *,
+        transport_factory: Optional[Callable[[], Any]] = None,
+        max_users: int = USER_EVENTS_MAX_USERS,
+        enabled: bool = USER_EVENTS_ENABLED,
+        on_order_updates: Optional[Callable[[int, List[Dict[str, Any]]], None]] = None,
+    ):
+        self._factory = transport_factory or _default_transport_factory
+        self._on_order_updates = on_order_updates
+        self._max_users = max(0, int(max_users))
+        self._enabled = bool(enabled) and (transport_factory is not None or websocket is not None)
+        self._lock = threading.Lock()
+        self._streams: Dict[int, _UserStream] = {}
+        if enabled and not self._enabled:
+            log("websocket-client no disponible — user events deshabilitados (polling)", "WARN")
+
+    def watch(self, user_id: int, wallet: Optional[str]) -> bool:
+        """Abre (si hace falta) el stream de la wallet. False = usar polling."""
+        if not self._enabled or not wallet:
+            return False
+        uid = int(user_id)
+        with self._lock:
+            stream = self._streams.get(uid)
+            if stream is not None:
+                if stream.ledger.wallet == str(wallet).lower():
+                    return True
+                stream.stop()
+                self._streams.pop(uid, None)
+            if len(self._streams) >= self._max_users:
+                return False
+            stream = _UserStream(UserLedger(uid, wallet), self._factory, self._on_order_updates)
+            self._streams[uid] = stream
+        stream.start()
+        return True
+
+    def unwatch(self, user_id: int) -> None:
+        with self._lock:
+            stream = self._streams.pop(int(user_id), None)
+        if stream is not None:
+            stream.stop()
+
+    def ledger(self, user_id: int) -> Optional[UserLedger]:
+        with self._lock:
+            stream = self._streams.get(int(user_id))
+        return stream.ledger if stream is not None else None
+
+    def live_ledger(self, user_id: int) -> Optional[UserLedger]:
+        led = self.ledger(user_id)
+        return led if (led is not None and led.live) else None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            streams = dict(self._streams)
+        return {
+            "enabled": self._enabled,
+            "users": len(streams),
+            "max_users": self._max_users,
+            "live": sum(1 for s in streams.values() if s.ledger.live),
+        }
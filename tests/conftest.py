@@ -0,0 +1,6 @@
+import os
+
+# app.config exige estas variables al importarse; los tests no tocan Telegram ni Mongo.
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "test")
+os.environ.setdefault("ADMIN_TELEGRAM_ID", "1")
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:1")
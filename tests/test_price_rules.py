@@ -0,0 +1,94 @@
+# ============================================================
+# TESTS – price_rules
+# Cuantizadores enteros vs camino Decimal de referencia
+# ============================================================
+
+import math
+
+import pytest
+
+from app.price_rules import (
+    PriceRules,
+    _reference_format_price,
+    _reference_format_size,
+    verify_against_reference,
+)
+
+TICKS = (0.0, 1.0, 5.0, 10.0, 0.5, 0.25, 0.01, 0.0001, 1e-05)
+EDGES = (0.0, -0.0, -1.0, -123.45, float("inf"), float("-inf"), float("nan"))
+
+
+@pytest.mark.parametrize("seed", [1, 7, 42])
+def test_random_samples_match_reference(seed):
+    assert verify_against_reference(samples=20000, seed=seed) == []
+
+
+@pytest.mark.parametrize("tick", TICKS)
+@pytest.mark.parametrize("szd", [0, 2, 5])
+@pytest.mark.parametrize("up", [False, True])
+def test_price_edges_return_zero(tick, szd, up):
+    rules = PriceRules(sz_decimals=szd, tick_size=tick)
+    for px in EDGES:
+        assert rules.format_price(px, round_up=up) == "0"
+        assert _reference_format_price(px, szd, tick, up) == "0"
+
+
+@pytest.mark.parametrize("up", [False, True])
+def test_size_edges_match_reference(up):
+    rules = PriceRules(sz_decimals=3)
+    for sz in (0.0, -0.0, -1.23456, 1e-09):
+        assert rules.format_size(sz, round_up=up) == _reference_format_size(sz, 3, up)
+    for sz in (float("inf"), float("nan")):
+        assert rules.format_size(sz, round_up=up) == "0"
+
+
+@pytest.mark.parametrize("tick", [1.0, 5.0, 10.0, 100.0])
+@pytest.mark.parametrize("px", [0.3, 7.0, 12.5, 99999.9, 123456.789])
+@pytest.mark.parametrize("up", [False, True])
+def test_tick_at_least_one(tick, px, up):
+    rules = PriceRules(sz_decimals=0, tick_size=tick)
+    got = rules.format_price(px, round_up=up)
+    assert got == _reference_format_price(px, 0, tick, up)
+    if got != "0":
+        assert "." not in got
+        assert float(got) % tick == 0
+        assert (float(got) >= px) if up else (float(got) <= px)
+
+
+@pytest.mark.parametrize("tick", [0.01, 0.5, 1.0, 5.0])
+def test_sub_tick_price(tick):
+    rules = PriceRules(sz_decimals=2, tick_size=tick)
+    px = tick * 0.4
+    # Hacia abajo no queda ningún tick; hacia arriba, exactamente uno.
+    assert rules.format_price(px, round_up=False) == "0"
+    assert float(rules.format_price(px, round_up=True)) == tick
+    for up in (False, True):
+        assert rules.format_price(px, round_up=up) == _reference_format_price(px, 2, tick, up)
+
+
+def test_sig_figs_and_decimals_limits():
+    rules = PriceRules(sz_decimals=2)
+    assert rules.format_price(1234.5678, round_up=False) == "1234.5"
+    assert rules.format_price(1234.5678, round_up=True) == "1234.6"
+    assert rules.format_price(123456.7, round_up=False) == "123456"
+    # máx 6 - szDecimals = 4 decimales
+    assert rules.format_price(0.000123456, round_up=False) == "0.0001"
+
+
+@pytest.mark.parametrize("direction,cur", [("long", 100.0), ("short", 100.0)])
+def test_stop_trigger_respects_buffer(direction, cur):
+    rules = PriceRules(sz_decimals=2, tick_size=0.01)
+    if direction == "long":
+        trig = float(rules.stop_trigger(101.0, direction=direction, current_px=cur, buffer_pct=0.001))
+        assert trig <= cur * (1 - 0.001)
+    else:
+        trig = float(rules.stop_trigger(99.0, direction=direction, current_px=cur, buffer_pct=0.001))
+        assert trig >= cur * (1 + 0.001)
+    assert math.isfinite(trig)
+
+
+def test_stop_trigger_invalid_inputs():
+    rules = PriceRules(sz_decimals=2, tick_size=0.01)
+    assert rules.stop_trigger(0.0, direction="long") == "0"
+    assert rules.stop_trigger(-5.0, direction="short") == "0"
+    assert rules.stop_trigger(None, direction="long") == "0"
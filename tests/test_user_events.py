@@ -0,0 +1,164 @@
+# ============================================================
+# TESTS – user_events
+# UserEventHub + UserLedger sobre LocalEventBus (mismo formato que el WS)
+# ============================================================
+
+import threading
+import time
+
+import pytest
+
+from app.user_events import LocalEventBus, UserEventHub
+
+WALLET = "0xAbC0000000000000000000000000000000000001"
+UID = 1
+
+
+def _wait(pred, timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if pred():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def _publish(bus, channel, data, timeout=5.0):
+    """Publica cuando el stream ya está suscrito (tras conectar / reconectar)."""
+    assert _wait(lambda: bus.publish(WALLET, channel, data) > 0, timeout), f"sin suscriptor para {channel}"
+
+
+def _snapshots(bus, fills=(), positions=(), server_ms=None):
+    _publish(bus, "userFills", {"isSnapshot": True, "user": WALLET, "fills": list(fills)})
+    _publish(bus, "webData2", {
+        "serverTime": server_ms or int(time.time() * 1000),
+        "clearinghouseState": {"assetPositions": [{"position": dict(p)} for p in positions]},
+    })
+
+
+def _fill(tid, side, px, sz, start, ts, closed_pnl=0.0, fee=0.0):
+    return {"coin": "BTC", "px": str(px), "sz": str(sz), "side": side, "time": ts, "tid": tid,
+            "startPosition": str(start), "closedPnl": str(closed_pnl), "fee": str(fee)}
+
+
+@pytest.fixture
+def stream():
+    bus = LocalEventBus()
+    updates = []
+    hub = UserEventHub(
+        transport_factory=bus.connect,
+        max_users=5,
+        enabled=True,
+        on_order_updates=lambda uid, ups: updates.append((uid, ups)),
+    )
+    assert hub.watch(UID, WALLET)
+    _snapshots(bus)
+    assert _wait(lambda: hub.live_ledger(UID) is not None)
+    yield bus, hub, updates
+    hub.unwatch(UID)
+    bus.disconnect_all()
+
+
+def test_not_live_before_snapshots():
+    bus = LocalEventBus()
+    hub = UserEventHub(transport_factory=bus.connect, max_users=5, enabled=True)
+    try:
+        assert hub.watch(UID, WALLET)
+        _publish(bus, "userFills", {"isSnapshot": True, "user": WALLET, "fills": []})
+        ledger = hub.ledger(UID)
+        assert hub.live_ledger(UID) is None
+        assert ledger.position_size("BTC") is None
+    finally:
+        hub.unwatch(UID)
+        bus.disconnect_all()
+
+
+def test_entry_fill_vwap_and_size(stream):
+    bus, hub, _ = stream
+    ledger = hub.live_ledger(UID)
+    since = int(time.time() * 1000)
+    _publish(bus, "userFills", {"user": WALLET, "fills": [
+        _fill(1, "B", 100.0, 0.5, 0.0, since + 1, fee=0.01),
+        _fill(2, "B", 102.0, 0.5, 0.5, since + 2, fee=0.01),
+    ]})
+    entry = ledger.entry_fill("BTC", since, timeout=3.0)
+    assert entry is not None
+    assert entry["entry_px"] == pytest.approx(101.0)
+    assert entry["sz"] == pytest.approx(1.0)
+    assert entry["szi"] == pytest.approx(1.0)
+    assert entry["fills"] == 2
+    assert ledger.position_size("BTC") == pytest.approx(1.0)
+
+
+def test_entry_fill_times_out_without_fills(stream):
+    _, hub, _ = stream
+    since = int(time.time() * 1000)
+    assert hub.live_ledger(UID).entry_fill("BTC", since, timeout=0.2) is None
+
+
+def test_wait_flat_and_closed_pnl(stream):
+    bus, hub, _ = stream
+    ledger = hub.live_ledger(UID)
+    since = int(time.time() * 1000)
+    _publish(bus, "userFills", {"user": WALLET, "fills": [
+        _fill(1, "B", 100.0, 0.5, 0.0, since + 1, fee=0.01),
+        _fill(2, "B", 102.0, 0.5, 0.5, since + 2, fee=0.01),
+    ]})
+    assert ledger.entry_fill("BTC", since, timeout=3.0) is not None
+    assert not ledger.wait_flat("BTC", since, timeout=0.1)
+
+    def close_later():
+        time.sleep(0.2)
+        _publish(bus, "userFills", {"user": WALLET, "fills": [
+            _fill(3, "A", 110.0, 1.0, 1.0, since + 3, closed_pnl=9.0, fee=0.02),
+        ]})
+
+    t = threading.Thread(target=close_later)
+    t.start()
+    assert ledger.wait_flat("BTC", since, timeout=3.0)
+    t.join()
+    assert ledger.position_size("BTC") == 0.0
+
+    pnl = ledger.closed_pnl("BTC", since)
+    assert pnl["pnl"] == pytest.approx(9.0)
+    assert pnl["fees"] == pytest.approx(0.04)
+    assert pnl["net"] == pytest.approx(8.96)
+    assert pnl["exit_px"] == pytest.approx(110.0)
+    assert pnl["fills"] == 3
+
+
+def test_stop_triggered_and_order_callback(stream):
+    bus, hub, updates = stream
+    ledger = hub.live_ledger(UID)
+    since = int(time.time() * 1000)
+    order = {"oid": 55, "coin": "BTC", "side": "A", "triggerPx": "95", "isTrigger": True, "reduceOnly": True}
+    _publish(bus, "orderUpdates", [{"order": order, "status": "open", "statusTimestamp": since + 1}])
+    assert _wait(lambda: [o["oid"] for o in ledger.open_orders("BTC")] == [55])
+    _publish(bus, "orderUpdates", [{"order": order, "status": "filled", "statusTimestamp": since + 2}])
+    assert _wait(lambda: ledger.stop_triggered("BTC", since) is not None)
+    assert ledger.stop_triggered("BTC", since)["trigger_px"] == pytest.approx(95.0)
+    assert ledger.open_orders("BTC") == []
+    assert _wait(lambda: len(updates) == 2)
+    assert all(uid == UID for uid, _ in updates)
+
+
+def test_reconnect_waits_for_new_snapshots(stream):
+    bus, hub, _ = stream
+    ledger = hub.ledger(UID)
+    since = int(time.time() * 1000)
+    opened = [_fill(1, "B", 100.0, 1.0, 0.0, since + 1, fee=0.01)]
+    _publish(bus, "userFills", {"user": WALLET, "fills": opened})
+    assert _wait(lambda: ledger.position_size("BTC") == 1.0)
+
+    bus.disconnect_all()
+    assert _wait(lambda: hub.live_ledger(UID) is None)
+    assert ledger.position_size("BTC") is None
+    assert ledger.closed_pnl("BTC", since) is None
+
+    # Tras reconectar: snapshots nuevos (fills repetidos no se duplican). El
+    # snapshot trae historia anterior a `since`, así que el ledger vuelve a cubrirlo.
+    older = dict(_fill(0, "B", 3000.0, 0.1, 0.0, since - 60_000), coin="ETH")
+    _snapshots(bus, fills=[older] + opened, positions=[{"coin": "BTC", "szi": "1.0", "entryPx": "100"}])
+    assert _wait(lambda: hub.live_ledger(UID) is not None)
+    assert ledger.position_size("BTC") == pytest.approx(1.0)
+    assert ledger.closed_pnl("BTC", since)["fills"] == 1